@@ -5,6 +5,12 @@ It exposes the ASGI callable as a module-level variable named ``application``.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
+
+Поток новых тикетов для агентов (tickets:agent_ticket_stream, Server-Sent Events) работает
+только через это приложение, например: uvicorn helpdesk_project.asgi:application
+События раздаются из памяти процесса (tickets/live.py), поэтому поток и создание тикетов
+должны обслуживаться одним процессом ASGI-сервера. Под WSGI страницы агентов переходят
+на периодический опрос check_new_tickets_api_view.
 """
 
 import os
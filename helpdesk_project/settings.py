@@ -35,6 +35,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # Число SQL-запросов, время в БД и отрисовки по представлениям (tickets/instrumentation.py) - первым, чтобы учесть весь стек
+    'tickets.instrumentation.QueryInstrumentationMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -137,6 +139,54 @@ STATIC_URL = 'static/'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Загрузки принимаются с подсчетом SHA-256 по ходу чтения - вложения сохраняются в хранилище блобов
+# (tickets/blobstore.py) без повторного чтения файла
+FILE_UPLOAD_HANDLERS = [
+    'tickets.blobstore.HashingMemoryFileUploadHandler',
+    'tickets.blobstore.HashingTemporaryFileUploadHandler',
+]
+# Файлы вложений отдаются представлениями tickets (с проверкой доступа); MEDIA_URL публично не раздается -
+# ни Django (helpdesk_project/urls.py), ни nginx: location для MEDIA_ROOT допустим только internal.
+# За nginx можно отдать байты ему:
+# ATTACHMENT_X_ACCEL_PREFIX = '/protected-media/'  # location /protected-media/ { internal; alias <MEDIA_ROOT>/; }
+ATTACHMENT_X_ACCEL_PREFIX = None
+# Превью изображений-вложений (tickets/previews.py, нужен Pillow): число потоков и предельный объем кэша превью
+PREVIEW_WORKERS = 2
+PREVIEW_CACHE_MAX_BYTES = 512 * 1024 * 1024
+
+# Кэши. 'fragments' - отрисованные строки списка заявок (tickets/fragment_cache.py); объем ограничен MAX_ENTRIES.
+# Для нескольких процессов можно вынести в общий кэш, например:
+#   'fragments': {'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': 'redis://127.0.0.1:6379/1'}
+# (лимит тогда задается maxmemory/maxmemory-policy allkeys-lru в Redis).
+CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+    'fragments': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'helpdesk-fragments',
+        'TIMEOUT': 24 * 3600,
+        'OPTIONS': {'MAX_ENTRIES': 20000, 'CULL_FREQUENCY': 4},
+    },
+}
+TICKET_ROW_CACHE_ALIAS = 'fragments'
+TICKET_ROW_CACHE_ENABLED = True
+
+# Замер нагрузки по представлениям (tickets/instrumentation.py)
+INSTRUMENTATION_BUFFER_SIZE = 2000 # последних запросов на процесс для страницы agent/stats/performance/
+METRICS_TOKEN = None # токен для agent/metrics/ (Authorization: Bearer <токен>); без токена - только сотрудникам в сессии
+# Бюджеты SQL-запросов на один запрос к представлению. Превышение пишется в лог (logger tickets.instrumentation),
+# при QUERY_BUDGET_STRICT = True - исключение QueryBudgetExceeded (в тестах: @override_settings(QUERY_BUDGET_STRICT=True)).
+QUERY_BUDGETS = {
+    'tickets:agent_ticket_list': 14, # с холодными кэшами процесса (справочники, фильтры доп. полей, строки списка)
+    'tickets:agent_my_ticket_list': 10,
+    'tickets:agent_ticket_detail': 20,
+    'tickets:check_ticket_status': 16,
+    'tickets:create_ticket_for_category': 40, # с автоназначением (блокировка правила, счетчики, событие, уведомление), поиском дубликатов и сводками для отчетов
+    'tickets:agent_check_new_tickets_api': 8,
+    'tickets:agent_dashboard': 8,
+    'tickets:agent_reports': 12,
+}
+QUERY_BUDGET_STRICT = False
+
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/stable/ref/settings/#default-auto-field
@@ -2,8 +2,6 @@
 
 from django.contrib import admin
 from django.urls import path, include
-from django.conf import settings  # Для доступа к settings.DEBUG
-from django.conf.urls.static import static # Для обслуживания медиафайлов
 
 urlpatterns = [
     # URL для админ-панели Django
@@ -20,10 +18,6 @@ urlpatterns = [
     # path('', ticket_views.some_landing_page_view, name='landing_page'),
 ]
 
-# Это нужно ТОЛЬКО для режима разработки (DEBUG=True)
-# чтобы Django Development Server мог отдавать загруженные пользователем медиафайлы.
-# В продакшене медиафайлы должны раздаваться веб-сервером (Nginx, Apache и т.д.).
-if settings.DEBUG:
-    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
-    # Также можно добавить раздачу статических файлов, если DEBUG=True и ты не используешь Whitenoise на ранних этапах
-    # urlpatterns += static(settings.STATIC_URL, document_root=settings.STATIC_ROOT) # Но это если STATIC_ROOT определен
\ No newline at end of file
+# MEDIA_ROOT не раздается напрямую даже при DEBUG=True: там только вложения, а их отдают представления
+# tickets с проверкой доступа (tickets/downloads.py). Веб-сервер тоже не должен раздавать MEDIA_ROOT
+# публично - только через internal-location для ATTACHMENT_X_ACCEL_PREFIX (см. settings.py).
@@ -4,35 +4,47 @@ from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
 from django.urls import reverse
 from django.utils.html import format_html
+from django.utils import timezone
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
 from django.core.mail import EmailMessage # Используем EmailMessage для большей гибкости
 from django.core.exceptions import ValidationError # Для EmailSettings.clean()
 
 from .models import (
     Project, Agent, Ticket, TicketCategory, TicketStatus, TicketPriority,
     Comment, Attachment, CustomFormField, FieldTemplate,
-    EmailSettings, NotificationTemplate, Feedback
+    EmailSettings, NotificationTemplate, Feedback, TicketNumberSequence,
+    NotificationOutbox, TicketCounter, ImportCheckpoint, AttachmentBlob,
+    BusinessCalendar, BusinessHours, Holiday, SLAPolicy, AutoAssignmentRule, AgentSkill,
+    TicketDuplicateCandidate, TicketDailyRollup
 )
 
+
+def counter_subquery(scope, field):
+    # Значение счетчика тикетов (TicketCounter) для строки списка - одним подзапросом вместо count() на строку
+    counter = TicketCounter.objects.filter(scope=scope, object_id=OuterRef('pk')).values(field)[:1]
+    return Coalesce(Subquery(counter, output_field=IntegerField()), 0)
+
 # 1. FieldTemplateAdmin
 @admin.register(FieldTemplate)
 class FieldTemplateAdmin(admin.ModelAdmin):
-    list_display = ('label_default', 'name', 'field_type', 'is_active')
+    list_display = ('label_default', 'name', 'field_type', 'is_active', 'is_filterable')
     search_fields = ('name', 'label_default')
-    list_filter = ('field_type', 'is_active')
-    list_editable = ('is_active',)
-    fields = ('label_default', 'name', 'field_type', 'help_text_default', 'select_choices_json_default', 'is_active')
+    list_filter = ('field_type', 'is_active', 'is_filterable')
+    list_editable = ('is_active', 'is_filterable')
+    fields = ('label_default', 'name', 'field_type', 'help_text_default', 'select_choices_json_default', 'is_active', 'is_filterable')
 
 # 2. AgentAdmin
 @admin.register(Agent)
 class AgentAdmin(BaseUserAdmin):
     list_display = ('username', 'email', 'first_name', 'last_name', 'is_staff', 
-                    'agent_role', 'display_projects', 'is_active')
+                    'agent_role', 'display_projects', 'count_open_tickets', 'is_active')
     list_filter = BaseUserAdmin.list_filter + ('agent_role', 'projects',)
     search_fields = ('username', 'first_name', 'last_name', 'email')
     
     custom_fieldsets = list(BaseUserAdmin.fieldsets)
     custom_fieldsets.append(
-        ('Роль и Проекты Сотрудника', {'fields': ('agent_role', 'projects')})
+        ('Роль и Проекты Сотрудника', {'fields': ('agent_role', 'projects', 'accepts_auto_assignment')})
     )
     fieldsets = tuple(custom_fieldsets)
     
@@ -44,31 +56,56 @@ class AgentAdmin(BaseUserAdmin):
     
     filter_horizontal = ('projects', 'groups', 'user_permissions')
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).prefetch_related('projects').annotate(
+            open_tickets=counter_subquery(TicketCounter.SCOPE_AGENT, 'open_count'),
+        )
+
     def display_projects(self, obj):
         return ", ".join([project.name for project in obj.projects.all()])
     display_projects.short_description = 'Проекты'
 
+    def count_open_tickets(self, obj):
+        return obj.open_tickets
+    count_open_tickets.short_description = "Открытых заявок (исполнитель)"
+    count_open_tickets.admin_order_field = 'open_tickets'
+
 # 3. ProjectAdmin
 @admin.register(Project)
 class ProjectAdmin(admin.ModelAdmin):
-    list_display = ('name', 'project_email', 'is_active', 'count_agents', 'count_categories', 'count_tickets')
+    list_display = ('name', 'project_email', 'is_active', 'count_agents', 'count_categories', 'count_tickets', 'count_open_tickets')
     search_fields = ('name', 'description', 'project_email')
     list_filter = ('is_active',)
     list_editable = ('is_active',)
     fields = ('name', 'description', 'project_email', 'is_active') 
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(
+            agents_total=Count('agents', distinct=True),
+            categories_total=Count('ticket_categories', distinct=True),
+            open_tickets=counter_subquery(TicketCounter.SCOPE_PROJECT, 'open_count'),
+            closed_tickets=counter_subquery(TicketCounter.SCOPE_PROJECT, 'closed_count'),
+        )
+
     def count_agents(self, obj):
-        return obj.agents.count()
+        return obj.agents_total
     count_agents.short_description = "Кол-во сотрудников"
+    count_agents.admin_order_field = 'agents_total'
 
     def count_categories(self, obj):
-        return obj.ticket_categories.count()
+        return obj.categories_total
     count_categories.short_description = "Кол-во категорий"
+    count_categories.admin_order_field = 'categories_total'
 
     def count_tickets(self, obj):
-        return obj.tickets.count()
+        return obj.open_tickets + obj.closed_tickets
     count_tickets.short_description = "Кол-во тикетов"
 
+    def count_open_tickets(self, obj):
+        return obj.open_tickets
+    count_open_tickets.short_description = "Открытых"
+    count_open_tickets.admin_order_field = 'open_tickets'
+
 # 4. Инлайн для CustomFormField
 class CustomFormFieldForCategoryInline(admin.TabularInline):
     model = CustomFormField
@@ -82,12 +119,19 @@ class CustomFormFieldForCategoryInline(admin.TabularInline):
 # 5. TicketCategoryAdmin
 @admin.register(TicketCategory)
 class TicketCategoryAdmin(admin.ModelAdmin):
-    list_display = ('name', 'project_with_status', 'description', 'count_configured_fields', 'is_active') # Добавил is_active
+    list_display = ('name', 'project_with_status', 'description', 'count_configured_fields', 'count_open_tickets', 'is_active') # Добавил is_active
     search_fields = ('name', 'project__name')
     list_filter = ('project', 'is_active') # Добавил is_active
     list_editable = ('is_active',) # Сделал is_active редактируемым
     ordering = ('project', 'name',)
     inlines = [CustomFormFieldForCategoryInline]
+    list_select_related = ('project',)
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(
+            configured_fields_total=Count('custom_form_fields'),
+            open_tickets=counter_subquery(TicketCounter.SCOPE_CATEGORY, 'open_count'),
+        )
 
     def project_with_status(self, obj): # Для более информативного отображения
         return f"{obj.project.name} ({'Активен' if obj.project.is_active else 'Неактивен'})"
@@ -96,8 +140,14 @@ class TicketCategoryAdmin(admin.ModelAdmin):
 
 
     def count_configured_fields(self, obj):
-        return obj.custom_form_fields.count()
+        return obj.configured_fields_total
     count_configured_fields.short_description = "Кол-во настроенных полей"
+    count_configured_fields.admin_order_field = 'configured_fields_total'
+
+    def count_open_tickets(self, obj):
+        return obj.open_tickets
+    count_open_tickets.short_description = "Открытых заявок"
+    count_open_tickets.admin_order_field = 'open_tickets'
 
 # 6. CustomFormFieldAdmin
 @admin.register(CustomFormField)
@@ -222,7 +272,7 @@ class TicketAdmin(admin.ModelAdmin):
         'ticket_id_display', 'title', 'project', 'status', 'priority', 'category',
         'reporter_name', 'assignee', 'created_at_formatted', 'reporter_ip_address'
     )
-    list_filter = ('project', 'status', 'priority', 'category', 'assignee', 'created_at')
+    list_filter = ('project', 'status', 'priority', 'category', 'assignee', 'sla_state', 'created_at')
     search_fields = (
         'ticket_id_display', 'title', 'description', 
         'reporter_name', 'reporter_email', 'reporter_ip_address',
@@ -232,10 +282,12 @@ class TicketAdmin(admin.ModelAdmin):
     )
     readonly_fields = (
         'ticket_id_display', 'created_at', 'updated_at', 'resolved_at', 
-        'closed_at', 'custom_form_data_display', 'reporter_ip_address'
+        'closed_at', 'custom_form_data_display', 'reporter_ip_address',
+        'sla_policy', 'first_response_due_at', 'first_responded_at', 'resolution_due_at', 'sla_due_at', 'sla_warn_at', 'sla_state'
     )
     list_select_related = ('project', 'status', 'priority', 'category', 'assignee')
     autocomplete_fields = ['project', 'category', 'assignee', 'status', 'priority']
+    raw_id_fields = ('duplicate_of',)
     
     fieldsets = (
         ('Основная информация', {'fields': ('ticket_id_display', 'project', 'title', 'description')}),
@@ -243,11 +295,14 @@ class TicketAdmin(admin.ModelAdmin):
             'reporter_name', 'reporter_email', 'reporter_phone', 
             'reporter_building', 'reporter_room', 'reporter_department', 'reporter_ip_address'
         )}),
-        ('Классификация и статус', {'fields': ('status', 'priority', 'category', 'assignee')}),
+        ('Классификация и статус', {'fields': ('status', 'priority', 'category', 'assignee', 'duplicate_of')}),
         ('Дополнительные данные формы (только чтение)', {'fields': ('custom_form_data_display',), 'classes': ('collapse',)}),
         ('Даты (только чтение)', {'fields': (
             'created_at', 'updated_at', 'resolved_at', 'closed_at'
         ), 'classes': ('collapse',)}),
+        ('SLA (только чтение)', {'fields': (
+            'sla_policy', 'sla_state', 'first_response_due_at', 'first_responded_at', 'resolution_due_at', 'sla_due_at', 'sla_warn_at'
+        ), 'classes': ('collapse',)}),
     )
 
     def created_at_formatted(self, obj):
@@ -273,16 +328,16 @@ class TicketAdmin(admin.ModelAdmin):
 class AttachmentAdmin(admin.ModelAdmin):
     list_display = ('filename_admin', 'ticket_link_admin', 'comment_id_admin', 'uploaded_by_display_admin', 'uploaded_at_formatted_attach')
     list_filter = ('uploaded_at', 'uploaded_by_agent', 'ticket__project', 'comment__ticket__project') # Упростил фильтры
-    search_fields = ('file', 'ticket__ticket_id_display', 'comment__body', 'uploaded_by_name_display')
-    readonly_fields = ('uploaded_at', 'uploaded_by_name_display') # uploaded_by_name_display из модели
+    search_fields = ('original_name', 'file', 'blob__sha256', 'ticket__ticket_id_display', 'comment__body', 'uploaded_by_name_display')
+    readonly_fields = ('uploaded_at', 'uploaded_by_name_display', 'original_name', 'blob') # uploaded_by_name_display из модели, blob - из хранилища
     list_select_related = ('ticket', 'ticket__project', 'comment', 'comment__ticket', 'comment__ticket__project', 'uploaded_by_agent')
-    fields = ('file', 'ticket', 'comment', 'uploaded_by_agent', 'uploaded_by_name_display', 'uploaded_at')
+    fields = ('file', 'original_name', 'blob', 'ticket', 'comment', 'uploaded_by_agent', 'uploaded_by_name_display', 'uploaded_at')
     autocomplete_fields = ['ticket', 'comment', 'uploaded_by_agent']
 
     def filename_admin(self, obj):
-        return os.path.basename(obj.file.name) if obj.file else "N/A"
+        return obj.display_name or "N/A"
     filename_admin.short_description = "Имя файла"
-    filename_admin.admin_order_field = 'file'
+    filename_admin.admin_order_field = 'original_name'
 
     def ticket_link_admin(self, obj):
         ticket_to_display = obj.ticket or (obj.comment and obj.comment.ticket)
@@ -343,13 +398,7 @@ class EmailSettingsAdmin(admin.ModelAdmin): # Убрал action_mixin, т.к. se
             f"Отправитель: {settings_obj.default_from_email}"
         )
         
-        from django.core.mail.backends.smtp import EmailBackend as SMTPEmailBackend
-        backend = SMTPEmailBackend(
-            host=settings_obj.smtp_host, port=settings_obj.smtp_port,
-            username=settings_obj.smtp_user, password=settings_obj.smtp_password,
-            use_tls=settings_obj.use_tls, use_ssl=settings_obj.use_ssl,
-            fail_silently=False
-        )
+        backend = settings_obj.get_connection()
         
         email = EmailMessage(
             subject, message_body, settings_obj.default_from_email,
@@ -375,7 +424,7 @@ class EmailSettingsAdmin(admin.ModelAdmin): # Убрал action_mixin, т.к. se
 # 14. NotificationTemplateAdmin
 @admin.register(NotificationTemplate)
 class NotificationTemplateAdmin(admin.ModelAdmin):
-    list_display = ('name', 'event_code', 'recipient_type', 'is_active')
+    list_display = ('name', 'event_code', 'recipient_type', 'is_active', 'updated_at')
     list_filter = ('is_active', 'recipient_type')
     search_fields = ('name', 'event_code', 'subject_template', 'body_template_html')
     list_editable = ('is_active',)
@@ -420,4 +469,147 @@ class FeedbackAdmin(admin.ModelAdmin):
         if obj: # obj is not None, so this is an edit page
              return self.readonly_fields + ('feedback_type', 'subject', 'message', 'name', 'email', 'submitted_at')
         # Это страница создания, здесь readonly_fields по умолчанию
-        return self.readonly_fields
\ No newline at end of file
+        return self.readonly_fields
+# 16. TicketNumberSequenceAdmin
+@admin.register(TicketNumberSequence)
+class TicketNumberSequenceAdmin(admin.ModelAdmin):
+    list_display = ('project_code', 'year', 'last_value')
+    list_filter = ('year',)
+    search_fields = ('project_code',)
+    ordering = ('project_code', '-year')
+
+# 17. NotificationOutboxAdmin
+@admin.register(NotificationOutbox)
+class NotificationOutboxAdmin(admin.ModelAdmin):
+    list_display = ('event', 'ticket', 'status', 'attempts', 'next_attempt_at', 'created_at', 'sent_at')
+    list_filter = ('status', 'event')
+    search_fields = ('ticket__ticket_id_display', 'event', 'last_error')
+    list_select_related = ('ticket',)
+    raw_id_fields = ('ticket', 'comment')
+    readonly_fields = ('created_at', 'sent_at', 'delivered', 'last_error')
+    actions = ['retry_now_action']
+
+    def retry_now_action(self, request, queryset):
+        updated = queryset.exclude(status=NotificationOutbox.STATUS_SENT).update(
+            status=NotificationOutbox.STATUS_PENDING, attempts=0, next_attempt_at=timezone.now()
+        )
+        self.message_user(request, f"Поставлено на повторную отправку: {updated}.")
+    retry_now_action.short_description = "Отправить повторно сейчас"
+
+# 18. TicketCounterAdmin
+@admin.register(TicketCounter)
+class TicketCounterAdmin(admin.ModelAdmin):
+    list_display = ('scope', 'object_id', 'open_count', 'closed_count', 'new_count', 'assigned_count', 'updated_at')
+    list_filter = ('scope',)
+    readonly_fields = ('scope', 'object_id', 'open_count', 'closed_count', 'new_count', 'assigned_count', 'updated_at')
+
+    def has_add_permission(self, request):
+        return False # строки создаются автоматически; пересчет - manage.py reconcile_ticket_counters
+
+# 19. ImportCheckpointAdmin
+@admin.register(ImportCheckpoint)
+class ImportCheckpointAdmin(admin.ModelAdmin):
+    list_display = ('source', 'rows_processed', 'tickets_created', 'rows_rejected', 'started_at', 'updated_at', 'finished_at')
+    search_fields = ('source',)
+    readonly_fields = ('source', 'rows_processed', 'tickets_created', 'rows_rejected', 'started_at', 'updated_at', 'finished_at')
+
+    def has_add_permission(self, request):
+        return False # создается командой import_tickets; удаление записи = импорт файла заново
+
+# 20. AttachmentBlobAdmin
+@admin.register(AttachmentBlob)
+class AttachmentBlobAdmin(admin.ModelAdmin):
+    list_display = ('sha256', 'size', 'ref_count', 'created_at', 'updated_at')
+    list_filter = ('created_at',)
+    search_fields = ('sha256',)
+    readonly_fields = ('sha256', 'file_name', 'size', 'ref_count', 'created_at', 'updated_at')
+
+    def has_add_permission(self, request):
+        return False # создается при сохранении вложения; блобы без ссылок удаляет manage.py gc_attachment_blobs
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+# 21. Инлайны рабочих часов и нерабочих дней для BusinessCalendar
+class BusinessHoursInline(admin.TabularInline):
+    model = BusinessHours
+    extra = 0
+    fields = ('weekday', 'start_time', 'end_time')
+
+class HolidayInline(admin.TabularInline):
+    model = Holiday
+    extra = 0
+    fields = ('date', 'name')
+
+# 22. BusinessCalendarAdmin
+@admin.register(BusinessCalendar)
+class BusinessCalendarAdmin(admin.ModelAdmin):
+    list_display = ('name', 'timezone', 'hours_summary')
+    search_fields = ('name',)
+    inlines = [BusinessHoursInline, HolidayInline]
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).prefetch_related('hours')
+
+    def hours_summary(self, obj):
+        return ", ".join(str(interval) for interval in obj.hours.all()) or "Круглосуточно"
+    hours_summary.short_description = "Рабочие часы"
+
+# 23. SLAPolicyAdmin
+@admin.register(SLAPolicy)
+class SLAPolicyAdmin(admin.ModelAdmin):
+    list_display = ('name', 'project', 'priority', 'calendar', 'first_response_minutes', 'resolution_minutes', 'at_risk_percent', 'escalate_to', 'is_active')
+    list_filter = ('is_active', 'project', 'priority', 'calendar')
+    search_fields = ('name', 'project__name', 'priority__name')
+    list_select_related = ('project', 'priority', 'calendar', 'escalate_to')
+    autocomplete_fields = ['project', 'priority', 'escalate_to']
+    fieldsets = (
+        (None, {'fields': ('name', 'is_active', 'project', 'priority')}),
+        ('Сроки', {'fields': ('calendar', 'first_response_minutes', 'resolution_minutes', 'at_risk_percent'),
+                   'description': "Новые сроки применяются к новым тикетам и к тикетам, сменившим проект или приоритет. Пересчитать открытые: manage.py recompute_ticket_sla --reset"}),
+        ('Эскалация', {'fields': ('escalate_to',)}),
+    )
+
+# 24. AutoAssignmentRuleAdmin
+@admin.register(AutoAssignmentRule)
+class AutoAssignmentRuleAdmin(admin.ModelAdmin):
+    list_display = ('project', 'strategy', 'is_active', 'max_open_per_agent', 'last_assignee', 'assignment_seq', 'updated_at')
+    list_filter = ('is_active', 'strategy')
+    search_fields = ('project__name',)
+    list_select_related = ('project', 'last_assignee')
+    autocomplete_fields = ['project']
+    readonly_fields = ('last_assignee', 'assignment_seq', 'updated_at')
+
+# 25. AgentSkillAdmin
+@admin.register(AgentSkill)
+class AgentSkillAdmin(admin.ModelAdmin):
+    list_display = ('agent', 'category', 'weight')
+    list_filter = ('category__project', 'category')
+    search_fields = ('agent__username', 'agent__first_name', 'agent__last_name', 'category__name')
+    list_select_related = ('agent', 'category__project')
+    autocomplete_fields = ['agent', 'category']
+
+# 26. TicketDuplicateCandidateAdmin
+@admin.register(TicketDuplicateCandidate)
+class TicketDuplicateCandidateAdmin(admin.ModelAdmin):
+    list_display = ('ticket', 'candidate', 'similarity', 'detected_at')
+    list_filter = ('ticket__project', 'detected_at')
+    search_fields = ('ticket__ticket_id_display', 'candidate__ticket_id_display')
+    list_select_related = ('ticket', 'candidate')
+    raw_id_fields = ('ticket', 'candidate')
+    readonly_fields = ('ticket', 'candidate', 'similarity', 'detected_at')
+
+    def has_add_permission(self, request):
+        return False # находятся при создании заявки и командой rebuild_duplicate_index --detect; удаление = "не дубликат"
+
+# 27. TicketDailyRollupAdmin
+@admin.register(TicketDailyRollup)
+class TicketDailyRollupAdmin(admin.ModelAdmin):
+    list_display = ('day', 'project', 'category_key', 'priority_key', 'assignee_key', 'created_count', 'backlog_delta', 'resolved_count', 'closed_count', 'first_response_count')
+    list_filter = ('project', 'day')
+    date_hierarchy = 'day'
+    list_select_related = ('project',)
+    readonly_fields = [field.name for field in TicketDailyRollup._meta.fields]
+
+    def has_add_permission(self, request):
+        return False # строки создаются автоматически; пересчет - manage.py backfill_ticket_rollups
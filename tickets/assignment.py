@@ -0,0 +1,190 @@
+# tickets/assignment.py
+# Автоматическое назначение исполнителя новым тикетам по правилу проекта (AutoAssignmentRule):
+# - round_robin: следующий по pk после последнего назначенного (курсор хранится в строке правила);
+# - least_open: сотрудник с наименьшим числом открытых назначенных заявок, при равенстве - кто дольше ждал;
+# - skills: сотрудники с навыком в категории тикета (AgentSkill), минимум (загрузка + 1) / вес;
+#   если навыков по категории ни у кого нет - как least_open.
+# Загрузка сотрудников (TicketCounter.assigned_count разреза "сотрудник") держится в памяти процесса
+# (AgentLoadBoard): куча на проект с ленивым удалением устаревших записей. Она обновляется приращениями
+# счетчиков после коммита (tickets/signals.py), а не подсчетом тикетов.
+# Атомарность: выбор и назначение идут в одной транзакции под блокировкой строки правила проекта
+# (SELECT FOR UPDATE), поэтому параллельно созданные заявки проекта назначаются строго по одной.
+# Назначения, сделанные другими процессами, видны по assignment_seq правила - тогда загрузка проекта
+# перечитывается из TicketCounter (один запрос); прочие изменения из других процессов (закрытие заявок)
+# подтягиваются не реже, чем раз в AUTO_ASSIGN_RESYNC_SECONDS.
+import heapq
+import threading
+import time
+
+from django.conf import settings
+from django.db import transaction
+
+from . import counters
+from .cache_versions import VersionStamp
+from .history import record_ticket_event
+from .models import Agent, AgentSkill, AutoAssignmentRule, TicketCounter, TicketEvent
+
+AUTO_ASSIGN_ACTOR_NAME = 'Автоназначение'
+DEFAULT_RESYNC_SECONDS = 60
+
+
+class _Roster:
+    """Сотрудники проекта, которым можно назначать заявки, и их навыки по категориям проекта."""
+
+    def __init__(self, agents, skills):
+        self.agents = {agent.pk: agent for agent in agents}
+        self.agent_ids = sorted(self.agents)
+        self.skills = skills # {category_id: {agent_id: вес}}
+
+
+class AgentLoadBoard:
+    def __init__(self):
+        self.roster_stamp = VersionStamp('assignment_rosters')
+        self._lock = threading.RLock()
+        self._rosters = {}
+        self._roster_version = None
+        self._heaps = {} # project_id -> [(загрузка, тик, agent_id)]
+        self._synced = {} # project_id -> (assignment_seq, time.monotonic() синхронизации)
+        self.loads = {} # agent_id -> открытых назначенных заявок
+        self.ticks = {} # agent_id -> номер последнего автоназначения в процессе
+        self._tick = 0
+        self.assignments = 0
+        self.resyncs = 0
+        self.roster_loads = 0
+
+    @property
+    def resync_seconds(self):
+        return getattr(settings, 'AUTO_ASSIGN_RESYNC_SECONDS', DEFAULT_RESYNC_SECONDS)
+
+    # --- Состав проекта ---
+    def _load_roster(self, project_id):
+        agents = list(
+            Agent.objects.filter(projects=project_id, is_active=True, is_staff=True, accepts_auto_assignment=True)
+            .only('pk', 'username', 'first_name', 'last_name', 'email').order_by('pk')
+        )
+        skills = {}
+        rows = AgentSkill.objects.filter(agent__in=[agent.pk for agent in agents], category__project_id=project_id).values_list('category_id', 'agent_id', 'weight')
+        for category_id, agent_id, weight in rows: skills.setdefault(category_id, {})[agent_id] = weight
+        return _Roster(agents, skills)
+
+    def roster(self, project_id):
+        version = self.roster_stamp.current()
+        with self._lock:
+            if self._roster_version != version:
+                self._rosters = {}; self._heaps = {}; self._synced = {}; self._roster_version = version
+            roster = self._rosters.get(project_id)
+            if roster is None:
+                roster = self._rosters[project_id] = self._load_roster(project_id); self.roster_loads += 1
+            return roster
+
+    def invalidate_rosters(self):
+        self.roster_stamp.bump()
+
+    # --- Загрузка ---
+    def _push(self, project_id, agent_id):
+        heap = self._heaps.get(project_id)
+        if heap is None: return
+        heapq.heappush(heap, (self.loads.get(agent_id, 0), self.ticks.get(agent_id, 0), agent_id))
+
+    def _resync(self, project_id, roster, seq):
+        values = counters.get_counters(TicketCounter.SCOPE_AGENT, roster.agent_ids)
+        for agent_id in roster.agent_ids:
+            counter = values.get(agent_id)
+            self.loads[agent_id] = counter.assigned_count if counter else 0
+        self._heaps[project_id] = [(self.loads[a], self.ticks.get(a, 0), a) for a in roster.agent_ids]
+        heapq.heapify(self._heaps[project_id])
+        self._synced[project_id] = (seq, time.monotonic()); self.resyncs += 1
+
+    def _ensure_synced(self, rule, roster):
+        synced = self._synced.get(rule.project_id)
+        if synced is None or synced[0] != rule.assignment_seq or time.monotonic() - synced[1] > self.resync_seconds:
+            self._resync(rule.project_id, roster, rule.assignment_seq)
+
+    def apply_counter_deltas(self, deltas):
+        """Приращения TicketCounter после коммита: меняется загрузка сотрудников (разрез 'agent')."""
+        with self._lock:
+            for (scope, agent_id), changes in deltas.items():
+                if scope != TicketCounter.SCOPE_AGENT or not changes.get('assigned_count') or agent_id not in self.loads: continue
+                self.loads[agent_id] += changes['assigned_count']
+                for project_id, roster in self._rosters.items():
+                    if agent_id in roster.agents: self._push(project_id, agent_id)
+
+    def note_assignment(self, project_id, agent_id, seq):
+        with self._lock:
+            self._tick += 1; self.ticks[agent_id] = self._tick; self.assignments += 1
+            synced = self._synced.get(project_id)
+            # Назначение этого процесса - загрузка уже учтена приращением счетчика, перечитывать не нужно
+            if synced is not None and synced[0] == seq - 1: self._synced[project_id] = (seq, synced[1])
+            for pid, roster in self._rosters.items():
+                if agent_id in roster.agents: self._push(pid, agent_id)
+
+    # --- Выбор исполнителя ---
+    def _least_open(self, project_id, roster, cap):
+        heap = self._heaps[project_id]
+        if len(heap) > 4 * len(roster.agent_ids) + 16: # много устаревших записей - пересобираем
+            heap[:] = [(self.loads.get(a, 0), self.ticks.get(a, 0), a) for a in roster.agent_ids]; heapq.heapify(heap)
+        while heap:
+            load, tick, agent_id = heap[0]
+            if load != self.loads.get(agent_id, 0) or tick != self.ticks.get(agent_id, 0) or agent_id not in roster.agents:
+                heapq.heappop(heap); continue # запись устарела
+            if cap is not None and load >= cap: return None # даже наименее загруженный на пределе
+            return roster.agents[agent_id]
+        return None
+
+    def _by_skills(self, project_id, roster, cap, category_id):
+        weights = roster.skills.get(category_id)
+        if not weights: return self._least_open(project_id, roster, cap)
+        candidates = [
+            ((self.loads.get(agent_id, 0) + 1) / weight, self.ticks.get(agent_id, 0), agent_id)
+            for agent_id, weight in weights.items() if cap is None or self.loads.get(agent_id, 0) < cap
+        ]
+        return roster.agents[min(candidates)[2]] if candidates else None
+
+    def _round_robin(self, rule, roster, cap):
+        agent_ids = [a for a in roster.agent_ids if cap is None or self.loads.get(a, 0) < cap]
+        if not agent_ids: return None
+        after = rule.last_assignee_id or 0
+        return roster.agents[next((a for a in agent_ids if a > after), agent_ids[0])]
+
+    def choose(self, rule, ticket):
+        """Исполнитель для тикета по правилу (вызывать под блокировкой строки правила) или None."""
+        roster = self.roster(rule.project_id)
+        if not roster.agent_ids: return None
+        with self._lock:
+            self._ensure_synced(rule, roster)
+            cap = rule.max_open_per_agent
+            if rule.strategy == AutoAssignmentRule.STRATEGY_ROUND_ROBIN: return self._round_robin(rule, roster, cap)
+            if rule.strategy == AutoAssignmentRule.STRATEGY_SKILLS: return self._by_skills(rule.project_id, roster, cap, ticket.category_id)
+            return self._least_open(rule.project_id, roster, cap)
+
+    def stats(self):
+        return {
+            'projects': len(self._rosters), 'agents': len(self.loads), 'assignments': self.assignments,
+            'resyncs': self.resyncs, 'roster_loads': self.roster_loads, 'version': self.roster_stamp.current(),
+        }
+
+
+assignment_board = AgentLoadBoard()
+
+
+def auto_assign_ticket(ticket):
+    """
+    Назначает исполнителя тикету без исполнителя по активному правилу его проекта.
+    Возвращает назначенного сотрудника или None (правила нет, нет подходящих сотрудников, все на пределе).
+    """
+    from .notifications import EVENT_ASSIGNEE_CHANGED, enqueue_notification
+    if ticket.assignee_id or not ticket.project_id: return None
+    with transaction.atomic():
+        rule = AutoAssignmentRule.objects.select_for_update().filter(project_id=ticket.project_id, is_active=True).first()
+        if rule is None: return None
+        agent = assignment_board.choose(rule, ticket)
+        if agent is None: return None
+        ticket.assignee = agent
+        ticket.save(update_fields=['assignee', 'updated_at']) # updated_at - ключ кэша строк списка и опрос планировщика SLA
+        rule.last_assignee = agent; rule.assignment_seq += 1
+        rule.save(update_fields=['last_assignee', 'assignment_seq', 'updated_at'])
+        record_ticket_event(ticket, TicketEvent.KIND_ASSIGNEE, None, agent, actor_name=AUTO_ASSIGN_ACTOR_NAME, note=f"Назначено автоматически: {rule.get_strategy_display().lower()}.")
+        enqueue_notification(EVENT_ASSIGNEE_CHANGED, ticket, old_assignee="не был назначен", new_assignee=agent.get_full_name() or agent.username)
+        project_id, agent_id, seq = rule.project_id, agent.pk, rule.assignment_seq
+        transaction.on_commit(lambda: assignment_board.note_assignment(project_id, agent_id, seq))
+    return agent
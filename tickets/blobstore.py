@@ -0,0 +1,157 @@
+# tickets/blobstore.py
+# Хранилище вложений с адресацией по содержимому.
+# Файл хранится один раз под именем из SHA-256 содержимого: attachment_blobs/ab/cd/<sha256>
+# (два уровня каталогов, чтобы в одном каталоге не копились сотни тысяч файлов).
+# Одинаковый скриншот, приложенный к 50 тикетам, лежит на диске в одном экземпляре; вложения ссылаются
+# на строку AttachmentBlob, которая считает ссылки (ref_count). Исходное имя файла хранится
+# в Attachment.original_name.
+# Хэш считается во время приема загрузки (HashingTemporaryFileUploadHandler / HashingMemoryFileUploadHandler
+# в FILE_UPLOAD_HANDLERS) - файл не перечитывается; для остальных файлов хэш считается при записи во
+# временный файл рядом с хранилищем. Блобы без ссылок удаляет команда gc_attachment_blobs.
+import hashlib
+import os
+import tempfile
+from datetime import timedelta
+
+from django.core.files.storage import FileSystemStorage
+from django.core.files.uploadhandler import MemoryFileUploadHandler, TemporaryFileUploadHandler
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+BLOB_DIR = 'attachment_blobs'
+HASH_CHUNK_SIZE = 64 * 1024
+DEFAULT_GC_GRACE = timedelta(hours=24)
+
+
+# --- Прием загрузки с подсчетом хэша ---
+class _HashingUploadMixin:
+    def new_file(self, *args, **kwargs):
+        self.hasher = hashlib.sha256() # до super(): MemoryFileUploadHandler.new_file завершается исключением StopFutureHandlers
+        super().new_file(*args, **kwargs)
+
+    def file_complete(self, file_size):
+        uploaded_file = super().file_complete(file_size)
+        if uploaded_file is not None: uploaded_file.sha256 = self.hasher.hexdigest()
+        return uploaded_file
+
+class HashingMemoryFileUploadHandler(_HashingUploadMixin, MemoryFileUploadHandler):
+    def receive_data_chunk(self, raw_data, start):
+        if self.activated: self.hasher.update(raw_data) # большой файл уходит следующему обработчику
+        return super().receive_data_chunk(raw_data, start)
+
+class HashingTemporaryFileUploadHandler(_HashingUploadMixin, TemporaryFileUploadHandler):
+    def receive_data_chunk(self, raw_data, start):
+        self.hasher.update(raw_data)
+        return super().receive_data_chunk(raw_data, start)
+
+
+# --- Хранилище ---
+def blob_name(sha256):
+    return f"{BLOB_DIR}/{sha256[:2]}/{sha256[2:4]}/{sha256}"
+
+def sha256_from_name(name):
+    """SHA-256 из имени блоба; None для файлов, еще не перенесенных в хранилище блобов."""
+    if not name or not name.startswith(BLOB_DIR + '/'): return None
+    return os.path.basename(name)
+
+def blob_upload_to(instance, filename):
+    # Итоговое имя выбирает хранилище по содержимому; это имя используется только до записи
+    return f"{BLOB_DIR}/incoming/{os.path.basename(filename)}"
+
+
+class AttachmentBlobStorage(FileSystemStorage):
+    """FileSystemStorage в MEDIA_ROOT, который сохраняет файл под именем его SHA-256.
+    Старые вложения (ticket_attachments/...) лежат в том же корне и читаются как раньше."""
+
+    def _save(self, name, content):
+        sha256 = getattr(content, 'sha256', None)
+        temp_path = None
+        if sha256 is None: sha256, temp_path = self._hash_to_temp(content)
+        final_name = blob_name(sha256)
+        final_path = self.path(final_name)
+        if os.path.exists(final_path): # такой файл уже есть - не пишем второй раз
+            if temp_path: os.remove(temp_path)
+            return final_name
+        os.makedirs(os.path.dirname(final_path), exist_ok=True)
+        if temp_path:
+            os.replace(temp_path, final_path)
+            if self.file_permissions_mode is not None: os.chmod(final_path, self.file_permissions_mode)
+            return final_name
+        saved_name = super()._save(final_name, content)
+        if saved_name != final_name: # параллельная загрузка того же файла успела первой
+            self.delete(saved_name)
+        return final_name
+
+    def _hash_to_temp(self, content):
+        temp_dir = self.path(BLOB_DIR)
+        os.makedirs(temp_dir, exist_ok=True)
+        hasher = hashlib.sha256()
+        fd, temp_path = tempfile.mkstemp(dir=temp_dir, prefix='.upload-')
+        try:
+            with os.fdopen(fd, 'wb') as temp_file:
+                if hasattr(content, 'seek'): content.seek(0)
+                for chunk in content.chunks(HASH_CHUNK_SIZE) if hasattr(content, 'chunks') else iter(lambda: content.read(HASH_CHUNK_SIZE), b''):
+                    hasher.update(chunk); temp_file.write(chunk)
+        except BaseException:
+            os.remove(temp_path); raise
+        return hasher.hexdigest(), temp_path
+
+_storage = None
+
+def attachment_storage():
+    global _storage
+    if _storage is None: _storage = AttachmentBlobStorage() # MEDIA_ROOT/MEDIA_URL читаются при обращении (и меняются в тестах)
+    return _storage
+
+
+# --- Подсчет ссылок ---
+def acquire_blob(name, size):
+    """Добавляет ссылку на блоб (создает строку при первой ссылке). Вызывается в транзакции сохранения вложения."""
+    from .models import AttachmentBlob
+    sha256 = sha256_from_name(name)
+    if sha256 is None: return None
+    blob, created = AttachmentBlob.objects.get_or_create(sha256=sha256, defaults={'file_name': name, 'size': size or 0, 'ref_count': 1})
+    if not created: AttachmentBlob.objects.filter(pk=blob.pk).update(ref_count=F('ref_count') + 1, updated_at=timezone.now())
+    return blob
+
+def release_blob(blob_id):
+    from .models import AttachmentBlob
+    if blob_id: AttachmentBlob.objects.filter(pk=blob_id).update(ref_count=F('ref_count') - 1, updated_at=timezone.now())
+
+def recount_blob_references():
+    """Пересчитывает ref_count по фактическим вложениям; возвращает число исправленных строк."""
+    from django.db.models import Count
+    from .models import AttachmentBlob
+    fixed = 0
+    for blob in AttachmentBlob.objects.annotate(actual=Count('attachments')).exclude(ref_count=F('actual')).only('pk'):
+        AttachmentBlob.objects.filter(pk=blob.pk).update(ref_count=blob.actual, updated_at=timezone.now()); fixed += 1
+    return fixed
+
+def collect_garbage(grace=DEFAULT_GC_GRACE, dry_run=False):
+    """Удаляет блобы без ссылок, не менявшиеся дольше grace (чтобы не гоняться с загрузкой, которая
+    только что нашла файл на диске). Возвращает (количество, освобождено байт)."""
+    from .models import AttachmentBlob
+    storage = attachment_storage()
+    candidates = AttachmentBlob.objects.filter(ref_count__lte=0, updated_at__lt=timezone.now() - grace, attachments__isnull=True)
+    removed = 0; freed = 0
+    for blob_id in list(candidates.values_list('pk', flat=True)):
+        with transaction.atomic():
+            blob = AttachmentBlob.objects.select_for_update().filter(pk=blob_id, ref_count__lte=0).first()
+            if blob is None or blob.attachments.exists(): continue # ссылка появилась после выборки
+            removed += 1; freed += blob.size
+            if dry_run: continue
+            blob.delete()
+            transaction.on_commit(lambda name=blob.file_name: storage.delete(name))
+    return removed, freed
+
+def orphan_blob_files():
+    """Файлы в каталоге блобов без строки AttachmentBlob (например, после сбоя между записью файла и коммитом)."""
+    from .models import AttachmentBlob
+    storage = attachment_storage()
+    root = storage.path(BLOB_DIR)
+    known = set(AttachmentBlob.objects.values_list('sha256', flat=True))
+    for dirpath, _, filenames in os.walk(root):
+        for filename in filenames:
+            if len(filename) == 64 and filename not in known:
+                yield os.path.relpath(os.path.join(dirpath, filename), storage.location).replace(os.sep, '/')
@@ -0,0 +1,62 @@
+# tickets/cache_versions.py
+# Номера версий для внутрипроцессных кэшей (справочники, формы и т.п.).
+# Версии хранятся в БД (таблица CacheVersion), поэтому сброс, сделанный в одном процессе (например,
+# сохранение в админке), видят все процессы: веб-воркеры и долгоживущие команды (run_sla_scheduler,
+# send_notifications, auto_assign_tickets) - независимо от того, какой кэш Django настроен.
+# Чтобы не обращаться к БД на каждый запрос, процесс перечитывает все версии одним запросом
+# не чаще, чем раз в CACHE_VERSION_CHECK_INTERVAL секунд. В своем процессе сброс виден сразу.
+import threading
+import time
+
+from django.conf import settings
+from django.db.models import F
+from django.utils import timezone
+
+from .models import CacheVersion
+
+DEFAULT_CHECK_INTERVAL = 5 # секунд
+
+
+class _VersionTable:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._values = {}
+        self._checked_at = None
+        self.reads = 0
+
+    def get(self, name, check_interval):
+        now = time.monotonic()
+        if self._checked_at is None or now - self._checked_at >= check_interval:
+            with self._lock:
+                if self._checked_at is None or now - self._checked_at >= check_interval:
+                    self._values = dict(CacheVersion.objects.values_list('name', 'version'))
+                    self._checked_at = now; self.reads += 1
+        return self._values.get(name, 0)
+
+    def bump(self, name):
+        changes = {'version': F('version') + 1, 'updated_at': timezone.now()}
+        if not CacheVersion.objects.filter(name=name).update(**changes):
+            # Строки еще нет - создаем (параллельное создание не страшно) и повторяем приращение
+            CacheVersion.objects.bulk_create([CacheVersion(name=name)], ignore_conflicts=True)
+            CacheVersion.objects.filter(name=name).update(**changes)
+        value = CacheVersion.objects.filter(name=name).values_list('version', flat=True).first()
+        with self._lock: self._values[name] = value
+        return value
+
+
+_versions = _VersionTable()
+
+
+class VersionStamp:
+    def __init__(self, name):
+        self.name = name
+
+    @property
+    def check_interval(self):
+        return getattr(settings, 'CACHE_VERSION_CHECK_INTERVAL', DEFAULT_CHECK_INTERVAL)
+
+    def current(self):
+        return _versions.get(self.name, self.check_interval)
+
+    def bump(self):
+        return _versions.bump(self.name)
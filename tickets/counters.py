@@ -0,0 +1,110 @@
+# tickets/counters.py
+# Поддержка таблицы TicketCounter: количество открытых/закрытых/новых/назначенных тикетов
+# по проекту, категории и исполнителю.
+# Перед сохранением и удалением прежнее состояние тикета читается под блокировкой строки (pre_save/pre_delete
+# в tickets/signals.py), после - в счетчики добавляется разница старого и нового вклада через F().
+# Массовые операции в обход save() (QuerySet.update, bulk_create) счетчики не обновляют -
+# для них есть команда reconcile_ticket_counters.
+from collections import defaultdict
+
+from django.db.models import Count, F, Q
+
+from .models import Ticket, TicketCounter, TicketStatus
+from .reference_cache import reference_data
+
+COUNTER_FIELDS = ('open_count', 'closed_count', 'new_count', 'assigned_count')
+NEW_STATUS_CODE = 'new'
+STATE_FIELDS = ('project_id', 'category_id', 'assignee_id', 'status_id')
+_DEFERRED = object()
+
+def _status_flags(status_id):
+    if not status_id: return False, False
+    try: status = reference_data.get_status_by_pk(status_id)
+    except TicketStatus.DoesNotExist: return False, False
+    return status.is_closed_status, status.code == NEW_STATUS_CODE
+
+def snapshot_state(ticket):
+    """Значения полей, от которых зависят счетчики; None, если какие-то поля не загружены (.only/.defer)."""
+    values = tuple(ticket.__dict__.get(name, _DEFERRED) for name in STATE_FIELDS)
+    if any(value is _DEFERRED for value in values): return None
+    return values
+
+def load_state(ticket_pk):
+    row = Ticket.objects.filter(pk=ticket_pk).values_list(*STATE_FIELDS).first()
+    return tuple(row) if row else None
+
+def state_from_row(row):
+    """Состояние из строки .values() с полями STATE_FIELDS (и, возможно, другими)."""
+    return tuple(row[name] for name in STATE_FIELDS) if row else None
+
+def state_contributions(state):
+    """{(разрез, id): {поле: +1}} - вклад одного тикета в счетчики."""
+    if state is None: return {}
+    project_id, category_id, assignee_id, status_id = state
+    is_closed, is_new = _status_flags(status_id)
+    values = {
+        'open_count': 0 if is_closed else 1,
+        'closed_count': 1 if is_closed else 0,
+        'new_count': 1 if is_new else 0,
+        'assigned_count': 1 if assignee_id and not is_closed else 0,
+    }
+    contributions = {}
+    if project_id: contributions[(TicketCounter.SCOPE_PROJECT, project_id)] = values
+    if category_id: contributions[(TicketCounter.SCOPE_CATEGORY, category_id)] = values
+    if assignee_id: contributions[(TicketCounter.SCOPE_AGENT, assignee_id)] = values
+    return contributions
+
+def state_deltas(old_state, new_state):
+    deltas = defaultdict(lambda: dict.fromkeys(COUNTER_FIELDS, 0))
+    for key, values in state_contributions(old_state).items():
+        for field, value in values.items(): deltas[key][field] -= value
+    for key, values in state_contributions(new_state).items():
+        for field, value in values.items(): deltas[key][field] += value
+    return {key: changes for key, changes in deltas.items() if any(changes.values())}
+
+def apply_deltas(deltas):
+    for (scope, object_id), changes in deltas.items():
+        update_kwargs = {field: F(field) + value for field, value in changes.items() if value}
+        if TicketCounter.objects.filter(scope=scope, object_id=object_id).update(**update_kwargs): continue
+        # Строки счетчика еще нет - создаем (параллельное создание не страшно) и повторяем приращение
+        TicketCounter.objects.bulk_create([TicketCounter(scope=scope, object_id=object_id)], ignore_conflicts=True)
+        TicketCounter.objects.filter(scope=scope, object_id=object_id).update(**update_kwargs)
+
+def apply_ticket_change(old_state, new_state):
+    deltas = state_deltas(old_state, new_state)
+    if deltas: apply_deltas(deltas)
+    return deltas
+
+def add_new_tickets(states):
+    """Учитывает в счетчиках пачку новых тикетов, созданных в обход save() (bulk_create при импорте)."""
+    deltas = defaultdict(lambda: dict.fromkeys(COUNTER_FIELDS, 0))
+    for state in states:
+        for key, values in state_contributions(state).items():
+            for field, value in values.items(): deltas[key][field] += value
+    apply_deltas({key: changes for key, changes in deltas.items() if any(changes.values())})
+
+# --- Чтение ---
+def get_counters(scope, object_ids=None):
+    """{id объекта: TicketCounter} для разреза; object_ids=None - все строки разреза."""
+    queryset = TicketCounter.objects.filter(scope=scope)
+    if object_ids is not None: queryset = queryset.filter(object_id__in=list(object_ids))
+    return {counter.object_id: counter for counter in queryset}
+
+# --- Полный пересчет (reconcile) ---
+def compute_counters():
+    """Точные значения счетчиков по данным тикетов: {(разрез, id): {поле: значение}}."""
+    closed_status_ids = [s.pk for s in reference_data.statuses() if s.is_closed_status]
+    new_status_ids = [s.pk for s in reference_data.statuses() if s.code == NEW_STATUS_CODE]
+    is_closed = Q(status_id__in=closed_status_ids)
+    aggregates = {
+        'open_count': Count('pk', filter=~is_closed),
+        'closed_count': Count('pk', filter=is_closed),
+        'new_count': Count('pk', filter=Q(status_id__in=new_status_ids)),
+        'assigned_count': Count('pk', filter=Q(assignee__isnull=False) & ~is_closed),
+    }
+    result = {}
+    for scope, field in ((TicketCounter.SCOPE_PROJECT, 'project_id'), (TicketCounter.SCOPE_CATEGORY, 'category_id'), (TicketCounter.SCOPE_AGENT, 'assignee_id')):
+        rows = Ticket.objects.filter(**{f"{field}__isnull": False}).order_by().values(field).annotate(**aggregates)
+        for row in rows:
+            result[(scope, row[field])] = {name: row[name] for name in COUNTER_FIELDS}
+    return result
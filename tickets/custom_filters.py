@@ -0,0 +1,168 @@
+# tickets/custom_filters.py
+# Фильтры списка заявок агента по дополнительным полям (Ticket.custom_form_data).
+# Фильтруются только шаблоны полей с FieldTemplate.is_filterable; поле формы фильтров - 'cf_<имя поля>',
+# как колонки выгрузки (tickets/export.py). Сравнение - точное, с типом значения из JSON
+# (число - числом, да/нет - булевым, дата - строкой ISO), поэтому условие имеет вид
+# (custom_form_data -> 'имя') = значение и в PostgreSQL использует индекс по выражению.
+# Индексы создаются не миграцией, а командой sync_custom_field_indexes (CREATE INDEX CONCURRENTLY):
+# набор полей меняется в админке, а создание индекса на миллионах строк нельзя делать в запросе.
+# Имя индекса содержит pk шаблона и crc32 имени поля - переименованное поле получает новый индекс.
+# Шаблоны с именем колонки Ticket не фильтруются: их значение сохраняется в колонку (FieldTemplate.clean).
+# Описания фильтров кэшируются в памяти процесса по версии (сигналы в tickets/signals.py), как формы категорий.
+import threading
+import zlib
+
+from django import forms
+from django.db import connection, models
+from django.db.models.fields.json import KeyTransform
+
+from .cache_versions import VersionStamp
+from .models import CustomFormField, FieldTemplate, Ticket
+
+CUSTOM_FILTER_PREFIX = 'cf_'
+FILTERABLE_FIELD_TYPES = FieldTemplate.FILTERABLE_FIELD_TYPES
+INDEX_PREFIX = 'ticket_cf_'
+BOOL_FILTER_CHOICES = [('', 'Любое'), ('1', 'Да'), ('0', 'Нет')]
+TICKET_COLUMN_NAMES = {f.name for f in Ticket._meta.get_fields() if not f.is_relation}
+
+
+def index_name(template_id, name):
+    return f"{INDEX_PREFIX}{template_id}_{zlib.crc32(name.encode('utf-8')):08x}"
+
+def field_index(template_id, name):
+    """Индекс по выражению (custom_form_data -> 'имя') - то же выражение, что в условии фильтра."""
+    return models.Index(KeyTransform(name, 'custom_form_data'), name=index_name(template_id, name))
+
+
+class CustomFieldFilter:
+    """Фильтруемое поле: шаблон и категории/проекты, где оно включено."""
+
+    def __init__(self, template):
+        self.template_id = template.pk
+        self.name = template.name
+        self.label = template.label_default
+        self.field_type = template.field_type
+        self.choices = template.select_choices_json_default if isinstance(template.select_choices_json_default, dict) else None
+        self.category_ids = set()
+        self.project_ids = set()
+
+    @property
+    def form_field_name(self):
+        return f"{CUSTOM_FILTER_PREFIX}{self.name}"
+
+    def form_field(self):
+        field_kwargs = {'label': self.label, 'required': False}
+        if self.field_type == 'int':
+            return forms.IntegerField(widget=forms.NumberInput(attrs={'class': 'form-control form-control-sm', 'placeholder': self.label}), **field_kwargs)
+        if self.field_type == 'date':
+            return forms.DateField(widget=forms.DateInput(attrs={'class': 'form-control form-control-sm', 'type': 'date'}, format='%Y-%m-%d'), **field_kwargs)
+        if self.field_type == 'bool':
+            return forms.ChoiceField(choices=BOOL_FILTER_CHOICES, widget=forms.Select(attrs={'class': 'form-select form-select-sm'}), **field_kwargs)
+        if self.field_type == 'select' and self.choices:
+            return forms.ChoiceField(choices=[('', f"{self.label}: любое")] + list(self.choices.items()), widget=forms.Select(attrs={'class': 'form-select form-select-sm'}), **field_kwargs)
+        return forms.CharField(max_length=255, widget=forms.TextInput(attrs={'class': 'form-control form-control-sm', 'placeholder': self.label}), **field_kwargs)
+
+    def json_value(self, cleaned_value):
+        """Значение в том виде, в каком оно лежит в custom_form_data, или None, если фильтр не задан."""
+        if cleaned_value in (None, ''): return None
+        if self.field_type == 'bool': return cleaned_value == '1'
+        if self.field_type == 'date': return cleaned_value.isoformat()
+        if isinstance(cleaned_value, str): return cleaned_value.strip() or None
+        return cleaned_value
+
+    def apply(self, queryset, cleaned_value):
+        value = self.json_value(cleaned_value)
+        if value is None: return queryset
+        # Через alias, а не custom_form_data__<имя>: имя поля может совпасть с названием lookup'а ('contains', 'in')
+        alias = f"custom_filter_{self.template_id}"
+        return queryset.alias(**{alias: KeyTransform(self.name, 'custom_form_data')}).filter(**{alias: value})
+
+
+class CustomFieldFilterRegistry:
+    def __init__(self):
+        self.stamp = VersionStamp('custom_field_filters')
+        self._lock = threading.Lock()
+        self._filters = None
+        self._filters_version = None
+        self.hits = 0
+        self.misses = 0
+
+    def _load(self):
+        filters = {}
+        rows = (
+            CustomFormField.objects.filter(is_active_in_category=True, field_template__is_filterable=True, field_template__field_type__in=FILTERABLE_FIELD_TYPES)
+            .select_related('field_template', 'category').order_by('field_template__label_default', 'field_template_id')
+        )
+        for field_def in rows:
+            if field_def.field_template.name in TICKET_COLUMN_NAMES: continue
+            custom_filter = filters.get(field_def.field_template_id)
+            if custom_filter is None: custom_filter = filters[field_def.field_template_id] = CustomFieldFilter(field_def.field_template)
+            custom_filter.category_ids.add(field_def.category_id); custom_filter.project_ids.add(field_def.category.project_id)
+        return list(filters.values())
+
+    def all(self):
+        version = self.stamp.current()
+        filters = self._filters
+        if filters is not None and self._filters_version == version:
+            self.hits += 1
+            return filters
+        self.misses += 1
+        filters = self._load()
+        with self._lock:
+            self._filters = filters; self._filters_version = version
+        return filters
+
+    def for_scope(self, category_id=None, project_ids=None):
+        """Фильтры для категории (если выбрана) или для проектов сотрудника (None - все проекты)."""
+        filters = self.all()
+        if category_id: return [f for f in filters if category_id in f.category_ids]
+        if project_ids is not None: return [f for f in filters if f.project_ids.intersection(project_ids)]
+        return filters
+
+    def invalidate(self):
+        with self._lock:
+            self._filters = None
+        self.stamp.bump()
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'fields': len(self._filters or ()), 'version': self.stamp.current()}
+
+
+custom_field_filters = CustomFieldFilterRegistry()
+
+
+# --- Индексы по выражению для фильтруемых полей ---
+def expected_indexes():
+    """{имя индекса: models.Index} для всех шаблонов с is_filterable (в том числе еще не добавленных в категории)."""
+    templates = FieldTemplate.objects.filter(is_filterable=True, field_type__in=FILTERABLE_FIELD_TYPES).values_list('pk', 'name')
+    return {index_name(pk, name): field_index(pk, name) for pk, name in templates if name not in TICKET_COLUMN_NAMES}
+
+def existing_indexes():
+    with connection.cursor() as cursor:
+        constraints = connection.introspection.get_constraints(cursor, Ticket._meta.db_table)
+    return {name for name, info in constraints.items() if info.get('index') and name.startswith(INDEX_PREFIX)}
+
+def invalid_indexes():
+    """Индексы, не достроенные CREATE INDEX CONCURRENTLY (прерванная команда): их нужно удалить и создать заново."""
+    if connection.vendor != 'postgresql': return set()
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT c.relname FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+            "WHERE i.indrelid = %s::regclass AND NOT i.indisvalid AND c.relname LIKE %s",
+            [Ticket._meta.db_table, INDEX_PREFIX + '%'],
+        )
+        return {row[0] for row in cursor.fetchall()}
+
+def add_field_index(index):
+    # В PostgreSQL - без блокировки записи в таблицу тикетов; CONCURRENTLY нельзя выполнять в транзакции
+    if connection.vendor == 'postgresql':
+        with connection.schema_editor(atomic=False) as schema_editor: schema_editor.add_index(Ticket, index, concurrently=True)
+    else:
+        with connection.schema_editor() as schema_editor: schema_editor.add_index(Ticket, index)
+
+def drop_field_index(name):
+    index = models.Index(fields=['id'], name=name) # для DROP INDEX важно только имя
+    if connection.vendor == 'postgresql':
+        with connection.schema_editor(atomic=False) as schema_editor: schema_editor.remove_index(Ticket, index, concurrently=True)
+    else:
+        with connection.schema_editor() as schema_editor: schema_editor.remove_index(Ticket, index)
@@ -0,0 +1,116 @@
+# tickets/downloads.py
+# Отдача файлов вложений через представление с проверкой доступа (views.*_attachment_download_view).
+# - Файл не читается в память: полный ответ - FileResponse (wsgi.file_wrapper / sendfile, если сервер умеет),
+#   диапазон - поток кусками по DOWNLOAD_CHUNK_SIZE.
+# - HTTP Range (один диапазон bytes=a-b, bytes=a-, bytes=-n), If-Range, ETag/If-None-Match -> 304.
+#   ETag блоба - его SHA-256 (содержимое неизменно), у старых вложений - размер и время изменения файла.
+# - Если задан ATTACHMENT_X_ACCEL_PREFIX (например '/protected-media/'), байты отдает nginx:
+#   ответ содержит только заголовок X-Accel-Redirect, Range nginx обрабатывает сам.
+#   Пример nginx:  location /protected-media/ { internal; alias /path/to/media/; }
+# Ссылки заявителя на вложения содержат подписанный токен с id заявки (django.core.signing), а не номер
+# заявки и email: email не попадает в журналы сервера, историю браузера и заголовок Referer.
+import mimetypes
+import os
+import re
+
+from django.conf import settings
+from django.core import signing
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseNotModified, StreamingHttpResponse
+from django.utils.http import content_disposition_header
+
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+INLINE_CONTENT_TYPES = {'image/png', 'image/jpeg', 'image/gif', 'image/webp', 'application/pdf'}
+RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+REPORTER_TOKEN_SALT = 'tickets.downloads.reporter'
+REPORTER_TOKEN_MAX_AGE = 7 * 24 * 3600 # ссылки со страницы статуса действуют неделю
+
+
+def attachment_ticket(attachment):
+    return attachment.ticket or (attachment.comment.ticket if attachment.comment_id else None)
+
+def reporter_attachment_token(ticket):
+    """Токен для ссылок заявителя на вложения заявки (страница проверки статуса)."""
+    return signing.dumps(ticket.pk, salt=REPORTER_TOKEN_SALT, compress=True)
+
+def ticket_pk_from_token(token):
+    """id заявки из токена или None, если токен поддельный или устарел."""
+    try: return signing.loads(token, salt=REPORTER_TOKEN_SALT, max_age=REPORTER_TOKEN_MAX_AGE)
+    except signing.BadSignature: return None
+
+def _etag_matches(header, etag):
+    if not header: return False
+    if header.strip() == '*': return True
+    weak_etag = etag[2:] if etag.startswith('W/') else etag
+    return any((tag.strip()[2:] if tag.strip().startswith('W/') else tag.strip()) == weak_etag for tag in header.split(','))
+
+def parse_range(header, size):
+    """(start, end) включительно; None - отдать файл целиком; False - диапазон невыполним (416)."""
+    match = RANGE_RE.match(header.strip()) if header else None
+    if match is None: return None # нет заголовка, несколько диапазонов или другой формат - полный ответ
+    first, last = match.groups()
+    if not first and not last: return None
+    if size == 0: return False # в пустом файле нет ни одного байта для диапазона
+    if not first: # последние N байт
+        length = int(last)
+        if length == 0: return False
+        return max(size - length, 0), size - 1
+    start = int(first); end = min(int(last), size - 1) if last else size - 1
+    if start >= size or (last and int(last) < start): return False
+    return start, end
+
+def _iter_file_range(path, start, length):
+    with open(path, 'rb') as f:
+        f.seek(start)
+        while length > 0:
+            chunk = f.read(min(DOWNLOAD_CHUNK_SIZE, length))
+            if not chunk: break
+            length -= len(chunk)
+            yield chunk
+
+
+def serve_file(request, path, filename, etag, cache_control, storage_name=None):
+    """Отдает файл с диска: 304 по ETag, X-Accel-Redirect (если настроен и известно имя в MEDIA_ROOT), Range или целиком."""
+    try: stat_result = os.stat(path)
+    except FileNotFoundError: raise Http404("Файл не найден.")
+    size = stat_result.st_size
+    if etag is None: etag = f'W/"{size:x}-{int(stat_result.st_mtime):x}"'
+    content_type = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    as_attachment = content_type not in INLINE_CONTENT_TYPES
+
+    if _etag_matches(request.headers.get('If-None-Match'), etag):
+        response = HttpResponseNotModified(); response['ETag'] = etag
+        return response
+
+    accel_prefix = getattr(settings, 'ATTACHMENT_X_ACCEL_PREFIX', None)
+    if accel_prefix and storage_name:
+        response = HttpResponse(content_type=content_type)
+        response['X-Accel-Redirect'] = accel_prefix.rstrip('/') + '/' + storage_name
+    else:
+        byte_range = parse_range(request.headers.get('Range'), size)
+        if_range = request.headers.get('If-Range')
+        if byte_range and if_range and (if_range.strip() != etag or etag.startswith('W/')): byte_range = None # файл мог измениться - отдаем целиком
+        if byte_range is False:
+            response = HttpResponse(status=416); response['Content-Range'] = f"bytes */{size}"
+            return response
+        if byte_range:
+            start, end = byte_range; length = end - start + 1
+            response = StreamingHttpResponse(_iter_file_range(path, start, length), status=206, content_type=content_type)
+            response['Content-Range'] = f"bytes {start}-{end}/{size}"
+            response['Content-Length'] = str(length)
+        else:
+            response = FileResponse(open(path, 'rb'), content_type=content_type)
+            response['Content-Length'] = str(size)
+    response['Content-Disposition'] = content_disposition_header(as_attachment, filename)
+    response['Accept-Ranges'] = 'bytes'
+    response['ETag'] = etag
+    response['Cache-Control'] = cache_control
+    response['X-Content-Type-Options'] = 'nosniff'
+    return response
+
+def serve_attachment(request, attachment):
+    return serve_file(
+        request, attachment.file.path, attachment.display_name or 'attachment',
+        etag=f'"{attachment.blob.sha256}"' if attachment.blob_id else None,
+        cache_control='private, max-age=86400' if attachment.blob_id else 'private, no-cache',
+        storage_name=attachment.file.name,
+    )
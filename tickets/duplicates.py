@@ -0,0 +1,276 @@
+# tickets/duplicates.py
+# Поиск похожих заявок (возможных дубликатов) при создании тикета.
+# - Текст заявки (тема + описание) нормализуется как для поиска (tokenize) и режется на символьные
+#   шинглы по SHINGLE_SIZE символов; email заявителя и кабинет добавляются отдельными шинглами.
+# - По шинглам считается MinHash-подпись из NUM_PERMUTATIONS чисел; доля совпавших позиций двух подписей -
+#   оценка сходства Жаккара. Вместо NUM_PERMUTATIONS независимых перестановок - одна (one permutation hashing):
+#   хеш шингла выбирает ячейку и значение, в ячейке остается минимум, пустые ячейки заполняются из соседних
+#   справа (densification) - один проход по шинглам вместо NUM_PERMUTATIONS.
+#   Подпись хранится в TicketFingerprint, чтобы не пересчитывать старые заявки.
+# - LSH: подпись делится на LSH_BANDS полос по LSH_ROWS чисел; заявки с совпавшей хотя бы одной полосой -
+#   кандидаты, их сходство проверяется по подписям. Полосы держатся в памяти процесса по проектам
+#   (DuplicateIndex) за последние DUPLICATE_WINDOW_DAYS дней, поэтому поиск - несколько обращений к словарю.
+# - Заявки, созданные другими процессами, дочитываются перед поиском одним запросом: ticket_id больше последнего
+#   загруженного, а также подписи за последние RELOAD_OVERLAP до самой поздней загруженной. Подписи пишутся
+#   в порядке завершения запросов, а не pk: при одновременных заявках подпись меньшего pk может появиться позже.
+# Найденные пары пишутся в TicketDuplicateCandidate и показываются в карточке, где заявку можно объединить с основной.
+# Параметры хеширования менять нельзя без manage.py rebuild_duplicate_index: сохраненные подписи станут несравнимы.
+import operator
+import threading
+import time
+import zlib
+from array import array
+from collections import deque
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .cache_versions import VersionStamp
+from .history import record_ticket_event
+from .models import Comment, Ticket, TicketDuplicateCandidate, TicketEvent, TicketFingerprint
+from .search import tokenize
+
+SHINGLE_SIZE = 4
+MAX_TEXT_LENGTH = 2000 # длинные описания (вставленные логи) дальше не режем - начало текста важнее
+NUM_PERMUTATIONS = 64
+LSH_BANDS = 16
+LSH_ROWS = NUM_PERMUTATIONS // LSH_BANDS # порог LSH ~ (1 / 16) ** (1 / 4) ~ 0.5
+MAX_CANDIDATES = 5
+MAX_BUCKET_SIZE = 100 # частые полосы ("принтер не работает") почти ничего не говорят - держим только последние заявки
+DEFAULT_THRESHOLD = 0.6
+DEFAULT_WINDOW_DAYS = 90
+RELOAD_OVERLAP = timedelta(minutes=2) # с запасом больше, чем от сохранения заявки до записи ее подписи
+MERGE_STATUS_CODE = 'closed'
+
+_MASK = (1 << 32) - 1
+_PRIME = (1 << 61) - 1
+# Фиксированные параметры перестановки: подписи должны совпадать во всех процессах и после перезапуска
+_MULTIPLIER = 0x1F3D5B79A2C4E6F1 % _PRIME
+_INCREMENT = 0x6A09E667F3BCC909 % _PRIME
+_ROTATION = 0x9E3779B1 # сдвиг значения пустой ячейки на каждую пройденную соседнюю ячейку
+
+
+# --- Подписи ---
+def ticket_shingles(title, description, reporter_email='', reporter_room=''):
+    """Множество 32-битных хешей шинглов заявки; пустое, если нет текста (по одному заявителю дубликаты не ищем)."""
+    text = ' '.join(tokenize(f"{title or ''} {description or ''}"))[:MAX_TEXT_LENGTH]
+    if not text: return set()
+    items = {text[i:i + SHINGLE_SIZE] for i in range(max(len(text) - SHINGLE_SIZE + 1, 1))}
+    if reporter_email: items.add('@' + reporter_email.strip().lower())
+    if reporter_room: items.add('#' + ' '.join(tokenize(reporter_room)))
+    return {zlib.crc32(item.encode('utf-8')) for item in items}
+
+def minhash_signature(shingles):
+    if not shingles: return None
+    bins = [None] * NUM_PERMUTATIONS
+    for x in shingles:
+        h = (_MULTIPLIER * x + _INCREMENT) % _PRIME
+        slot = h % NUM_PERMUTATIONS; value = (h // NUM_PERMUTATIONS) & _MASK
+        if bins[slot] is None or value < bins[slot]: bins[slot] = value
+    signature = array('I', [0]) * NUM_PERMUTATIONS
+    for slot in range(NUM_PERMUTATIONS):
+        distance = 0
+        while bins[(slot + distance) % NUM_PERMUTATIONS] is None: distance += 1
+        signature[slot] = (bins[(slot + distance) % NUM_PERMUTATIONS] + distance * _ROTATION) & _MASK
+    return signature
+
+def ticket_signature(ticket):
+    return minhash_signature(ticket_shingles(ticket.title, ticket.description, ticket.reporter_email, ticket.reporter_room))
+
+def signature_from_bytes(data):
+    signature = array('I'); signature.frombytes(bytes(data))
+    return signature if len(signature) == NUM_PERMUTATIONS else None # подпись с другими параметрами - пропускаем
+
+def estimate_similarity(first, second):
+    return sum(map(operator.eq, first, second)) / NUM_PERMUTATIONS
+
+def band_keys(signature):
+    raw = signature.tobytes(); width = LSH_ROWS * signature.itemsize
+    return [(band, raw[band * width:(band + 1) * width]) for band in range(LSH_BANDS)]
+
+
+# --- LSH-индекс в памяти процесса ---
+class ProjectDuplicateIndex:
+    def __init__(self):
+        self.signatures = {} # ticket_id -> подпись
+        self.buckets = {} # (полоса, байты полосы) -> [ticket_id]; удаленные id вычищаются при обращении
+        self.order = deque() # (created_at, ticket_id) по возрастанию - для выхода из окна
+        self.last_ticket_id = 0
+        self.last_created_at = None
+
+    def add(self, ticket_id, created_at, signature):
+        if ticket_id in self.signatures: return
+        self.signatures[ticket_id] = signature
+        for key in band_keys(signature):
+            bucket = self.buckets.setdefault(key, []); bucket.append(ticket_id)
+            if len(bucket) > MAX_BUCKET_SIZE: del bucket[0]
+        self.order.append((created_at, ticket_id)); self.last_ticket_id = max(self.last_ticket_id, ticket_id)
+        if self.last_created_at is None or created_at > self.last_created_at: self.last_created_at = created_at
+
+    def expire(self, cutoff):
+        while self.order and self.order[0][0] < cutoff: self.signatures.pop(self.order.popleft()[1], None)
+
+    def candidates(self, signature):
+        found = set()
+        for key in band_keys(signature):
+            bucket = self.buckets.get(key)
+            if not bucket: continue
+            alive = [ticket_id for ticket_id in bucket if ticket_id in self.signatures]
+            if len(alive) != len(bucket):
+                if alive: self.buckets[key] = alive
+                else: del self.buckets[key]
+            found.update(alive)
+        return found
+
+    def matches(self, signature, threshold, exclude_id=None):
+        """[(сходство, ticket_id)] по убыванию сходства, не больше MAX_CANDIDATES."""
+        result = []
+        for ticket_id in self.candidates(signature):
+            if ticket_id == exclude_id: continue
+            similarity = estimate_similarity(signature, self.signatures[ticket_id])
+            if similarity >= threshold: result.append((similarity, ticket_id))
+        result.sort(reverse=True)
+        return result[:MAX_CANDIDATES]
+
+
+class DuplicateIndex:
+    def __init__(self):
+        self.stamp = VersionStamp('duplicate_index')
+        self._lock = threading.RLock()
+        self._projects = {}
+        self._version = None
+        self.loads = 0
+        self.lookups = 0
+        self.lookup_seconds = 0.0
+
+    @property
+    def threshold(self):
+        return getattr(settings, 'DUPLICATE_SIMILARITY_THRESHOLD', DEFAULT_THRESHOLD)
+
+    @property
+    def window(self):
+        return timedelta(days=getattr(settings, 'DUPLICATE_WINDOW_DAYS', DEFAULT_WINDOW_DAYS))
+
+    def _project_index(self, project_id):
+        """Индекс проекта с дочитанными из БД новыми подписями (первое обращение - загрузка окна целиком)."""
+        version = self.stamp.current()
+        if self._version != version: self._projects = {}; self._version = version
+        cutoff = timezone.now() - self.window
+        index = self._projects.get(project_id)
+        if index is None: index = self._projects[project_id] = ProjectDuplicateIndex(); self.loads += 1
+        rows = TicketFingerprint.objects.filter(project_id=project_id, created_at__gte=cutoff)
+        if index.last_created_at is not None: # уже известные id add() пропускает
+            rows = rows.filter(Q(ticket_id__gt=index.last_ticket_id) | Q(created_at__gte=index.last_created_at - RELOAD_OVERLAP))
+        elif index.last_ticket_id: rows = rows.filter(ticket_id__gt=index.last_ticket_id)
+        for ticket_id, created_at, data in rows.order_by('ticket_id').values_list('ticket_id', 'created_at', 'signature').iterator(chunk_size=2000):
+            signature = signature_from_bytes(data)
+            if signature is not None: index.add(ticket_id, created_at, signature)
+            else: index.last_ticket_id = max(index.last_ticket_id, ticket_id)
+        index.expire(cutoff)
+        return index
+
+    def find(self, project_id, signature, exclude_id=None):
+        """[(сходство, ticket_id)] похожих заявок проекта по убыванию сходства, не больше MAX_CANDIDATES."""
+        with self._lock:
+            index = self._project_index(project_id)
+            started = time.perf_counter()
+            matches = index.matches(signature, self.threshold, exclude_id)
+            self.lookups += 1; self.lookup_seconds += time.perf_counter() - started
+        return matches
+
+    def discard(self, ticket_id):
+        with self._lock:
+            for index in self._projects.values(): index.signatures.pop(ticket_id, None)
+
+    def invalidate(self):
+        with self._lock:
+            self._projects = {}
+        self.stamp.bump()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'projects': len(self._projects), 'tickets': sum(len(i.signatures) for i in self._projects.values()),
+                'buckets': sum(len(i.buckets) for i in self._projects.values()), 'loads': self.loads, 'lookups': self.lookups,
+                'avg_lookup_us': (self.lookup_seconds / self.lookups * 1e6) if self.lookups else None, 'version': self.stamp.current(),
+            }
+
+
+duplicate_index = DuplicateIndex()
+
+
+# --- Пометка при создании и массовая индексация ---
+def flag_duplicates(ticket):
+    """
+    Сохраняет подпись новой заявки и помечает похожие заявки ее проекта (TicketDuplicateCandidate).
+    Возвращает список найденных тикетов (может быть пустым).
+    """
+    signature = ticket_signature(ticket)
+    if signature is None or not ticket.project_id: return []
+    # Подпись пишется до поиска: параллельно созданные одинаковые заявки найдут друг друга
+    TicketFingerprint.objects.create(ticket=ticket, project_id=ticket.project_id, signature=signature.tobytes(), created_at=ticket.created_at)
+    matches = duplicate_index.find(ticket.project_id, signature, exclude_id=ticket.pk)
+    if not matches: return []
+    # В индексе могут остаться удаленные, объединенные или перенесенные в другой проект заявки
+    similarity_by_id = {ticket_id: similarity for similarity, ticket_id in matches}
+    candidates = list(Ticket.objects.filter(pk__in=similarity_by_id, project_id=ticket.project_id, duplicate_of__isnull=True).only('pk', 'ticket_id_display', 'title'))
+    TicketDuplicateCandidate.objects.bulk_create(
+        [TicketDuplicateCandidate(ticket=ticket, candidate=candidate, similarity=similarity_by_id[candidate.pk]) for candidate in candidates], ignore_conflicts=True
+    )
+    return sorted(candidates, key=lambda candidate: -similarity_by_id[candidate.pk])
+
+def index_fingerprints(tickets):
+    """Сохраняет подписи пачки тикетов (для rebuild_duplicate_index); возвращает число сохраненных."""
+    fingerprints = []; empty_ids = []
+    for ticket in tickets:
+        signature = ticket_signature(ticket)
+        if signature is not None and ticket.project_id: fingerprints.append(TicketFingerprint(ticket_id=ticket.pk, project_id=ticket.project_id, signature=signature.tobytes(), created_at=ticket.created_at))
+        else: empty_ids.append(ticket.pk)
+    TicketFingerprint.objects.bulk_create(fingerprints, update_conflicts=True, unique_fields=['ticket'], update_fields=['project', 'signature', 'created_at'])
+    if empty_ids: TicketFingerprint.objects.filter(ticket_id__in=empty_ids).delete() # текст заявки стерли - подпись больше не нужна
+    return len(fingerprints)
+
+
+# --- Карточка и объединение ---
+def duplicate_candidates_for(ticket, agent_scope):
+    """Похожие заявки для карточки (в обе стороны: найденные для этой заявки и те, для которых нашлась она)."""
+    links = TicketDuplicateCandidate.objects.filter(Q(ticket=ticket) | Q(candidate=ticket)).select_related('ticket__status', 'candidate__status')
+    result = {}
+    for link in links:
+        other = link.candidate if link.ticket_id == ticket.pk else link.ticket
+        if other.duplicate_of_id or not agent_scope.can_view_project(other.project_id): continue
+        if other.pk not in result or result[other.pk]['similarity'] < link.similarity: result[other.pk] = {'ticket': other, 'similarity': link.similarity}
+    return sorted(result.values(), key=lambda item: -item['similarity'])
+
+def merge_ticket_into(ticket, target, actor):
+    """
+    Объединяет заявку с основной: заявка закрывается со ссылкой duplicate_of, ее данные добавляются
+    в основную внутренним комментарием, заявителю уходит уведомление о закрытии. TicketStatus.DoesNotExist,
+    если нет статуса MERGE_STATUS_CODE; ValueError - если объединение невозможно.
+    """
+    from .notifications import EVENT_STATUS_CHANGED, enqueue_notification
+    from .reference_cache import reference_data
+    if target.pk == ticket.pk: raise ValueError("Нельзя объединить заявку саму с собой.")
+    if target.duplicate_of_id: raise ValueError(f"Заявка #{target.ticket_id_display} сама объединена с другой заявкой.")
+    if ticket.duplicate_of_id: raise ValueError("Заявка уже объединена с другой заявкой.")
+    closed_status = reference_data.get_status(MERGE_STATUS_CODE)
+    with transaction.atomic():
+        old_status = ticket.status
+        ticket.duplicate_of = target; ticket.status = closed_status; ticket.save()
+        note = f"Заявка объединена с заявкой #{target.ticket_id_display}, работа по ней продолжится там."
+        record_ticket_event(ticket, TicketEvent.KIND_MERGE, None, target, actor=actor, note=note)
+        record_ticket_event(ticket, TicketEvent.KIND_STATUS, old_status, closed_status, actor=actor)
+        record_ticket_event(target, TicketEvent.KIND_MERGE, None, ticket, actor=actor, note=f"Присоединен дубликат #{ticket.ticket_id_display}.")
+        Comment.objects.create(ticket=target, author_agent=actor, is_internal=True, body=(
+            f"Присоединена заявка #{ticket.ticket_id_display} от {ticket.reporter_name} <{ticket.reporter_email}>:\n{ticket.title}\n\n{ticket.description}"
+        ))
+        merge_comment = Comment.objects.create(ticket=ticket, author_agent=actor, is_internal=False, body=note)
+        TicketFingerprint.objects.filter(ticket=ticket).delete()
+        TicketDuplicateCandidate.objects.filter(Q(ticket=ticket) | Q(candidate=ticket)).delete()
+        enqueue_notification(EVENT_STATUS_CHANGED, ticket, comment=merge_comment, actor_email=actor.email, old_status=old_status.name, new_status=closed_status.name, status_comment=note)
+        ticket_id = ticket.pk
+        transaction.on_commit(lambda: duplicate_index.discard(ticket_id))
+    return ticket
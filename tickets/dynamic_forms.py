@@ -0,0 +1,112 @@
+# tickets/dynamic_forms.py
+# Классы форм создания тикета с дополнительными полями категории.
+# Для каждой категории один раз собирается подкласс TicketCreateForm со всеми настроенными
+# CustomFormField (включая разбор вариантов выпадающих списков) и кэшируется в памяти процесса.
+# Кэш привязан к версии: любое изменение CustomFormField, FieldTemplate или TicketCategory
+# сбрасывает его (сигналы в tickets/signals.py), поэтому в горячем пути остается поиск в словаре
+# и создание экземпляра формы.
+import logging
+import threading
+
+from django import forms
+
+from .cache_versions import VersionStamp
+from .forms import TicketCreateForm
+
+logger = logging.getLogger(__name__)
+
+# --- Построители полей по типу шаблона ---
+def _char_field(field_def, field_kwargs):
+    return forms.CharField(widget=forms.TextInput(attrs={'class': 'form-control'}), **field_kwargs)
+
+def _text_field(field_def, field_kwargs):
+    return forms.CharField(widget=forms.Textarea(attrs={'class': 'form-control'}), **field_kwargs)
+
+def _email_field(field_def, field_kwargs):
+    return forms.EmailField(widget=forms.EmailInput(attrs={'class': 'form-control'}), **field_kwargs)
+
+def _int_field(field_def, field_kwargs):
+    return forms.IntegerField(widget=forms.NumberInput(attrs={'class': 'form-control'}), **field_kwargs)
+
+def _bool_field(field_def, field_kwargs):
+    return forms.BooleanField(widget=forms.CheckboxInput(attrs={'class': 'form-check-input'}), **field_kwargs)
+
+def _date_field(field_def, field_kwargs):
+    return forms.DateField(widget=forms.DateInput(attrs={'class': 'form-control', 'type': 'date'}, format='%Y-%m-%d'), **field_kwargs)
+
+def _file_field(field_def, field_kwargs):
+    return forms.FileField(widget=forms.ClearableFileInput(attrs={'class': 'form-control-file'}), **field_kwargs)
+
+def _select_field(field_def, field_kwargs):
+    choices_json = field_def.effective_select_choices_json
+    if not choices_json: return None
+    choices = list(choices_json.items())
+    if not field_def.is_required_in_category: choices.insert(0, ('', '---------'))
+    return forms.ChoiceField(choices=choices, widget=forms.Select(attrs={'class': 'form-select'}), **field_kwargs)
+
+FIELD_BUILDERS = {
+    'char': _char_field, 'text': _text_field, 'email': _email_field, 'int': _int_field,
+    'bool': _bool_field, 'date': _date_field, 'file': _file_field, 'select': _select_field,
+}
+
+def build_ticket_create_form_class(category):
+    """Собирает подкласс TicketCreateForm с дополнительными полями категории (без кэша)."""
+    field_defs = category.custom_form_fields.filter(is_active_in_category=True).select_related('field_template').order_by('order_in_category')
+    attrs = {}; custom_field_names = []; file_field_names = []
+    for field_def in field_defs:
+        builder = FIELD_BUILDERS.get(field_def.field_type)
+        if builder is None: continue
+        field_kwargs = {'label': field_def.effective_label, 'required': field_def.is_required_in_category, 'help_text': field_def.effective_help_text}
+        try: form_field = builder(field_def, field_kwargs)
+        except Exception:
+            logger.exception("Ошибка построения поля %s в категории %s", field_def.name, category.name); continue
+        if form_field is None: continue
+        attrs[field_def.name] = form_field
+        custom_field_names.append(field_def.name)
+        if field_def.field_type == 'file': file_field_names.append(field_def.name)
+    attrs.update({
+        'category_id': category.pk,
+        'custom_field_names': tuple(custom_field_names),
+        'file_field_names': tuple(file_field_names),
+    })
+    return type(f'TicketCreateFormCategory{category.pk}', (TicketCreateForm,), attrs)
+
+
+class TicketCreateFormRegistry:
+    def __init__(self):
+        self.stamp = VersionStamp('ticket_create_forms')
+        self._lock = threading.Lock()
+        self._classes = {}
+        self._classes_version = None
+        self.hits = 0
+        self.misses = 0
+
+    def get_form_class(self, category):
+        version = self.stamp.current()
+        if self._classes_version != version:
+            with self._lock:
+                if self._classes_version != version:
+                    self._classes = {}; self._classes_version = version
+        form_class = self._classes.get(category.pk)
+        if form_class is not None:
+            self.hits += 1
+            return form_class
+        self.misses += 1
+        form_class = build_ticket_create_form_class(category)
+        with self._lock:
+            if self._classes_version == version: self._classes[category.pk] = form_class
+        return form_class
+
+    def invalidate(self):
+        with self._lock:
+            self._classes = {}
+        self.stamp.bump()
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'cached_categories': len(self._classes), 'version': self.stamp.current()}
+
+
+ticket_create_forms = TicketCreateFormRegistry()
+
+def get_ticket_create_form_class(category):
+    return ticket_create_forms.get_form_class(category)
@@ -0,0 +1,141 @@
+# tickets/export.py
+# Потоковая выгрузка тикетов для BI: CSV, JSONL и Parquet (колоночный формат, нужен pyarrow).
+# Тикеты читаются через values() (без модельных объектов) и iterator(chunk_size), поэтому память
+# не зависит от объема выгрузки. Описание (description) по умолчанию не выгружается.
+# Дополнительные поля из custom_form_data раскладываются по колонкам 'cf_<имя поля>' по настройкам
+# CustomFormField категорий; значения полей, не настроенных в категории тикета, не выгружаются.
+# Инкрементальная выгрузка: since - выгрузить тикеты с updated_at >= since (сортировка по updated_at, pk),
+# следующий водяной знак - updated_at последней строки (строки с этим же updated_at попадут и в следующую
+# выгрузку, поэтому получатель дедуплицирует по id - так не теряются тикеты, сохраненные в ту же микросекунду).
+import csv
+import io
+import json
+from datetime import datetime, timezone as dt_timezone
+
+from django.utils import timezone
+
+from .models import CustomFormField, Ticket
+
+EXPORT_FORMATS = ('csv', 'jsonl', 'parquet')
+STREAMING_FORMATS = ('csv', 'jsonl')
+CONTENT_TYPES = {'csv': 'text/csv; charset=utf-8', 'jsonl': 'application/x-ndjson; charset=utf-8'}
+DEFAULT_CHUNK_SIZE = 2000
+STREAM_BUFFER_SIZE = 64 * 1024
+CUSTOM_COLUMN_PREFIX = 'cf_'
+
+# (колонка в выгрузке, путь для values())
+BASE_COLUMNS = [
+    ('id', 'pk'), ('ticket_id', 'ticket_id_display'), ('title', 'title'),
+    ('reporter_name', 'reporter_name'), ('reporter_email', 'reporter_email'), ('reporter_phone', 'reporter_phone'),
+    ('reporter_building', 'reporter_building'), ('reporter_room', 'reporter_room'), ('reporter_department', 'reporter_department'),
+    ('project_id', 'project_id'), ('project', 'project__name'),
+    ('category_id', 'category_id'), ('category', 'category__name'),
+    ('status_code', 'status__code'), ('status', 'status__name'), ('priority_code', 'priority__code'),
+    ('assignee', 'assignee__username'),
+    ('created_at', 'created_at'), ('updated_at', 'updated_at'), ('resolved_at', 'resolved_at'), ('closed_at', 'closed_at'),
+]
+DESCRIPTION_COLUMN = ('description', 'description')
+INTEGER_COLUMNS = {'id', 'project_id', 'category_id'}
+DATETIME_COLUMNS = {'created_at', 'updated_at', 'resolved_at', 'closed_at'}
+
+
+class TicketExport:
+    """Описание выгрузки: фильтр тикетов, колонки и генератор строк (словарей)."""
+
+    def __init__(self, queryset=None, since=None, include_description=False, chunk_size=DEFAULT_CHUNK_SIZE):
+        self.queryset = Ticket.objects.all() if queryset is None else queryset
+        if since is not None: self.queryset = self.queryset.filter(updated_at__gte=since)
+        self.chunk_size = chunk_size
+        self.base_columns = BASE_COLUMNS + ([DESCRIPTION_COLUMN] if include_description else [])
+        self.fields_by_category, self.custom_field_names = self._load_custom_fields()
+        self.custom_columns = [CUSTOM_COLUMN_PREFIX + name for name in self.custom_field_names]
+        self.columns = [column for column, _ in self.base_columns] + self.custom_columns
+        self.last_updated_at = None
+        self.row_count = 0
+
+    def _load_custom_fields(self):
+        # Один запрос на все категории; порядок колонок - по категории и порядку поля в ней
+        fields_by_category = {}; names = []
+        definitions = CustomFormField.objects.filter(is_active_in_category=True).exclude(field_template__field_type='file').order_by('category_id', 'order_in_category').values_list('category_id', 'field_template__name')
+        for category_id, name in definitions:
+            fields_by_category.setdefault(category_id, set()).add(name)
+            if name not in names: names.append(name)
+        return fields_by_category, names
+
+    def rows(self):
+        value_paths = [path for _, path in self.base_columns] + ['custom_form_data']
+        values_qs = self.queryset.order_by('updated_at', 'pk').values(*value_paths)
+        for record in values_qs.iterator(chunk_size=self.chunk_size):
+            row = {column: record[path] for column, path in self.base_columns}
+            custom_data = record['custom_form_data'] if isinstance(record['custom_form_data'], dict) else {}
+            allowed = self.fields_by_category.get(record['category_id'], ())
+            for name in self.custom_field_names:
+                row[CUSTOM_COLUMN_PREFIX + name] = custom_data.get(name) if name in allowed else None
+            self.last_updated_at = record['updated_at']; self.row_count += 1
+            yield row
+
+# --- Форматы ---
+def _text_value(value):
+    if value is None: return ''
+    if isinstance(value, datetime): return value.isoformat()
+    if isinstance(value, (dict, list)): return json.dumps(value, ensure_ascii=False)
+    if isinstance(value, bool): return '1' if value else '0'
+    return str(value)
+
+def _json_value(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+def iter_csv(export):
+    buffer = io.StringIO(); writer = csv.writer(buffer)
+    writer.writerow(export.columns)
+    for row in export.rows():
+        writer.writerow([_text_value(row[column]) for column in export.columns])
+        if buffer.tell() >= STREAM_BUFFER_SIZE:
+            yield buffer.getvalue(); buffer.seek(0); buffer.truncate()
+    yield buffer.getvalue()
+
+def iter_jsonl(export):
+    chunk = []; chunk_size = 0
+    for row in export.rows():
+        line = json.dumps({column: _json_value(row[column]) for column in export.columns}, ensure_ascii=False, default=str) + '\n'
+        chunk.append(line); chunk_size += len(line)
+        if chunk_size >= STREAM_BUFFER_SIZE:
+            yield ''.join(chunk); chunk = []; chunk_size = 0
+    if chunk: yield ''.join(chunk)
+
+STREAM_WRITERS = {'csv': iter_csv, 'jsonl': iter_jsonl}
+
+def write_parquet(export, output, row_group_size=50000):
+    """Пишет Parquet группами строк по row_group_size (в памяти одна группа). Нужен pyarrow."""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema_fields = []
+    for column in export.columns:
+        if column in INTEGER_COLUMNS: column_type = pa.int64()
+        elif column in DATETIME_COLUMNS: column_type = pa.timestamp('us', tz='UTC')
+        else: column_type = pa.string()
+        schema_fields.append(pa.field(column, column_type))
+    schema = pa.schema(schema_fields)
+
+    def convert(column, value):
+        if value is None: return None
+        if column in INTEGER_COLUMNS: return value
+        if column in DATETIME_COLUMNS: return value.astimezone(dt_timezone.utc) if timezone.is_aware(value) else value
+        return _text_value(value)
+
+    with pq.ParquetWriter(output, schema, compression='zstd') as writer:
+        batch = {column: [] for column in export.columns}; batch_rows = 0
+        for row in export.rows():
+            for column in export.columns: batch[column].append(convert(column, row[column]))
+            batch_rows += 1
+            if batch_rows >= row_group_size:
+                writer.write_table(pa.Table.from_pydict(batch, schema=schema))
+                batch = {column: [] for column in export.columns}; batch_rows = 0
+        if batch_rows: writer.write_table(pa.Table.from_pydict(batch, schema=schema))
+    return export.row_count
+
+def parquet_available():
+    try: import pyarrow.parquet # noqa: F401
+    except ImportError: return False
+    return True
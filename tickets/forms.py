@@ -5,6 +5,14 @@ from .models import (
     TicketCategory, TicketStatus, TicketPriority, Project,
     Feedback # Добавлен импорт для Feedback
 )
+from .custom_filters import custom_field_filters
+from .scope import get_agent_scope
+
+# Сортировка списков заявок агента (сортировка по SLA - tickets/views.py, order_tickets_by_sla)
+TICKET_LIST_SORT_CHOICES = [
+    ('', 'Сначала новые'),
+    ('sla', 'По SLA: нарушенные и под угрозой сверху'),
+]
 
 # ------------------- Форма для Шага 1: Выбор Категории Тикета -------------------
 class SelectTicketCategoryForm(forms.Form):
@@ -182,6 +190,12 @@ class TicketFilterForm(forms.Form):
         initial=False, 
         widget=forms.CheckboxInput(attrs={'class': 'form-check-input', 'id': 'id_show_only_new'})
     )
+    sort = forms.ChoiceField(
+        label="Сортировка",
+        choices=TICKET_LIST_SORT_CHOICES,
+        required=False,
+        widget=forms.Select(attrs={'class': 'form-select form-select-sm'})
+    )
 
     def __init__(self, *args, **kwargs):
         user = kwargs.pop('user', None) 
@@ -196,16 +210,17 @@ class TicketFilterForm(forms.Form):
                 self.fields['show_active'].initial = False
                 self.fields['show_completed'].initial = False
             
-            if not (user.is_superuser or getattr(user, 'agent_role', None) == 'system_admin'):
-                user_projects = user.projects.filter(is_active=True)
+            agent_scope = get_agent_scope(user)
+            if not agent_scope.is_privileged:
+                user_projects = agent_scope.projects()
                 self.fields['project'].queryset = user_projects
                 
-                if user_projects.exists():
+                if agent_scope.project_ids:
                     self.fields['category'].queryset = TicketCategory.objects.filter(
-                        project__in=user_projects, is_active=True
+                        project_id__in=agent_scope.project_ids, is_active=True
                     ).select_related('project').order_by('project__name', 'name')
                     self.fields['assignee'].queryset = Agent.objects.filter(
-                        is_active=True, projects__in=user_projects
+                        is_active=True, projects__in=agent_scope.project_ids
                     ).distinct().order_by('username')
                 else:
                     self.fields['category'].queryset = TicketCategory.objects.none()
@@ -224,6 +239,24 @@ class TicketFilterForm(forms.Form):
         self.fields['project'].label_from_instance = lambda obj: obj.name
         self.fields['assignee'].label_from_instance = lambda obj: obj.get_full_name() or obj.username
 
+        # Фильтры по дополнительным полям (tickets/custom_filters.py): выбранной категории или всех проектов сотрудника
+        self.custom_filters = []
+        if user:
+            category_value = str(self.data.get(self.add_prefix('category')) or '') if self.is_bound else ''
+            self.custom_filters = custom_field_filters.for_scope(
+                category_id=int(category_value) if category_value.isdigit() else None,
+                project_ids=None if agent_scope.is_privileged else agent_scope.project_ids,
+            )
+        for custom_filter in self.custom_filters: self.fields[custom_filter.form_field_name] = custom_filter.form_field()
+
+    @property
+    def custom_filter_fields(self):
+        return [self[custom_filter.form_field_name] for custom_filter in self.custom_filters]
+
+    def apply_custom_filters(self, queryset):
+        for custom_filter in self.custom_filters: queryset = custom_filter.apply(queryset, self.cleaned_data.get(custom_filter.form_field_name))
+        return queryset
+
     def clean(self):
         cleaned_data = super().clean()
         show_only_new = cleaned_data.get('show_only_new')
@@ -269,6 +302,91 @@ class MyTicketsStatusFilterForm(forms.Form):
         initial=False, 
         widget=forms.CheckboxInput(attrs={'class': 'form-check-input'})
     )
+    sort = forms.ChoiceField(
+        label="Сортировка",
+        choices=TICKET_LIST_SORT_CHOICES,
+        required=False,
+        widget=forms.Select(attrs={'class': 'form-select form-select-sm'})
+    )
+
+# ------------------- Форма фильтров отчета по сводкам (tickets/rollups.py) -------------------
+REPORT_GRANULARITY_CHOICES = [
+    ('day', 'По дням'),
+    ('week', 'По неделям'),
+    ('month', 'По месяцам'),
+    ('year', 'По годам'),
+]
+REPORT_MAX_DAILY_PERIOD_DAYS = 366 # по дням - не больше года строк в таблице
+
+class TicketReportFilterForm(forms.Form):
+    date_from = forms.DateField(
+        label="С",
+        widget=forms.DateInput(attrs={'type': 'date', 'class': 'form-control form-control-sm'})
+    )
+    date_to = forms.DateField(
+        label="По",
+        widget=forms.DateInput(attrs={'type': 'date', 'class': 'form-control form-control-sm'})
+    )
+    granularity = forms.ChoiceField(
+        label="Группировка",
+        choices=REPORT_GRANULARITY_CHOICES,
+        initial='month',
+        widget=forms.Select(attrs={'class': 'form-select form-select-sm'})
+    )
+    project = forms.ModelChoiceField(
+        label="Проект",
+        queryset=Project.objects.filter(is_active=True).order_by('name'),
+        required=False,
+        empty_label="Все проекты",
+        widget=forms.Select(attrs={'class': 'form-select form-select-sm'})
+    )
+    category = forms.ModelChoiceField(
+        label="Категория",
+        queryset=TicketCategory.objects.select_related('project').order_by('project__name', 'name'),
+        required=False,
+        empty_label="Все категории",
+        widget=forms.Select(attrs={'class': 'form-select form-select-sm'})
+    )
+    priority = forms.ModelChoiceField(
+        label="Приоритет",
+        queryset=TicketPriority.objects.all().order_by('order', 'name'),
+        required=False,
+        empty_label="Все приоритеты",
+        widget=forms.Select(attrs={'class': 'form-select form-select-sm'})
+    )
+    assignee = forms.ModelChoiceField(
+        label="Исполнитель",
+        queryset=Agent.objects.filter(is_active=True).order_by('username'),
+        required=False,
+        empty_label="Любой исполнитель",
+        widget=forms.Select(attrs={'class': 'form-select form-select-sm'})
+    )
+
+    def __init__(self, *args, **kwargs):
+        user = kwargs.pop('user', None)
+        super().__init__(*args, **kwargs)
+        agent_scope = get_agent_scope(user) if user else None
+        if agent_scope is None or (not agent_scope.is_privileged and not agent_scope.project_ids):
+            self.fields['project'].queryset = Project.objects.none()
+            self.fields['category'].queryset = TicketCategory.objects.none()
+            self.fields['assignee'].queryset = Agent.objects.none()
+        elif not agent_scope.is_privileged:
+            self.fields['project'].queryset = agent_scope.projects()
+            self.fields['category'].queryset = TicketCategory.objects.filter(project_id__in=agent_scope.project_ids).select_related('project').order_by('project__name', 'name')
+            self.fields['assignee'].queryset = Agent.objects.filter(is_active=True, projects__in=agent_scope.project_ids).distinct().order_by('username')
+        self.fields['category'].label_from_instance = lambda obj: f"{obj.name} ({obj.project.name})"
+        self.fields['project'].label_from_instance = lambda obj: obj.name
+        self.fields['assignee'].label_from_instance = lambda obj: obj.get_full_name() or obj.username
+
+    def clean(self):
+        cleaned_data = super().clean()
+        date_from, date_to = cleaned_data.get('date_from'), cleaned_data.get('date_to')
+        if date_from and date_to:
+            if date_from > date_to:
+                self.add_error('date_to', "Дата окончания раньше даты начала.")
+            elif cleaned_data.get('granularity') == 'day' and (date_to - date_from).days >= REPORT_MAX_DAILY_PERIOD_DAYS:
+                self.add_error('granularity', f"По дням можно построить отчет не больше чем за {REPORT_MAX_DAILY_PERIOD_DAYS} дней.")
+        return cleaned_data
 
 # ------------------- Форма для Жалоб и Предложений -------------------
 class FeedbackForm(forms.ModelForm):
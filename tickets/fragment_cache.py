@@ -0,0 +1,79 @@
+# tickets/fragment_cache.py
+# Кэш отрисованных строк списка заявок агента (agent_ticket_list.html, шаблон строки agent_ticket_list_row.html).
+# Строка зависит только от самого тикета и справочников, поэтому ключ строится из:
+# - pk и updated_at тикета (любое сохранение тикета дает новый ключ);
+# - версии справочников (статусы, приоритеты, проекты - reference_data);
+# - версии строк (VersionStamp 'ticket_list_rows'): ее сбрасывают изменения категорий и имен сотрудников (tickets/signals.py),
+#   которые тоже видны в строке, но не меняют updated_at тикета;
+# - часового пояса (даты в строке выводятся в локальном времени).
+# Все строки страницы читаются одним get_many, недостающие отрисовываются и пишутся одним set_many.
+# Бэкенд - кэш Django с псевдонимом TICKET_ROW_CACHE_ALIAS (settings.CACHES['fragments']: locmem/file
+# с MAX_ENTRIES или Redis/Memcached с собственным лимитом памяти); если псевдоним не настроен - 'default'.
+# Устаревшие строки не удаляются явно: их ключи больше не запрашиваются и вытесняются по лимиту/таймауту.
+import threading
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.base import InvalidCacheBackendError
+from django.template.loader import render_to_string
+from django.utils import timezone
+from django.utils.safestring import mark_safe
+
+from .cache_versions import VersionStamp
+from .reference_cache import reference_data
+
+ROW_TEMPLATE = 'tickets/agent_ticket_list_row.html'
+DEFAULT_ALIAS = 'fragments'
+DEFAULT_TIMEOUT = 24 * 3600
+
+
+class TicketRowCache:
+    def __init__(self):
+        self.stamp = VersionStamp('ticket_list_rows')
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def cache(self):
+        alias = getattr(settings, 'TICKET_ROW_CACHE_ALIAS', DEFAULT_ALIAS)
+        try: return caches[alias]
+        except InvalidCacheBackendError: return caches['default']
+
+    @property
+    def enabled(self):
+        return getattr(settings, 'TICKET_ROW_CACHE_ENABLED', True)
+
+    def key(self, ticket, prefix):
+        return f"{prefix}:{ticket.pk}:{ticket.updated_at.timestamp():.6f}"
+
+    def _prefix(self):
+        return f"helpdesk:ticket_row:{reference_data.version}:{self.stamp.current()}:{timezone.get_current_timezone_name()}"
+
+    def render_rows(self, tickets):
+        """[(тикет, html строки)] в порядке tickets; отрисовываются только строки, которых нет в кэше."""
+        tickets = list(tickets)
+        if not self.enabled: return [(ticket, render_to_string(ROW_TEMPLATE, {'ticket': ticket})) for ticket in tickets]
+        prefix = self._prefix()
+        keys = {ticket.pk: self.key(ticket, prefix) for ticket in tickets}
+        cached = self.cache.get_many(list(keys.values())) if keys else {}
+        rows = []; rendered = {}
+        for ticket in tickets:
+            html = cached.get(keys[ticket.pk])
+            if html is None:
+                html = rendered[keys[ticket.pk]] = render_to_string(ROW_TEMPLATE, {'ticket': ticket})
+            rows.append((ticket, mark_safe(html))) # после сериализации в кэше тип SafeString не гарантирован
+        if rendered: self.cache.set_many(rendered, getattr(settings, 'TICKET_ROW_CACHE_TIMEOUT', DEFAULT_TIMEOUT))
+        with self._lock:
+            self.hits += len(tickets) - len(rendered); self.misses += len(rendered)
+        return rows
+
+    def invalidate(self):
+        self.stamp.bump()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses, 'hit_ratio': (self.hits / total) if total else None, 'version': self.stamp.current()}
+
+
+ticket_row_cache = TicketRowCache()
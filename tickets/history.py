@@ -0,0 +1,22 @@
+# tickets/history.py
+# Запись истории изменений тикета (TicketEvent) из представлений и команд.
+from .models import TicketEvent
+
+def _value_parts(value):
+    # Значение - объект модели (статус, приоритет, проект, сотрудник) или None
+    if value is None: return None, ''
+    if hasattr(value, 'get_full_name'): return value.pk, value.get_full_name() or value.username
+    return value.pk, getattr(value, 'name', str(value))
+
+def build_ticket_event(ticket, kind, old_value=None, new_value=None, actor=None, actor_name='', note='', **extra):
+    old_id, old_display = _value_parts(old_value)
+    new_id, new_display = _value_parts(new_value)
+    return TicketEvent(
+        ticket=ticket, kind=kind, old_value_id=old_id, old_value_display=old_display[:255],
+        new_value_id=new_id, new_value_display=new_display[:255], actor=actor, actor_name=actor_name[:255], note=note or '', **extra
+    )
+
+def record_ticket_event(ticket, kind, old_value=None, new_value=None, actor=None, actor_name='', note=''):
+    event = build_ticket_event(ticket, kind, old_value, new_value, actor=actor, actor_name=actor_name, note=note)
+    event.save()
+    return event
@@ -0,0 +1,291 @@
+# tickets/importer.py
+# Массовый импорт тикетов (с комментариями) из JSONL или CSV - для переноса из старого трекера.
+# - Источник читается потоком, строки собираются в пакеты по batch_size.
+# - Проект, категория, статус, приоритет и исполнитель ищутся в словарях, загруженных один раз.
+# - Дополнительные поля проверяются полями скомпилированной формы категории (tickets/dynamic_forms.py).
+# - Номера тикетов выделяются блоком на пакет (reserve_ticket_ids), тикеты и комментарии - bulk_create.
+#   Номер из источника (ticket_id), уже занятый в базе или повторенный в пакете, - ошибка строки;
+#   счетчик номеров поднимается до максимального импортированного номера в той же транзакции.
+# - После каждого пакета обновляются поисковый индекс и счетчики TicketCounter, а контрольная точка
+#   (ImportCheckpoint) сохраняется в той же транзакции, что и пакет: после сбоя импорт продолжается
+#   с первой незагруженной строки.
+# - Сроки SLA считаются до bulk_create (он обходит Ticket.save()) от исходной даты создания; первый ответ -
+#   самый ранний публичный комментарий сотрудника. Состояние SLA на момент импорта считается уже
+#   эскалированным, как для заявок, существовавших до миграции 0024: импорт истории не рассылает эскалаций.
+# Формат строки (ключи JSON или колонки CSV): title, description, reporter_name, reporter_email,
+# reporter_phone, reporter_building, reporter_room, reporter_department, project (название или id),
+# category (название или id), status (код), priority (код), assignee (логин), ticket_id, created_at,
+# resolved_at, closed_at, доп. поля - 'cf_<имя>' или объект custom_form_data; в JSONL также
+# comments: [{body, author, is_internal, created_at}].
+import csv
+import json
+from collections import defaultdict
+from datetime import date, datetime
+
+from django import forms
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from . import counters, rollups
+from .dynamic_forms import get_ticket_create_form_class
+from .export import CUSTOM_COLUMN_PREFIX
+from .models import Agent, Comment, ImportCheckpoint, Project, Ticket, TicketCategory, TicketPriority
+from .numbering import advance_ticket_numbers, parse_ticket_id, reserve_ticket_ids
+from .reference_cache import reference_data
+from .search import index_tickets
+from .sla import update_ticket_sla
+
+DEFAULT_BATCH_SIZE = 1000
+STANDARD_TEXT_FIELDS = ('title', 'description', 'reporter_name', 'reporter_phone', 'reporter_building', 'reporter_room', 'reporter_department')
+_email_field = forms.EmailField()
+
+
+class ImportRowError(Exception):
+    pass
+
+
+# --- Чтение источника ---
+def iter_source_rows(path, source_format):
+    """(номер строки, словарь) для каждой записи источника."""
+    with open(path, encoding='utf-8-sig', newline='') as f:
+        if source_format == 'csv':
+            for line_number, row in enumerate(csv.DictReader(f), start=2):
+                yield line_number, row
+        else:
+            for line_number, line in enumerate(f, start=1):
+                line = line.strip()
+                if not line: continue
+                try: row = json.loads(line)
+                except json.JSONDecodeError as e: row = {'__error__': f"Некорректный JSON: {e}", 'raw': line}
+                yield line_number, row
+
+
+# --- Справочники ---
+class ReferenceMaps:
+    def __init__(self):
+        self.projects_by_name = {}; self.projects_by_id = {}
+        for project in Project.objects.all():
+            self.projects_by_name[project.name.lower()] = project; self.projects_by_id[project.pk] = project
+        self.categories_by_name = {}; self.categories_by_id = {}
+        for category in TicketCategory.objects.select_related('project'):
+            self.categories_by_name[(category.project_id, category.name.lower())] = category; self.categories_by_id[category.pk] = category
+        self.statuses = {status.code: status for status in reference_data.statuses()}
+        self.priorities = {priority.code: priority for priority in reference_data.priorities()}
+        self.agents = dict(Agent.objects.values_list('username', 'pk'))
+        self.default_status = reference_data.get_default_status()
+        try: self.default_priority = reference_data.get_priority('NORMAL')
+        except TicketPriority.DoesNotExist: self.default_priority = None
+
+    def project(self, value):
+        value = str(value or '').strip()
+        project = self.projects_by_id.get(int(value)) if value.isdigit() else self.projects_by_name.get(value.lower())
+        if project is None: raise ImportRowError(f"Проект '{value}' не найден.")
+        return project
+
+    def category(self, value, project):
+        value = str(value or '').strip()
+        if not value: return None
+        category = self.categories_by_id.get(int(value)) if value.isdigit() else self.categories_by_name.get((project.pk, value.lower()))
+        if category is None or category.project_id != project.pk: raise ImportRowError(f"Категория '{value}' не найдена в проекте '{project.name}'.")
+        return category
+
+    def status(self, value):
+        if not value: return self.default_status
+        try: return self.statuses[value]
+        except KeyError: raise ImportRowError(f"Статус с кодом '{value}' не найден.")
+
+    def priority(self, value):
+        if not value: return self.default_priority
+        try: return self.priorities[value]
+        except KeyError: raise ImportRowError(f"Приоритет с кодом '{value}' не найден.")
+
+    def agent_id(self, value):
+        if not value: return None
+        try: return self.agents[value]
+        except KeyError: raise ImportRowError(f"Сотрудник '{value}' не найден.")
+
+
+def _parse_datetime(value, field_name):
+    if value in (None, ''): return None
+    parsed = parse_datetime(str(value))
+    if parsed is None: raise ImportRowError(f"Некорректная дата в поле {field_name}: '{value}'.")
+    return timezone.make_aware(parsed) if timezone.is_naive(parsed) else parsed
+
+def _json_safe(value):
+    return value.isoformat() if isinstance(value, (date, datetime)) else value
+
+
+class TicketImporter:
+    def __init__(self, source, batch_size=DEFAULT_BATCH_SIZE, strict=False, error_log=None, progress=None):
+        self.source = source
+        self.batch_size = batch_size
+        self.strict = strict
+        self.error_log = error_log # файл, куда пишутся отклоненные строки (JSONL)
+        self.progress = progress # callback(checkpoint, batch_rows) после каждого пакета
+        self.maps = ReferenceMaps()
+        self.rows_read = 0 # строк прочитано в этом запуске (без пропущенных по контрольной точке)
+        self.standard_field_names = {f.name for f in Ticket._meta.get_fields() if not f.is_relation}
+
+    # --- Разбор строки ---
+    def build_ticket(self, row):
+        if '__error__' in row: raise ImportRowError(row['__error__'])
+        project = self.maps.project(row.get('project'))
+        category = self.maps.category(row.get('category'), project)
+        status = self.maps.status(row.get('status'))
+        values = {name: (row.get(name) or '').strip() if isinstance(row.get(name), str) else row.get(name) for name in STANDARD_TEXT_FIELDS}
+        for required in ('title', 'reporter_name'):
+            if not values.get(required): raise ImportRowError(f"Не заполнено обязательное поле {required}.")
+        try: reporter_email = _email_field.clean(row.get('reporter_email'))
+        except ValidationError as e: raise ImportRowError(f"reporter_email: {' '.join(e.messages)}")
+
+        custom_form_data = {}
+        if category is not None:
+            raw_custom = dict(row.get('custom_form_data') or {})
+            for key, value in row.items():
+                if key.startswith(CUSTOM_COLUMN_PREFIX) and value not in (None, ''): raw_custom[key[len(CUSTOM_COLUMN_PREFIX):]] = value
+            form_class = get_ticket_create_form_class(category)
+            for name in form_class.custom_field_names:
+                if name in form_class.file_field_names: continue
+                try: cleaned = form_class.base_fields[name].clean(raw_custom.get(name))
+                except ValidationError as e: raise ImportRowError(f"{name}: {' '.join(e.messages)}")
+                if name in self.standard_field_names: values[name] = cleaned
+                elif cleaned not in (None, ''): custom_form_data[name] = _json_safe(cleaned)
+
+        created_at = _parse_datetime(row.get('created_at'), 'created_at')
+        resolved_at = _parse_datetime(row.get('resolved_at'), 'resolved_at')
+        closed_at = _parse_datetime(row.get('closed_at'), 'closed_at')
+        if status.is_resolved_status and not resolved_at: resolved_at = closed_at or created_at or timezone.now()
+        if status.is_closed_status and not closed_at: closed_at = resolved_at or created_at or timezone.now()
+        legacy_ticket_id = (row.get('ticket_id') or '').strip()
+        if len(legacy_ticket_id) > Ticket._meta.get_field('ticket_id_display').max_length: raise ImportRowError(f"Слишком длинный номер тикета '{legacy_ticket_id}'.")
+        ticket = Ticket(
+            project=project, category=category, status=status, priority=self.maps.priority(row.get('priority')),
+            assignee_id=self.maps.agent_id(row.get('assignee')), reporter_email=reporter_email,
+            ticket_id_display=legacy_ticket_id, custom_form_data=custom_form_data,
+            resolved_at=resolved_at if status.is_resolved_status else None, closed_at=closed_at if status.is_closed_status else None,
+            **{name: value or ('' if name in ('title', 'description', 'reporter_name') else None) for name, value in values.items()},
+        )
+        ticket._import_created_at = created_at
+        ticket._import_comments = self.build_comments(row.get('comments') or [])
+        return ticket
+
+    def build_comments(self, raw_comments):
+        if not isinstance(raw_comments, list): raise ImportRowError("Поле comments должно быть списком.")
+        comments = []
+        for raw in raw_comments:
+            if not isinstance(raw, dict) or not raw.get('body'): raise ImportRowError("Комментарий без текста (body).")
+            author = raw.get('author') or ''
+            agent_id = self.maps.agents.get(author)
+            comment = Comment(body=raw['body'], is_internal=bool(raw.get('is_internal')), author_agent_id=agent_id, author_name_display=author[:255])
+            comment._import_created_at = _parse_datetime(raw.get('created_at'), 'comments.created_at')
+            comments.append(comment)
+        return comments
+
+    # --- Пакет ---
+    def reject_taken_ticket_ids(self, tickets):
+        """Отклоняет тикеты, чей номер из источника уже есть в базе или раньше в пакете; возвращает (оставшиеся, отклонено)."""
+        legacy_ids = [t.ticket_id_display for t in tickets if t.ticket_id_display]
+        if not legacy_ids: return tickets, 0
+        taken = set(Ticket.objects.filter(ticket_id_display__in=legacy_ids).values_list('ticket_id_display', flat=True))
+        accepted = []; rejected = 0
+        for ticket in tickets:
+            ticket_id = ticket.ticket_id_display
+            if ticket_id and ticket_id in taken:
+                rejected += 1; line_number, row = ticket._import_source
+                self.reject(line_number, row, f"Тикет с номером '{ticket_id}' уже существует.")
+                continue
+            if ticket_id: taken.add(ticket_id)
+            accepted.append(ticket)
+        return accepted, rejected
+
+    def advance_ticket_sequences(self, tickets):
+        # Счетчик поднимается до импортированных номеров до выдачи новых: иначе блок номеров пакета может их повторить
+        highest = {}
+        for ticket in tickets:
+            parsed = parse_ticket_id(ticket.ticket_id_display)
+            if parsed is None: continue
+            project_code, year, number = parsed
+            if number > highest.get((project_code, year), 0): highest[(project_code, year)] = number
+        for (project_code, year), number in highest.items(): advance_ticket_numbers(project_code, year, number)
+
+    def assign_ticket_ids(self, tickets):
+        # Один блок номеров на (проект, год) в пакете вместо запроса на каждый тикет
+        groups = defaultdict(list)
+        for ticket in tickets:
+            if not ticket.ticket_id_display:
+                year = (ticket._import_created_at or timezone.now()).year
+                groups[(ticket.project_id, year)].append(ticket)
+        for (project_id, year), group in groups.items():
+            block = reserve_ticket_ids(self.maps.projects_by_id[project_id], len(group), year=year)
+            for ticket, ticket_id in zip(group, block): ticket.ticket_id_display = ticket_id
+
+    def apply_sla(self, tickets):
+        now = timezone.now()
+        for ticket in tickets:
+            ticket.created_at = ticket._import_created_at or now # bulk_create снова подставит now, даты восстанавливаются после
+            responses = [c._import_created_at for c in ticket._import_comments if c.author_agent_id and not c.is_internal and c._import_created_at]
+            if responses: ticket.first_responded_at = min(responses)
+            update_ticket_sla(ticket, now)
+            ticket.sla_escalated_state = ticket.sla_state
+
+    def write_batch(self, checkpoint, tickets, rows_in_batch, rejected_in_batch):
+        with transaction.atomic():
+            tickets, taken_count = self.reject_taken_ticket_ids(tickets)
+            rejected_in_batch += taken_count
+            if tickets:
+                self.advance_ticket_sequences(tickets)
+                self.assign_ticket_ids(tickets)
+                self.apply_sla(tickets)
+                Ticket.objects.bulk_create(tickets)
+                # created_at с auto_now_add при bulk_create заменяется текущим временем - восстанавливаем исходные даты
+                dated = [t for t in tickets if t._import_created_at]
+                for ticket in dated: ticket.created_at = ticket._import_created_at
+                if dated: Ticket.objects.bulk_update(dated, ['created_at'])
+                comments = []
+                for ticket in tickets:
+                    for comment in ticket._import_comments: comment.ticket_id = ticket.pk; comments.append(comment)
+                if comments:
+                    Comment.objects.bulk_create(comments)
+                    dated_comments = [c for c in comments if c._import_created_at]
+                    for comment in dated_comments: comment.created_at = comment._import_created_at
+                    if dated_comments: Comment.objects.bulk_update(dated_comments, ['created_at'])
+                counters.add_new_tickets([(t.project_id, t.category_id, t.assignee_id, t.status_id) for t in tickets])
+                rollups.add_new_tickets(tickets)
+            checkpoint.rows_processed += rows_in_batch
+            checkpoint.tickets_created += len(tickets)
+            checkpoint.rows_rejected += rejected_in_batch
+            checkpoint.save()
+        if tickets: index_tickets([t.pk for t in tickets])
+
+    def reject(self, line_number, row, message):
+        if self.strict: raise ImportRowError(f"Строка {line_number}: {message}")
+        if self.error_log is not None:
+            self.error_log.write(json.dumps({'line': line_number, 'error': message, 'row': row}, ensure_ascii=False, default=str) + '\n')
+
+    # --- Запуск ---
+    def run(self, rows, restart=False):
+        checkpoint, _ = ImportCheckpoint.objects.get_or_create(source=self.source)
+        if restart:
+            checkpoint.rows_processed = 0; checkpoint.tickets_created = 0; checkpoint.rows_rejected = 0; checkpoint.finished_at = None
+            checkpoint.save()
+        skip = checkpoint.rows_processed
+        batch = []; rows_in_batch = 0; rejected_in_batch = 0
+        for index, (line_number, row) in enumerate(rows):
+            if index < skip: continue # уже загружено до сбоя
+            rows_in_batch += 1; self.rows_read += 1
+            try: ticket = self.build_ticket(row)
+            except ImportRowError as e:
+                rejected_in_batch += 1; self.reject(line_number, row, str(e))
+            else:
+                ticket._import_source = (line_number, row); batch.append(ticket)
+            if rows_in_batch >= self.batch_size:
+                self.write_batch(checkpoint, batch, rows_in_batch, rejected_in_batch)
+                if self.progress: self.progress(checkpoint, rows_in_batch)
+                batch = []; rows_in_batch = 0; rejected_in_batch = 0
+        if rows_in_batch:
+            self.write_batch(checkpoint, batch, rows_in_batch, rejected_in_batch)
+            if self.progress: self.progress(checkpoint, rows_in_batch)
+        checkpoint.finished_at = timezone.now(); checkpoint.save(update_fields=['finished_at', 'updated_at'])
+        return checkpoint
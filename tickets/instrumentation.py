@@ -0,0 +1,283 @@
+# tickets/instrumentation.py
+# Замер нагрузки на БД по представлениям (QueryInstrumentationMiddleware в settings.MIDDLEWARE).
+# - Каждый SQL-запрос проходит через обертку execute_wrappers соединения (ставится один раз на соединение,
+#   сигнал connection_created), которая передает его QueryRecorder текущего запроса из contextvar:
+#   так замеряются и WSGI, и ASGI (sync-представления под ASGI выполняются в другом потоке, со своими
+#   соединениями, но с тем же контекстом). Считаются число запросов, время в БД
+#   и повторы - одинаковый SQL с одинаковыми параметрами (например, повторный TicketStatus.objects.get)
+#   и одинаковый SQL с разными параметрами (признак N+1).
+# - Время отрисовки шаблонов - обертка над render() шаблонов бэкенда Django (вложенные include
+#   не учитываются дважды; SQL, выполненный из шаблона, входит и в render_ms, и в sql_ms).
+# - Последние INSTRUMENTATION_BUFFER_SIZE запросов хранятся в кольцевом буфере процесса (страница
+#   agent/stats/performance/), накопительные счетчики - для Prometheus (agent/metrics/).
+#   У каждого процесса (воркера gunicorn) свой буфер и свои счетчики.
+# - Бюджеты: QUERY_BUDGETS = {'tickets:agent_ticket_list': 10, ...}. Превышение пишется в лог,
+#   а при QUERY_BUDGET_STRICT = True (в тестах: override_settings) вызывает QueryBudgetExceeded,
+#   и тестовый клиент пробрасывает его в тест.
+# Потоковые ответы (выгрузка, SSE) учитываются до начала отдачи тела.
+import contextvars
+import logging
+import threading
+import time
+from collections import Counter, deque
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.template.backends.django import Template as DjangoBackendTemplate
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUFFER_SIZE = 2000
+DURATION_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0) # секунды, для гистограммы Prometheus
+IGNORED_VIEWS = {'tickets:agent_metrics'} # опрос Prometheus не должен попадать в статистику
+TOP_DUPLICATES = 3
+SQL_PREVIEW_LENGTH = 300
+
+_current_recorder = contextvars.ContextVar('query_recorder', default=None)
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+class QueryRecorder:
+    """Обертка execute_wrapper: собирает запросы одного HTTP-запроса."""
+
+    def __init__(self):
+        self.count = 0
+        self.sql_seconds = 0.0
+        self.render_seconds = 0.0
+        self.exact = Counter() # (sql, параметры) -> сколько раз
+        self.shapes = Counter() # sql -> сколько раз (с любыми параметрами)
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try: return execute(sql, params, many, context)
+        finally:
+            self.sql_seconds += time.perf_counter() - started
+            self.count += 1
+            self.shapes[sql] += 1
+            if not many:
+                try: self.exact[(sql, repr(params))] += 1
+                except Exception: pass
+
+    @property
+    def duplicate_count(self):
+        """Лишние выполнения одинаковых запросов (сам запрос и параметры совпадают)."""
+        return sum(n - 1 for n in self.exact.values() if n > 1)
+
+    @property
+    def similar_count(self):
+        """Лишние выполнения одного SQL с разными параметрами (кандидаты в select_related/prefetch)."""
+        return sum(n - 1 for n in self.shapes.values() if n > 1) - self.duplicate_count
+
+    def top_duplicates(self, limit=TOP_DUPLICATES):
+        repeated = [(n, sql, 'same') for (sql, _), n in self.exact.items() if n > 1]
+        exact_shapes = {sql for (sql, _), n in self.exact.items() if n > 1}
+        repeated += [(n, sql, 'similar') for sql, n in self.shapes.items() if n > 1 and sql not in exact_shapes]
+        repeated.sort(key=lambda item: -item[0])
+        return [{'count': n, 'kind': kind, 'sql': sql[:SQL_PREVIEW_LENGTH]} for n, sql, kind in repeated[:limit]]
+
+
+# --- Перехват SQL ---
+def _record_query(execute, sql, params, many, context):
+    recorder = _current_recorder.get()
+    if recorder is None: return execute(sql, params, many, context)
+    return recorder(execute, sql, params, many, context)
+
+def _add_query_wrapper(connection):
+    # В начало списка: connection.execute_wrapper() снимает свою обертку через pop() с конца
+    if _record_query not in connection.execute_wrappers: connection.execute_wrappers.insert(0, _record_query)
+
+def _on_connection_created(sender, connection, **kwargs):
+    _add_query_wrapper(connection)
+
+def install_query_recording():
+    connection_created.connect(_on_connection_created, dispatch_uid='tickets.instrumentation.query_recording')
+    for connection in connections.all(initialized_only=True): _add_query_wrapper(connection) # уже открытые в этом потоке
+
+
+# --- Время отрисовки шаблонов ---
+_original_render = DjangoBackendTemplate.render
+
+def _timed_render(self, context=None, request=None):
+    recorder = _current_recorder.get()
+    if recorder is None: return _original_render(self, context, request)
+    started = time.perf_counter()
+    try: return _original_render(self, context, request)
+    finally: recorder.render_seconds += time.perf_counter() - started
+
+_timed_render._instrumented = True
+
+def install_render_timing():
+    if not getattr(DjangoBackendTemplate.render, '_instrumented', False): DjangoBackendTemplate.render = _timed_render
+
+
+# --- Хранилище результатов ---
+class _ViewTotals:
+    __slots__ = ('requests', 'errors', 'seconds', 'sql_seconds', 'render_seconds', 'queries', 'duplicates', 'budget_exceeded', 'buckets')
+
+    def __init__(self):
+        self.requests = 0; self.errors = 0; self.seconds = 0.0; self.sql_seconds = 0.0; self.render_seconds = 0.0
+        self.queries = 0; self.duplicates = 0; self.budget_exceeded = 0
+        self.buckets = [0] * len(DURATION_BUCKETS)
+
+
+class RequestLog:
+    def __init__(self, size=None):
+        self._lock = threading.Lock()
+        self._size = size
+        self._records = None
+        self._totals = {} # (представление, метод) -> _ViewTotals
+        self.started_at = time.time()
+
+    @property
+    def records(self):
+        if self._records is None: self._records = deque(maxlen=self._size or getattr(settings, 'INSTRUMENTATION_BUFFER_SIZE', DEFAULT_BUFFER_SIZE))
+        return self._records
+
+    def add(self, record):
+        with self._lock:
+            self.records.append(record)
+            totals = self._totals.get((record['view'], record['method']))
+            if totals is None: totals = self._totals[(record['view'], record['method'])] = _ViewTotals()
+            totals.requests += 1; totals.errors += record['status'] >= 500
+            totals.seconds += record['total_ms'] / 1000; totals.sql_seconds += record['sql_ms'] / 1000; totals.render_seconds += record['render_ms'] / 1000
+            totals.queries += record['queries']; totals.duplicates += record['duplicates']; totals.budget_exceeded += record['over_budget']
+            for index, bound in enumerate(DURATION_BUCKETS):
+                if record['total_ms'] / 1000 <= bound: totals.buckets[index] += 1
+
+    def snapshot(self):
+        with self._lock: return list(self.records)
+
+    def totals(self):
+        with self._lock: return {key: _copy_totals(value) for key, value in self._totals.items()}
+
+    def clear(self):
+        with self._lock:
+            self.records.clear(); self._totals.clear(); self.started_at = time.time()
+
+    def summary(self):
+        """Сводка по представлениям из кольцевого буфера (перцентили - по последним запросам)."""
+        groups = {}
+        for record in self.snapshot(): groups.setdefault(record['view'], []).append(record)
+        rows = []
+        for view, records in groups.items():
+            durations = sorted(r['total_ms'] for r in records)
+            queries = [r['queries'] for r in records]
+            rows.append({
+                'view': view, 'requests': len(records),
+                'p50_ms': _percentile(durations, 50), 'p95_ms': _percentile(durations, 95), 'max_ms': durations[-1],
+                'queries_avg': sum(queries) / len(queries), 'queries_max': max(queries),
+                'sql_ms_avg': sum(r['sql_ms'] for r in records) / len(records),
+                'render_ms_avg': sum(r['render_ms'] for r in records) / len(records),
+                'duplicates_avg': sum(r['duplicates'] for r in records) / len(records),
+                'budget': query_budget(view), 'over_budget': sum(r['over_budget'] for r in records),
+            })
+        rows.sort(key=lambda row: -row['sql_ms_avg'] * row['requests']) # сначала те, кто больше всего нагружает БД
+        return rows
+
+def _copy_totals(totals):
+    copy = _ViewTotals()
+    for name in _ViewTotals.__slots__: setattr(copy, name, list(getattr(totals, name)) if name == 'buckets' else getattr(totals, name))
+    return copy
+
+def _percentile(sorted_values, p):
+    if not sorted_values: return 0.0
+    return sorted_values[min(max(int(round(p / 100.0 * len(sorted_values) + 0.5)) - 1, 0), len(sorted_values) - 1)]
+
+request_log = RequestLog()
+
+
+# --- Бюджеты ---
+def query_budget(view_name):
+    return getattr(settings, 'QUERY_BUDGETS', {}).get(view_name)
+
+def check_query_budget(view_name, query_count, duplicates=None):
+    """True, если бюджет превышен; при QUERY_BUDGET_STRICT - исключение QueryBudgetExceeded."""
+    budget = query_budget(view_name)
+    if budget is None or query_count <= budget: return False
+    message = f"Представление {view_name}: {query_count} SQL-запросов при бюджете {budget}."
+    if duplicates: message += " Повторы: " + "; ".join(f"{d['count']}x {d['sql'][:120]}" for d in duplicates)
+    if getattr(settings, 'QUERY_BUDGET_STRICT', False): raise QueryBudgetExceeded(message)
+    logger.warning(message)
+    return True
+
+
+# --- Middleware ---
+class QueryInstrumentationMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async: markcoroutinefunction(self)
+        install_query_recording()
+        install_render_timing()
+
+    def __call__(self, request):
+        if self.is_async: return self.__acall__(request)
+        recorder = QueryRecorder()
+        token = _current_recorder.set(recorder)
+        started = time.perf_counter()
+        try: response = self.get_response(request)
+        finally: _current_recorder.reset(token)
+        self.record(request, response, recorder, time.perf_counter() - started)
+        return response
+
+    async def __acall__(self, request):
+        recorder = QueryRecorder()
+        token = _current_recorder.set(recorder) # контекст копируется в потоки sync_to_async
+        started = time.perf_counter()
+        try: response = await self.get_response(request)
+        finally: _current_recorder.reset(token)
+        self.record(request, response, recorder, time.perf_counter() - started)
+        return response
+
+    def record(self, request, response, recorder, total_seconds):
+        match = getattr(request, 'resolver_match', None)
+        view_name = match.view_name if match else None
+        if not view_name or view_name in IGNORED_VIEWS: return
+        duplicates = recorder.top_duplicates()
+        over_budget = check_query_budget(view_name, recorder.count, duplicates)
+        request_log.add({
+            'time': time.time(), 'view': view_name, 'method': request.method, 'path': request.path[:200], 'status': response.status_code,
+            'total_ms': total_seconds * 1000, 'sql_ms': recorder.sql_seconds * 1000, 'render_ms': recorder.render_seconds * 1000,
+            'queries': recorder.count, 'duplicates': recorder.duplicate_count, 'similar': recorder.similar_count,
+            'top_duplicates': duplicates, 'over_budget': over_budget, 'streaming': response.streaming,
+        })
+
+
+# --- Prometheus ---
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def prometheus_metrics():
+    """Текстовый формат Prometheus (version 0.0.4)."""
+    totals = request_log.totals()
+    lines = []
+    def metric(name, kind, help_text, values):
+        lines.append(f"# HELP {name} {help_text}"); lines.append(f"# TYPE {name} {kind}")
+        lines.extend(values)
+    def series(name, attr):
+        return [f'{name}{{view="{_label(view)}",method="{method}"}} {getattr(t, attr)}' for (view, method), t in sorted(totals.items())]
+
+    metric('helpdesk_view_requests_total', 'counter', "Requests handled per view.", series('helpdesk_view_requests_total', 'requests'))
+    metric('helpdesk_view_errors_total', 'counter', "Responses with status >= 500 per view.", series('helpdesk_view_errors_total', 'errors'))
+    histogram = []
+    for (view, method), t in sorted(totals.items()):
+        labels = f'view="{_label(view)}",method="{method}"'
+        for bound, count in zip(DURATION_BUCKETS, t.buckets): histogram.append(f'helpdesk_view_duration_seconds_bucket{{{labels},le="{bound}"}} {count}')
+        histogram.append(f'helpdesk_view_duration_seconds_bucket{{{labels},le="+Inf"}} {t.requests}')
+        histogram.append(f'helpdesk_view_duration_seconds_sum{{{labels}}} {t.seconds:.6f}')
+        histogram.append(f'helpdesk_view_duration_seconds_count{{{labels}}} {t.requests}')
+    metric('helpdesk_view_duration_seconds', 'histogram', "Time to build the response (streaming body excluded).", histogram)
+    metric('helpdesk_view_db_queries_total', 'counter', "SQL queries executed per view.", series('helpdesk_view_db_queries_total', 'queries'))
+    metric('helpdesk_view_db_seconds_total', 'counter', "Time spent in SQL per view.", series('helpdesk_view_db_seconds_total', 'sql_seconds'))
+    metric('helpdesk_view_render_seconds_total', 'counter', "Template rendering time per view.", series('helpdesk_view_render_seconds_total', 'render_seconds'))
+    metric('helpdesk_view_duplicate_queries_total', 'counter', "Repeated identical SQL queries per view.", series('helpdesk_view_duplicate_queries_total', 'duplicates'))
+    metric('helpdesk_view_query_budget_exceeded_total', 'counter', "Requests over the view query budget.", series('helpdesk_view_query_budget_exceeded_total', 'budget_exceeded'))
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,87 @@
+# tickets/live.py
+# Рассылка событий о новых тикетах подключенным агентам (Server-Sent Events).
+# При создании тикета сигнал публикует одно событие в хаб, а хаб раскладывает его по очередям
+# подписчиков, у которых есть доступ к проекту тикета. Подписчики - открытые вкладки агентов,
+# каждую обслуживает асинхронное представление agent_ticket_stream_view. Запросов к БД
+# на клиента и на интервал нет.
+# Хаб живет в памяти процесса: поток работает под ASGI-сервером (см. helpdesk_project/asgi.py),
+# и тикеты должны создаваться в том же процессе, что и обслуживает поток.
+import asyncio
+import itertools
+import json
+import threading
+
+from django.urls import reverse
+
+from .models import Project, TicketStatus
+from .reference_cache import reference_data
+
+# Сколько событий держим в очереди медленного клиента; старые события при переполнении отбрасываются
+SUBSCRIBER_QUEUE_SIZE = 100
+
+def build_ticket_event(ticket):
+    """Данные события в том же формате, что и элементы 'tickets' в check_new_tickets_api_view."""
+    try: project_name = reference_data.get_project(ticket.project_id).name if ticket.project_id else 'N/A'
+    except Project.DoesNotExist: project_name = ticket.project.name
+    try: status_name = reference_data.get_status_by_pk(ticket.status_id).name if ticket.status_id else 'N/A'
+    except TicketStatus.DoesNotExist: status_name = ticket.status.name
+    return {
+        'id': ticket.pk, 'ticket_id_display': ticket.ticket_id_display, 'title': ticket.title,
+        'project_id': ticket.project_id, 'project': project_name,
+        'category': ticket.category.name if ticket.category_id else 'N/A',
+        'status_name': status_name, 'created_at_iso': ticket.created_at.isoformat(),
+        'url': reverse('tickets:agent_ticket_detail', kwargs={'ticket_pk': ticket.pk}),
+    }
+
+def format_sse(event, event_type='ticket'):
+    return f"id: {event['id']}\nevent: {event_type}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+
+
+class Subscription:
+    def __init__(self, sub_id, project_ids, loop):
+        self.id = sub_id
+        self.project_ids = project_ids # None - все проекты (привилегированные пользователи)
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        self.dropped = 0
+
+    def accepts(self, event):
+        return self.project_ids is None or event.get('project_id') in self.project_ids
+
+    def _put(self, event):
+        # Выполняется в цикле событий подписчика
+        if self.queue.full():
+            self.queue.get_nowait(); self.dropped += 1
+        self.queue.put_nowait(event)
+
+
+class TicketStreamHub:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = {}
+        self._ids = itertools.count(1)
+        self.published = 0
+
+    def subscribe(self, project_ids=None):
+        subscription = Subscription(next(self._ids), project_ids, asyncio.get_running_loop())
+        with self._lock: self._subscribers[subscription.id] = subscription
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock: self._subscribers.pop(subscription.id, None)
+
+    def publish(self, event):
+        # Может вызываться из любого потока (синхронные представления, воркеры)
+        with self._lock: subscribers = list(self._subscribers.values())
+        self.published += 1
+        for subscription in subscribers:
+            if not subscription.accepts(event): continue
+            try: subscription.loop.call_soon_threadsafe(subscription._put, event)
+            except RuntimeError: self.unsubscribe(subscription) # цикл событий уже закрыт
+
+    @property
+    def subscriber_count(self):
+        return len(self._subscribers)
+
+
+ticket_stream_hub = TicketStreamHub()
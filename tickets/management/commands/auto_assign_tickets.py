@@ -0,0 +1,33 @@
+# tickets/management/commands/auto_assign_tickets.py
+# Назначение исполнителей уже накопившимся открытым заявкам без исполнителя - по тем же правилам
+# проектов (AutoAssignmentRule), что и для новых заявок (tickets/assignment.py). Нужна после включения
+# правила в проекте или после того, как у сотрудников освободились места (max_open_per_agent).
+#   python manage.py auto_assign_tickets --project 3 --limit 500
+# Каждая заявка назначается в своей транзакции, старые - первыми.
+from django.core.management.base import BaseCommand
+
+from tickets.assignment import auto_assign_ticket
+from tickets.models import AutoAssignmentRule, Ticket
+
+
+class Command(BaseCommand):
+    help = "Назначает исполнителей открытым заявкам без исполнителя по правилам автоназначения проектов."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--project', type=int, help="Только проект с этим pk.")
+        parser.add_argument('--limit', type=int, default=1000, help="Не больше N заявок за запуск.")
+
+    def handle(self, *args, **options):
+        rules = AutoAssignmentRule.objects.filter(is_active=True)
+        if options['project']: rules = rules.filter(project_id=options['project'])
+        project_ids = list(rules.values_list('project_id', flat=True))
+        if not project_ids:
+            self.stdout.write("Нет проектов с включенным автоназначением."); return
+        tickets = (Ticket.objects.filter(project_id__in=project_ids, assignee__isnull=True, status__is_closed_status=False)
+                   .select_related('project').order_by('created_at', 'pk')[:options['limit']])
+        assigned = 0; skipped = 0; full_projects = set()
+        for ticket in tickets:
+            if ticket.project_id in full_projects: skipped += 1; continue
+            if auto_assign_ticket(ticket) is None: full_projects.add(ticket.project_id); skipped += 1 # в проекте никого свободного
+            else: assigned += 1
+        self.stdout.write(self.style.SUCCESS(f"Назначено: {assigned}, осталось без исполнителя: {skipped}."))
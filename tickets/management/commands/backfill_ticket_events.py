@@ -0,0 +1,100 @@
+# tickets/management/commands/backfill_ticket_events.py
+# Перенос истории изменений из служебных (внутренних) комментариев в TicketEvent.
+# Раньше смена статуса, приоритета, исполнителя и проекта записывалась внутренним комментарием
+# с фиксированным текстом; команда разбирает эти тексты и создает структурированные события.
+# Исходный комментарий связывается с событием (source_comment) и перестает показываться в ленте.
+# Повторный запуск безопасен: уже перенесенные комментарии пропускаются.
+import re
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from tickets.models import Agent, Comment, Project, TicketEvent, TicketPriority, TicketStatus
+
+# Фразы, по которым старая версия карточки тикета относила комментарий к истории
+LEGACY_LOG_PHRASES = [
+    "Статус изменен на:", "Агент взял заявку в работу", "Приоритет изменен на:", "Исполнитель изменен на:",
+    "Заявка перенаправлена из проекта", "Заявка помечена как 'Решена'", "Заявка закрыта", "Заявка закрыта с замечанием",
+    "Статус изменен с",
+]
+EMPTY_VALUE_NAMES = {"не был назначен", "снят", "снято назначение"}
+
+STATUS_CHANGED_RE = re.compile(r"^Статус изменен с '(?P<old>.*?)' на '(?P<new>.*?)'\.(?:\nКомментарий: (?P<note>.*))?$", re.S)
+TAKEN_RE = re.compile(r"^Агент взял заявку в работу\. Статус изменен с '(?P<old>.*?)' на '(?P<new>.*?)'\.$", re.S)
+TAKEN_NO_STATUS_RE = re.compile(r"^Агент взял заявку в работу\. \((?P<note>.*)\)\.?$", re.S)
+PRIORITY_RE = re.compile(r"^Приоритет изменен на: (?P<new>.*) \(предыдущий: (?P<old>.*)\)$", re.S)
+ASSIGNEE_RE = re.compile(r"^Исполнитель изменен на: (?P<new>.*) \(предыдущий: (?P<old>.*)\)\.$", re.S)
+PROJECT_RE = re.compile(r"^Заявка перенаправлена из проекта '(?P<old>.*?)' в проект '(?P<new>.*?)'\. Исполнитель сброшен\.$", re.S)
+CLOSED_RE = re.compile(r"^Заявка закрыта\. Статус изменен с '(?P<old>.*?)' на '(?P<new>.*?)'\.(?:\nКомментарий при закрытии: (?P<note>.*))?$", re.S)
+
+
+class Command(BaseCommand):
+    help = "Создает записи TicketEvent из служебных комментариев (история изменений до появления TicketEvent)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--dry-run', action='store_true', help="Только посчитать, ничего не записывать.")
+
+    def handle(self, *args, **options):
+        self.value_ids = {
+            TicketEvent.KIND_STATUS: {s.name: s.pk for s in TicketStatus.objects.all()},
+            TicketEvent.KIND_PRIORITY: {p.name: p.pk for p in TicketPriority.objects.all()},
+            TicketEvent.KIND_PROJECT: {p.name: p.pk for p in Project.objects.all()},
+            TicketEvent.KIND_ASSIGNEE: {},
+        }
+        for agent in Agent.objects.all():
+            self.value_ids[TicketEvent.KIND_ASSIGNEE].setdefault(agent.username, agent.pk)
+            if agent.get_full_name(): self.value_ids[TicketEvent.KIND_ASSIGNEE].setdefault(agent.get_full_name(), agent.pk)
+
+        comments = Comment.objects.filter(is_internal=True, ticket_event__isnull=True).order_by('pk')
+
+        batch_size = options['batch_size']; last_pk = 0
+        total_comments = 0; total_events = 0; legacy = 0
+        while True:
+            batch = list(comments.filter(pk__gt=last_pk).select_related('author_agent')[:batch_size])
+            if not batch: break
+            last_pk = batch[-1].pk
+            events = []
+            for comment in batch:
+                if not any(phrase in comment.body for phrase in LEGACY_LOG_PHRASES): continue
+                comment_events = self.parse_comment(comment)
+                total_comments += 1; total_events += len(comment_events)
+                legacy += sum(1 for e in comment_events if e.kind == TicketEvent.KIND_LEGACY)
+                events.extend(comment_events)
+            if events and not options['dry_run']:
+                with transaction.atomic(): TicketEvent.objects.bulk_create(events)
+            self.stdout.write(f"  обработано до комментария pk={last_pk}: событий {total_events}")
+
+        prefix = "[dry-run] " if options['dry_run'] else ""
+        self.stdout.write(self.style.SUCCESS(
+            f"{prefix}Комментариев перенесено: {total_comments}, событий создано: {total_events} (без разбора, как запись журнала: {legacy})."
+        ))
+
+    def _event(self, comment, kind, old_name=None, new_name=None, note='', link=True):
+        old_name = None if old_name in EMPTY_VALUE_NAMES else old_name
+        new_name = None if new_name in EMPTY_VALUE_NAMES else new_name
+        ids = self.value_ids.get(kind, {})
+        return TicketEvent(
+            ticket_id=comment.ticket_id, kind=kind,
+            old_value_id=ids.get(old_name) if old_name else None, old_value_display=(old_name or '')[:255],
+            new_value_id=ids.get(new_name) if new_name else None, new_value_display=(new_name or '')[:255],
+            actor=comment.author_agent, actor_name=comment.author_name_display[:255], note=(note or '').strip(),
+            source_comment=comment if link else None, created_at=comment.created_at,
+        )
+
+    def parse_comment(self, comment):
+        body = comment.body.strip()
+        author_name = (comment.author_agent.get_full_name() or comment.author_agent.username) if comment.author_agent else None
+        match = TAKEN_RE.match(body)
+        if match:
+            return [
+                self._event(comment, TicketEvent.KIND_STATUS, match['old'], match['new']),
+                self._event(comment, TicketEvent.KIND_ASSIGNEE, None, author_name, note="Агент взял заявку в работу.", link=False),
+            ]
+        match = TAKEN_NO_STATUS_RE.match(body)
+        if match: return [self._event(comment, TicketEvent.KIND_ASSIGNEE, None, author_name, note=f"Агент взял заявку в работу. {match['note']}")]
+        for pattern, kind in ((STATUS_CHANGED_RE, TicketEvent.KIND_STATUS), (CLOSED_RE, TicketEvent.KIND_STATUS),
+                              (PRIORITY_RE, TicketEvent.KIND_PRIORITY), (ASSIGNEE_RE, TicketEvent.KIND_ASSIGNEE), (PROJECT_RE, TicketEvent.KIND_PROJECT)):
+            match = pattern.match(body)
+            if match: return [self._event(comment, kind, match['old'], match['new'], note=match.groupdict().get('note') or '')]
+        return [self._event(comment, TicketEvent.KIND_LEGACY, note=body)]
@@ -0,0 +1,136 @@
+# tickets/management/commands/benchmark_queries.py
+# Замер типовых запросов агентских страниц и страницы проверки статуса - с индексами из
+# Ticket.Meta.indexes / Comment.Meta.indexes и без них - на сгенерированном наборе данных.
+#   python manage.py benchmark_queries --tickets 50000 --comments 3
+# Все выполняется в одной транзакции, которая в конце откатывается: тестовые тикеты и временное
+# удаление индексов в базе не остаются (DDL в PostgreSQL и SQLite транзакционный). Но до отката транзакция
+# держит DROP INDEX - исключительную блокировку таблиц тикетов и комментариев: на рабочей базе это остановит
+# систему на все время замера. Поэтому, как seed_helpdesk, команда без --force работает только при DEBUG=True.
+# Для каждого запроса печатаются медиана времени и план (EXPLAIN ANALYZE в PostgreSQL, EXPLAIN QUERY PLAN в SQLite).
+# Функциональный индекс UPPER(ticket_id_display) работает только в PostgreSQL: SQLite выполняет __iexact через LIKE.
+import random
+import statistics
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+
+from tickets.models import Agent, Comment, Project, Ticket, TicketPriority, TicketStatus
+
+BENCH_PREFIX = 'BENCH-'
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = "Сравнивает планы и время типовых запросов к тикетам с новыми индексами и без них (данные откатываются)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tickets', type=int, default=20000, help="Сколько тикетов сгенерировать.")
+        parser.add_argument('--comments', type=int, default=3, help="Комментариев на тикет.")
+        parser.add_argument('--repeat', type=int, default=20, help="Повторов каждого запроса.")
+        parser.add_argument('--plans', action='store_true', help="Печатать планы запросов.")
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--force', action='store_true', help="Разрешить запуск при DEBUG=False.")
+
+    def handle(self, *args, **options):
+        if not settings.DEBUG and not options['force']:
+            raise CommandError("Похоже на рабочую базу (DEBUG=False). Для запуска добавьте --force.")
+        self.options = options
+        self.random = random.Random(options['seed'])
+        projects = list(Project.objects.filter(is_active=True))
+        statuses = list(TicketStatus.objects.all())
+        if not projects or not statuses: raise CommandError("Нужны хотя бы один активный проект и статусы тикетов.")
+        try:
+            with transaction.atomic():
+                self.generate(projects, statuses)
+                after = self.measure("С индексами")
+                self.drop_indexes()
+                before = self.measure("Без новых индексов")
+                self.report(before, after)
+                raise Rollback
+        except Rollback:
+            self.stdout.write("Тестовые данные и изменения индексов откачены.")
+
+    # --- Данные ---
+    def generate(self, projects, statuses):
+        count = self.options['tickets']
+        agents = list(Agent.objects.filter(is_active=True).values_list('pk', flat=True)) or [None]
+        priority = TicketPriority.objects.first()
+        now = timezone.now(); started = time.perf_counter()
+        tickets = []
+        for i in range(count):
+            tickets.append(Ticket(
+                title=f"Тестовая заявка {i}", description="Сгенерировано benchmark_queries",
+                reporter_name="Тест", reporter_email=f"user{i % 5000}@example.com",
+                ticket_id_display=f"{BENCH_PREFIX}{i:07d}", project=self.random.choice(projects),
+                status=self.random.choice(statuses), priority=priority,
+                assignee_id=self.random.choice(agents) if self.random.random() < 0.7 else None, custom_form_data={},
+            ))
+        Ticket.objects.bulk_create(tickets, batch_size=2000)
+        # created_at с auto_now_add - разносим по последнему году, как в живой базе
+        for ticket in tickets: ticket.created_at = now - timedelta(minutes=self.random.randint(0, 525600))
+        Ticket.objects.bulk_update(tickets, ['created_at'], batch_size=2000)
+        comments = [
+            Comment(ticket=ticket, body="Комментарий", is_internal=self.random.random() < 0.3, author_name_display="Тест")
+            for ticket in tickets for _ in range(self.options['comments'])
+        ]
+        Comment.objects.bulk_create(comments, batch_size=5000)
+        self.analyze()
+        self.sample_ticket = tickets[len(tickets) // 2]
+        self.sample_project_ids = [projects[0].pk]
+        self.sample_agent_id = next((a for a in agents if a), None)
+        self.stdout.write(f"Сгенерировано тикетов: {count}, комментариев: {len(comments)} за {time.perf_counter() - started:.1f} с")
+
+    def analyze(self):
+        with connection.cursor() as cursor: cursor.execute("ANALYZE")
+
+    def drop_indexes(self):
+        # DROP INDEX напрямую: schema_editor SQLite нельзя открыть внутри transaction.atomic()
+        with connection.cursor() as cursor:
+            for model in (Ticket, Comment):
+                for index in model._meta.indexes: cursor.execute(f"DROP INDEX {connection.ops.quote_name(index.name)}")
+        self.analyze()
+
+    # --- Запросы (те же формы, что в представлениях) ---
+    def queries(self):
+        ticket = self.sample_ticket; project_ids = self.sample_project_ids
+        since = timezone.now() - timedelta(minutes=5)
+        new_status = TicketStatus.objects.filter(code='new').first()
+        queries = [
+            ("Список агента: открытые проекта", Ticket.objects.filter(project_id__in=project_ids, status__is_closed_status=False).order_by('-created_at', '-id')[:25]),
+            ("Опрос: новые после pk", Ticket.objects.filter(project_id__in=project_ids, pk__gt=ticket.pk).order_by('-created_at')[:5]),
+            ("Опрос: новые после времени", Ticket.objects.filter(project_id__in=project_ids, created_at__gt=since).order_by('-created_at')[:5]),
+            ("Проверка статуса: номер + email", Ticket.objects.filter(ticket_id_display__iexact=ticket.ticket_id_display.lower(), reporter_email__iexact=ticket.reporter_email.upper())),
+            ("Лента: публичные комментарии", Comment.objects.filter(ticket=ticket, is_internal=False).order_by('created_at')),
+        ]
+        if new_status: queries.insert(1, ("Список агента: только новые", Ticket.objects.filter(project_id__in=project_ids, status=new_status).order_by('-created_at', '-id')[:25]))
+        if self.sample_agent_id: queries.append(("Мои заявки: открытые", Ticket.objects.filter(assignee_id=self.sample_agent_id, status__is_closed_status=False).order_by('-created_at', '-id')[:25]))
+        return queries
+
+    def measure(self, label):
+        results = {}
+        self.stdout.write(self.style.MIGRATE_HEADING(f"== {label} =="))
+        for name, queryset in self.queries():
+            list(queryset) # прогрев
+            timings = []
+            for _ in range(self.options['repeat']):
+                started = time.perf_counter(); list(queryset._chain()); timings.append((time.perf_counter() - started) * 1000)
+            results[name] = statistics.median(timings)
+            self.stdout.write(f"  {name}: {results[name]:.2f} мс")
+            if self.options['plans']:
+                plan = queryset.explain(analyze=True) if connection.vendor == 'postgresql' else queryset.explain()
+                for line in plan.splitlines(): self.stdout.write(f"      {line}")
+        return results
+
+    def report(self, before, after):
+        self.stdout.write(self.style.MIGRATE_HEADING("== Итог (медиана, мс) =="))
+        self.stdout.write(f"  {'Запрос':<36} {'без':>9} {'с индексами':>12} {'ускорение':>10}")
+        for name in after:
+            speedup = before[name] / after[name] if after[name] else 0
+            self.stdout.write(f"  {name:<36} {before[name]:>9.2f} {after[name]:>12.2f} {speedup:>9.1f}x")
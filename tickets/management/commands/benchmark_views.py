@@ -0,0 +1,182 @@
+# tickets/management/commands/benchmark_views.py
+# Нагрузочный замер горячих представлений через тестовый клиент Django (полный стек: middleware,
+# сессии, шаблоны). Для каждого сценария печатаются p50/p95/p99/max времени ответа, число SQL-запросов
+# и память, выделенная за запрос (пик по tracemalloc, отдельным проходом - трассировка замедляет ответы).
+#   python manage.py seed_helpdesk --tickets 200000
+#   python manage.py benchmark_views --requests 200 --json before.json
+# Созданные сценарием create_ticket тикеты удаляются после замера (--keep - оставить).
+# С --enforce-budgets команда завершается ошибкой, если представление превысило бюджет SQL-запросов
+# (settings.QUERY_BUDGETS, tickets/instrumentation.py) - для проверки в CI.
+import json
+import random
+import statistics
+import time
+import tracemalloc
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import resolve, reverse
+
+from tickets.dynamic_forms import get_ticket_create_form_class
+from tickets.instrumentation import query_budget
+from tickets.models import Agent, TicketCategory, Ticket
+from tickets.scope import get_agent_scope
+from tickets.search import tokenize
+from tickets.seeding import SEED_PREFIX, sample_form_data
+
+SAMPLE_TICKETS = 2000 # сколько тикетов берется для случайного выбора в сценариях
+
+
+def percentile(sorted_values, p):
+    """Перцентиль по методу ближайшего ранга."""
+    if not sorted_values: return 0.0
+    rank = max(int(round(p / 100.0 * len(sorted_values) + 0.5)) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+
+class Command(BaseCommand):
+    help = "Замеряет время ответа, число запросов и память горячих представлений (список, карточка, проверка статуса, создание, API новых тикетов)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=100, help="Запросов на сценарий.")
+        parser.add_argument('--warmup', type=int, default=5, help="Запросов прогрева на сценарий (не учитываются).")
+        parser.add_argument('--alloc-samples', type=int, default=10, help="Запросов на сценарий для замера памяти (0 - не замерять).")
+        parser.add_argument('--agent', help="Логин сотрудника, от имени которого идут агентские запросы.")
+        parser.add_argument('--scenarios', help="Через запятую: только эти сценарии.")
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--json', dest='json_path', help="Сохранить результаты в JSON (для сравнения до/после).")
+        parser.add_argument('--keep', action='store_true', help="Не удалять тикеты, созданные сценарием create_ticket.")
+        parser.add_argument('--enforce-budgets', action='store_true', help="Ошибка, если число SQL-запросов превысило QUERY_BUDGETS.")
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options['seed'])
+        self.created_ticket_ids = []
+        agent = self.get_agent(options['agent'])
+        self.prepare_samples(agent)
+        host = next((h.lstrip('.') for h in settings.ALLOWED_HOSTS if h != '*'), 'localhost')
+        self.public_client = Client(HTTP_HOST=host)
+        self.agent_client = Client(HTTP_HOST=host); self.agent_client.force_login(agent)
+
+        scenarios = self.scenarios()
+        if options['scenarios']:
+            wanted = {name.strip() for name in options['scenarios'].split(',')}
+            unknown = wanted - {name for name, *_ in scenarios}
+            if unknown: raise CommandError(f"Неизвестные сценарии: {', '.join(sorted(unknown))}. Доступны: {', '.join(name for name, *_ in scenarios)}")
+            scenarios = [s for s in scenarios if s[0] in wanted]
+
+        self.stdout.write(f"Сотрудник: {agent.username}, тикетов для выборки: {len(self.sample_tickets)}, БД: {connection.vendor}")
+        results = []
+        try:
+            for name, make_request, expected_status in scenarios:
+                results.append(self.run_scenario(name, make_request, expected_status, options))
+        finally:
+            if self.created_ticket_ids and not options['keep']: Ticket.objects.filter(pk__in=self.created_ticket_ids).delete()
+        self.report(results)
+        if options['json_path']:
+            with open(options['json_path'], 'w', encoding='utf-8') as f: json.dump(results, f, ensure_ascii=False, indent=2)
+            self.stdout.write(f"Результаты сохранены в {options['json_path']}")
+        over_budget = [r['scenario'] for r in results if r['over_budget']]
+        if over_budget and options['enforce_budgets']: raise CommandError(f"Превышен бюджет SQL-запросов: {', '.join(over_budget)}.")
+
+    # --- Подготовка ---
+    def get_agent(self, username):
+        if username:
+            try: return Agent.objects.get(username=username)
+            except Agent.DoesNotExist: raise CommandError(f"Сотрудник '{username}' не найден.")
+        agents = Agent.objects.filter(is_active=True, is_staff=True)
+        agent = agents.filter(username__startswith=f"{SEED_PREFIX}-agent-", agent_role='project_manager').first() or agents.filter(is_superuser=False).first() or agents.first()
+        if agent is None: raise CommandError("Нет ни одного активного сотрудника. Запустите seed_helpdesk или укажите --agent.")
+        return agent
+
+    def prepare_samples(self, agent):
+        scope = get_agent_scope(agent)
+        visible = scope.filter_tickets(Ticket.objects.all())
+        fields = ('pk', 'ticket_id_display', 'reporter_email', 'title')
+        # Свежие и старые тикеты: у свежих больше шансов попасть в кэши, у старых - нет
+        self.sample_tickets = list(visible.order_by('-pk').values_list(*fields)[:SAMPLE_TICKETS // 2]) + list(visible.order_by('pk').values_list(*fields)[:SAMPLE_TICKETS // 2])
+        if not self.sample_tickets: raise CommandError(f"У сотрудника {agent.username} нет доступных тикетов. Запустите seed_helpdesk.")
+        self.search_words = [word for *_, title in self.sample_tickets[:200] for word in tokenize(title)] or ['принтер']
+        self.latest_ticket_id = max(pk for pk, *_ in self.sample_tickets)
+        self.categories = []
+        for category in TicketCategory.objects.filter(is_active=True, project__is_active=True).select_related('project')[:50]:
+            form_class = get_ticket_create_form_class(category)
+            if not any(form_class.base_fields[name].required for name in form_class.file_field_names): self.categories.append((category, form_class))
+
+    # --- Сценарии: (имя, функция запроса, ожидаемый код ответа) ---
+    def scenarios(self):
+        scenarios = [
+            ('ticket_list', lambda: self.agent_client.get(reverse('tickets:agent_ticket_list')), 200),
+            ('ticket_list_search', lambda: self.agent_client.get(reverse('tickets:agent_ticket_list'), {'search_query': self.rng.choice(self.search_words), 'show_active': 'on', 'show_completed': 'on'}), 200),
+            ('ticket_list_last_page', lambda: self.agent_client.get(reverse('tickets:agent_ticket_list'), {'last': '1'}), 200),
+            ('ticket_detail', lambda: self.agent_client.get(reverse('tickets:agent_ticket_detail', args=[self.rng.choice(self.sample_tickets)[0]])), 200),
+            ('check_status', self.request_check_status, 200),
+            ('check_new_tickets', lambda: self.agent_client.get(reverse('tickets:agent_check_new_tickets_api'), {'since_id': self.latest_ticket_id - self.rng.randint(0, 50)}), 200),
+        ]
+        if self.categories:
+            scenarios.append(('create_ticket_form', lambda: self.public_client.get(reverse('tickets:create_ticket_for_category', args=[self.rng.choice(self.categories)[0].pk])), 200))
+            scenarios.append(('create_ticket_submit', self.request_create_ticket, 302))
+        return scenarios
+
+    def request_check_status(self):
+        _, ticket_id_display, reporter_email, _ = self.rng.choice(self.sample_tickets)
+        return self.public_client.get(reverse('tickets:check_ticket_status'), {'ticket_number': ticket_id_display, 'reporter_email': reporter_email})
+
+    def request_create_ticket(self):
+        category, form_class = self.rng.choice(self.categories)
+        response = self.public_client.post(reverse('tickets:create_ticket_for_category', args=[category.pk]), sample_form_data(form_class, self.rng))
+        if response.status_code == 302:
+            match = resolve(response.url)
+            if match.url_name == 'ticket_creation_success': self.created_ticket_ids.append(match.kwargs['ticket_pk'])
+        return response
+
+    # --- Замер ---
+    def run_scenario(self, name, make_request, expected_status, options):
+        for _ in range(options['warmup']): self._consume(make_request())
+        timings = []; query_counts = []; errors = 0; view_name = None
+        for _ in range(options['requests']):
+            with CaptureQueriesContext(connection) as queries:
+                started = time.perf_counter()
+                response = make_request(); self._consume(response)
+                timings.append((time.perf_counter() - started) * 1000)
+            query_counts.append(len(queries))
+            if response.status_code != expected_status: errors += 1
+            if response.resolver_match: view_name = response.resolver_match.view_name
+        peaks = []
+        if options['alloc_samples']:
+            tracemalloc.start()
+            try:
+                for _ in range(options['alloc_samples']):
+                    tracemalloc.reset_peak(); baseline = tracemalloc.get_traced_memory()[0]
+                    self._consume(make_request())
+                    peaks.append((tracemalloc.get_traced_memory()[1] - baseline) / 1024)
+            finally:
+                tracemalloc.stop()
+        timings.sort()
+        result = {
+            'scenario': name, 'requests': len(timings), 'errors': errors,
+            'p50_ms': percentile(timings, 50), 'p95_ms': percentile(timings, 95), 'p99_ms': percentile(timings, 99), 'max_ms': timings[-1] if timings else 0,
+            'queries_avg': statistics.fmean(query_counts) if query_counts else 0, 'queries_max': max(query_counts, default=0),
+            'alloc_peak_kib': statistics.median(peaks) if peaks else None,
+            'view': view_name, 'query_budget': query_budget(view_name) if view_name else None,
+        }
+        result['over_budget'] = result['query_budget'] is not None and result['queries_max'] > result['query_budget']
+        self.stdout.write(f"  {name}: p50 {result['p50_ms']:.1f} мс, запросов {result['queries_avg']:.1f}" + (f", ошибок {errors}" if errors else ""))
+        return result
+
+    def _consume(self, response):
+        if getattr(response, 'streaming', False):
+            for _ in response.streaming_content: pass
+        return response
+
+    def report(self, results):
+        self.stdout.write(self.style.MIGRATE_HEADING("== Итог (время в мс, память - медиана пика за запрос) =="))
+        self.stdout.write(f"  {'Сценарий':<24} {'n':>5} {'p50':>8} {'p95':>8} {'p99':>8} {'max':>8} {'SQL ср.':>8} {'SQL max':>8} {'бюджет':>7} {'КиБ':>9} {'ошибки':>7}")
+        for r in results:
+            alloc = f"{r['alloc_peak_kib']:.0f}" if r['alloc_peak_kib'] is not None else '-'
+            budget = str(r['query_budget']) if r['query_budget'] is not None else '-'
+            line = (f"  {r['scenario']:<24} {r['requests']:>5} {r['p50_ms']:>8.1f} {r['p95_ms']:>8.1f} {r['p99_ms']:>8.1f} {r['max_ms']:>8.1f} "
+                    f"{r['queries_avg']:>8.1f} {r['queries_max']:>8} {budget:>7} {alloc:>9} {r['errors']:>7}")
+            self.stdout.write(self.style.ERROR(line) if r['errors'] or r['over_budget'] else line)
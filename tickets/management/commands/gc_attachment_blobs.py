@@ -0,0 +1,39 @@
+# tickets/management/commands/gc_attachment_blobs.py
+# Удаление содержимого вложений, на которое больше не ссылается ни одно вложение.
+# Запускать по расписанию (например, раз в сутки):  python manage.py gc_attachment_blobs
+# --recount пересчитывает ref_count по фактическим вложениям (после удалений в обход сигналов),
+# --orphans удаляет файлы в каталоге блобов без строки AttachmentBlob (остатки прерванных загрузок).
+import os
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from tickets.blobstore import attachment_storage, collect_garbage, orphan_blob_files, recount_blob_references
+
+
+class Command(BaseCommand):
+    help = "Удаляет блобы вложений без ссылок (ref_count = 0) старше периода ожидания."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--grace-hours', type=float, default=24, help="Сколько часов блоб без ссылок хранится до удаления.")
+        parser.add_argument('--recount', action='store_true', help="Сначала пересчитать ref_count по вложениям.")
+        parser.add_argument('--orphans', action='store_true', help="Удалить файлы блобов без записи в БД.")
+        parser.add_argument('--dry-run', action='store_true')
+
+    def handle(self, *args, **options):
+        grace = timedelta(hours=options['grace_hours'])
+        prefix = "[dry-run] " if options['dry_run'] else ""
+        if options['recount'] and not options['dry_run']:
+            self.stdout.write(f"Исправлено счетчиков ссылок: {recount_blob_references()}")
+
+        removed, freed = collect_garbage(grace=grace, dry_run=options['dry_run'])
+        self.stdout.write(self.style.SUCCESS(f"{prefix}Удалено блобов: {removed}, освобождено: {freed} байт."))
+
+        if options['orphans']:
+            storage = attachment_storage(); cutoff = time.time() - grace.total_seconds(); orphans = 0
+            for name in orphan_blob_files():
+                if os.path.getmtime(storage.path(name)) > cutoff: continue # загрузка может быть еще не закоммичена
+                orphans += 1
+                if not options['dry_run']: storage.delete(name)
+            self.stdout.write(self.style.SUCCESS(f"{prefix}Удалено файлов без записи в БД: {orphans}."))
@@ -0,0 +1,27 @@
+# tickets/management/commands/generate_attachment_previews.py
+# Создание превью для уже загруженных изображений (после включения Pillow или очистки кэша превью).
+# Превью новых вложений создаются в фоне автоматически; команда работает синхронно, по одному файлу.
+from django.core.management.base import BaseCommand, CommandError
+
+from tickets.models import Attachment
+from tickets.previews import is_previewable, pillow_available, preview_pipeline
+
+
+class Command(BaseCommand):
+    help = "Создает недостающие миниатюры и превью для вложений-изображений."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ticket', type=int, action='append', help="Только вложения тикета с этим pk (можно несколько раз).")
+
+    def handle(self, *args, **options):
+        if not pillow_available(): raise CommandError("Для превью нужен пакет Pillow (pip install Pillow).")
+        attachments = Attachment.objects.select_related('blob').exclude(file='').order_by('pk')
+        if options['ticket']: attachments = attachments.filter(ticket_id__in=options['ticket'])
+        checked = 0; created = 0
+        for attachment in attachments.iterator(chunk_size=500):
+            if not is_previewable(attachment): continue
+            checked += 1; created += preview_pipeline.generate_now(attachment)
+        stats = preview_pipeline.stats()
+        self.stdout.write(self.style.SUCCESS(
+            f"Изображений проверено: {checked}, превью создано: {created}, ошибок: {stats['failures']}, вытеснено из кэша: {stats['evictions']}."
+        ))
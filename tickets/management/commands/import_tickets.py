@@ -0,0 +1,53 @@
+# tickets/management/commands/import_tickets.py
+# Массовый импорт тикетов из старого трекера (JSONL или CSV), формат строк - см. tickets/importer.py.
+#   python manage.py import_tickets legacy.jsonl --errors rejected.jsonl
+#   python manage.py import_tickets legacy.csv --format csv --batch-size 2000 --strict
+# Прогресс хранится в ImportCheckpoint (по --run-name, по умолчанию - имя файла): повторный запуск
+# после сбоя продолжает с первой незагруженной строки, --restart начинает заново.
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from tickets.importer import DEFAULT_BATCH_SIZE, ImportRowError, TicketImporter, iter_source_rows
+
+
+class Command(BaseCommand):
+    help = "Импортирует тикеты (с комментариями) пакетами из JSONL или CSV."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="Файл источника.")
+        parser.add_argument('--format', choices=('jsonl', 'csv'), help="По умолчанию - по расширению файла.")
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+        parser.add_argument('--run-name', help="Имя загрузки для контрольной точки (по умолчанию - имя файла).")
+        parser.add_argument('--errors', help="Файл для отклоненных строк (JSONL).")
+        parser.add_argument('--strict', action='store_true', help="Остановиться на первой ошибочной строке.")
+        parser.add_argument('--restart', action='store_true', help="Сбросить контрольную точку и загрузить файл заново.")
+
+    def handle(self, *args, **options):
+        path = options['path']
+        if not os.path.exists(path): raise CommandError(f"Файл '{path}' не найден.")
+        if options['batch_size'] < 1: raise CommandError("--batch-size должен быть больше нуля.")
+        source_format = options['format'] or ('csv' if path.lower().endswith('.csv') else 'jsonl')
+        run_name = options['run_name'] or os.path.basename(path)
+
+        started_at = time.perf_counter()
+        def progress(checkpoint, batch_rows):
+            elapsed = time.perf_counter() - started_at
+            self.stdout.write(f"  строк: {checkpoint.rows_processed}, тикетов: {checkpoint.tickets_created}, отклонено: {checkpoint.rows_rejected}, {importer.rows_read / elapsed:.0f} строк/с")
+
+        error_log = open(options['errors'], 'a', encoding='utf-8') if options['errors'] else None
+        try:
+            importer = TicketImporter(run_name, batch_size=options['batch_size'], strict=options['strict'], error_log=error_log, progress=progress)
+            checkpoint = importer.run(iter_source_rows(path, source_format), restart=options['restart'])
+        except ImportRowError as e:
+            raise CommandError(f"{e} Загруженные пакеты сохранены, повторный запуск продолжит с первой незагруженной строки.")
+        finally:
+            if error_log is not None: error_log.close()
+
+        elapsed = time.perf_counter() - started_at
+        rate = importer.rows_read / elapsed if elapsed else 0
+        self.stdout.write(self.style.SUCCESS(
+            f"Импорт '{run_name}' завершен: строк {checkpoint.rows_processed}, создано тикетов {checkpoint.tickets_created}, "
+            f"отклонено {checkpoint.rows_rejected} за {elapsed:.1f} с (~{rate:.0f} строк/с)."
+        ))
@@ -0,0 +1,55 @@
+# tickets/management/commands/migrate_attachment_blobs.py
+# Перенос существующих вложений (media/ticket_attachments/<год>/<месяц>/<проект>/<тикет>/...) в хранилище
+# блобов: файл хэшируется потоком, одинаковые файлы сводятся к одному блобу, вложение получает
+# original_name и ссылку на блоб. Старый файл удаляется только с --delete-old и только после коммита.
+# Повторный запуск безопасен: перенесенные вложения (blob заполнен) пропускаются.
+import os
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from tickets.blobstore import acquire_blob, attachment_storage
+from tickets.models import Attachment
+
+
+class Command(BaseCommand):
+    help = "Переносит существующие файлы вложений в хранилище блобов с дедупликацией по SHA-256."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=200)
+        parser.add_argument('--delete-old', action='store_true', help="Удалять старые файлы после переноса.")
+        parser.add_argument('--dry-run', action='store_true', help="Только посчитать вложения для переноса.")
+
+    def handle(self, *args, **options):
+        storage = attachment_storage()
+        pending = Attachment.objects.filter(blob__isnull=True).exclude(file='').order_by('pk')
+        if options['dry_run']:
+            self.stdout.write(f"[dry-run] Вложений для переноса: {pending.count()}"); return
+
+        moved = 0; missing = 0; bytes_before = 0; blob_ids = set(); last_pk = 0
+        while True:
+            batch = list(pending.filter(pk__gt=last_pk)[:options['batch_size']])
+            if not batch: break
+            last_pk = batch[-1].pk
+            for attachment in batch:
+                old_name = attachment.file.name
+                if not storage.exists(old_name):
+                    missing += 1; self.stderr.write(f"  вложение #{attachment.pk}: файл '{old_name}' не найден"); continue
+                with storage.open(old_name, 'rb') as content:
+                    new_name = storage.save(old_name, content)
+                size = storage.size(new_name); bytes_before += size
+                with transaction.atomic():
+                    attachment.file.name = new_name
+                    attachment.original_name = attachment.original_name or os.path.basename(old_name)[:255]
+                    attachment.blob = acquire_blob(new_name, size)
+                    # update() вместо save(): файл уже записан, модельный save() записал бы его повторно
+                    Attachment.objects.filter(pk=attachment.pk).update(file=new_name, original_name=attachment.original_name, blob=attachment.blob)
+                    if options['delete_old'] and old_name != new_name:
+                        transaction.on_commit(lambda name=old_name: storage.delete(name))
+                blob_ids.add(attachment.blob_id); moved += 1
+            self.stdout.write(f"  перенесено: {moved} (до вложения pk={last_pk})")
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Перенесено вложений: {moved}, уникальных блобов: {len(blob_ids)}, "
+            f"объем до дедупликации: {bytes_before} байт, файлов не найдено: {missing}."
+        ))
@@ -0,0 +1,67 @@
+# tickets/management/commands/rebuild_duplicate_index.py
+# Пересчет MinHash-подписей тикетов для поиска дубликатов (tickets/duplicates.py).
+# Нужен после первого развертывания (подписи есть только у заявок, созданных через форму),
+# после импорта и массовых изменений в обход формы создания. Объединенные дубликаты не индексируются.
+#   python manage.py rebuild_duplicate_index --batch-size 1000
+#   python manage.py rebuild_duplicate_index --project 3 --detect
+# С --detect для заявок окна DUPLICATE_WINDOW_DAYS дополнительно ищутся похожие более ранние заявки
+# (TicketDuplicateCandidate) - так появляются отметки и для уже накопленных дублей.
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from tickets.duplicates import ProjectDuplicateIndex, duplicate_index, index_fingerprints, signature_from_bytes
+from tickets.models import Project, Ticket, TicketDuplicateCandidate, TicketFingerprint
+
+
+class Command(BaseCommand):
+    help = "Пересчитывает подписи тикетов для поиска дубликатов пакетами; с --detect отмечает найденные дубликаты."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--project', type=int, help="Только тикеты проекта с указанным ID.")
+        parser.add_argument('--since-id', type=int, default=0, help="Только тикеты с pk больше указанного.")
+        parser.add_argument('--detect', action='store_true', help="После индексации отметить похожие заявки внутри окна поиска.")
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        if batch_size < 1: raise CommandError("--batch-size должен быть положительным.")
+        tickets = Ticket.objects.filter(pk__gt=options['since_id'], duplicate_of__isnull=True)
+        if options['project']:
+            if not Project.objects.filter(pk=options['project']).exists(): raise CommandError(f"Проект с ID {options['project']} не найден.")
+            tickets = tickets.filter(project_id=options['project'])
+        fields = ('pk', 'project_id', 'created_at', 'title', 'description', 'reporter_email', 'reporter_room')
+        started_at = time.perf_counter(); total = 0; batch = []
+        for ticket in tickets.order_by('pk').only(*fields).iterator(chunk_size=batch_size):
+            batch.append(ticket)
+            if len(batch) >= batch_size:
+                total += index_fingerprints(batch); batch = []
+                self.stdout.write(f"  подписей: {total} (последний pk {ticket.pk})")
+        if batch: total += index_fingerprints(batch)
+        # Новая версия в БД: работающие процессы (в течение CACHE_VERSION_CHECK_INTERVAL) перечитают окно
+        # подписей целиком, включая пересчитанные подписи старых заявок - дочитывание по ticket_id их бы пропустило
+        duplicate_index.invalidate()
+        self.stdout.write(self.style.SUCCESS(f"Подписи пересчитаны: {total} тикетов за {time.perf_counter() - started_at:.1f} с."))
+        if options['detect']: self.detect(options, batch_size)
+
+    def detect(self, options, batch_size):
+        # Индексы проектов строятся здесь же по возрастанию pk: заявка сравнивается только с более ранними
+        # (пара отмечается один раз), и на каждую заявку не нужен запрос к БД; с --since-id более ранние заявки
+        # окна тоже загружаются, но отметки ищутся только для новых
+        fingerprints = TicketFingerprint.objects.filter(created_at__gte=timezone.now() - duplicate_index.window)
+        if options['project']: fingerprints = fingerprints.filter(project_id=options['project'])
+        started_at = time.perf_counter(); indexes = {}; threshold = duplicate_index.threshold
+        checked = 0; found = 0; pairs = []
+        rows = fingerprints.order_by('ticket_id').values_list('ticket_id', 'project_id', 'created_at', 'signature')
+        for ticket_id, project_id, created_at, data in rows.iterator(chunk_size=batch_size):
+            signature = signature_from_bytes(data)
+            if signature is None: continue
+            index = indexes.setdefault(project_id, ProjectDuplicateIndex())
+            if ticket_id > options['since_id']:
+                checked += 1
+                pairs.extend(TicketDuplicateCandidate(ticket_id=ticket_id, candidate_id=candidate_id, similarity=similarity) for similarity, candidate_id in index.matches(signature, threshold))
+            index.add(ticket_id, created_at, signature)
+            if len(pairs) >= batch_size: found += len(pairs); TicketDuplicateCandidate.objects.bulk_create(pairs, ignore_conflicts=True); pairs = []
+        if pairs: found += len(pairs); TicketDuplicateCandidate.objects.bulk_create(pairs, ignore_conflicts=True)
+        self.stdout.write(self.style.SUCCESS(f"Проверено заявок: {checked}, найдено пар: {found} за {time.perf_counter() - started_at:.1f} с."))
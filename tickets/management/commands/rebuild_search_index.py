@@ -0,0 +1,32 @@
+# tickets/management/commands/rebuild_search_index.py
+# Полная (или частичная) переиндексация тикетов для полнотекстового поиска.
+# Нужна после первого развертывания поиска и после массовых операций в обход save() (bulk_create, update).
+import time
+
+from django.core.management.base import BaseCommand
+
+from tickets.models import Ticket
+from tickets.search import index_tickets, uses_postgres_search
+
+
+class Command(BaseCommand):
+    help = "Пересобирает поисковые документы тикетов пакетами."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--since-id', type=int, default=0, help="Индексировать только тикеты с pk больше указанного.")
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        ticket_ids = Ticket.objects.filter(pk__gt=options['since_id']).order_by('pk').values_list('pk', flat=True)
+        backend = "PostgreSQL tsvector" if uses_postgres_search() else "инвертированный индекс"
+        self.stdout.write(f"Индексация ({backend})...")
+        started_at = time.perf_counter(); total = 0; batch = []
+        for ticket_id in ticket_ids.iterator(chunk_size=batch_size):
+            batch.append(ticket_id)
+            if len(batch) >= batch_size:
+                total += index_tickets(batch); batch = []
+                self.stdout.write(f"  проиндексировано: {total} (последний pk {ticket_id})")
+        if batch: total += index_tickets(batch)
+        elapsed = time.perf_counter() - started_at
+        self.stdout.write(self.style.SUCCESS(f"Готово: {total} тикетов за {elapsed:.1f} с."))
@@ -0,0 +1,47 @@
+# tickets/management/commands/recompute_ticket_sla.py
+# Пересчет сроков SLA у существующих тикетов: после первого развертывания SLA, изменения политик или календарей.
+#   python manage.py recompute_ticket_sla            # открытые тикеты без политики или со сменившейся политикой
+#   python manage.py recompute_ticket_sla --reset    # сроки открытых тикетов заново по текущим политикам
+# Тикеты читаются пакетами по pk и пишутся bulk_update (без сигналов); updated_at обновляется,
+# поэтому работающий run_sla_scheduler подхватывает новые сроки при следующем опросе.
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from tickets.models import Ticket
+from tickets.sla import SLA_UPDATE_FIELDS, update_ticket_sla
+
+LOAD_FIELDS = (
+    'pk', 'project_id', 'priority_id', 'created_at', 'resolved_at', 'closed_at', 'first_responded_at',
+    'sla_policy_id', 'first_response_due_at', 'resolution_due_at', 'sla_due_at', 'sla_warn_at', 'sla_state',
+)
+
+
+class Command(BaseCommand):
+    help = "Пересчитывает сроки и состояние SLA тикетов (Ticket.sla_*)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true', help="Считать сроки заново даже при той же политике.")
+        parser.add_argument('--all', action='store_true', help="Включая закрытые тикеты (по умолчанию только открытые).")
+        parser.add_argument('--project', type=int, help="Только тикеты проекта с этим pk.")
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--dry-run', action='store_true', help="Только посчитать, сколько тикетов изменится.")
+
+    def handle(self, *args, **options):
+        queryset = Ticket.objects.only(*LOAD_FIELDS).order_by('pk')
+        if not options['all']: queryset = queryset.filter(closed_at__isnull=True)
+        if options['project']: queryset = queryset.filter(project_id=options['project'])
+        started = time.perf_counter(); last_pk = 0; checked = 0; changed = 0
+        while True:
+            batch = list(queryset.filter(pk__gt=last_pk)[:options['batch_size']])
+            if not batch: break
+            last_pk = batch[-1].pk; checked += len(batch); now = timezone.now()
+            to_update = [ticket for ticket in batch if update_ticket_sla(ticket, now, reset=options['reset'])]
+            for ticket in to_update: ticket.updated_at = now
+            if to_update and not options['dry_run']:
+                with transaction.atomic(): Ticket.objects.bulk_update(to_update, sorted(SLA_UPDATE_FIELDS))
+            changed += len(to_update)
+        action = "Изменилось бы" if options['dry_run'] else "Обновлено"
+        self.stdout.write(self.style.SUCCESS(f"Проверено тикетов: {checked}. {action}: {changed} ({time.perf_counter() - started:.1f} с)."))
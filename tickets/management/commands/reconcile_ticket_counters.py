@@ -0,0 +1,47 @@
+# tickets/management/commands/reconcile_ticket_counters.py
+# Пересчет таблицы TicketCounter по фактическим данным тикетов.
+# Нужен после первого развертывания счетчиков, массовых операций в обход save() и при подозрении на расхождения.
+# Расходящиеся строки исправляются, недостающие создаются, строки без тикетов удаляются.
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from tickets.counters import COUNTER_FIELDS, compute_counters
+from tickets.models import TicketCounter
+
+
+class Command(BaseCommand):
+    help = "Сверяет счетчики тикетов (TicketCounter) с данными и исправляет расхождения."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help="Только показать расхождения.")
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            # Сначала блокировки строк счетчиков, потом подсчет: сохранение тикета, успевшее применить F()-дельту
+            # между ними, было бы затерто устаревшим значением. Теперь оно ждет блокировки и ляжет поверх исправления
+            existing = {(c.scope, c.object_id): c for c in TicketCounter.objects.select_for_update()}
+            expected = compute_counters()
+            to_create = []; to_update = []; to_delete = []
+            for key, values in expected.items():
+                counter = existing.get(key)
+                if counter is None:
+                    to_create.append(TicketCounter(scope=key[0], object_id=key[1], **values)); continue
+                drift = {field: (getattr(counter, field), value) for field, value in values.items() if getattr(counter, field) != value}
+                if drift:
+                    self.stdout.write(f"  {counter.get_scope_display()} #{key[1]}: " + ", ".join(f"{f} {old} -> {new}" for f, (old, new) in drift.items()))
+                    for field, value in values.items(): setattr(counter, field, value)
+                    counter.updated_at = timezone.now()
+                    to_update.append(counter)
+            for key, counter in existing.items():
+                if key not in expected: to_delete.append(counter.pk)
+
+            if not options['dry_run']:
+                TicketCounter.objects.bulk_create(to_create)
+                TicketCounter.objects.bulk_update(to_update, list(COUNTER_FIELDS) + ['updated_at'])
+                TicketCounter.objects.filter(pk__in=to_delete).delete()
+
+        prefix = "[dry-run] " if options['dry_run'] else ""
+        self.stdout.write(self.style.SUCCESS(
+            f"{prefix}Создано: {len(to_create)}, исправлено: {len(to_update)}, удалено: {len(to_delete)}."
+        ))
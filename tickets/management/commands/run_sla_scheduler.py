@@ -0,0 +1,48 @@
+# tickets/management/commands/run_sla_scheduler.py
+# Эскалации по срокам SLA: переводит тикеты в "под угрозой" и "нарушен", пишет историю (TicketEvent)
+# и ставит уведомления sla_at_risk / sla_breached в очередь (их отправляет send_notifications).
+# Постоянный процесс:    python manage.py run_sla_scheduler --loop
+# Разовый запуск (cron): python manage.py run_sla_scheduler
+# Процесс держит в памяти кучу ближайших сроков (tickets/sla.py, SLAScheduler) и между проходами только
+# дочитывает измененные тикеты и следующий участок горизонта - таблица целиком не просматривается.
+# Запускайте один процесс: повторная эскалация исключена блокировкой строки, но лишние проходы бесполезны.
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from tickets.sla import SLAScheduler
+
+
+class Command(BaseCommand):
+    help = "Отслеживает сроки SLA тикетов и запускает эскалации."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true', help="Работать постоянно.")
+        parser.add_argument('--interval', type=float, default=30.0, help="Секунд между опросами измененных тикетов.")
+        parser.add_argument('--horizon', type=int, default=60, help="На сколько минут вперед держать сроки в памяти.")
+        parser.add_argument('--batch-size', type=int, default=200)
+
+    def handle(self, *args, **options):
+        if options['interval'] <= 0 or options['horizon'] <= 0: raise CommandError("--interval и --horizon должны быть больше нуля.")
+        horizon = max(timedelta(minutes=options['horizon']), timedelta(seconds=options['interval'] * 2))
+        scheduler = SLAScheduler(horizon=horizon, poll_overlap=timedelta(seconds=max(options['interval'] * 2, 60)), batch_size=options['batch_size'])
+        scheduler.start(timezone.now())
+        self.stdout.write(f"Сроков в памяти: {len(scheduler.heap)} (горизонт до {timezone.localtime(scheduler.loaded_until):%d.%m.%Y %H:%M})")
+        refreshed_at = time.monotonic()
+        try:
+            while True:
+                fired = scheduler.fire_due(timezone.now())
+                if fired:
+                    stats = scheduler.stats()
+                    self.stdout.write(f"Эскалаций: {fired} (всего под угрозой: {stats['at_risk_fired']}, нарушено: {stats['breaches_fired']})")
+                if not options['loop']: break
+                # Спим до ближайшего срока в куче, но не дольше интервала опроса изменений
+                next_fire_at = scheduler.next_fire_at(); sleep_for = options['interval']
+                if next_fire_at is not None: sleep_for = min(sleep_for, max((next_fire_at - timezone.now()).total_seconds(), 0))
+                time.sleep(sleep_for)
+                if time.monotonic() - refreshed_at >= options['interval']:
+                    scheduler.refresh(timezone.now()); refreshed_at = time.monotonic()
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,54 @@
+# tickets/management/commands/seed_helpdesk.py
+# Наполнение базы сгенерированными данными для нагрузочных замеров (benchmark_views, benchmark_queries).
+#   python manage.py seed_helpdesk --projects 5 --categories 6 --agents 8 --tickets 1000000
+# Повторный запуск добавляет тикеты к уже созданным проектам/категориям/сотрудникам (они ищутся по имени).
+# Сгенерированные сотрудники создаются без пароля (вход невозможен); для ручной проверки задайте пароль в админке.
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from tickets.seeding import DEFAULT_BATCH_SIZE, HelpdeskSeeder
+
+
+class Command(BaseCommand):
+    help = "Генерирует проекты, категории с дополнительными полями, сотрудников и тикеты с комментариями и вложениями."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--projects', type=int, default=3)
+        parser.add_argument('--categories', type=int, default=5, help="Категорий на проект.")
+        parser.add_argument('--agents', type=int, default=5, help="Сотрудников на проект.")
+        parser.add_argument('--tickets', type=int, default=10000)
+        parser.add_argument('--comments', type=int, default=3, help="Среднее число комментариев на тикет.")
+        parser.add_argument('--attachments', type=float, default=0.2, help="Доля тикетов с вложением (0..1).")
+        parser.add_argument('--blobs', type=int, default=20, help="Сколько разных файлов используют вложения.")
+        parser.add_argument('--days', type=int, default=365, help="За сколько дней распределить даты создания.")
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+        parser.add_argument('--seed', type=int, default=1, help="Зерно генератора (одинаковое зерно - одинаковые данные).")
+        parser.add_argument('--skip-search-index', action='store_true', help="Не обновлять поисковый индекс (потом rebuild_search_index).")
+        parser.add_argument('--force', action='store_true', help="Разрешить запуск при DEBUG=False.")
+
+    def handle(self, *args, **options):
+        if not settings.DEBUG and not options['force']:
+            raise CommandError("Похоже на рабочую базу (DEBUG=False). Для запуска добавьте --force.")
+        if not 0 <= options['attachments'] <= 1: raise CommandError("--attachments должно быть от 0 до 1.")
+        started = time.perf_counter()
+
+        def progress(created, total):
+            elapsed = time.perf_counter() - started
+            self.stdout.write(f"  тикетов: {created}/{total} ({created / elapsed if elapsed else 0:.0f} в секунду)")
+
+        seeder = HelpdeskSeeder(seed=options['seed'], batch_size=options['batch_size'], update_search_index=not options['skip_search_index'], progress=progress)
+        seeder.ensure_reference_data()
+        templates = seeder.create_field_templates()
+        projects = seeder.create_projects(options['projects'])
+        categories = seeder.create_categories(projects, options['categories'], templates)
+        agents = seeder.create_agents(projects, options['agents'])
+        blobs = seeder.create_blobs(options['blobs']) if options['attachments'] else []
+        self.stdout.write(f"Проектов: {len(projects)}, категорий: {len(categories)}, сотрудников: {len(agents)}, файлов вложений: {len(blobs)}")
+
+        created = seeder.create_tickets(categories, agents, options['tickets'], comments_per_ticket=options['comments'],
+                                        attachment_ratio=options['attachments'], blobs=blobs, days=options['days'])
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(f"Создано тикетов: {created} за {elapsed:.1f} с."))
+        if options['skip_search_index']: self.stdout.write("Поисковый индекс не обновлялся - запустите rebuild_search_index.")
@@ -0,0 +1,75 @@
+# tickets/management/commands/send_notifications.py
+# Воркер email уведомлений: разбирает очередь NotificationOutbox через одно SMTP-соединение.
+# Разовый запуск (cron):      python manage.py send_notifications
+# Постоянный процесс:         python manage.py send_notifications --loop --interval 5
+# Пока нет активных настроек EmailSettings, события остаются в очереди и будут отправлены после включения.
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from tickets.models import EmailSettings, NotificationOutbox
+from tickets.notifications import DEFAULT_MAX_ATTEMPTS, NotificationDispatcher, pending_notifications_count
+
+DISABLED_RECHECK_SECONDS = 60 # без настроек отправки проверяем их реже
+
+
+def _connection_params(email_settings):
+    if email_settings is None: return None
+    return (email_settings.pk, email_settings.smtp_host, email_settings.smtp_port, email_settings.smtp_user,
+            email_settings.smtp_password, email_settings.use_tls, email_settings.use_ssl, email_settings.default_from_email)
+
+
+class Command(BaseCommand):
+    help = "Отправляет email уведомления из очереди (NotificationOutbox)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=50)
+        parser.add_argument('--max-attempts', type=int, default=DEFAULT_MAX_ATTEMPTS)
+        parser.add_argument('--loop', action='store_true', help="Работать постоянно, проверяя очередь каждые --interval секунд.")
+        parser.add_argument('--interval', type=float, default=5.0)
+        parser.add_argument('--purge-days', type=int, default=None, help="Удалить отправленные и пропущенные записи старше N дней.")
+
+    def handle(self, *args, **options):
+        if options['purge_days'] is not None:
+            deleted, _ = NotificationOutbox.objects.filter(
+                status__in=[NotificationOutbox.STATUS_SENT, NotificationOutbox.STATUS_SKIPPED],
+                created_at__lt=timezone.now() - timedelta(days=options['purge_days'])
+            ).delete()
+            self.stdout.write(f"Удалено старых записей очереди: {deleted}")
+
+        dispatcher = None; params = None
+        try:
+            while True:
+                email_settings = EmailSettings.get_active()
+                if _connection_params(email_settings) != params:
+                    # Настройки изменились (или первый проход) - пересоздаем соединение
+                    if dispatcher is not None: dispatcher.close()
+                    dispatcher = None; params = _connection_params(email_settings)
+                    if email_settings is not None:
+                        dispatcher = NotificationDispatcher(email_settings, batch_size=options['batch_size'], max_attempts=options['max_attempts'])
+                if dispatcher is None:
+                    pending = pending_notifications_count()
+                    if pending: self.stdout.write(self.style.WARNING(f"Нет активных настроек отправки email: {pending} событий ждут в очереди."))
+                else:
+                    self._drain(dispatcher)
+                if not options['loop']: break
+                time.sleep(options['interval'] if dispatcher is not None else max(options['interval'], DISABLED_RECHECK_SECONDS))
+        except KeyboardInterrupt:
+            pass
+        finally:
+            if dispatcher is not None: dispatcher.close()
+
+    def _drain(self, dispatcher):
+        started_at = time.perf_counter(); processed = 0; sent_before = dispatcher.sent; errors_before = dispatcher.errors
+        while True:
+            batch_count = dispatcher.process_batch()
+            processed += batch_count
+            if batch_count < dispatcher.batch_size: break
+        if processed:
+            elapsed = time.perf_counter() - started_at
+            self.stdout.write(
+                f"Обработано событий: {processed}, писем отправлено: {dispatcher.sent - sent_before}, "
+                f"ошибок: {dispatcher.errors - errors_before} ({elapsed:.1f} с)"
+            )
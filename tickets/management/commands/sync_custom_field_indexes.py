@@ -0,0 +1,35 @@
+# tickets/management/commands/sync_custom_field_indexes.py
+# Индексы по выражению (custom_form_data -> 'имя') для дополнительных полей с FieldTemplate.is_filterable
+# (фильтры списка заявок агента, tickets/custom_filters.py).
+# Недостающие индексы создаются, индексы полей, снятых с фильтрации или переименованных, удаляются.
+# В PostgreSQL - CREATE/DROP INDEX CONCURRENTLY: запись тикетов не блокируется, но на большой таблице
+# команда идет долго; прерванное построение оставляет невалидный индекс - он пересоздается при следующем запуске.
+#   python manage.py sync_custom_field_indexes --dry-run
+#   python manage.py sync_custom_field_indexes
+import time
+
+from django.core.management.base import BaseCommand
+
+from tickets.custom_filters import add_field_index, drop_field_index, existing_indexes, expected_indexes, invalid_indexes
+
+
+class Command(BaseCommand):
+    help = "Создает и удаляет индексы для фильтров по дополнительным полям (FieldTemplate.is_filterable)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help="Только показать, какие индексы будут созданы и удалены.")
+
+    def handle(self, *args, **options):
+        expected = expected_indexes(); existing = existing_indexes(); invalid = invalid_indexes()
+        to_drop = sorted((existing - set(expected)) | (invalid & existing))
+        to_create = sorted(name for name in expected if name not in existing or name in invalid)
+        prefix = "[dry-run] " if options['dry_run'] else ""
+        for name in to_drop:
+            self.stdout.write(f"  {prefix}удаление {name}")
+            if not options['dry_run']: drop_field_index(name)
+        for name in to_create:
+            self.stdout.write(f"  {prefix}создание {name} ({expected[name].expressions[0].key_name})")
+            if options['dry_run']: continue
+            started_at = time.perf_counter(); add_field_index(expected[name])
+            self.stdout.write(f"    готово за {time.perf_counter() - started_at:.1f} с")
+        self.stdout.write(self.style.SUCCESS(f"{prefix}Создано: {len(to_create)}, удалено: {len(to_drop)}, всего для фильтров: {len(expected)}."))
@@ -0,0 +1,19 @@
+# tickets/migration_operations.py
+# Операции миграций приложения tickets.
+from django.contrib.postgres.operations import AddIndexConcurrently as PostgresAddIndexConcurrently
+from django.db import migrations
+
+
+class AddIndexConcurrently(PostgresAddIndexConcurrently):
+    """
+    В PostgreSQL - CREATE INDEX CONCURRENTLY: на больших таблицах тикетов и комментариев обычный
+    CREATE INDEX блокирует запись на все время построения. В других СУБД - обычный AddIndex.
+    Миграция с этой операцией должна быть atomic = False.
+    """
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor == 'postgresql': return super().database_forwards(app_label, schema_editor, from_state, to_state)
+        return migrations.AddIndex.database_forwards(self, app_label, schema_editor, from_state, to_state)
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor == 'postgresql': return super().database_backwards(app_label, schema_editor, from_state, to_state)
+        return migrations.AddIndex.database_backwards(self, app_label, schema_editor, from_state, to_state)
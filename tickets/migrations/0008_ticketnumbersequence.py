@@ -0,0 +1,44 @@
+# Generated by Django 5.2.1 on 2026-10-18 01:13
+
+from django.db import migrations, models
+
+
+def seed_ticket_number_sequences(apps, schema_editor):
+    # Продолжаем нумерацию с максимального уже выданного номера для каждого "<КОД>-<ГОД>-"
+    Ticket = apps.get_model('tickets', 'Ticket')
+    TicketNumberSequence = apps.get_model('tickets', 'TicketNumberSequence')
+    last_values = {}
+    for ticket_id_display in Ticket.objects.values_list('ticket_id_display', flat=True).iterator():
+        parts = (ticket_id_display or '').rsplit('-', 2)
+        if len(parts) != 3 or not parts[1].isdigit() or not parts[2].isdigit(): continue
+        key = (parts[0], int(parts[1]))
+        last_values[key] = max(last_values.get(key, 0), int(parts[2]))
+    TicketNumberSequence.objects.bulk_create([
+        TicketNumberSequence(project_code=project_code, year=year, last_value=last_value)
+        for (project_code, year), last_value in last_values.items()
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tickets', '0007_feedback'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TicketNumberSequence',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('project_code', models.CharField(max_length=10, verbose_name='Код проекта в номере тикета')),
+                ('year', models.PositiveIntegerField(verbose_name='Год')),
+                ('last_value', models.PositiveBigIntegerField(default=0, verbose_name='Последний выданный номер')),
+            ],
+            options={
+                'verbose_name': 'Счетчик номеров тикетов',
+                'verbose_name_plural': 'Счетчики номеров тикетов',
+                'constraints': [models.UniqueConstraint(fields=('project_code', 'year'), name='unique_ticket_number_sequence')],
+            },
+        ),
+        migrations.RunPython(seed_ticket_number_sequences, migrations.RunPython.noop),
+    ]
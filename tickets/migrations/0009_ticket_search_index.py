@@ -0,0 +1,57 @@
+# Generated by Django 5.2.1 on 2026-10-18 01:16
+
+import django.contrib.postgres.search
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def create_gin_index(apps, schema_editor):
+    # GIN-индекс по поисковому вектору есть только в PostgreSQL
+    if schema_editor.connection.vendor != 'postgresql': return
+    schema_editor.execute(
+        'CREATE INDEX IF NOT EXISTS ticket_search_vector_gin '
+        'ON tickets_ticketsearchdocument USING gin (search_vector)'
+    )
+
+
+def drop_gin_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql': return
+    schema_editor.execute('DROP INDEX IF EXISTS ticket_search_vector_gin')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tickets', '0008_ticketnumbersequence'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TicketSearchDocument',
+            fields=[
+                ('ticket', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='search_document', serialize=False, to='tickets.ticket', verbose_name='Тикет')),
+                ('content', models.TextField(blank=True, verbose_name='Проиндексированный текст')),
+                ('search_vector', django.contrib.postgres.search.SearchVectorField(blank=True, null=True, verbose_name='Поисковый вектор (PostgreSQL)')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Дата индексации')),
+            ],
+            options={
+                'verbose_name': 'Поисковый документ тикета',
+                'verbose_name_plural': 'Поисковые документы тикетов',
+            },
+        ),
+        migrations.CreateModel(
+            name='TicketSearchTerm',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('term', models.CharField(max_length=64, verbose_name='Терм')),
+                ('weight', models.PositiveIntegerField(default=1, verbose_name='Вес')),
+                ('ticket', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_terms', to='tickets.ticket', verbose_name='Тикет')),
+            ],
+            options={
+                'verbose_name': 'Терм поискового индекса',
+                'verbose_name_plural': 'Термы поискового индекса',
+                'indexes': [models.Index(fields=['term', 'ticket'], name='ticket_search_term_idx')],
+            },
+        ),
+        migrations.RunPython(create_gin_index, drop_gin_index),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.2.1 on 2026-10-18 01:23
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tickets', '0011_notificationtemplate_updated_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TicketEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('status', 'Статус'), ('priority', 'Приоритет'), ('assignee', 'Исполнитель'), ('project', 'Проект'), ('legacy', 'Запись журнала (перенесена из комментариев)')], max_length=20, verbose_name='Что изменилось')),
+                ('old_value_id', models.PositiveBigIntegerField(blank=True, null=True, verbose_name='Старое значение (pk)')),
+                ('old_value_display', models.CharField(blank=True, max_length=255, verbose_name='Старое значение')),
+                ('new_value_id', models.PositiveBigIntegerField(blank=True, null=True, verbose_name='Новое значение (pk)')),
+                ('new_value_display', models.CharField(blank=True, max_length=255, verbose_name='Новое значение')),
+                ('actor_name', models.CharField(blank=True, max_length=255, verbose_name='Кто изменил (для отображения)')),
+                ('note', models.TextField(blank=True, verbose_name='Комментарий к изменению')),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Дата изменения')),
+                ('actor', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='ticket_events', to=settings.AUTH_USER_MODEL, verbose_name='Кто изменил (сотрудник)')),
+                ('source_comment', models.OneToOneField(blank=True, help_text='Служебный комментарий, из которого запись перенесена командой backfill_ticket_events.', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='ticket_event', to='tickets.comment', verbose_name='Исходный комментарий')),
+                ('ticket', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='events', to='tickets.ticket', verbose_name='Тикет')),
+            ],
+            options={
+                'verbose_name': 'Событие истории тикета',
+                'verbose_name_plural': 'История изменений тикетов',
+                'ordering': ['-created_at', '-id'],
+                'indexes': [models.Index(fields=['ticket', 'created_at'], name='ticket_event_ticket_idx')],
+            },
+        ),
+    ]
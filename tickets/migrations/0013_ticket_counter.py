@@ -0,0 +1,54 @@
+# Generated by Django 5.2.1 on 2026-10-18 01:25
+
+from django.db import migrations, models
+from django.db.models import Count, Q
+
+
+def seed_ticket_counters(apps, schema_editor):
+    # Начальные значения счетчиков по существующим тикетам (та же логика, что в tickets.counters.compute_counters)
+    Ticket = apps.get_model('tickets', 'Ticket')
+    TicketStatus = apps.get_model('tickets', 'TicketStatus')
+    TicketCounter = apps.get_model('tickets', 'TicketCounter')
+    closed_status_ids = list(TicketStatus.objects.filter(is_closed_status=True).values_list('pk', flat=True))
+    new_status_ids = list(TicketStatus.objects.filter(code='new').values_list('pk', flat=True))
+    is_closed = Q(status_id__in=closed_status_ids)
+    aggregates = {
+        'open_count': Count('pk', filter=~is_closed),
+        'closed_count': Count('pk', filter=is_closed),
+        'new_count': Count('pk', filter=Q(status_id__in=new_status_ids)),
+        'assigned_count': Count('pk', filter=Q(assignee__isnull=False) & ~is_closed),
+    }
+    counters = []
+    for scope, field in (('project', 'project_id'), ('category', 'category_id'), ('agent', 'assignee_id')):
+        for row in Ticket.objects.filter(**{f"{field}__isnull": False}).order_by().values(field).annotate(**aggregates):
+            counters.append(TicketCounter(scope=scope, object_id=row.pop(field), **row))
+    TicketCounter.objects.bulk_create(counters, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tickets', '0012_ticket_event'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TicketCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('scope', models.CharField(choices=[('project', 'Проект'), ('category', 'Категория'), ('agent', 'Сотрудник (исполнитель)')], max_length=10, verbose_name='Разрез')),
+                ('object_id', models.PositiveBigIntegerField(verbose_name='ID объекта')),
+                ('open_count', models.IntegerField(default=0, verbose_name='Открытые')),
+                ('closed_count', models.IntegerField(default=0, verbose_name='Закрытые')),
+                ('new_count', models.IntegerField(default=0, verbose_name='Новые')),
+                ('assigned_count', models.IntegerField(default=0, verbose_name='Открытые с исполнителем')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Обновлено')),
+            ],
+            options={
+                'verbose_name': 'Счетчик тикетов',
+                'verbose_name_plural': 'Счетчики тикетов',
+                'constraints': [models.UniqueConstraint(fields=('scope', 'object_id'), name='unique_ticket_counter')],
+            },
+        ),
+        migrations.RunPython(seed_ticket_counters, migrations.RunPython.noop),
+    ]
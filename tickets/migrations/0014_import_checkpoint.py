@@ -0,0 +1,31 @@
+# Generated by Django 5.2.1 on 2026-10-18 01:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tickets', '0013_ticket_counter'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source', models.CharField(max_length=255, unique=True, verbose_name='Источник (имя загрузки)')),
+                ('rows_processed', models.PositiveBigIntegerField(default=0, verbose_name='Обработано строк')),
+                ('tickets_created', models.PositiveBigIntegerField(default=0, verbose_name='Создано тикетов')),
+                ('rows_rejected', models.PositiveBigIntegerField(default=0, verbose_name='Отклонено строк')),
+                ('started_at', models.DateTimeField(auto_now_add=True, verbose_name='Начало')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Последний пакет')),
+                ('finished_at', models.DateTimeField(blank=True, null=True, verbose_name='Завершено')),
+            ],
+            options={
+                'verbose_name': 'Контрольная точка импорта',
+                'verbose_name_plural': 'Контрольные точки импорта',
+                'ordering': ['-updated_at'],
+            },
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.2.1 on 2026-10-18 01:36
+
+import django.db.models.functions.text
+from django.db import migrations, models
+
+from tickets.migration_operations import AddIndexConcurrently
+
+
+class Migration(migrations.Migration):
+    atomic = False # CREATE INDEX CONCURRENTLY нельзя выполнять в транзакции
+
+    dependencies = [
+        ('tickets', '0015_attachment_blobs'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='comment',
+            index=models.Index(fields=['ticket', 'is_internal', 'created_at'], name='comment_ticket_feed_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='ticket',
+            index=models.Index(fields=['project', '-created_at', '-id'], name='ticket_project_created_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='ticket',
+            index=models.Index(fields=['project', 'status', '-created_at'], name='ticket_project_status_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='ticket',
+            index=models.Index(fields=['assignee', 'status', '-created_at'], name='ticket_assignee_status_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='ticket',
+            index=models.Index(django.db.models.functions.text.Upper('ticket_id_display'), django.db.models.functions.text.Upper('reporter_email'), name='ticket_status_lookup_idx'),
+        ),
+    ]
@@ -0,0 +1,143 @@
+# Generated by Django 5.2.1 on 2026-10-18 01:55
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tickets', '0016_query_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BusinessCalendar',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True, verbose_name='Название календаря')),
+                ('timezone', models.CharField(default='Europe/Moscow', help_text='Имя из базы IANA, например Europe/Moscow. Рабочие часы и праздники задаются в этом поясе.', max_length=64, verbose_name='Часовой пояс')),
+                ('description', models.TextField(blank=True, verbose_name='Описание')),
+            ],
+            options={
+                'verbose_name': 'Рабочий календарь',
+                'verbose_name_plural': 'Рабочие календари',
+                'ordering': ['name'],
+            },
+        ),
+        migrations.AddField(
+            model_name='ticket',
+            name='first_responded_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Первый ответ'),
+        ),
+        migrations.AddField(
+            model_name='ticket',
+            name='first_response_due_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Срок первого ответа'),
+        ),
+        migrations.AddField(
+            model_name='ticket',
+            name='resolution_due_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Срок решения'),
+        ),
+        migrations.AddField(
+            model_name='ticket',
+            name='sla_due_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Ближайший срок SLA'),
+        ),
+        migrations.AddField(
+            model_name='ticket',
+            name='sla_state',
+            field=models.PositiveSmallIntegerField(choices=[(0, 'Без SLA'), (1, 'В срок'), (2, 'Под угрозой'), (3, 'Нарушен')], default=0, verbose_name='Состояние SLA'),
+        ),
+        migrations.AddField(
+            model_name='ticket',
+            name='sla_warn_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Под угрозой с'),
+        ),
+        migrations.AlterField(
+            model_name='notificationtemplate',
+            name='recipient_type',
+            field=models.CharField(choices=[('user', 'Пользователь (заявитель)'), ('agent', 'Агент (исполнитель)'), ('project_email', 'Email проекта'), ('all_project_agents', 'Все агенты проекта'), ('sla_escalation', 'Ответственный за эскалацию SLA')], max_length=20, verbose_name='Тип получателя'),
+        ),
+        migrations.AlterField(
+            model_name='ticketevent',
+            name='kind',
+            field=models.CharField(choices=[('status', 'Статус'), ('priority', 'Приоритет'), ('assignee', 'Исполнитель'), ('project', 'Проект'), ('legacy', 'Запись журнала (перенесена из комментариев)'), ('sla', 'SLA')], max_length=20, verbose_name='Что изменилось'),
+        ),
+        migrations.CreateModel(
+            name='BusinessHours',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('weekday', models.PositiveSmallIntegerField(choices=[(0, 'Понедельник'), (1, 'Вторник'), (2, 'Среда'), (3, 'Четверг'), (4, 'Пятница'), (5, 'Суббота'), (6, 'Воскресенье')], verbose_name='День недели')),
+                ('start_time', models.TimeField(verbose_name='Начало')),
+                ('end_time', models.TimeField(help_text='00:00 - до конца суток.', verbose_name='Окончание')),
+                ('calendar', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='hours', to='tickets.businesscalendar', verbose_name='Календарь')),
+            ],
+            options={
+                'verbose_name': 'Рабочие часы',
+                'verbose_name_plural': 'Рабочие часы',
+                'ordering': ['calendar', 'weekday', 'start_time'],
+            },
+        ),
+        migrations.CreateModel(
+            name='Holiday',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(verbose_name='Дата')),
+                ('name', models.CharField(blank=True, max_length=100, verbose_name='Название')),
+                ('calendar', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='holidays', to='tickets.businesscalendar', verbose_name='Календарь')),
+            ],
+            options={
+                'verbose_name': 'Нерабочий день',
+                'verbose_name_plural': 'Нерабочие дни',
+                'ordering': ['calendar', 'date'],
+            },
+        ),
+        migrations.CreateModel(
+            name='SLAPolicy',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=150, verbose_name='Название')),
+                ('first_response_minutes', models.PositiveIntegerField(blank=True, help_text='Пусто - срок первого ответа не отслеживается.', null=True, verbose_name='Первый ответ, рабочих минут')),
+                ('resolution_minutes', models.PositiveIntegerField(blank=True, help_text='Пусто - срок решения не отслеживается.', null=True, verbose_name='Решение, рабочих минут')),
+                ('at_risk_percent', models.PositiveSmallIntegerField(default=80, help_text='Какая доля срока должна пройти, чтобы тикет считался под угрозой нарушения.', verbose_name="Порог 'под угрозой', %")),
+                ('is_active', models.BooleanField(default=True, verbose_name='Политика активна')),
+                ('calendar', models.ForeignKey(blank=True, help_text='Пусто - время идет круглосуточно.', null=True, on_delete=django.db.models.deletion.PROTECT, related_name='sla_policies', to='tickets.businesscalendar', verbose_name='Рабочий календарь')),
+                ('escalate_to', models.ForeignKey(blank=True, help_text="Получатель уведомлений с типом 'Ответственный за эскалацию SLA'.", null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='sla_escalations', to=settings.AUTH_USER_MODEL, verbose_name='Эскалация на')),
+                ('priority', models.ForeignKey(blank=True, help_text='Пусто - для всех приоритетов.', null=True, on_delete=django.db.models.deletion.CASCADE, related_name='sla_policies', to='tickets.ticketpriority', verbose_name='Приоритет')),
+                ('project', models.ForeignKey(blank=True, help_text='Пусто - для всех проектов.', null=True, on_delete=django.db.models.deletion.CASCADE, related_name='sla_policies', to='tickets.project', verbose_name='Проект')),
+            ],
+            options={
+                'verbose_name': 'Политика SLA',
+                'verbose_name_plural': 'Политики SLA',
+                'ordering': ['project__name', 'priority__order', 'name'],
+            },
+        ),
+        migrations.AddField(
+            model_name='ticket',
+            name='sla_policy',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='tickets', to='tickets.slapolicy', verbose_name='Политика SLA'),
+        ),
+        migrations.AddIndex(
+            model_name='ticket',
+            index=models.Index(fields=['project', '-sla_state', 'sla_due_at'], name='ticket_project_sla_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ticket',
+            index=models.Index(condition=models.Q(('sla_due_at__isnull', False)), fields=['sla_due_at'], name='ticket_sla_due_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ticket',
+            index=models.Index(condition=models.Q(('sla_warn_at__isnull', False)), fields=['sla_warn_at'], name='ticket_sla_warn_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ticket',
+            index=models.Index(fields=['updated_at'], name='ticket_updated_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='holiday',
+            unique_together={('calendar', 'date')},
+        ),
+    ]
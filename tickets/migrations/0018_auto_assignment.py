@@ -0,0 +1,52 @@
+# Generated by Django 5.2.1 on 2026-10-18 01:59
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tickets', '0017_sla'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='agent',
+            name='accepts_auto_assignment',
+            field=models.BooleanField(default=True, help_text='Снимите, чтобы автоназначение (правила проектов) пропускало сотрудника: отпуск, другая работа.', verbose_name='Получает заявки автоматически'),
+        ),
+        migrations.CreateModel(
+            name='AutoAssignmentRule',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('strategy', models.CharField(choices=[('round_robin', 'По очереди'), ('least_open', 'Наименее загруженному'), ('skills', 'По навыкам в категории с учетом загрузки')], default='least_open', max_length=20, verbose_name='Способ выбора исполнителя')),
+                ('is_active', models.BooleanField(default=True, verbose_name='Автоназначение включено')),
+                ('max_open_per_agent', models.PositiveIntegerField(blank=True, help_text='Пусто - без ограничения. Если все заняты, заявка остается без исполнителя.', null=True, verbose_name='Не больше открытых заявок на сотрудника')),
+                ('assignment_seq', models.PositiveBigIntegerField(default=0, help_text='По нему процессы замечают назначения, сделанные другими процессами.', verbose_name='Автоназначений всего')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Обновлено')),
+                ('last_assignee', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL, verbose_name='Последний назначенный')),
+                ('project', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='auto_assignment_rule', to='tickets.project', verbose_name='Проект')),
+            ],
+            options={
+                'verbose_name': 'Правило автоназначения',
+                'verbose_name_plural': 'Правила автоназначения',
+            },
+        ),
+        migrations.CreateModel(
+            name='AgentSkill',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('weight', models.PositiveSmallIntegerField(default=1, help_text='1-10: во сколько раз больше открытых заявок этой категории может вести сотрудник по сравнению с весом 1.', verbose_name='Вес навыка')),
+                ('agent', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='skills', to=settings.AUTH_USER_MODEL, verbose_name='Сотрудник')),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='agent_skills', to='tickets.ticketcategory', verbose_name='Категория')),
+            ],
+            options={
+                'verbose_name': 'Навык сотрудника',
+                'verbose_name_plural': 'Навыки сотрудников',
+                'ordering': ['category', '-weight'],
+                'unique_together': {('agent', 'category')},
+            },
+        ),
+    ]
@@ -0,0 +1,54 @@
+# Generated by Django 5.2.1 on 2026-10-18 02:04
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tickets', '0018_auto_assignment'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ticket',
+            name='duplicate_of',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='merged_duplicates', to='tickets.ticket', verbose_name='Дубликат заявки'),
+        ),
+        migrations.AlterField(
+            model_name='ticketevent',
+            name='kind',
+            field=models.CharField(choices=[('status', 'Статус'), ('priority', 'Приоритет'), ('assignee', 'Исполнитель'), ('project', 'Проект'), ('legacy', 'Запись журнала (перенесена из комментариев)'), ('sla', 'SLA'), ('merge', 'Объединение дубликатов')], max_length=20, verbose_name='Что изменилось'),
+        ),
+        migrations.CreateModel(
+            name='TicketDuplicateCandidate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('similarity', models.FloatField(verbose_name='Сходство')),
+                ('detected_at', models.DateTimeField(auto_now_add=True, verbose_name='Найдено')),
+                ('candidate', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='tickets.ticket', verbose_name='Похожая заявка')),
+                ('ticket', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='duplicate_candidates', to='tickets.ticket', verbose_name='Тикет')),
+            ],
+            options={
+                'verbose_name': 'Возможный дубликат',
+                'verbose_name_plural': 'Возможные дубликаты',
+                'ordering': ['-similarity'],
+                'constraints': [models.UniqueConstraint(fields=('ticket', 'candidate'), name='unique_duplicate_candidate')],
+            },
+        ),
+        migrations.CreateModel(
+            name='TicketFingerprint',
+            fields=[
+                ('ticket', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='fingerprint', serialize=False, to='tickets.ticket', verbose_name='Тикет')),
+                ('signature', models.BinaryField(verbose_name='MinHash-подпись')),
+                ('created_at', models.DateTimeField(verbose_name='Дата создания тикета')),
+                ('project', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='tickets.project', verbose_name='Проект')),
+            ],
+            options={
+                'verbose_name': 'Отпечаток тикета',
+                'verbose_name_plural': 'Отпечатки тикетов',
+                'indexes': [models.Index(fields=['project', 'ticket'], name='ticket_fingerprint_project_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,59 @@
+# Generated by Django 5.2.1 on 2026-10-18 02:16
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tickets', '0019_duplicate_detection'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TicketDailyRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(verbose_name='День')),
+                ('category_key', models.PositiveBigIntegerField(default=0, verbose_name='Категория (ID, 0 - нет)')),
+                ('priority_key', models.PositiveBigIntegerField(default=0, verbose_name='Приоритет (ID, 0 - нет)')),
+                ('assignee_key', models.PositiveBigIntegerField(default=0, verbose_name='Исполнитель (ID, 0 - нет)')),
+                ('created_count', models.IntegerField(default=0, verbose_name='Создано')),
+                ('backlog_delta', models.IntegerField(default=0, help_text='Открытых на конец дня = сумма за все дни до него включительно.', verbose_name='Изменение числа открытых')),
+                ('resolved_count', models.IntegerField(default=0, verbose_name='Решено')),
+                ('reopened_count', models.IntegerField(default=0, verbose_name='Возвращено в работу')),
+                ('closed_count', models.IntegerField(default=0, verbose_name='Закрыто')),
+                ('first_response_count', models.IntegerField(default=0, verbose_name='Первых ответов')),
+                ('first_response_seconds', models.BigIntegerField(default=0, verbose_name='Время до первого ответа, с (сумма)')),
+                ('resolution_seconds', models.BigIntegerField(default=0, verbose_name='Время до решения, с (сумма)')),
+                ('project', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='tickets.project', verbose_name='Проект')),
+            ],
+            options={
+                'verbose_name': 'Сводка за день',
+                'verbose_name_plural': 'Сводки за день',
+                'indexes': [models.Index(fields=['project', 'day'], name='ticket_rollup_project_day_idx')],
+                'constraints': [models.UniqueConstraint(fields=('day', 'project', 'category_key', 'priority_key', 'assignee_key'), name='unique_ticket_daily_rollup')],
+            },
+        ),
+        migrations.CreateModel(
+            name='TicketRollupSketch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(verbose_name='День')),
+                ('category_key', models.PositiveBigIntegerField(default=0, verbose_name='Категория (ID, 0 - нет)')),
+                ('priority_key', models.PositiveBigIntegerField(default=0, verbose_name='Приоритет (ID, 0 - нет)')),
+                ('assignee_key', models.PositiveBigIntegerField(default=0, verbose_name='Исполнитель (ID, 0 - нет)')),
+                ('metric', models.CharField(choices=[('first_response', 'Время до первого ответа'), ('resolution', 'Время до решения')], max_length=20, verbose_name='Показатель')),
+                ('bucket', models.SmallIntegerField(verbose_name='Корзина')),
+                ('count', models.IntegerField(default=0, verbose_name='Количество')),
+                ('project', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='tickets.project', verbose_name='Проект')),
+            ],
+            options={
+                'verbose_name': 'Корзина гистограммы сводки',
+                'verbose_name_plural': 'Корзины гистограмм сводок',
+                'indexes': [models.Index(fields=['project', 'metric', 'day'], name='ticket_sketch_project_day_idx')],
+                'constraints': [models.UniqueConstraint(fields=('day', 'project', 'category_key', 'priority_key', 'assignee_key', 'metric', 'bucket'), name='unique_ticket_rollup_sketch')],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.1 on 2026-10-18 02:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tickets', '0020_daily_rollups'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='fieldtemplate',
+            name='is_filterable',
+            field=models.BooleanField(default=False, help_text='Поле появится в фильтрах списка заявок агента (точное совпадение). Индекс для фильтра создает manage.py sync_custom_field_indexes.', verbose_name='Фильтр в списке заявок'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.1 on 2026-10-18 02:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tickets', '0022_cache_versions'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='notificationoutbox',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Ожидает отправки'), ('sending', 'Отправляется'), ('sent', 'Отправлено'), ('failed', 'Ошибка (попытки исчерпаны)'), ('skipped', 'Пропущено')], default='pending', max_length=10, verbose_name='Состояние'),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.2.1 on 2026-10-18 02:40
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def mark_current_states_escalated(apps, schema_editor):
+    # Уже "под угрозой" и "нарушенные" тикеты не эскалируются повторно после обновления
+    Ticket = apps.get_model('tickets', 'Ticket')
+    Ticket.objects.filter(sla_state__gt=0).update(sla_escalated_state=F('sla_state'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tickets', '0023_notification_outbox_sending'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ticket',
+            name='sla_escalated_state',
+            field=models.PositiveSmallIntegerField(choices=[(0, 'Без SLA'), (1, 'В срок'), (2, 'Под угрозой'), (3, 'Нарушен')], default=0, verbose_name='Эскалация SLA отправлена для состояния'),
+        ),
+        migrations.RunPython(mark_current_states_escalated, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 5.2.1 on 2026-10-18 02:40
+
+from django.db import migrations, models
+
+from tickets.migration_operations import AddIndexConcurrently
+
+
+class Migration(migrations.Migration):
+    atomic = False # CREATE INDEX CONCURRENTLY нельзя выполнять в транзакции
+
+    dependencies = [
+        ('tickets', '0024_ticket_sla_escalated_state'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='ticket',
+            index=models.Index(condition=models.Q(('sla_state__gt', models.F('sla_escalated_state'))), fields=['sla_state'], name='ticket_sla_unescalated_idx'),
+        ),
+    ]
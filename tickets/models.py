@@ -1,10 +1,13 @@
 # tickets/models.py
-from django.db import models
+from django.db import models, transaction
+from django.db.models.functions import Upper
 from django.contrib.auth.models import AbstractUser
 from django.utils import timezone
 from django.core.exceptions import ValidationError
 import os
-from django.template import Context, Template as DjangoTemplate # Для рендеринга шаблонов писем
+from django.template import Context # Для рендеринга шаблонов писем (скомпилированные шаблоны - tickets/template_cache.py)
+from django.contrib.postgres.search import SearchVectorField # Только тип колонки; на SQLite остается пустой
+from .blobstore import acquire_blob, attachment_storage, blob_upload_to, release_blob
 
 # ------------------- Модель Проекта (Отдела) -------------------
 class Project(models.Model):
@@ -59,6 +62,11 @@ class Agent(AbstractUser):
         verbose_name="Проекты сотрудника",
         help_text="Проекты, к которым сотрудник имеет доступ и в которых может работать."
     )
+    accepts_auto_assignment = models.BooleanField(
+        default=True,
+        verbose_name="Получает заявки автоматически",
+        help_text="Снимите, чтобы автоназначение (правила проектов) пропускало сотрудника: отпуск, другая работа."
+    )
 
     class Meta(AbstractUser.Meta):
         verbose_name = "Сотрудник поддержки"
@@ -137,18 +145,27 @@ class FieldTemplate(models.Model):
         ('bool', 'Да/Нет (чекбокс)'), ('date', 'Дата'),
         ('select', 'Выпадающий список'), ('file', 'Файл (вложение)'),
     ]
+    FILTERABLE_FIELD_TYPES = ('char', 'email', 'int', 'bool', 'date', 'select') # длинный текст и файлы не фильтруются
     name = models.SlugField(max_length=100, unique=True, verbose_name="Уникальное имя поля (англ., для системы)", help_text="Используется в коде. Только латиница, цифры, подчеркивания.")
     label_default = models.CharField(max_length=255, verbose_name="Метка поля по умолчанию", help_text="Как поле будет называться для пользователя, если не переопределено в категории.")
     field_type = models.CharField(max_length=20, choices=FIELD_TYPE_CHOICES, verbose_name="Тип поля")
     help_text_default = models.CharField(max_length=255, blank=True, null=True, verbose_name="Подсказка для поля по умолчанию")
     select_choices_json_default = models.JSONField(blank=True, null=True, verbose_name="Варианты для выпадающего списка (JSON) по умолчанию", help_text='Если тип поля "Выпадающий список". Пример: {"val1": "Опция 1", "val2": "Опция 2"}')
     is_active = models.BooleanField(default=True, verbose_name="Доступен для добавления в категории", help_text="Если неактивен, его нельзя будет выбрать при настройке полей для категории.")
+    is_filterable = models.BooleanField(default=False, verbose_name="Фильтр в списке заявок", help_text="Поле появится в фильтрах списка заявок агента (точное совпадение). Индекс для фильтра создает manage.py sync_custom_field_indexes.")
 
     class Meta:
         ordering = ['label_default']
         verbose_name = "Шаблон кастомного поля (Библиотека)"
         verbose_name_plural = "Шаблоны кастомных полей (Библиотека)"
 
+    def clean(self):
+        if self.is_filterable and self.field_type not in self.FILTERABLE_FIELD_TYPES:
+            raise ValidationError({'is_filterable': f"Поля типа «{self.get_field_type_display()}» нельзя использовать в фильтрах."})
+        # Значение поля с именем колонки Ticket (reporter_phone и т.п.) сохраняется в колонку, а не в custom_form_data
+        if self.is_filterable and self.name in {f.name for f in Ticket._meta.get_fields() if not f.is_relation}:
+            raise ValidationError({'is_filterable': f"Поле «{self.name}» хранится в колонке заявки, а не в дополнительных данных; фильтр по нему не поддерживается."})
+
     def __str__(self):
         active_status = "" if self.is_active else " (Неактивен для добавления)"
         return f"{self.label_default} ({self.name}) - Тип: {self.get_field_type_display()}{active_status}"
@@ -184,6 +201,134 @@ class CustomFormField(models.Model):
         active_status = "" if self.is_active_in_category else " (Неактивно в этой категории)"
         return f"Поле '{self.effective_label}' ({self.name}) для '{self.category}'{active_status}"
 
+# ------------------- SLA: рабочие календари и политики -------------------
+# Сроки тикетов считаются в tickets/sla.py; эскалации по срокам - команда run_sla_scheduler.
+class BusinessCalendar(models.Model):
+    name = models.CharField(max_length=100, unique=True, verbose_name="Название календаря")
+    timezone = models.CharField(max_length=64, default='Europe/Moscow', verbose_name="Часовой пояс", help_text="Имя из базы IANA, например Europe/Moscow. Рабочие часы и праздники задаются в этом поясе.")
+    description = models.TextField(blank=True, verbose_name="Описание")
+
+    class Meta:
+        ordering = ['name']
+        verbose_name = "Рабочий календарь"
+        verbose_name_plural = "Рабочие календари"
+
+    def clean(self):
+        from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+        try: ZoneInfo(self.timezone)
+        except (ZoneInfoNotFoundError, ValueError): raise ValidationError({'timezone': f"Неизвестный часовой пояс '{self.timezone}'."})
+
+    def __str__(self):
+        return f"{self.name} ({self.timezone})"
+
+class BusinessHours(models.Model):
+    WEEKDAY_CHOICES = [(0, 'Понедельник'), (1, 'Вторник'), (2, 'Среда'), (3, 'Четверг'), (4, 'Пятница'), (5, 'Суббота'), (6, 'Воскресенье')]
+    calendar = models.ForeignKey(BusinessCalendar, on_delete=models.CASCADE, related_name='hours', verbose_name="Календарь")
+    weekday = models.PositiveSmallIntegerField(choices=WEEKDAY_CHOICES, verbose_name="День недели")
+    start_time = models.TimeField(verbose_name="Начало")
+    end_time = models.TimeField(verbose_name="Окончание", help_text="00:00 - до конца суток.")
+
+    class Meta:
+        ordering = ['calendar', 'weekday', 'start_time']
+        verbose_name = "Рабочие часы"
+        verbose_name_plural = "Рабочие часы"
+
+    def clean(self):
+        if self.start_time is not None and self.end_time is not None and self.end_time.isoformat() != '00:00:00' and self.end_time <= self.start_time:
+            raise ValidationError("Окончание рабочего интервала должно быть позже начала.")
+
+    def __str__(self):
+        return f"{self.get_weekday_display()} {self.start_time:%H:%M}-{self.end_time:%H:%M}"
+
+class Holiday(models.Model):
+    calendar = models.ForeignKey(BusinessCalendar, on_delete=models.CASCADE, related_name='holidays', verbose_name="Календарь")
+    date = models.DateField(verbose_name="Дата")
+    name = models.CharField(max_length=100, blank=True, verbose_name="Название")
+
+    class Meta:
+        ordering = ['calendar', 'date']
+        verbose_name = "Нерабочий день"
+        verbose_name_plural = "Нерабочие дни"
+        unique_together = [['calendar', 'date']]
+
+    def __str__(self):
+        return f"{self.date:%d.%m.%Y} {self.name}".strip()
+
+class SLAPolicy(models.Model):
+    # Политика подбирается по паре (проект, приоритет); пустое поле - "любой". Порядок поиска:
+    # проект+приоритет, проект, приоритет, общая политика (tickets/sla.py, SLAPolicyRegistry.policy_for).
+    name = models.CharField(max_length=150, verbose_name="Название")
+    project = models.ForeignKey(Project, on_delete=models.CASCADE, null=True, blank=True, related_name='sla_policies', verbose_name="Проект", help_text="Пусто - для всех проектов.")
+    priority = models.ForeignKey(TicketPriority, on_delete=models.CASCADE, null=True, blank=True, related_name='sla_policies', verbose_name="Приоритет", help_text="Пусто - для всех приоритетов.")
+    calendar = models.ForeignKey(BusinessCalendar, on_delete=models.PROTECT, null=True, blank=True, related_name='sla_policies', verbose_name="Рабочий календарь", help_text="Пусто - время идет круглосуточно.")
+    first_response_minutes = models.PositiveIntegerField(null=True, blank=True, verbose_name="Первый ответ, рабочих минут", help_text="Пусто - срок первого ответа не отслеживается.")
+    resolution_minutes = models.PositiveIntegerField(null=True, blank=True, verbose_name="Решение, рабочих минут", help_text="Пусто - срок решения не отслеживается.")
+    at_risk_percent = models.PositiveSmallIntegerField(default=80, verbose_name="Порог 'под угрозой', %", help_text="Какая доля срока должна пройти, чтобы тикет считался под угрозой нарушения.")
+    escalate_to = models.ForeignKey(Agent, on_delete=models.SET_NULL, null=True, blank=True, related_name='sla_escalations', verbose_name="Эскалация на", help_text="Получатель уведомлений с типом 'Ответственный за эскалацию SLA'.")
+    is_active = models.BooleanField(default=True, verbose_name="Политика активна")
+
+    class Meta:
+        ordering = ['project__name', 'priority__order', 'name']
+        verbose_name = "Политика SLA"
+        verbose_name_plural = "Политики SLA"
+
+    def clean(self):
+        if self.at_risk_percent is not None and not 1 <= self.at_risk_percent <= 100:
+            raise ValidationError({'at_risk_percent': "Порог должен быть от 1 до 100%."})
+        if not self.first_response_minutes and not self.resolution_minutes:
+            raise ValidationError("Укажите хотя бы один срок: первого ответа или решения.")
+        # UNIQUE по (project, priority) не срабатывает для NULL, поэтому дубликаты проверяем здесь
+        duplicates = SLAPolicy.objects.filter(project=self.project, priority=self.priority, is_active=True).exclude(pk=self.pk)
+        if self.is_active and duplicates.exists():
+            raise ValidationError("Для этого сочетания проекта и приоритета уже есть активная политика SLA.")
+
+    def __str__(self):
+        return self.name
+
+# ------------------- Автоназначение тикетов -------------------
+# Правило проекта и навыки сотрудников; выбор исполнителя - tickets/assignment.py.
+class AutoAssignmentRule(models.Model):
+    STRATEGY_ROUND_ROBIN = 'round_robin'
+    STRATEGY_LEAST_OPEN = 'least_open'
+    STRATEGY_SKILLS = 'skills'
+    STRATEGY_CHOICES = [
+        (STRATEGY_ROUND_ROBIN, 'По очереди'),
+        (STRATEGY_LEAST_OPEN, 'Наименее загруженному'),
+        (STRATEGY_SKILLS, 'По навыкам в категории с учетом загрузки'),
+    ]
+    project = models.OneToOneField(Project, on_delete=models.CASCADE, related_name='auto_assignment_rule', verbose_name="Проект")
+    strategy = models.CharField(max_length=20, choices=STRATEGY_CHOICES, default=STRATEGY_LEAST_OPEN, verbose_name="Способ выбора исполнителя")
+    is_active = models.BooleanField(default=True, verbose_name="Автоназначение включено")
+    max_open_per_agent = models.PositiveIntegerField(null=True, blank=True, verbose_name="Не больше открытых заявок на сотрудника", help_text="Пусто - без ограничения. Если все заняты, заявка остается без исполнителя.")
+    # Строка правила блокируется на время выбора (SELECT FOR UPDATE) - параллельные заявки проекта назначаются по одной
+    last_assignee = models.ForeignKey(Agent, on_delete=models.SET_NULL, null=True, blank=True, related_name='+', verbose_name="Последний назначенный")
+    assignment_seq = models.PositiveBigIntegerField(default=0, verbose_name="Автоназначений всего", help_text="По нему процессы замечают назначения, сделанные другими процессами.")
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="Обновлено")
+
+    class Meta:
+        verbose_name = "Правило автоназначения"
+        verbose_name_plural = "Правила автоназначения"
+
+    def __str__(self):
+        return f"{self.project.name}: {self.get_strategy_display()}"
+
+class AgentSkill(models.Model):
+    agent = models.ForeignKey(Agent, on_delete=models.CASCADE, related_name='skills', verbose_name="Сотрудник")
+    category = models.ForeignKey(TicketCategory, on_delete=models.CASCADE, related_name='agent_skills', verbose_name="Категория")
+    weight = models.PositiveSmallIntegerField(default=1, verbose_name="Вес навыка", help_text="1-10: во сколько раз больше открытых заявок этой категории может вести сотрудник по сравнению с весом 1.")
+
+    class Meta:
+        ordering = ['category', '-weight']
+        verbose_name = "Навык сотрудника"
+        verbose_name_plural = "Навыки сотрудников"
+        unique_together = [['agent', 'category']]
+
+    def clean(self):
+        if self.weight is not None and not 1 <= self.weight <= 10: raise ValidationError({'weight': "Вес должен быть от 1 до 10."})
+
+    def __str__(self):
+        return f"{self.agent} - {self.category.name} ({self.weight})"
+
 # ------------------- Основная Модель Тикета -------------------
 class Ticket(models.Model):
     title = models.CharField(max_length=255, verbose_name="Тема тикета")
@@ -210,24 +355,40 @@ class Ticket(models.Model):
     resolved_at = models.DateTimeField(null=True, blank=True, verbose_name="Дата решения")
     closed_at = models.DateTimeField(null=True, blank=True, verbose_name="Дата закрытия")
 
+    # SLA (tickets/sla.py): сроки пересчитываются при сохранении по политике SLAPolicy и рабочему календарю.
+    # sla_due_at - ближайший невыполненный срок, sla_warn_at - момент "под угрозой" для него; по этим
+    # колонкам (частичные индексы) планировщик run_sla_scheduler выбирает тикеты, не просматривая всю таблицу.
+    # Состояние - число, чтобы список сортировался по нему напрямую: нарушенные, затем под угрозой.
+    SLA_STATE_NONE = 0
+    SLA_STATE_OK = 1
+    SLA_STATE_AT_RISK = 2
+    SLA_STATE_BREACHED = 3
+    SLA_STATE_CHOICES = [
+        (SLA_STATE_NONE, 'Без SLA'),
+        (SLA_STATE_OK, 'В срок'),
+        (SLA_STATE_AT_RISK, 'Под угрозой'),
+        (SLA_STATE_BREACHED, 'Нарушен'),
+    ]
+    sla_policy = models.ForeignKey(SLAPolicy, on_delete=models.SET_NULL, null=True, blank=True, related_name='tickets', verbose_name="Политика SLA")
+    first_response_due_at = models.DateTimeField(null=True, blank=True, verbose_name="Срок первого ответа")
+    first_responded_at = models.DateTimeField(null=True, blank=True, verbose_name="Первый ответ")
+    resolution_due_at = models.DateTimeField(null=True, blank=True, verbose_name="Срок решения")
+    sla_due_at = models.DateTimeField(null=True, blank=True, verbose_name="Ближайший срок SLA")
+    sla_warn_at = models.DateTimeField(null=True, blank=True, verbose_name="Под угрозой с")
+    sla_state = models.PositiveSmallIntegerField(choices=SLA_STATE_CHOICES, default=SLA_STATE_NONE, verbose_name="Состояние SLA")
+    # Состояние, о котором уже отправлена эскалация. Переход в "под угрозой"/"нарушен" может сделать и Ticket.save(),
+    # раньше планировщика - тогда планировщик находит тикет по sla_state > sla_escalated_state и эскалирует сам.
+    sla_escalated_state = models.PositiveSmallIntegerField(choices=SLA_STATE_CHOICES, default=SLA_STATE_NONE, verbose_name="Эскалация SLA отправлена для состояния")
+    # Объединение дубликатов (tickets/duplicates.py): заявка закрывается и ссылается на основную
+    duplicate_of = models.ForeignKey('self', on_delete=models.SET_NULL, null=True, blank=True, related_name='merged_duplicates', verbose_name="Дубликат заявки")
+
     def generate_ticket_id(self):
-        current_year = timezone.now().year
-        project_code = "N_A"; next_num_for_project = 1
-        if self.project:
-            project_name_alphanum = "".join(filter(str.isalnum, self.project.name)); project_code = project_name_alphanum[:3].upper()
-            if not project_code: project_code = f"P{self.project.pk}"[:3].upper()
-            prefix_to_match = f"{project_code}-{current_year}-"
-            last_ticket = Ticket.objects.filter(ticket_id_display__startswith=prefix_to_match, project=self.project).order_by('-ticket_id_display').first()
-            if last_ticket and last_ticket.ticket_id_display.startswith(prefix_to_match):
-                try: last_num_str = last_ticket.ticket_id_display.split('-')[-1]; next_num_for_project = int(last_num_str) + 1
-                except (ValueError, IndexError): count_for_fallback = Ticket.objects.filter(project=self.project, created_at__year=current_year).count(); next_num_for_project = count_for_fallback + 1
-            else: count_existing_for_project = Ticket.objects.filter(project=self.project, created_at__year=current_year).count(); next_num_for_project = count_existing_for_project + 1
-            return f"{project_code}-{current_year}-{str(next_num_for_project).zfill(5)}"
-        else: 
-            last_generic_ticket_count = Ticket.objects.filter(ticket_id_display__startswith=f"IT-{current_year}-").count(); next_generic_num = last_generic_ticket_count + 1
-            return f"IT-{current_year}-{str(next_generic_num).zfill(5)}"
+        # Номер выдается счетчиком (project_code, год) за один запрос к БД, без поиска последнего тикета
+        from .numbering import allocate_ticket_id
+        return allocate_ticket_id(self.project)
 
     def save(self, *args, **kwargs):
+        from .reference_cache import reference_data
         is_new = not self.pk 
         if is_new:
             if not self.ticket_id_display: 
@@ -235,25 +396,184 @@ class Ticket(models.Model):
                 else: self.ticket_id_display = f"TEMP-{timezone.now().strftime('%Y%m%d%H%M%S%f')}"
             if not self.priority_id:
                 try:
-                    default_priority = TicketPriority.objects.get(code='NORMAL')
+                    default_priority = reference_data.get_priority('NORMAL')
                     self.priority = default_priority
                 except TicketPriority.DoesNotExist: pass
         
-        if self.status: 
-            if self.status.is_resolved_status and not self.resolved_at: self.resolved_at = timezone.now()
-            elif not self.status.is_resolved_status and self.resolved_at: self.resolved_at = None
-            if self.status.is_closed_status and not self.closed_at: self.closed_at = timezone.now()
-            elif not self.status.is_closed_status and self.closed_at: self.closed_at = None
-        super().save(*args, **kwargs)
+        # Флаги статуса берем из кэша справочников, чтобы не загружать статус отдельным запросом
+        status = None
+        if self.status_id:
+            try: status = reference_data.get_status_by_pk(self.status_id)
+            except TicketStatus.DoesNotExist: status = self.status
+        if status: 
+            if status.is_resolved_status and not self.resolved_at: self.resolved_at = timezone.now()
+            elif not status.is_resolved_status and self.resolved_at: self.resolved_at = None
+            if status.is_closed_status and not self.closed_at: self.closed_at = timezone.now()
+            elif not status.is_closed_status and self.closed_at: self.closed_at = None
+        # Сроки SLA - по уже выставленным resolved_at/closed_at; при save(update_fields=...) поля SLA дописываются
+        from .sla import SLA_TRIGGER_FIELDS, SLA_UPDATE_FIELDS, update_ticket_sla
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None or SLA_TRIGGER_FIELDS.intersection(update_fields):
+            if update_ticket_sla(self) and update_fields is not None: kwargs['update_fields'] = set(update_fields) | SLA_UPDATE_FIELDS
+        # Счетчики тикетов (TicketCounter) обновляются в post_save - в той же транзакции, что и сам тикет
+        with transaction.atomic():
+            super().save(*args, **kwargs)
 
     class Meta:
         ordering = ['-created_at'] 
         verbose_name = "Тикет"
         verbose_name_plural = "Тикеты"
+        # Индексы под фактические запросы (замеры - manage.py benchmark_queries):
+        # список агента и опрос новых - project + created_at/pk; "Мои заявки" - assignee + status;
+        # проверка статуса заявителем - ticket_id_display__iexact + reporter_email__iexact (UPPER(...) = UPPER(%s))
+        indexes = [
+            models.Index(fields=['project', '-created_at', '-id'], name='ticket_project_created_idx'),
+            models.Index(fields=['project', 'status', '-created_at'], name='ticket_project_status_idx'),
+            models.Index(fields=['assignee', 'status', '-created_at'], name='ticket_assignee_status_idx'),
+            models.Index(Upper('ticket_id_display'), Upper('reporter_email'), name='ticket_status_lookup_idx'),
+            # SLA: сортировка списка по состоянию и сроку; выборки планировщика по срокам и по времени изменения
+            models.Index(fields=['project', '-sla_state', 'sla_due_at'], name='ticket_project_sla_idx'),
+            models.Index(fields=['sla_due_at'], name='ticket_sla_due_idx', condition=models.Q(sla_due_at__isnull=False)),
+            models.Index(fields=['sla_warn_at'], name='ticket_sla_warn_idx', condition=models.Q(sla_warn_at__isnull=False)),
+            models.Index(fields=['updated_at'], name='ticket_updated_idx'),
+            models.Index(fields=['sla_state'], name='ticket_sla_unescalated_idx', condition=models.Q(sla_state__gt=models.F('sla_escalated_state'))),
+        ]
 
     def __str__(self):
         return f"{self.ticket_id_display or 'Новый тикет'} - {self.title or 'Без темы'}"
 
+# ------------------- Счетчики тикетов по проектам, категориям и сотрудникам -------------------
+class TicketCounter(models.Model):
+    # Денормализованные количества тикетов для админки и панели агента. Обновляются приращениями (F())
+    # при сохранении и удалении тикета (tickets/counters.py); расхождения исправляет reconcile_ticket_counters.
+    SCOPE_PROJECT = 'project'
+    SCOPE_CATEGORY = 'category'
+    SCOPE_AGENT = 'agent'
+    SCOPE_CHOICES = [(SCOPE_PROJECT, 'Проект'), (SCOPE_CATEGORY, 'Категория'), (SCOPE_AGENT, 'Сотрудник (исполнитель)')]
+    scope = models.CharField(max_length=10, choices=SCOPE_CHOICES, verbose_name="Разрез")
+    object_id = models.PositiveBigIntegerField(verbose_name="ID объекта")
+    open_count = models.IntegerField(default=0, verbose_name="Открытые")
+    closed_count = models.IntegerField(default=0, verbose_name="Закрытые")
+    new_count = models.IntegerField(default=0, verbose_name="Новые")
+    assigned_count = models.IntegerField(default=0, verbose_name="Открытые с исполнителем")
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="Обновлено")
+
+    class Meta:
+        verbose_name = "Счетчик тикетов"
+        verbose_name_plural = "Счетчики тикетов"
+        constraints = [models.UniqueConstraint(fields=['scope', 'object_id'], name='unique_ticket_counter')]
+
+    def __str__(self):
+        return f"{self.get_scope_display()} #{self.object_id}: открыто {self.open_count}, закрыто {self.closed_count}"
+
+    @property
+    def total_count(self):
+        return self.open_count + self.closed_count
+
+# ------------------- Ежедневные сводки для отчетов -------------------
+# Факты по дням и разрезу (проект, категория, приоритет, исполнитель) - tickets/rollups.py. Строки обновляются
+# приращениями (F()) при сохранении тикета, отчет за месяц или год суммирует их, не обращаясь к тикетам.
+# Категория, приоритет и исполнитель - числа, а не внешние ключи: 0 значит "не задано", и строка однозначно
+# находится по уникальному ключу (NULL в уникальном индексе друг другу не равны).
+class TicketDailyRollup(models.Model):
+    day = models.DateField(verbose_name="День")
+    project = models.ForeignKey(Project, on_delete=models.CASCADE, related_name='+', verbose_name="Проект")
+    category_key = models.PositiveBigIntegerField(default=0, verbose_name="Категория (ID, 0 - нет)")
+    priority_key = models.PositiveBigIntegerField(default=0, verbose_name="Приоритет (ID, 0 - нет)")
+    assignee_key = models.PositiveBigIntegerField(default=0, verbose_name="Исполнитель (ID, 0 - нет)")
+    created_count = models.IntegerField(default=0, verbose_name="Создано")
+    backlog_delta = models.IntegerField(default=0, verbose_name="Изменение числа открытых", help_text="Открытых на конец дня = сумма за все дни до него включительно.")
+    resolved_count = models.IntegerField(default=0, verbose_name="Решено")
+    reopened_count = models.IntegerField(default=0, verbose_name="Возвращено в работу")
+    closed_count = models.IntegerField(default=0, verbose_name="Закрыто")
+    first_response_count = models.IntegerField(default=0, verbose_name="Первых ответов")
+    first_response_seconds = models.BigIntegerField(default=0, verbose_name="Время до первого ответа, с (сумма)")
+    resolution_seconds = models.BigIntegerField(default=0, verbose_name="Время до решения, с (сумма)")
+
+    class Meta:
+        verbose_name = "Сводка за день"
+        verbose_name_plural = "Сводки за день"
+        constraints = [models.UniqueConstraint(fields=['day', 'project', 'category_key', 'priority_key', 'assignee_key'], name='unique_ticket_daily_rollup')]
+        indexes = [models.Index(fields=['project', 'day'], name='ticket_rollup_project_day_idx')]
+
+    def __str__(self):
+        return f"{self.day:%d.%m.%Y} {self.project_id}/{self.category_key}/{self.priority_key}/{self.assignee_key}: создано {self.created_count}"
+
+class TicketRollupSketch(models.Model):
+    # Гистограмма длительностей (DDSketch): корзина i - значения в (gamma^(i-1), gamma^i] секунд. Корзины
+    # разных дней и разрезов складываются, поэтому перцентили за любой период считаются по сумме корзин.
+    METRIC_FIRST_RESPONSE = 'first_response'
+    METRIC_RESOLUTION = 'resolution'
+    METRIC_CHOICES = [(METRIC_FIRST_RESPONSE, 'Время до первого ответа'), (METRIC_RESOLUTION, 'Время до решения')]
+    day = models.DateField(verbose_name="День")
+    project = models.ForeignKey(Project, on_delete=models.CASCADE, related_name='+', verbose_name="Проект")
+    category_key = models.PositiveBigIntegerField(default=0, verbose_name="Категория (ID, 0 - нет)")
+    priority_key = models.PositiveBigIntegerField(default=0, verbose_name="Приоритет (ID, 0 - нет)")
+    assignee_key = models.PositiveBigIntegerField(default=0, verbose_name="Исполнитель (ID, 0 - нет)")
+    metric = models.CharField(max_length=20, choices=METRIC_CHOICES, verbose_name="Показатель")
+    bucket = models.SmallIntegerField(verbose_name="Корзина")
+    count = models.IntegerField(default=0, verbose_name="Количество")
+
+    class Meta:
+        verbose_name = "Корзина гистограммы сводки"
+        verbose_name_plural = "Корзины гистограмм сводок"
+        constraints = [models.UniqueConstraint(fields=['day', 'project', 'category_key', 'priority_key', 'assignee_key', 'metric', 'bucket'], name='unique_ticket_rollup_sketch')]
+        indexes = [models.Index(fields=['project', 'metric', 'day'], name='ticket_sketch_project_day_idx')]
+
+    def __str__(self):
+        return f"{self.day:%d.%m.%Y} {self.metric} #{self.bucket}: {self.count}"
+
+# ------------------- Контрольные точки массового импорта -------------------
+class ImportCheckpoint(models.Model):
+    # Сколько строк источника уже загружено. Обновляется в одной транзакции с каждым пакетом,
+    # поэтому после сбоя import_tickets продолжает ровно с первой незагруженной строки.
+    source = models.CharField(max_length=255, unique=True, verbose_name="Источник (имя загрузки)")
+    rows_processed = models.PositiveBigIntegerField(default=0, verbose_name="Обработано строк")
+    tickets_created = models.PositiveBigIntegerField(default=0, verbose_name="Создано тикетов")
+    rows_rejected = models.PositiveBigIntegerField(default=0, verbose_name="Отклонено строк")
+    started_at = models.DateTimeField(auto_now_add=True, verbose_name="Начало")
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="Последний пакет")
+    finished_at = models.DateTimeField(null=True, blank=True, verbose_name="Завершено")
+
+    class Meta:
+        ordering = ['-updated_at']
+        verbose_name = "Контрольная точка импорта"
+        verbose_name_plural = "Контрольные точки импорта"
+
+    def __str__(self):
+        return f"{self.source}: {self.rows_processed} строк"
+
+# ------------------- Версии внутрипроцессных кэшей (tickets/cache_versions.py) -------------------
+class CacheVersion(models.Model):
+    # Версия кэша справочников, форм, политик SLA и т.п.: все процессы (веб, планировщик SLA, рассылка)
+    # перечитывают таблицу одним запросом раз в CACHE_VERSION_CHECK_INTERVAL секунд
+    name = models.CharField(max_length=64, primary_key=True, verbose_name="Кэш")
+    version = models.PositiveBigIntegerField(default=0, verbose_name="Версия")
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="Дата сброса")
+
+    class Meta:
+        verbose_name = "Версия кэша"
+        verbose_name_plural = "Версии кэшей"
+
+    def __str__(self):
+        return f"{self.name}: {self.version}"
+
+# ------------------- Счетчик номеров тикетов -------------------
+class TicketNumberSequence(models.Model):
+    # Последний выданный номер для префикса "<код проекта>-<год>-". Строка блокируется на время
+    # выдачи номера (UPSERT / SELECT FOR UPDATE), поэтому параллельные заявки не получают одинаковый ID.
+    project_code = models.CharField(max_length=10, verbose_name="Код проекта в номере тикета")
+    year = models.PositiveIntegerField(verbose_name="Год")
+    last_value = models.PositiveBigIntegerField(default=0, verbose_name="Последний выданный номер")
+
+    class Meta:
+        verbose_name = "Счетчик номеров тикетов"
+        verbose_name_plural = "Счетчики номеров тикетов"
+        constraints = [models.UniqueConstraint(fields=['project_code', 'year'], name='unique_ticket_number_sequence')]
+
+    def __str__(self):
+        return f"{self.project_code}-{self.year}: {self.last_value}"
+
 # ------------------- Модели Комментариев и Вложений -------------------
 class Comment(models.Model):
     ticket = models.ForeignKey(Ticket, on_delete=models.CASCADE, related_name='comments', verbose_name="Тикет")
@@ -273,12 +593,136 @@ class Comment(models.Model):
         ordering = ['created_at']
         verbose_name = "Комментарий"
         verbose_name_plural = "Комментарии"
+        # Лента комментариев тикета: все (агент) или только публичные (заявитель), по времени
+        indexes = [models.Index(fields=['ticket', 'is_internal', 'created_at'], name='comment_ticket_feed_idx')]
 
     def __str__(self):
         author = self.author_name_display or (self.author_agent.username if self.author_agent else "Аноним")
         ticket_id_str = self.ticket.ticket_id_display if self.ticket and self.ticket.ticket_id_display else (f"ID {self.ticket.id}" if self.ticket else "N/A")
         return f"Комментарий от {author} к тикету #{ticket_id_str}"
 
+# ------------------- Поисковый индекс тикетов -------------------
+# Заполняется из tickets/search.py при сохранении тикета и комментариев.
+class TicketSearchDocument(models.Model):
+    # Один документ на тикет: номер, тема, заявитель, описание, доп. поля и тексты комментариев.
+    # На PostgreSQL поиск идет по search_vector (GIN-индекс создается миграцией), на других СУБД - по TicketSearchTerm.
+    ticket = models.OneToOneField(Ticket, on_delete=models.CASCADE, primary_key=True, related_name='search_document', verbose_name="Тикет")
+    content = models.TextField(blank=True, verbose_name="Проиндексированный текст")
+    search_vector = SearchVectorField(null=True, blank=True, verbose_name="Поисковый вектор (PostgreSQL)")
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="Дата индексации")
+
+    class Meta:
+        verbose_name = "Поисковый документ тикета"
+        verbose_name_plural = "Поисковые документы тикетов"
+
+    def __str__(self):
+        return f"Поисковый документ тикета {self.ticket_id}"
+
+class TicketSearchTerm(models.Model):
+    # Инвертированный индекс для СУБД без полнотекстового поиска (SQLite в тестах): терм -> тикет с весом.
+    ticket = models.ForeignKey(Ticket, on_delete=models.CASCADE, related_name='search_terms', verbose_name="Тикет")
+    term = models.CharField(max_length=64, verbose_name="Терм")
+    weight = models.PositiveIntegerField(default=1, verbose_name="Вес")
+
+    class Meta:
+        verbose_name = "Терм поискового индекса"
+        verbose_name_plural = "Термы поискового индекса"
+        indexes = [models.Index(fields=['term', 'ticket'], name='ticket_search_term_idx')]
+
+    def __str__(self):
+        return f"{self.term} -> {self.ticket_id}"
+
+# ------------------- Поиск похожих заявок (дубликатов) -------------------
+# Заполняется из tickets/duplicates.py при создании тикета и командой rebuild_duplicate_index.
+class TicketFingerprint(models.Model):
+    # MinHash-подпись текста заявки. По ней каждый процесс строит в памяти LSH-индекс проекта,
+    # а не пересчитывает подписи старых заявок; project и created_at скопированы для выборки окна без JOIN.
+    ticket = models.OneToOneField(Ticket, on_delete=models.CASCADE, primary_key=True, related_name='fingerprint', verbose_name="Тикет")
+    project = models.ForeignKey(Project, on_delete=models.CASCADE, related_name='+', verbose_name="Проект")
+    signature = models.BinaryField(verbose_name="MinHash-подпись")
+    created_at = models.DateTimeField(verbose_name="Дата создания тикета")
+
+    class Meta:
+        verbose_name = "Отпечаток тикета"
+        verbose_name_plural = "Отпечатки тикетов"
+        indexes = [models.Index(fields=['project', 'ticket'], name='ticket_fingerprint_project_idx')]
+
+    def __str__(self):
+        return f"Отпечаток тикета {self.ticket_id}"
+
+class TicketDuplicateCandidate(models.Model):
+    # Найденная при создании похожая заявка того же проекта (оценка сходства Жаккара по подписям).
+    ticket = models.ForeignKey(Ticket, on_delete=models.CASCADE, related_name='duplicate_candidates', verbose_name="Тикет")
+    candidate = models.ForeignKey(Ticket, on_delete=models.CASCADE, related_name='+', verbose_name="Похожая заявка")
+    similarity = models.FloatField(verbose_name="Сходство")
+    detected_at = models.DateTimeField(auto_now_add=True, verbose_name="Найдено")
+
+    class Meta:
+        ordering = ['-similarity']
+        verbose_name = "Возможный дубликат"
+        verbose_name_plural = "Возможные дубликаты"
+        constraints = [models.UniqueConstraint(fields=['ticket', 'candidate'], name='unique_duplicate_candidate')]
+
+    def __str__(self):
+        return f"{self.ticket_id} ~ {self.candidate_id} ({self.similarity:.0%})"
+
+# ------------------- История изменений тикета -------------------
+class TicketEvent(models.Model):
+    # Структурированная запись истории: что изменилось, с какого значения на какое и кем.
+    # Значения хранятся парой (pk, название на момент изменения), поэтому история читается
+    # без JOIN и не меняется при переименовании статусов/проектов.
+    KIND_STATUS = 'status'
+    KIND_PRIORITY = 'priority'
+    KIND_ASSIGNEE = 'assignee'
+    KIND_PROJECT = 'project'
+    KIND_LEGACY = 'legacy'
+    KIND_SLA = 'sla'
+    KIND_MERGE = 'merge'
+    KIND_CHOICES = [
+        (KIND_STATUS, 'Статус'),
+        (KIND_PRIORITY, 'Приоритет'),
+        (KIND_ASSIGNEE, 'Исполнитель'),
+        (KIND_PROJECT, 'Проект'),
+        (KIND_LEGACY, 'Запись журнала (перенесена из комментариев)'),
+        (KIND_SLA, 'SLA'),
+        (KIND_MERGE, 'Объединение дубликатов'),
+    ]
+    ticket = models.ForeignKey(Ticket, on_delete=models.CASCADE, related_name='events', verbose_name="Тикет")
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES, verbose_name="Что изменилось")
+    old_value_id = models.PositiveBigIntegerField(null=True, blank=True, verbose_name="Старое значение (pk)")
+    old_value_display = models.CharField(max_length=255, blank=True, verbose_name="Старое значение")
+    new_value_id = models.PositiveBigIntegerField(null=True, blank=True, verbose_name="Новое значение (pk)")
+    new_value_display = models.CharField(max_length=255, blank=True, verbose_name="Новое значение")
+    actor = models.ForeignKey(Agent, on_delete=models.SET_NULL, null=True, blank=True, related_name='ticket_events', verbose_name="Кто изменил (сотрудник)")
+    actor_name = models.CharField(max_length=255, blank=True, verbose_name="Кто изменил (для отображения)")
+    note = models.TextField(blank=True, verbose_name="Комментарий к изменению")
+    source_comment = models.OneToOneField(
+        'Comment', on_delete=models.SET_NULL, null=True, blank=True, related_name='ticket_event',
+        verbose_name="Исходный комментарий", help_text="Служебный комментарий, из которого запись перенесена командой backfill_ticket_events."
+    )
+    created_at = models.DateTimeField(default=timezone.now, verbose_name="Дата изменения")
+
+    class Meta:
+        ordering = ['-created_at', '-id']
+        verbose_name = "Событие истории тикета"
+        verbose_name_plural = "История изменений тикетов"
+        indexes = [models.Index(fields=['ticket', 'created_at'], name='ticket_event_ticket_idx')]
+
+    def __str__(self):
+        return f"{self.ticket_id}: {self.summary}"
+
+    @property
+    def actor_display(self):
+        if self.actor: return self.actor.get_full_name() or self.actor.username
+        return self.actor_name or "Система"
+
+    @property
+    def summary(self):
+        if self.kind == self.KIND_LEGACY: return '' # текст перенесенной записи целиком в note
+        old_value = self.old_value_display or "не задано"
+        new_value = self.new_value_display or "не задано"
+        return f"{self.get_kind_display()}: '{old_value}' → '{new_value}'"
+
 def ticket_attachment_path(instance, filename):
     now = timezone.now(); path_parts = ['ticket_attachments', str(now.year), str(now.month).zfill(2)]
     ticket_obj = instance.ticket or (instance.comment and instance.comment.ticket)
@@ -292,10 +736,31 @@ def ticket_attachment_path(instance, filename):
     safe_filename = os.path.basename(filename); path_parts.append(safe_filename)
     return os.path.join(*path_parts)
 
+class AttachmentBlob(models.Model):
+    # Содержимое вложения, хранящееся один раз (tickets/blobstore.py). ref_count - число вложений,
+    # ссылающихся на блоб; блобы с ref_count = 0 удаляет gc_attachment_blobs.
+    sha256 = models.CharField(max_length=64, unique=True, verbose_name="SHA-256")
+    file_name = models.CharField(max_length=255, verbose_name="Путь в хранилище")
+    size = models.PositiveBigIntegerField(default=0, verbose_name="Размер, байт")
+    ref_count = models.IntegerField(default=0, verbose_name="Ссылок")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="Создан")
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="Изменен")
+
+    class Meta:
+        verbose_name = "Содержимое вложения"
+        verbose_name_plural = "Содержимое вложений"
+
+    def __str__(self):
+        return f"{self.sha256[:12]} ({self.ref_count} ссылок)"
+
 class Attachment(models.Model):
     ticket = models.ForeignKey(Ticket, on_delete=models.CASCADE, related_name='attachments', verbose_name="Тикет", null=True, blank=True)
     comment = models.ForeignKey(Comment, on_delete=models.CASCADE, related_name='attachments', verbose_name="Комментарий", null=True, blank=True)
-    file = models.FileField(upload_to=ticket_attachment_path, verbose_name="Файл")
+    # Файл пишется в хранилище блобов под именем SHA-256 содержимого; старые вложения (до переноса
+    # командой migrate_attachment_blobs) остаются по путям ticket_attachment_path
+    file = models.FileField(upload_to=blob_upload_to, storage=attachment_storage, max_length=255, verbose_name="Файл")
+    original_name = models.CharField(max_length=255, blank=True, verbose_name="Исходное имя файла")
+    blob = models.ForeignKey(AttachmentBlob, on_delete=models.PROTECT, null=True, blank=True, related_name='attachments', verbose_name="Содержимое")
     uploaded_by_agent = models.ForeignKey(Agent, on_delete=models.SET_NULL, null=True, blank=True, related_name='uploaded_attachments', verbose_name="Загрузил (сотрудник)")
     uploaded_by_name_display = models.CharField(max_length=255, blank=True, verbose_name="Загрузил (имя для отображения)")
     uploaded_at = models.DateTimeField(auto_now_add=True, verbose_name="Дата загрузки")
@@ -303,15 +768,31 @@ class Attachment(models.Model):
     def save(self, *args, **kwargs):
         if self.uploaded_by_agent and not self.uploaded_by_name_display:
             self.uploaded_by_name_display = self.uploaded_by_agent.get_full_name() or self.uploaded_by_agent.username
-        super().save(*args, **kwargs)
+        is_new_file = bool(self.file) and not self.file._committed
+        if not is_new_file:
+            super().save(*args, **kwargs); return
+        if not self.original_name: self.original_name = os.path.basename(self.file.name)[:255]
+        content = self.file.file; old_blob_id = self.blob_id
+        with transaction.atomic():
+            # Ссылка на блоб добавляется в одной транзакции со строкой вложения
+            self.file.save(self.original_name, content, save=False)
+            self.blob = acquire_blob(self.file.name, self.file.size)
+            if not self.file.storage.exists(self.file.name): # блоб удалили сборщиком мусора между проверкой и ссылкой
+                content.seek(0); self.file.storage.save(self.file.name, content)
+            super().save(*args, **kwargs)
+            if old_blob_id and old_blob_id != self.blob_id: release_blob(old_blob_id)
 
     class Meta: 
         ordering = ['-uploaded_at']
         verbose_name = "Вложение"
         verbose_name_plural = "Вложения"
 
+    @property
+    def display_name(self):
+        return self.original_name or (os.path.basename(self.file.name) if self.file else "")
+
     def __str__(self): 
-        return os.path.basename(self.file.name) if self.file else "Пустое вложение"
+        return self.display_name or "Пустое вложение"
 
 # ------------------- Модели для Настроек Email Уведомлений -------------------
 class EmailSettings(models.Model):
@@ -343,6 +824,19 @@ class EmailSettings(models.Model):
     def __str__(self):
         return f"Настройки Email (SMTP) - {'Активны' if self.is_active else 'Неактивны'}"
 
+    @classmethod
+    def get_active(cls):
+        return cls.objects.filter(is_active=True).first()
+
+    def get_connection(self, **kwargs):
+        from django.core.mail.backends.smtp import EmailBackend as SMTPEmailBackend
+        kwargs.setdefault('fail_silently', False)
+        return SMTPEmailBackend(
+            host=self.smtp_host, port=self.smtp_port,
+            username=self.smtp_user, password=self.smtp_password,
+            use_tls=self.use_tls, use_ssl=self.use_ssl, **kwargs
+        )
+
     def clean(self):
         if self.use_tls and self.use_ssl:
             raise ValidationError("Нельзя одновременно использовать STARTTLS и SSL/TLS (прямое соединение). Выберите что-то одно.")
@@ -370,6 +864,7 @@ class NotificationTemplate(models.Model):
             ('agent', 'Агент (исполнитель)'),
             ('project_email', 'Email проекта'),
             ('all_project_agents', 'Все агенты проекта'),
+            ('sla_escalation', 'Ответственный за эскалацию SLA'),
         ],
         verbose_name="Тип получателя"
     )
@@ -382,6 +877,7 @@ class NotificationTemplate(models.Model):
         verbose_name="Шаблон тела письма (HTML)",
         help_text="Можно использовать переменные Django шаблонов. Например: <p>Заявка {{ ticket.title }} создана.</p>"
     )
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="Дата изменения") # входит в ключ кэша скомпилированных шаблонов
 
     class Meta:
         ordering = ['name']
@@ -391,15 +887,65 @@ class NotificationTemplate(models.Model):
     def __str__(self):
         return f"{self.name} ({self.event_code}) - {'Активно' if self.is_active else 'Неактивно'}"
 
+    def get_compiled(self):
+        from .template_cache import compiled_notification_templates
+        return compiled_notification_templates.get(self)
+
     def render_subject(self, context_data):
-        template = DjangoTemplate(self.subject_template)
-        context = Context(context_data)
-        return template.render(context)
+        return self.get_compiled().subject.render(Context(context_data))
 
     def render_body_html(self, context_data):
-        template = DjangoTemplate(self.body_template_html)
-        context = Context(context_data)
-        return template.render(context)
+        return self.get_compiled().body_html.render(Context(context_data))
+
+    def render_many(self, contexts, base_context=None):
+        """
+        Рендерит тему и тело для списка контекстов получателей (шаблон компилируется один раз).
+        base_context - общие для всех получателей переменные. Возвращает список пар (тема, тело).
+        """
+        compiled = self.get_compiled()
+        context = Context(base_context or {})
+        rendered = []
+        for context_data in contexts:
+            with context.push(context_data):
+                rendered.append((compiled.subject.render(context), compiled.body_html.render(context)))
+        return rendered
+
+# ------------------- Очередь исходящих уведомлений -------------------
+class NotificationOutbox(models.Model):
+    # Одна запись на событие тикета. Запись создается в запросе (один INSERT), письма по шаблонам
+    # NotificationTemplate формирует и отправляет воркер: python manage.py send_notifications
+    STATUS_PENDING = 'pending'
+    STATUS_SENDING = 'sending' # забрано воркером; next_attempt_at - срок, после которого запись снова можно забрать
+    STATUS_SENT = 'sent'
+    STATUS_FAILED = 'failed'
+    STATUS_SKIPPED = 'skipped'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'Ожидает отправки'),
+        (STATUS_SENDING, 'Отправляется'),
+        (STATUS_SENT, 'Отправлено'),
+        (STATUS_FAILED, 'Ошибка (попытки исчерпаны)'),
+        (STATUS_SKIPPED, 'Пропущено'),
+    ]
+    event = models.CharField(max_length=100, verbose_name="Событие", help_text="Например, 'new_ticket' - подходят шаблоны 'new_ticket' и 'new_ticket_for_*'.")
+    ticket = models.ForeignKey(Ticket, on_delete=models.CASCADE, related_name='notifications', verbose_name="Тикет")
+    comment = models.ForeignKey('Comment', on_delete=models.CASCADE, null=True, blank=True, related_name='notifications', verbose_name="Комментарий")
+    payload = models.JSONField(default=dict, blank=True, verbose_name="Данные события")
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_PENDING, verbose_name="Состояние")
+    attempts = models.PositiveIntegerField(default=0, verbose_name="Попыток отправки")
+    next_attempt_at = models.DateTimeField(default=timezone.now, verbose_name="Следующая попытка")
+    delivered = models.JSONField(default=list, blank=True, verbose_name="Уже доставлено", help_text="Ключи 'шаблон:email', чтобы при повторе не отправлять письма дважды.")
+    last_error = models.TextField(blank=True, verbose_name="Последняя ошибка")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="Создано")
+    sent_at = models.DateTimeField(null=True, blank=True, verbose_name="Отправлено")
+
+    class Meta:
+        ordering = ['-created_at']
+        verbose_name = "Уведомление в очереди"
+        verbose_name_plural = "Очередь уведомлений"
+        indexes = [models.Index(fields=['status', 'next_attempt_at'], name='notification_outbox_due_idx')]
+
+    def __str__(self):
+        return f"{self.event} / тикет {self.ticket_id} - {self.get_status_display()}"
 
 # ------------------- Модель для Жалоб и Предложений -------------------
 class Feedback(models.Model):
@@ -0,0 +1,213 @@
+# tickets/notifications.py
+# Email уведомления о событиях тикетов.
+# Представления только ставят событие в очередь (NotificationOutbox, один INSERT в той же транзакции:
+# изменение заявки, запись истории и событие представления выполняют в одном transaction.atomic),
+# поэтому время ответа агенту не зависит от SMTP. Воркер (python manage.py send_notifications) забирает
+# события пакетами, подбирает шаблоны NotificationTemplate и получателей и отправляет письма через одно
+# переиспользуемое SMTP-соединение. Неудачные отправки повторяются с экспоненциальной задержкой.
+# Записи забираются короткой транзакцией (статус 'sending' со сроком CLAIM_SECONDS), письма отправляются
+# уже без транзакции и блокировок; если воркер упал, по истечении срока запись забирает другой.
+# Без активных настроек EmailSettings очередь не трогается - события ждут, пока отправку не включат.
+# Шаблон подходит к событию, если его event_code равен событию или начинается с '<событие>_for_'
+# (например, 'new_comment_for_user' и 'new_comment_for_agent' для события 'new_comment').
+import random
+import smtplib
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives
+from django.db import transaction
+from django.db.models import Q
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.html import strip_tags
+from django.utils.http import urlencode
+
+from .models import Agent, Comment, NotificationOutbox, NotificationTemplate, Ticket
+
+# --- События ---
+EVENT_NEW_TICKET = 'new_ticket'
+EVENT_NEW_COMMENT = 'new_comment'
+EVENT_STATUS_CHANGED = 'status_changed'
+EVENT_PRIORITY_CHANGED = 'priority_changed'
+EVENT_ASSIGNEE_CHANGED = 'assignee_changed'
+EVENT_PROJECT_CHANGED = 'project_changed'
+EVENT_SLA_AT_RISK = 'sla_at_risk' # ставит планировщик run_sla_scheduler (tickets/sla.py)
+EVENT_SLA_BREACHED = 'sla_breached'
+
+# --- Повторы ---
+RETRY_BASE_SECONDS = 60
+RETRY_MAX_SECONDS = 6 * 3600
+DEFAULT_MAX_ATTEMPTS = 8
+LAST_ERROR_MAX_LENGTH = 2000
+SMTP_TIMEOUT_SECONDS = 30
+CLAIM_SECONDS = 30 * 60 # больше, чем пакет может отправляться при таймаутах SMTP
+
+def enqueue_notification(event, ticket, comment=None, actor_email=None, **payload):
+    """
+    Ставит событие тикета в очередь уведомлений. actor_email - email того, кто вызвал событие:
+    ему письмо по этому событию не отправляется. Остальные именованные аргументы попадают
+    в контекст шаблона (должны сериализоваться в JSON).
+    """
+    if actor_email: payload['actor_email'] = actor_email
+    return NotificationOutbox.objects.create(event=event, ticket=ticket, comment=comment, payload=payload)
+
+def template_matches(template, event):
+    return template.event_code == event or template.event_code.startswith(f"{event}_for_")
+
+def retry_delay_seconds(attempts):
+    # 1, 2, 4, 8 ... минут, не больше RETRY_MAX_SECONDS; разброс +-20%, чтобы повторы не шли пачкой
+    delay = min(RETRY_MAX_SECONDS, RETRY_BASE_SECONDS * 2 ** max(attempts - 1, 0))
+    return delay * random.uniform(0.8, 1.2)
+
+def get_site_url():
+    return getattr(settings, 'HELPDESK_SITE_URL', '').rstrip('/')
+
+
+class NotificationDispatcher:
+    """Отправка событий из очереди. Один экземпляр держит одно SMTP-соединение на все пакеты."""
+
+    def __init__(self, email_settings, batch_size=50, max_attempts=DEFAULT_MAX_ATTEMPTS):
+        self.email_settings = email_settings
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.connection = email_settings.get_connection(timeout=SMTP_TIMEOUT_SECONDS)
+        self.site_url = get_site_url()
+        self.sent = 0
+        self.errors = 0
+
+    # --- Соединение ---
+    def open(self):
+        self.connection.open()
+
+    def close(self):
+        try: self.connection.close()
+        except Exception: pass
+
+    def _send(self, message):
+        if self.connection.connection is None: self.open() # соединение открывается один раз и переиспользуется
+        try: return self.connection.send_messages([message])
+        except smtplib.SMTPServerDisconnected:
+            # Сервер закрыл простаивающее соединение - переподключаемся один раз
+            self.close(); self.connection.open()
+            return self.connection.send_messages([message])
+
+    # --- Получатели и письма ---
+    def _recipients(self, template, ticket, comment, project_agents, payload):
+        recipient_type = template.recipient_type
+        if recipient_type == 'user':
+            if comment is not None and comment.is_internal: return []
+            return [(ticket.reporter_email, None)] if ticket.reporter_email else []
+        if recipient_type == 'agent':
+            return [(ticket.assignee.email, ticket.assignee)] if ticket.assignee and ticket.assignee.email else []
+        if recipient_type == 'project_email':
+            return [(ticket.project.project_email, None)] if ticket.project and ticket.project.project_email else []
+        if recipient_type == 'all_project_agents':
+            return [(agent.email, agent) for agent in project_agents.get(ticket.project_id, [])]
+        if recipient_type == 'sla_escalation':
+            return [(payload['escalate_to_email'], None)] if payload.get('escalate_to_email') else []
+        return []
+
+    def _ticket_url(self, ticket, for_reporter):
+        if for_reporter:
+            path = reverse('tickets:check_ticket_status') + '?' + urlencode({'ticket_number': ticket.ticket_id_display, 'reporter_email': ticket.reporter_email})
+        else:
+            path = reverse('tickets:agent_ticket_detail', kwargs={'ticket_pk': ticket.pk})
+        return f"{self.site_url}{path}"
+
+    def build_base_context(self, entry, ticket, comment):
+        context = dict(entry.payload)
+        context.update({'event': entry.event, 'ticket': ticket, 'comment': comment, 'site_url': self.site_url})
+        return context
+
+    def build_recipient_context(self, ticket, comment, recipient_agent, for_reporter):
+        ticket_url = self._ticket_url(ticket, for_reporter)
+        return {
+            'user': recipient_agent, 'ticket_url': ticket_url,
+            'comment_url': f"{ticket_url}#comment-{comment.pk}" if comment is not None else ticket_url,
+        }
+
+    def build_message(self, subject, body_html, email):
+        message = EmailMultiAlternatives(' '.join(subject.split()), strip_tags(body_html), self.email_settings.default_from_email, [email], connection=self.connection)
+        message.attach_alternative(body_html, 'text/html')
+        return message
+
+    # --- Обработка очереди ---
+    def _process_entry(self, entry, ticket, comment, templates, project_agents, now):
+        matching_templates = [t for t in templates if template_matches(t, entry.event)]
+        if not matching_templates:
+            entry.status = NotificationOutbox.STATUS_SKIPPED; entry.last_error = "Нет активных шаблонов для события."
+            return
+        actor_email = (entry.payload.get('actor_email') or '').lower()
+        delivered = set(entry.delivered); errors = []
+        base_context = self.build_base_context(entry, ticket, comment)
+        for template in matching_templates:
+            recipients = []
+            for email, recipient_agent in self._recipients(template, ticket, comment, project_agents, entry.payload):
+                key = f"{template.event_code}:{email.lower()}"
+                if key in delivered or email.lower() == actor_email: continue
+                recipients.append((key, email, recipient_agent))
+            if not recipients: continue
+            # Шаблон компилируется один раз (кэш) и рендерится сразу для всех получателей
+            try:
+                rendered = template.render_many(
+                    [self.build_recipient_context(ticket, comment, agent, for_reporter=template.recipient_type == 'user') for _, _, agent in recipients],
+                    base_context=base_context,
+                )
+            except Exception as e:
+                errors.append(f"{template.event_code}: ошибка шаблона: {e}"); self.errors += 1; continue
+            for (key, email, _), (subject, body_html) in zip(recipients, rendered):
+                try:
+                    self._send(self.build_message(subject, body_html, email))
+                    delivered.add(key); self.sent += 1
+                except Exception as e:
+                    errors.append(f"{key}: {e}"); self.errors += 1
+        entry.delivered = sorted(delivered)
+        if not errors:
+            entry.status = NotificationOutbox.STATUS_SENT; entry.sent_at = now; entry.last_error = ''
+            return
+        entry.attempts += 1
+        entry.last_error = '\n'.join(errors)[:LAST_ERROR_MAX_LENGTH]
+        if entry.attempts >= self.max_attempts: entry.status = NotificationOutbox.STATUS_FAILED
+        else: entry.next_attempt_at = now + timedelta(seconds=retry_delay_seconds(entry.attempts))
+
+    def claim_batch(self, now):
+        """Забирает пакет готовых к отправке событий: короткая транзакция, дальше записи принадлежат этому воркеру."""
+        with transaction.atomic():
+            # skip_locked: несколько воркеров не забирают одни и те же записи
+            entries = list(
+                NotificationOutbox.objects.select_for_update(skip_locked=True)
+                .filter(Q(status=NotificationOutbox.STATUS_PENDING) | Q(status=NotificationOutbox.STATUS_SENDING), next_attempt_at__lte=now)
+                .order_by('next_attempt_at', 'pk')[:self.batch_size]
+            )
+            if entries:
+                NotificationOutbox.objects.filter(pk__in=[e.pk for e in entries]).update(
+                    status=NotificationOutbox.STATUS_SENDING, next_attempt_at=now + timedelta(seconds=CLAIM_SECONDS)
+                )
+        return entries
+
+    def process_batch(self):
+        """Обрабатывает один пакет готовых к отправке событий. Возвращает число обработанных записей."""
+        now = timezone.now()
+        entries = self.claim_batch(now)
+        if not entries: return 0
+        tickets = Ticket.objects.select_related('project', 'status', 'priority', 'category', 'assignee').in_bulk({e.ticket_id for e in entries})
+        comments = Comment.objects.select_related('author_agent').in_bulk({e.comment_id for e in entries if e.comment_id})
+        templates = list(NotificationTemplate.objects.filter(is_active=True))
+        project_agents = {}
+        if any(t.recipient_type == 'all_project_agents' for t in templates):
+            project_ids = {t.project_id for t in tickets.values() if t.project_id}
+            for agent in Agent.objects.filter(is_active=True, projects__in=project_ids).exclude(email='').prefetch_related('projects').distinct():
+                for project in agent.projects.all():
+                    if project.pk in project_ids: project_agents.setdefault(project.pk, []).append(agent)
+        for entry in entries:
+            entry.status = NotificationOutbox.STATUS_PENDING; entry.next_attempt_at = now # по умолчанию - снова в очередь
+            ticket = tickets.get(entry.ticket_id)
+            if ticket is None: entry.status = NotificationOutbox.STATUS_SKIPPED; entry.last_error = "Тикет удален."
+            else: self._process_entry(entry, ticket, comments.get(entry.comment_id), templates, project_agents, now)
+            # Результат сохраняется сразу: если воркер упадет на следующей записи, доставленное не отправится повторно
+            entry.save(update_fields=['status', 'attempts', 'next_attempt_at', 'delivered', 'last_error', 'sent_at'])
+        return len(entries)
+
+def pending_notifications_count():
+    return NotificationOutbox.objects.filter(status__in=[NotificationOutbox.STATUS_PENDING, NotificationOutbox.STATUS_SENDING]).count()
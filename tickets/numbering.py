@@ -0,0 +1,110 @@
+# tickets/numbering.py
+# Выдача номеров тикетов вида "<КОД>-<ГОД>-<00001>".
+# Номера берутся из таблицы-счетчика TicketNumberSequence: одна строка на (код проекта, год).
+# На PostgreSQL и SQLite номер (или сразу блок номеров) выдается одним запросом
+# INSERT ... ON CONFLICT DO UPDATE ... RETURNING, который сам блокирует строку счетчика,
+# поэтому параллельные заявки в один проект не получают одинаковых ID.
+# Номера, пришедшие извне (импорт из старого трекера), поднимают счетчик до себя (advance_ticket_numbers),
+# чтобы следующие выданные номера их не повторяли.
+import re
+
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import TicketNumberSequence
+
+GENERIC_PROJECT_CODE = "IT" # Код для тикетов без проекта
+
+def get_project_code(project):
+    if project is None: return GENERIC_PROJECT_CODE
+    project_code = "".join(filter(str.isalnum, project.name))[:3].upper()
+    if not project_code: project_code = f"P{project.pk}"[:3].upper()
+    return project_code
+
+TICKET_ID_RE = re.compile(r'^(\w{1,10})-(\d{4})-(\d+)$')
+
+def format_ticket_id(project_code, year, number):
+    return f"{project_code}-{year}-{str(number).zfill(5)}"
+
+def parse_ticket_id(ticket_id):
+    """(код проекта, год, номер) для номера вида format_ticket_id или None."""
+    match = TICKET_ID_RE.match(ticket_id or '')
+    if not match: return None
+    return match.group(1), int(match.group(2)), int(match.group(3))
+
+def _allocate_upsert(project_code, year, count):
+    table = connection.ops.quote_name(TicketNumberSequence._meta.db_table)
+    sql = (
+        f"INSERT INTO {table} (project_code, year, last_value) VALUES (%s, %s, %s) "
+        f"ON CONFLICT (project_code, year) DO UPDATE SET last_value = {table}.last_value + EXCLUDED.last_value "
+        f"RETURNING last_value"
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [project_code, year, count])
+        return cursor.fetchone()[0]
+
+def _allocate_locked(project_code, year, count):
+    # Для остальных СУБД: блокировка строки счетчика через SELECT ... FOR UPDATE
+    with transaction.atomic():
+        sequence, created = TicketNumberSequence.objects.select_for_update().get_or_create(
+            project_code=project_code, year=year, defaults={'last_value': count}
+        )
+        if not created:
+            TicketNumberSequence.objects.filter(pk=sequence.pk).update(last_value=F('last_value') + count)
+            sequence.refresh_from_db(fields=['last_value'])
+        return sequence.last_value
+
+def allocate_ticket_numbers(project_code, year, count=1):
+    """Резервирует count номеров подряд и возвращает последний из них."""
+    if count < 1: raise ValueError("Количество номеров должно быть положительным.")
+    if connection.vendor in ('postgresql', 'sqlite'):
+        return _allocate_upsert(project_code, year, count)
+    return _allocate_locked(project_code, year, count)
+
+def advance_ticket_numbers(project_code, year, number):
+    """Поднимает счетчик (project_code, year) до number, если он меньше; номера не выдаются."""
+    if connection.vendor in ('postgresql', 'sqlite'):
+        table = connection.ops.quote_name(TicketNumberSequence._meta.db_table)
+        sql = (
+            f"INSERT INTO {table} (project_code, year, last_value) VALUES (%s, %s, %s) "
+            f"ON CONFLICT (project_code, year) DO UPDATE SET last_value = "
+            f"CASE WHEN {table}.last_value < EXCLUDED.last_value THEN EXCLUDED.last_value ELSE {table}.last_value END"
+        )
+        with connection.cursor() as cursor: cursor.execute(sql, [project_code, year, number])
+        return
+    with transaction.atomic():
+        sequence, created = TicketNumberSequence.objects.select_for_update().get_or_create(
+            project_code=project_code, year=year, defaults={'last_value': number}
+        )
+        if not created: TicketNumberSequence.objects.filter(pk=sequence.pk, last_value__lt=number).update(last_value=number)
+
+class TicketIdBlock:
+    """
+    Заранее выделенный диапазон номеров (для массового импорта).
+    Итерация возвращает готовые строки ticket_id_display по порядку.
+    """
+    def __init__(self, project_code, year, first_number, last_number):
+        self.project_code = project_code; self.year = year
+        self.first_number = first_number; self.last_number = last_number
+
+    def __len__(self):
+        return self.last_number - self.first_number + 1
+
+    def __iter__(self):
+        for number in range(self.first_number, self.last_number + 1):
+            yield format_ticket_id(self.project_code, self.year, number)
+
+    def __repr__(self):
+        return f"<TicketIdBlock {self.project_code}-{self.year} {self.first_number}..{self.last_number}>"
+
+def reserve_ticket_ids(project, count, year=None):
+    project_code = get_project_code(project)
+    year = year or timezone.now().year
+    last_number = allocate_ticket_numbers(project_code, year, count)
+    return TicketIdBlock(project_code, year, last_number - count + 1, last_number)
+
+def allocate_ticket_id(project, year=None):
+    project_code = get_project_code(project)
+    year = year or timezone.now().year
+    return format_ticket_id(project_code, year, allocate_ticket_numbers(project_code, year, 1))
@@ -0,0 +1,126 @@
+# tickets/pagination.py
+# Keyset-пагинация (по курсору) для списков тикетов.
+# Вместо OFFSET/LIMIT и COUNT(*) страница выбирается условием "строго после/до
+# последней показанной строки" по ключу сортировки, поэтому стоимость запроса
+# не зависит от номера страницы и общего количества тикетов.
+import base64
+import binascii
+import json
+from datetime import date, datetime
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db.models import Q
+
+
+class InvalidCursor(Exception):
+    """Курсор из URL не удалось разобрать (испорчен или от другой сортировки)."""
+
+
+class KeysetPage:
+    """
+    Страница результатов. Ведет себя как список объектов (итерация, len, bool),
+    а навигацию отдает курсорами next_cursor / previous_cursor.
+    """
+    def __init__(self, object_list, has_next, has_previous, next_cursor, previous_cursor):
+        self.object_list = object_list
+        self.has_next = has_next
+        self.has_previous = has_previous
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __bool__(self):
+        return bool(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    @property
+    def has_other_pages(self):
+        return self.has_next or self.has_previous
+
+
+class KeysetPaginator:
+    """
+    ordering - последовательность полей сортировки в формате order_by
+    (например, ('is_new_status_order', '-created_at', '-id')). Набор полей должен
+    однозначно упорядочивать строки (последним обычно идет '-id') и не содержать NULL.
+    Поля могут быть как полями модели, так и аннотациями queryset.
+    """
+    def __init__(self, queryset, ordering, per_page=50):
+        self.queryset = queryset
+        self.ordering = [(name.lstrip('-'), name.startswith('-')) for name in ordering]
+        self.per_page = per_page
+
+    # --- Курсоры ---
+    def encode_cursor(self, obj):
+        values = []
+        for field_name, _ in self.ordering:
+            value = getattr(obj, field_name)
+            if isinstance(value, (datetime, date)): value = value.isoformat()
+            values.append(value)
+        raw = json.dumps(values, separators=(',', ':')).encode()
+        return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+    def decode_cursor(self, cursor):
+        try:
+            padded = cursor + '=' * (-len(cursor) % 4)
+            values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        except (binascii.Error, ValueError, UnicodeDecodeError) as e:
+            raise InvalidCursor(str(e))
+        if not isinstance(values, list) or len(values) != len(self.ordering):
+            raise InvalidCursor("Курсор не соответствует сортировке списка.")
+        model_meta = self.queryset.model._meta
+        decoded = []
+        for (field_name, _), value in zip(self.ordering, values):
+            try: model_field = model_meta.get_field(field_name)
+            except FieldDoesNotExist: model_field = None  # аннотация - значение уже в нужном виде
+            if model_field is not None:
+                try: value = model_field.to_python(value)
+                except ValidationError as e: raise InvalidCursor(str(e))
+            decoded.append(value)
+        return decoded
+
+    # --- Условия и выборка ---
+    def _order_by(self, reverse=False):
+        return [f"{'-' if descending != reverse else ''}{field_name}" for field_name, descending in self.ordering]
+
+    def _seek_filter(self, values, reverse=False):
+        # (a, b, c) > (x, y, z) с учетом направления каждого поля:
+        # a > x OR (a = x AND b > y) OR (a = x AND b = y AND c > z)
+        condition = Q(); equal_prefix = Q()
+        for (field_name, descending), value in zip(self.ordering, values):
+            lookup = 'lt' if descending != reverse else 'gt'
+            condition |= equal_prefix & Q(**{f'{field_name}__{lookup}': value})
+            equal_prefix &= Q(**{field_name: value})
+        return condition
+
+    def page(self, after=None, before=None, last=False):
+        """
+        after  - курсор последней строки предыдущей страницы (движение вперед);
+        before - курсор первой строки следующей страницы (движение назад);
+        last   - последняя страница (выбирается обратной сортировкой, без COUNT).
+        Без аргументов возвращает первую страницу.
+        """
+        if before or last:
+            queryset = self.queryset
+            if before: queryset = queryset.filter(self._seek_filter(self.decode_cursor(before), reverse=True))
+            rows = list(queryset.order_by(*self._order_by(reverse=True))[:self.per_page + 1])
+            has_previous = len(rows) > self.per_page
+            rows = rows[:self.per_page]; rows.reverse()
+            has_next = bool(before)
+        else:
+            queryset = self.queryset
+            if after: queryset = queryset.filter(self._seek_filter(self.decode_cursor(after)))
+            rows = list(queryset.order_by(*self._order_by())[:self.per_page + 1])
+            has_next = len(rows) > self.per_page
+            rows = rows[:self.per_page]
+            has_previous = bool(after)
+        next_cursor = self.encode_cursor(rows[-1]) if rows and has_next else None
+        previous_cursor = self.encode_cursor(rows[0]) if rows and has_previous else None
+        return KeysetPage(rows, has_next, has_previous, next_cursor, previous_cursor)
@@ -0,0 +1,178 @@
+# tickets/previews.py
+# Миниатюры и превью для вложений-изображений (нужен Pillow; без него превью просто не показываются).
+# - Генерация идет в пуле потоков после коммита сохранения вложения (сигнал post_save), запрос загрузки не ждет.
+# - Ключ превью - SHA-256 содержимого (у старых, не перенесенных вложений - pk и время изменения файла)
+#   и размер: одинаковые файлы в разных тикетах дают одно превью, повторная постановка в очередь ничего не делает.
+# - Превью лежат в MEDIA_ROOT/attachment_previews; общий объем ограничен PREVIEW_CACHE_MAX_BYTES,
+#   при превышении удаляются давно не запрошенные файлы (время изменения обновляется при отдаче).
+#   Удаленное превью создается заново при следующем показе страницы.
+# - Для многостраничных/анимированных изображений (GIF, TIFF) берется первый кадр.
+import os
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+
+PREVIEW_DIR = 'attachment_previews'
+PREVIEW_SIZES = {'thumb': (240, 240), 'preview': (1280, 1280)}
+PREVIEWABLE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.gif', '.webp', '.bmp', '.tif', '.tiff'}
+PREVIEW_JPEG_QUALITY = 82
+DEFAULT_CACHE_MAX_BYTES = 512 * 1024 * 1024
+DEFAULT_WORKERS = 2
+EVICT_TO_RATIO = 0.9 # после вытеснения кэш занимает не больше 90% лимита
+
+
+def pillow_available():
+    try: import PIL.Image # noqa: F401
+    except ImportError: return False
+    return True
+
+def is_previewable(attachment):
+    if not attachment.file: return False
+    return os.path.splitext(attachment.display_name or attachment.file.name)[1].lower() in PREVIEWABLE_EXTENSIONS
+
+def preview_key(attachment):
+    if attachment.blob_id: return attachment.blob.sha256
+    try: mtime = int(os.path.getmtime(attachment.file.path))
+    except OSError: mtime = 0
+    return f"a{attachment.pk}-{mtime:x}"
+
+def preview_name(attachment, size):
+    key = preview_key(attachment)
+    return f"{PREVIEW_DIR}/{key[:2]}/{key}_{size}.jpg"
+
+def render_preview(source_path, target_path, max_size):
+    """Уменьшает изображение до max_size и пишет JPEG атомарно (через временный файл)."""
+    from PIL import Image, ImageOps
+    with Image.open(source_path) as image:
+        image.seek(0) # первый кадр
+        image.draft('RGB', max_size) # JPEG декодируется сразу в уменьшенном масштабе
+        image = ImageOps.exif_transpose(image) # фото с телефона - с учетом поворота из EXIF
+        if image.mode not in ('RGB', 'L'):
+            background = Image.new('RGB', image.size, 'white')
+            rgba = image.convert('RGBA'); background.paste(rgba, mask=rgba.split()[-1]); image = background
+        image.thumbnail(max_size)
+        os.makedirs(os.path.dirname(target_path), exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(target_path), prefix='.preview-')
+        try:
+            with os.fdopen(fd, 'wb') as f: image.save(f, 'JPEG', quality=PREVIEW_JPEG_QUALITY, optimize=True)
+            os.replace(temp_path, target_path)
+        except BaseException:
+            if os.path.exists(temp_path): os.remove(temp_path)
+            raise
+    return os.path.getsize(target_path)
+
+
+class PreviewCache:
+    """Каталог превью с ограничением по объему и вытеснением давно не использованных файлов."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._total = None # байт на диске; считается при первом обращении
+        self.evictions = 0
+
+    @property
+    def root(self):
+        return os.path.join(settings.MEDIA_ROOT, PREVIEW_DIR)
+
+    @property
+    def max_bytes(self):
+        return getattr(settings, 'PREVIEW_CACHE_MAX_BYTES', DEFAULT_CACHE_MAX_BYTES)
+
+    def path(self, name):
+        return os.path.join(settings.MEDIA_ROOT, name)
+
+    def touch(self, name):
+        try: os.utime(self.path(name))
+        except OSError: pass
+
+    def _scan(self):
+        files = []
+        for dirpath, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                if filename.startswith('.'): continue
+                path = os.path.join(dirpath, filename)
+                try: stat_result = os.stat(path)
+                except OSError: continue
+                files.append((stat_result.st_mtime, stat_result.st_size, path))
+        return files
+
+    def added(self, size):
+        with self._lock:
+            if self._total is None: self._total = sum(f[1] for f in self._scan())
+            else: self._total += size
+            if self._total <= self.max_bytes: return
+            target = self.max_bytes * EVICT_TO_RATIO
+            files = sorted(self._scan()); self._total = sum(f[1] for f in files)
+            for _, file_size, path in files:
+                if self._total <= target: break
+                try: os.remove(path)
+                except OSError: continue
+                self._total -= file_size; self.evictions += 1
+
+
+class PreviewPipeline:
+    def __init__(self):
+        self.cache = PreviewCache()
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pending = set() # имена превью в очереди/в работе - повторно не ставятся
+        self._failed = set() # файлы, которые Pillow не смог открыть - не пытаемся снова до перезапуска
+        self.generated = 0
+        self.failures = 0
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                workers = getattr(settings, 'PREVIEW_WORKERS', DEFAULT_WORKERS)
+                self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='previews')
+            return self._executor
+
+    def missing(self, attachment):
+        """Имена превью вложения, которых нет на диске ({размер: имя})."""
+        if not is_previewable(attachment) or not pillow_available(): return {}
+        result = {}
+        for size in PREVIEW_SIZES:
+            name = preview_name(attachment, size)
+            if name not in self._failed and not os.path.exists(self.cache.path(name)): result[size] = name
+        return result
+
+    def schedule(self, attachment):
+        """Ставит недостающие превью в очередь; возвращает True, если что-то поставлено."""
+        jobs = self.missing(attachment)
+        if not jobs: return False
+        source_path = attachment.file.path
+        with self._lock:
+            jobs = {size: name for size, name in jobs.items() if name not in self._pending}
+            self._pending.update(jobs.values())
+        if jobs: self._get_executor().submit(self._generate, source_path, jobs)
+        return bool(jobs)
+
+    def generate_now(self, attachment):
+        jobs = self.missing(attachment)
+        if jobs: self._generate(attachment.file.path, jobs)
+        return len(jobs)
+
+    def _generate(self, source_path, jobs):
+        try:
+            for size, name in jobs.items():
+                target_path = self.cache.path(name)
+                if os.path.exists(target_path): continue # успел другой процесс
+                try: written = render_preview(source_path, target_path, PREVIEW_SIZES[size])
+                except Exception: # поврежденный или неподдерживаемый файл
+                    self._failed.add(name); self.failures += 1; continue
+                self.generated += 1
+                self.cache.added(written)
+        finally:
+            with self._lock: self._pending.difference_update(jobs.values())
+
+    def ready(self, attachment, size='thumb'):
+        if not is_previewable(attachment): return False
+        return os.path.exists(self.cache.path(preview_name(attachment, size)))
+
+    def stats(self):
+        return {'generated': self.generated, 'failures': self.failures, 'pending': len(self._pending), 'evictions': self.cache.evictions}
+
+
+preview_pipeline = PreviewPipeline()
@@ -0,0 +1,113 @@
+# tickets/reference_cache.py
+# Кэш справочников в памяти процесса: статусы, приоритеты и проекты по коду и pk.
+# Справочники маленькие и меняются только из админки, поэтому загружаются целиком
+# (три запроса) и живут до сброса. Сброс делают сигналы post_save/post_delete (tickets/signals.py).
+# Методы get_* ведут себя как objects.get(): при отсутствии записи бросают Model.DoesNotExist.
+import threading
+
+from .cache_versions import VersionStamp
+from .models import Project, TicketPriority, TicketStatus
+
+
+class _ReferenceSnapshot:
+    def __init__(self, statuses, priorities, projects):
+        self.statuses = statuses
+        self.priorities = priorities
+        self.projects = projects
+        self.status_by_code = {s.code: s for s in statuses}
+        self.status_by_pk = {s.pk: s for s in statuses}
+        self.default_statuses = [s for s in statuses if s.is_default_status]
+        self.priority_by_code = {p.code: p for p in priorities}
+        self.priority_by_pk = {p.pk: p for p in priorities}
+        self.project_by_pk = {p.pk: p for p in projects}
+
+
+class ReferenceDataRegistry:
+    def __init__(self):
+        self.stamp = VersionStamp('reference_data')
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self._snapshot_version = None
+        self.hits = 0
+        self.misses = 0
+        self.loads = 0
+
+    # --- Загрузка и сброс ---
+    def _load(self):
+        return _ReferenceSnapshot(
+            statuses=list(TicketStatus.objects.all()),
+            priorities=list(TicketPriority.objects.all()),
+            projects=list(Project.objects.all()),
+        )
+
+    def _get_snapshot(self):
+        version = self.stamp.current()
+        snapshot = self._snapshot
+        if snapshot is not None and self._snapshot_version == version:
+            self.hits += 1
+            return snapshot
+        with self._lock:
+            if self._snapshot is None or self._snapshot_version != version:
+                self._snapshot = self._load()
+                self._snapshot_version = version
+                self.loads += 1
+            self.misses += 1
+            return self._snapshot
+
+    def invalidate(self):
+        with self._lock:
+            self._snapshot = None
+        self.stamp.bump()
+
+    @property
+    def version(self):
+        return self.stamp.current()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits, 'misses': self.misses, 'loads': self.loads,
+            'hit_ratio': (self.hits / total) if total else None,
+            'version': self.version,
+        }
+
+    # --- Статусы ---
+    def get_status(self, code):
+        try: return self._get_snapshot().status_by_code[code]
+        except KeyError: raise TicketStatus.DoesNotExist(f"Статус с кодом '{code}' не найден.")
+
+    def get_status_by_pk(self, pk):
+        try: return self._get_snapshot().status_by_pk[pk]
+        except KeyError: raise TicketStatus.DoesNotExist(f"Статус с pk={pk} не найден.")
+
+    def get_default_status(self):
+        default_statuses = self._get_snapshot().default_statuses
+        if not default_statuses: raise TicketStatus.DoesNotExist("Статус по умолчанию не найден.")
+        if len(default_statuses) > 1: raise TicketStatus.MultipleObjectsReturned("Найдено несколько статусов по умолчанию.")
+        return default_statuses[0]
+
+    def statuses(self):
+        return list(self._get_snapshot().statuses)
+
+    # --- Приоритеты ---
+    def get_priority(self, code):
+        try: return self._get_snapshot().priority_by_code[code]
+        except KeyError: raise TicketPriority.DoesNotExist(f"Приоритет с кодом '{code}' не найден.")
+
+    def get_priority_by_pk(self, pk):
+        try: return self._get_snapshot().priority_by_pk[pk]
+        except KeyError: raise TicketPriority.DoesNotExist(f"Приоритет с pk={pk} не найден.")
+
+    def priorities(self):
+        return list(self._get_snapshot().priorities)
+
+    # --- Проекты ---
+    def get_project(self, pk):
+        try: return self._get_snapshot().project_by_pk[pk]
+        except KeyError: raise Project.DoesNotExist(f"Проект с pk={pk} не найден.")
+
+    def projects(self):
+        return list(self._get_snapshot().projects)
+
+
+reference_data = ReferenceDataRegistry()
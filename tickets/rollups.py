@@ -0,0 +1,259 @@
+# tickets/rollups.py
+# Ежедневные сводки для отчетов (TicketDailyRollup, TicketRollupSketch).
+# Разрез строки - (день, проект, категория, приоритет, исполнитель) на момент события:
+# - создание - день created_at; решение, закрытие, первый ответ - день resolved_at/closed_at/first_responded_at
+#   (длительности отсчитываются от created_at и попадают в суммы и в гистограммы);
+# - число открытых хранится приращениями backlog_delta: +1, когда тикет становится открытым в разрезе
+#   (создан, возвращен из закрытых, перенесен в разрез), -1 - когда перестает. Открытых на дату = сумма до нее.
+# Гистограммы - DDSketch с относительной точностью SKETCH_RELATIVE_ACCURACY: корзина задается логарифмом
+# длительности, корзины складываются, поэтому перцентиль за месяц или год - по сумме корзин за период.
+# Как и TicketCounter (tickets/counters.py), сводки обновляются в post_save тикета через F() в той же транзакции;
+# массовые загрузки учитываются add_new_tickets, а пересчет по тикетам делает backfill_ticket_rollups.
+# Пакет массовой загрузки пишется не построчными UPDATE, а одним INSERT ... ON CONFLICT DO UPDATE на таблицу
+# (как счетчики номеров в tickets/numbering.py); строки идут в порядке ключа, чтобы параллельные пакеты не
+# взаимоблокировались. На остальных СУБД - построчные приращения, как при сохранении тикета.
+import math
+from collections import defaultdict, namedtuple
+
+from django.db import connection
+from django.db.models import F, Sum
+from django.db.models.functions import TruncMonth, TruncWeek, TruncYear
+from django.utils import timezone
+
+from .models import Ticket, TicketDailyRollup, TicketRollupSketch, TicketStatus
+from .reference_cache import reference_data
+
+SKETCH_RELATIVE_ACCURACY = 0.02
+SKETCH_GAMMA = (1 + SKETCH_RELATIVE_ACCURACY) / (1 - SKETCH_RELATIVE_ACCURACY)
+_LOG_GAMMA = math.log(SKETCH_GAMMA)
+ROLLUP_FIELDS = (
+    'created_count', 'backlog_delta', 'resolved_count', 'reopened_count', 'closed_count',
+    'first_response_count', 'first_response_seconds', 'resolution_seconds',
+)
+STATE_FIELDS = ('project_id', 'category_id', 'priority_id', 'assignee_id', 'status_id', 'created_at', 'resolved_at', 'closed_at', 'first_responded_at')
+RollupState = namedtuple('RollupState', STATE_FIELDS)
+_DEFERRED = object()
+
+
+# --- Гистограммы (DDSketch) ---
+def sketch_bucket(seconds):
+    """Корзина длительности: значения до 1 с - корзина 0, дальше (gamma^(i-1), gamma^i]."""
+    return 0 if seconds <= 1 else math.ceil(math.log(seconds) / _LOG_GAMMA)
+
+def bucket_value(bucket):
+    """Оценка значения корзины с относительной ошибкой не больше SKETCH_RELATIVE_ACCURACY."""
+    return 0.0 if bucket <= 0 else 2 * SKETCH_GAMMA ** bucket / (SKETCH_GAMMA + 1)
+
+def sketch_quantiles(counts, quantiles):
+    """{квантиль: секунды} по {корзина: количество}; None, если значений нет."""
+    total = sum(counts.values())
+    if not total: return dict.fromkeys(quantiles)
+    ordered = sorted(counts.items()); result = {}
+    for q in quantiles:
+        rank = q * (total - 1); seen = 0
+        for bucket, count in ordered:
+            seen += count
+            if seen > rank: result[q] = bucket_value(bucket); break
+    return result
+
+
+# --- Состояние тикета ---
+def snapshot_state(ticket):
+    """Поля, от которых зависят сводки; None, если какие-то не загружены (.only/.defer)."""
+    values = tuple(ticket.__dict__.get(name, _DEFERRED) for name in STATE_FIELDS)
+    if any(value is _DEFERRED for value in values): return None
+    return RollupState(*values)
+
+def load_state(ticket_pk):
+    row = Ticket.objects.filter(pk=ticket_pk).values_list(*STATE_FIELDS).first()
+    return RollupState(*row) if row else None
+
+def state_from_row(row):
+    return RollupState(*(row[name] for name in STATE_FIELDS)) if row else None
+
+def _is_closed(status_id):
+    if not status_id: return False
+    try: return reference_data.get_status_by_pk(status_id).is_closed_status
+    except TicketStatus.DoesNotExist: return False
+
+def _is_open(state):
+    return state is not None and bool(state.project_id) and not _is_closed(state.status_id)
+
+def _dims(state):
+    return (state.project_id, state.category_id or 0, state.priority_id or 0, state.assignee_id or 0)
+
+def _seconds(start, end):
+    return max(int((end - start).total_seconds()), 0)
+
+
+# --- Факты ---
+class RollupFacts:
+    """Приращения строк сводок {(день, разрез): {поле: +n}} и корзин {(день, разрез, показатель, корзина): +n}."""
+
+    def __init__(self):
+        self.rows = defaultdict(lambda: dict.fromkeys(ROLLUP_FIELDS, 0))
+        self.sketch = defaultdict(int)
+
+    def add(self, moment, dims, **changes):
+        row = self.rows[(timezone.localdate(moment), dims)]
+        for field, value in changes.items(): row[field] += value
+
+    def add_duration(self, moment, dims, metric, seconds):
+        self.sketch[(timezone.localdate(moment), dims, metric, sketch_bucket(seconds))] += 1
+
+    def first_response(self, state):
+        seconds = _seconds(state.created_at, state.first_responded_at)
+        self.add(state.first_responded_at, _dims(state), first_response_count=1, first_response_seconds=seconds)
+        self.add_duration(state.first_responded_at, _dims(state), TicketRollupSketch.METRIC_FIRST_RESPONSE, seconds)
+
+    def resolution(self, state):
+        seconds = _seconds(state.created_at, state.resolved_at)
+        self.add(state.resolved_at, _dims(state), resolved_count=1, resolution_seconds=seconds)
+        self.add_duration(state.resolved_at, _dims(state), TicketRollupSketch.METRIC_RESOLUTION, seconds)
+
+    def __bool__(self):
+        return bool(self.rows or self.sketch)
+
+def change_facts(old, new, now=None):
+    """Факты одного сохранения тикета: old - состояние до (None для нового), new - после (None при удалении)."""
+    facts = RollupFacts(); now = now or timezone.now()
+    if new is not None and not new.project_id: new = None
+    if old is not None and not old.project_id: old = None
+    if old is None and new is not None: facts.add(new.created_at, _dims(new), created_count=1)
+    old_open, new_open = _is_open(old), _is_open(new)
+    moved = old is not None and new is not None and _dims(old) != _dims(new)
+    if old_open and (not new_open or moved): facts.add(now, _dims(old), backlog_delta=-1)
+    if new_open and (not old_open or moved): facts.add(new.created_at if old is None else now, _dims(new), backlog_delta=1)
+    if new is None: return facts
+    if new.first_responded_at and not (old and old.first_responded_at): facts.first_response(new)
+    if new.resolved_at and not (old and old.resolved_at): facts.resolution(new)
+    elif old and old.resolved_at and not new.resolved_at: facts.add(now, _dims(new), reopened_count=1)
+    if new.closed_at and not (old and old.closed_at): facts.add(new.closed_at, _dims(new), closed_count=1)
+    return facts
+
+def lifetime_facts(state, facts=None):
+    """Все факты тикета по его текущим полям (пересчет и массовая загрузка): разрез - текущий, история переносов не видна."""
+    facts = facts if facts is not None else RollupFacts()
+    if state is None or not state.project_id: return facts
+    dims = _dims(state); closed = _is_closed(state.status_id)
+    facts.add(state.created_at, dims, created_count=1, backlog_delta=1)
+    if closed: facts.add(state.closed_at or state.created_at, dims, backlog_delta=-1)
+    if state.first_responded_at: facts.first_response(state)
+    if state.resolved_at: facts.resolution(state)
+    if state.closed_at: facts.add(state.closed_at, dims, closed_count=1)
+    return facts
+
+
+# --- Запись ---
+def _increment(model, lookup, changes):
+    update_kwargs = {field: F(field) + value for field, value in changes.items() if value}
+    if not update_kwargs or model.objects.filter(**lookup).update(**update_kwargs): return
+    # Строки еще нет - создаем (параллельное создание не страшно) и повторяем приращение
+    model.objects.bulk_create([model(**lookup)], ignore_conflicts=True)
+    model.objects.filter(**lookup).update(**update_kwargs)
+
+def _row_lookup(day, dims):
+    project_id, category_key, priority_key, assignee_key = dims
+    return {'day': day, 'project_id': project_id, 'category_key': category_key, 'priority_key': priority_key, 'assignee_key': assignee_key}
+
+def apply_facts(facts):
+    for (day, dims), changes in facts.rows.items(): _increment(TicketDailyRollup, _row_lookup(day, dims), changes)
+    for (day, dims, metric, bucket), count in facts.sketch.items(): _increment(TicketRollupSketch, dict(_row_lookup(day, dims), metric=metric, bucket=bucket), {'count': count})
+
+def _upsert_increments(model, key_fields, value_fields, rows):
+    """rows - [(значения key_fields, значения value_fields)]: существующие строки получают приращения, недостающие создаются."""
+    table = connection.ops.quote_name(model._meta.db_table)
+    fields = [model._meta.get_field(name) for name in key_fields + value_fields]
+    columns = [connection.ops.quote_name(field.column) for field in fields]
+    updates = ", ".join(f"{column} = {table}.{column} + EXCLUDED.{column}" for column in columns[len(key_fields):])
+    batch_size = max(connection.ops.bulk_batch_size(columns, rows), 1)
+    placeholders = "(" + ", ".join(["%s"] * len(columns)) + ")"
+    with connection.cursor() as cursor:
+        for start in range(0, len(rows), batch_size):
+            batch = rows[start:start + batch_size]
+            params = [field.get_db_prep_save(value, connection) for key, values in batch for field, value in zip(fields, key + values)]
+            cursor.execute(
+                f"INSERT INTO {table} ({', '.join(columns)}) VALUES {', '.join([placeholders] * len(batch))} "
+                f"ON CONFLICT ({', '.join(columns[:len(key_fields)])}) DO UPDATE SET {updates}", params,
+            )
+
+ROW_KEY_FIELDS = ['day', 'project', 'category_key', 'priority_key', 'assignee_key']
+
+def apply_facts_bulk(facts):
+    """Приращения пакета: по одному INSERT ... ON CONFLICT на таблицу (на пакет строк) вместо запросов на каждую строку."""
+    if connection.vendor not in ('postgresql', 'sqlite'): return apply_facts(facts)
+    rows = sorted(((day, *dims), tuple(changes[field] for field in ROLLUP_FIELDS)) for (day, dims), changes in facts.rows.items())
+    if rows: _upsert_increments(TicketDailyRollup, ROW_KEY_FIELDS, list(ROLLUP_FIELDS), rows)
+    sketch = sorted(((day, *dims, metric, bucket), (count,)) for (day, dims, metric, bucket), count in facts.sketch.items())
+    if sketch: _upsert_increments(TicketRollupSketch, ROW_KEY_FIELDS + ['metric', 'bucket'], ['count'], sketch)
+
+def apply_ticket_change(old_state, new_state):
+    facts = change_facts(old_state, new_state)
+    if facts: apply_facts(facts)
+    return facts
+
+def rollup_objects(facts, since=None):
+    """Строки TicketDailyRollup и TicketRollupSketch по фактам для bulk_create (пересчет); since - только дни не раньше."""
+    rows = [TicketDailyRollup(**_row_lookup(day, dims), **changes) for (day, dims), changes in facts.rows.items() if since is None or day >= since]
+    sketch = [
+        TicketRollupSketch(**_row_lookup(day, dims), metric=metric, bucket=bucket, count=count)
+        for (day, dims, metric, bucket), count in facts.sketch.items() if since is None or day >= since
+    ]
+    return rows, sketch
+
+def add_new_tickets(tickets):
+    """Учитывает в сводках пачку новых тикетов, созданных в обход save() (bulk_create при импорте и генерации)."""
+    facts = RollupFacts()
+    for ticket in tickets: lifetime_facts(snapshot_state(ticket), facts)
+    apply_facts_bulk(facts)
+
+
+# --- Чтение для отчетов ---
+def filter_rollups(queryset, project_ids=None, category_id=None, priority_id=None, assignee_id=None):
+    if project_ids is not None: queryset = queryset.filter(project_id__in=project_ids)
+    if category_id: queryset = queryset.filter(category_key=category_id)
+    if priority_id: queryset = queryset.filter(priority_key=priority_id)
+    if assignee_id: queryset = queryset.filter(assignee_key=assignee_id)
+    return queryset
+
+REPORT_QUANTILES = (0.5, 0.9, 0.95)
+REPORT_PERIODS = {'day': F('day'), 'week': TruncWeek('day'), 'month': TruncMonth('day'), 'year': TruncYear('day')}
+
+def _report_row(period, sums, sketches):
+    row = {'period': period, **sums}
+    row['first_response_avg'] = sums['first_response_seconds'] / sums['first_response_count'] if sums['first_response_count'] else None
+    row['resolution_avg'] = sums['resolution_seconds'] / sums['resolved_count'] if sums['resolved_count'] else None
+    first_response = sketch_quantiles(sketches.get(TicketRollupSketch.METRIC_FIRST_RESPONSE, {}), REPORT_QUANTILES)
+    resolution = sketch_quantiles(sketches.get(TicketRollupSketch.METRIC_RESOLUTION, {}), REPORT_QUANTILES)
+    row['first_response_quantiles'] = [first_response[q] for q in REPORT_QUANTILES]
+    row['resolution_quantiles'] = [resolution[q] for q in REPORT_QUANTILES]
+    return row
+
+def build_report(date_from, date_to, granularity='month', **filters):
+    """
+    Отчет за [date_from, date_to] по периодам granularity: суммы фактов, открытые на конец периода,
+    средние и перцентили (REPORT_QUANTILES) времени первого ответа и решения. Три запроса к сводкам.
+    Возвращает (строки по периодам, итог за весь диапазон).
+    """
+    period = REPORT_PERIODS[granularity]
+    rollups = filter_rollups(TicketDailyRollup.objects.all(), **filters)
+    backlog = rollups.filter(day__lt=date_from).aggregate(total=Sum('backlog_delta'))['total'] or 0
+    rows = (
+        rollups.filter(day__range=(date_from, date_to)).annotate(period=period)
+        .values('period').annotate(**{field: Sum(field) for field in ROLLUP_FIELDS}).order_by('period')
+    )
+    buckets = (
+        filter_rollups(TicketRollupSketch.objects.all(), **filters).filter(day__range=(date_from, date_to)).annotate(period=period)
+        .values_list('period', 'metric', 'bucket').annotate(total=Sum('count')).order_by()
+    )
+    sketches = defaultdict(lambda: defaultdict(lambda: defaultdict(int))) # период -> показатель -> корзина -> количество
+    for row_period, metric, bucket, total in buckets:
+        sketches[row_period][metric][bucket] += total
+        sketches[None][metric][bucket] += total # итог: корзины всех периодов складываются
+    periods = []; totals = dict.fromkeys(ROLLUP_FIELDS, 0)
+    for row in rows:
+        sums = {field: row[field] or 0 for field in ROLLUP_FIELDS}
+        backlog += sums['backlog_delta']
+        for field in ROLLUP_FIELDS: totals[field] += sums[field]
+        periods.append(dict(_report_row(row['period'], sums, sketches.get(row['period'], {})), backlog=backlog))
+    return periods, dict(_report_row(None, totals, sketches.get(None, {})), backlog=backlog)
@@ -0,0 +1,86 @@
+# tickets/scope.py
+# Права сотрудника на проекты (AgentScope): привилегированный ли он и в каких проектах состоит.
+# Раньше каждое представление заново делало agent.projects.filter(is_active=True), .exists(),
+# project in agent.projects.all() и проверки is_superuser/agent_role - несколько запросов на страницу.
+# Теперь область считается один раз: в пределах запроса запоминается на объекте пользователя,
+# между запросами хранится в кэше Django (ключ по сотруднику и версии).
+# Сброс (tickets/signals.py) - новая версия в БД (VersionStamp) после коммита: изменение Agent.projects,
+# сохранение сотрудника, изменение/удаление проекта (is_active). Версию видят все процессы не позже чем
+# через CACHE_VERSION_CHECK_INTERVAL секунд - столько снятый с проекта сотрудник может сохранять доступ.
+# Удаление ключа только этого сотрудника не годится: с LocMemCache оно сработало бы лишь в своем процессе.
+from django.core.cache import cache
+
+from .cache_versions import VersionStamp
+from .models import Project
+
+SCOPE_CACHE_TIMEOUT = 60 * 60
+scope_version = VersionStamp('agent_scopes')
+
+
+class AgentScope:
+    def __init__(self, agent_id, is_privileged, active_project_ids, member_project_ids):
+        self.agent_id = agent_id
+        self.is_privileged = is_privileged # суперпользователь или администратор системы - видит все проекты
+        self.project_ids = frozenset(active_project_ids) # активные проекты сотрудника
+        self.member_project_ids = frozenset(member_project_ids) # все проекты сотрудника, включая неактивные
+
+    # --- Проверки ---
+    def can_view_project(self, project_id):
+        return self.is_privileged or project_id in self.project_ids
+
+    def is_member(self, project_id):
+        return project_id in self.member_project_ids
+
+    @property
+    def has_projects(self):
+        return self.is_privileged or bool(self.project_ids)
+
+    @property
+    def visible_project_ids(self):
+        """None - без ограничений (привилегированный пользователь), иначе frozenset id активных проектов."""
+        return None if self.is_privileged else self.project_ids
+
+    # --- Фильтры для QuerySet ---
+    def filter_tickets(self, queryset, field='project_id'):
+        return queryset if self.is_privileged else queryset.filter(**{f"{field}__in": self.project_ids})
+
+    def projects(self):
+        queryset = Project.objects.filter(is_active=True)
+        return queryset if self.is_privileged else queryset.filter(pk__in=self.project_ids)
+
+    # --- Сериализация для кэша ---
+    def to_cache(self):
+        return (self.is_privileged, sorted(self.project_ids), sorted(self.member_project_ids))
+
+    @classmethod
+    def from_cache(cls, agent_id, value):
+        is_privileged, active_project_ids, member_project_ids = value
+        return cls(agent_id, is_privileged, active_project_ids, member_project_ids)
+
+
+def _cache_key(agent_id):
+    return f"helpdesk:agent_scope:{agent_id}:{scope_version.current()}"
+
+def compute_agent_scope(agent):
+    is_privileged = agent.is_superuser or getattr(agent, 'agent_role', None) == 'system_admin'
+    active_ids = []; member_ids = []
+    for project_id, is_active in agent.projects.values_list('pk', 'is_active'):
+        member_ids.append(project_id)
+        if is_active: active_ids.append(project_id)
+    return AgentScope(agent.pk, is_privileged, active_ids, member_ids)
+
+def get_agent_scope(agent):
+    """AgentScope сотрудника: с объекта пользователя (тот же запрос), из кэша или из БД (один запрос)."""
+    scope = getattr(agent, '_agent_scope', None)
+    if scope is not None: return scope
+    key = _cache_key(agent.pk)
+    cached = cache.get(key)
+    if cached is not None: scope = AgentScope.from_cache(agent.pk, cached)
+    else:
+        scope = compute_agent_scope(agent)
+        cache.set(key, scope.to_cache(), SCOPE_CACHE_TIMEOUT)
+    agent._agent_scope = scope
+    return scope
+
+def invalidate_agent_scopes():
+    scope_version.bump()
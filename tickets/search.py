@@ -0,0 +1,132 @@
+# tickets/search.py
+# Полнотекстовый поиск тикетов для списка агента.
+# Для каждого тикета хранится поисковый документ (TicketSearchDocument), который обновляется
+# при сохранении тикета или комментария (сигналы в tickets/signals.py).
+# - PostgreSQL: tsvector с конфигурациями 'russian' и 'english', веса A-D, GIN-индекс, ранжирование ts_rank.
+# - Остальные СУБД (SQLite в тестах): инвертированный индекс TicketSearchTerm, поиск по префиксу терма,
+#   ранг - сумма весов совпавших термов.
+import re
+from collections import defaultdict
+
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector
+from django.db import connection, transaction
+from django.db.models import Case, Exists, F, FloatField, IntegerField, OuterRef, Q, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce
+
+from .models import Comment, Ticket, TicketSearchDocument, TicketSearchTerm
+
+SEARCH_CONFIGS = ('russian', 'english')
+# Веса частей документа: A - номер и тема, B - заявитель, C - описание и доп. поля, D - комментарии
+FALLBACK_WEIGHTS = {'A': 8, 'B': 4, 'C': 2, 'D': 1}
+TERM_MAX_LENGTH = 64
+MAX_QUERY_TOKENS = 8
+
+_token_re = re.compile(r'\w+', re.UNICODE)
+
+def tokenize(text):
+    text = (text or '').lower().replace('ё', 'е')
+    return [token[:TERM_MAX_LENGTH] for token in _token_re.findall(text) if len(token) > 1 or token.isdigit()]
+
+def uses_postgres_search():
+    return connection.vendor == 'postgresql'
+
+# --- Построение документа ---
+def _custom_data_text(custom_form_data):
+    if not isinstance(custom_form_data, dict): return ''
+    return ' '.join(str(value) for value in custom_form_data.values() if value not in (None, ''))
+
+# Поля тикета, из которых строится документ: сохранение с update_fields без них индекс не меняет
+INDEXED_TICKET_FIELDS = frozenset({'ticket_id_display', 'title', 'reporter_name', 'reporter_email', 'description', 'custom_form_data'})
+
+def build_document_parts(ticket, comment_bodies):
+    return {
+        'A': ' '.join(filter(None, [ticket.ticket_id_display, ticket.title])),
+        'B': ' '.join(filter(None, [ticket.reporter_name, ticket.reporter_email])),
+        'C': ' '.join(filter(None, [ticket.description, _custom_data_text(ticket.custom_form_data)])),
+        'D': '\n'.join(comment_bodies),
+    }
+
+def _postgres_vector(parts):
+    vector = None
+    for weight, text in parts.items():
+        for config in SEARCH_CONFIGS:
+            part_vector = SearchVector(Value(text), config=config, weight=weight)
+            vector = part_vector if vector is None else vector + part_vector
+    return vector
+
+def _fallback_terms(ticket_id, parts):
+    weights = defaultdict(int)
+    for weight_letter, text in parts.items():
+        for token in tokenize(text): weights[token] += FALLBACK_WEIGHTS[weight_letter]
+    return [TicketSearchTerm(ticket_id=ticket_id, term=term, weight=weight) for term, weight in weights.items()]
+
+def index_tickets(ticket_ids):
+    """Пересобирает поисковые документы указанных тикетов (для сигналов и массовой индексации)."""
+    ticket_ids = list(ticket_ids)
+    if not ticket_ids: return 0
+    tickets = Ticket.objects.filter(pk__in=ticket_ids).only(
+        'pk', 'ticket_id_display', 'title', 'reporter_name', 'reporter_email', 'description', 'custom_form_data'
+    )
+    comments_by_ticket = defaultdict(list)
+    for ticket_id, body in Comment.objects.filter(ticket_id__in=ticket_ids).order_by('created_at').values_list('ticket_id', 'body'):
+        comments_by_ticket[ticket_id].append(body)
+
+    documents = []; terms = []; vectors = {}
+    for ticket in tickets:
+        parts = build_document_parts(ticket, comments_by_ticket[ticket.pk])
+        documents.append(TicketSearchDocument(ticket_id=ticket.pk, content='\n'.join(parts.values())))
+        if uses_postgres_search(): vectors[ticket.pk] = _postgres_vector(parts)
+        else: terms.extend(_fallback_terms(ticket.pk, parts))
+
+    with transaction.atomic():
+        TicketSearchDocument.objects.bulk_create(
+            documents, update_conflicts=True, unique_fields=['ticket'], update_fields=['content', 'updated_at']
+        )
+        if uses_postgres_search():
+            for ticket_id, vector in vectors.items():
+                TicketSearchDocument.objects.filter(pk=ticket_id).update(search_vector=vector)
+        else:
+            TicketSearchTerm.objects.filter(ticket_id__in=ticket_ids).delete()
+            TicketSearchTerm.objects.bulk_create(terms, batch_size=1000)
+    return len(documents)
+
+def index_ticket(ticket_id):
+    return index_tickets([ticket_id])
+
+def schedule_ticket_reindex(ticket_id):
+    # Индексируем после коммита, чтобы прочитать уже сохраненные данные
+    transaction.on_commit(lambda: index_ticket(ticket_id))
+
+# --- Поиск ---
+def search_tickets(queryset, search_query):
+    """
+    Фильтрует queryset тикетов по строке поиска и добавляет аннотацию search_rank
+    (чем больше, тем релевантнее). Точное совпадение номера тикета всегда идет первым.
+    """
+    search_query = (search_query or '').strip()
+    tokens = tokenize(search_query)[:MAX_QUERY_TOKENS]
+    exact_id_match = Q(ticket_id_display__iexact=search_query)
+    if not tokens:
+        return queryset.filter(ticket_id_display__icontains=search_query).annotate(search_rank=Value(0.0, output_field=FloatField()))
+
+    if uses_postgres_search():
+        raw_query = ' & '.join(f"{token}:*" for token in tokens)
+        ts_query = None
+        for config in SEARCH_CONFIGS:
+            config_query = SearchQuery(raw_query, config=config, search_type='raw')
+            ts_query = config_query if ts_query is None else ts_query | config_query
+        queryset = queryset.filter(Q(search_document__search_vector=ts_query) | exact_id_match)
+        text_rank = Coalesce(SearchRank(F('search_document__search_vector'), ts_query), Value(0.0), output_field=FloatField())
+    else:
+        for token in tokens:
+            queryset = queryset.filter(
+                Q(Exists(TicketSearchTerm.objects.filter(ticket=OuterRef('pk'), term__startswith=token))) | exact_id_match
+            )
+        token_match = Q()
+        for token in tokens: token_match |= Q(term__startswith=token)
+        weight_sum = TicketSearchTerm.objects.filter(token_match, ticket=OuterRef('pk')).order_by().values('ticket').annotate(total=Sum('weight')).values('total')
+        text_rank = Coalesce(Subquery(weight_sum, output_field=IntegerField()), Value(0), output_field=FloatField())
+
+    return queryset.annotate(search_rank=Case(
+        When(exact_id_match, then=Value(1000000.0)), default=text_rank, output_field=FloatField()
+    ))
@@ -0,0 +1,309 @@
+# tickets/seeding.py
+# Генерация правдоподобного набора данных для нагрузочных замеров (команда seed_helpdesk).
+# - Проекты, категории со схемами дополнительных полей (FieldTemplate/CustomFormField), сотрудники.
+# - Тикеты с комментариями и вложениями пишутся пакетами через bulk_create, как при импорте
+#   (tickets/importer.py): номера - блоком на пакет (reserve_ticket_ids), счетчики TicketCounter -
+#   counters.add_new_tickets, сводки для отчетов - rollups.add_new_tickets, поисковый индекс - index_tickets после коммита пакета.
+# - Вложения ссылаются на небольшой набор общих блобов (как одинаковые скриншоты в живой базе),
+#   поэтому миллионы вложений не занимают место на диске.
+# Все сгенерированные объекты помечаются префиксом SEED_PREFIX в имени, чтобы их можно было найти и удалить.
+import random
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import date, timedelta
+
+from django import forms
+from django.core.files.base import ContentFile
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from . import counters, rollups
+from .blobstore import attachment_storage, sha256_from_name
+from .models import (
+    Agent, Attachment, AttachmentBlob, Comment, CustomFormField, FieldTemplate, Project, Ticket,
+    TicketCategory, TicketPriority, TicketStatus
+)
+from .numbering import reserve_ticket_ids
+from .reference_cache import reference_data
+from .search import index_tickets
+
+SEED_PREFIX = 'seed'
+DEFAULT_BATCH_SIZE = 2000
+
+# Справочники на случай пустой базы (код, название, цвет, по умолчанию, решен, закрыт, доля среди тикетов)
+DEFAULT_STATUSES = [
+    ('new', "Новая", '#0d6efd', True, False, False, 10),
+    ('in_progress', "В работе", '#fd7e14', False, False, False, 15),
+    ('needs_rework', "Требуется доработка", '#dc3545', False, False, False, 3),
+    ('resolved', "Решена", '#198754', False, True, False, 12),
+    ('closed', "Закрыта", '#6c757d', False, True, True, 60),
+]
+DEFAULT_PRIORITIES = [('LOW', "Низкий", '#adb5bd', 20), ('NORMAL', "Обычный", '#0dcaf0', 60), ('HIGH', "Высокий", '#fd7e14', 15), ('CRITICAL', "Критический", '#dc3545', 5)]
+CLOSED_STATUS_WEIGHT = 60 # вес закрытых статусов, которых нет в DEFAULT_STATUSES
+
+# Библиотека полей: имя -> (метка, тип, варианты). title/description - стандартные поля тикета.
+SEED_FIELD_TEMPLATES = {
+    'title': ("Тема", 'char', None),
+    'description': ("Описание проблемы", 'text', None),
+    'reporter_phone': ("Телефон", 'char', None),
+    'reporter_building': ("Корпус", 'char', None),
+    'reporter_room': ("Кабинет", 'char', None),
+    'reporter_department': ("Подразделение", 'char', None),
+    'inventory_number': ("Инвентарный номер", 'char', None),
+    'device_type': ("Тип устройства", 'select', {'printer': "Принтер", 'mfu': "МФУ", 'pc': "Компьютер", 'laptop': "Ноутбук", 'phone': "Телефон"}),
+    'os_version': ("Операционная система", 'select', {'win10': "Windows 10", 'win11': "Windows 11", 'astra': "Astra Linux", 'macos': "macOS"}),
+    'error_date': ("Дата появления проблемы", 'date', None),
+    'affected_users': ("Сколько пользователей затронуто", 'int', None),
+    'is_blocking': ("Работа остановлена", 'bool', None),
+    'contact_email': ("Дополнительный email", 'email', None),
+}
+OPTIONAL_FIELD_NAMES = [name for name in SEED_FIELD_TEMPLATES if name not in ('title', 'description')]
+
+PROJECT_NAMES = ["Техническая поддержка", "Сеть", "Бухгалтерия", "Кадры", "Хозяйственная часть", "Телефония", "Учебный отдел", "Склад", "Безопасность", "Разработка"]
+CATEGORY_NAMES = ["Принтеры", "Компьютеры", "Доступ", "Почта", "Программы", "Оборудование", "Мебель", "Телефоны", "Учетные записи", "Прочее"]
+FIRST_NAMES = ["Иван", "Петр", "Анна", "Мария", "Сергей", "Ольга", "Алексей", "Елена", "Дмитрий", "Наталья"]
+LAST_NAMES = ["Иванов", "Петров", "Смирнов", "Кузнецов", "Попов", "Соколов", "Лебедев", "Козлов", "Новиков", "Морозов"]
+DEPARTMENTS = ["Бухгалтерия", "Отдел кадров", "Приемная", "Склад", "Лаборатория", "Деканат", "Канцелярия"]
+SUBJECTS = ["Не печатает принтер", "Не работает интернет", "Нет доступа к папке", "Сломалась мышь", "Не открывается почта",
+            "Ошибка при входе в систему", "Нужно установить программу", "Зависает компьютер", "Не работает телефон", "Замена картриджа"]
+WORDS = ("после обновления перестало работать сообщение ошибка при запуске компьютер сеть принтер бумага замятие "
+         "пароль доступ папка сервер почта вложение картридж монитор клавиатура звонок кабинет срочно очень просим").split()
+
+
+def seed_name(kind, number):
+    return f"{SEED_PREFIX}-{kind}-{number:03d}"
+
+def random_text(rng, min_words, max_words):
+    return ' '.join(rng.choice(WORDS) for _ in range(rng.randint(min_words, max_words))).capitalize() + '.'
+
+def random_person(rng):
+    return f"{rng.choice(LAST_NAMES)} {rng.choice(FIRST_NAMES)}"
+
+def random_email(rng, population=50000):
+    return f"user{rng.randrange(population)}@example.com"
+
+def sample_field_value(field, rng):
+    """Правдоподобное значение для поля формы (в виде, в котором оно приходит из POST)."""
+    if isinstance(field, forms.ChoiceField):
+        values = [value for value, _ in field.choices if value != '']
+        return rng.choice(values) if values else ''
+    if isinstance(field, forms.BooleanField): return 'on' if field.required or rng.random() < 0.3 else ''
+    if isinstance(field, forms.IntegerField): return str(rng.randint(1, 50))
+    if isinstance(field, forms.DateField): return (date.today() - timedelta(days=rng.randint(0, 30))).isoformat()
+    if isinstance(field, forms.EmailField): return random_email(rng)
+    if isinstance(field, forms.FileField): return None
+    if isinstance(field.widget, forms.Textarea): return random_text(rng, 10, 60)
+    return random_text(rng, 2, 6)[:60]
+
+def sample_form_data(form_class, rng):
+    """Данные POST для формы создания тикета (класс из get_ticket_create_form_class)."""
+    data = {}
+    for name, field in form_class.base_fields.items():
+        value = sample_field_value(field, rng)
+        if value not in (None, ''): data[name] = value
+    data['reporter_name'] = random_person(rng); data['reporter_email'] = random_email(rng)
+    if 'title' in data: data['title'] = rng.choice(SUBJECTS)
+    return data
+
+
+@contextmanager
+def explicit_timestamps(model):
+    """Отключает auto_now/auto_now_add модели на время bulk_create, чтобы записать заданные даты
+    одним INSERT (bulk_update после вставки на больших пакетах в разы медленнее). Только для команд:
+    флаги меняются на уровне класса и видны всем потокам процесса."""
+    fields = [f for f in model._meta.concrete_fields if getattr(f, 'auto_now', False) or getattr(f, 'auto_now_add', False)]
+    saved = [(f, f.auto_now, f.auto_now_add) for f in fields]
+    for f in fields: f.auto_now = f.auto_now_add = False
+    try: yield
+    finally:
+        for f, auto_now, auto_now_add in saved: f.auto_now = auto_now; f.auto_now_add = auto_now_add
+
+
+class HelpdeskSeeder:
+    def __init__(self, seed=1, batch_size=DEFAULT_BATCH_SIZE, update_search_index=True, progress=None):
+        self.rng = random.Random(seed)
+        self.batch_size = batch_size
+        self.update_search_index = update_search_index
+        self.progress = progress # callback(создано тикетов, всего)
+
+    # --- Справочники и настройка ---
+    def ensure_reference_data(self):
+        if not TicketStatus.objects.exists():
+            for order, (code, name, color, is_default, is_resolved, is_closed, _) in enumerate(DEFAULT_STATUSES):
+                TicketStatus.objects.create(code=code, name=name, color=color, is_default_status=is_default, is_resolved_status=is_resolved, is_closed_status=is_closed, order=order)
+        if not TicketPriority.objects.exists():
+            for order, (code, name, color, _) in enumerate(DEFAULT_PRIORITIES):
+                TicketPriority.objects.create(code=code, name=name, color=color, order=order)
+
+    def create_field_templates(self):
+        templates = {}
+        for name, (label, field_type, choices) in SEED_FIELD_TEMPLATES.items():
+            templates[name], _ = FieldTemplate.objects.get_or_create(name=name, defaults={'label_default': label, 'field_type': field_type, 'select_choices_json_default': choices})
+        return templates
+
+    def create_projects(self, count):
+        projects = []
+        for number in range(1, count + 1):
+            base_name = PROJECT_NAMES[(number - 1) % len(PROJECT_NAMES)]
+            # Первые символы названия дают код в номере тикета (numbering.get_project_code) - делаем его уникальным
+            project, _ = Project.objects.get_or_create(name=f"S{number:02d} {base_name}", defaults={'description': f"{SEED_PREFIX}: сгенерированный проект", 'is_active': True})
+            projects.append(project)
+        return projects
+
+    def create_categories(self, projects, per_project, templates):
+        categories = []
+        for project in projects:
+            for number in range(per_project):
+                category, created = TicketCategory.objects.get_or_create(project=project, name=CATEGORY_NAMES[number % len(CATEGORY_NAMES)] + ('' if number < len(CATEGORY_NAMES) else f" {number}"))
+                if created:
+                    field_names = ['title', 'description'] + self.rng.sample(OPTIONAL_FIELD_NAMES, self.rng.randint(2, 6))
+                    CustomFormField.objects.bulk_create([
+                        CustomFormField(category=category, field_template=templates[name], order_in_category=order,
+                                        is_required_in_category=name in ('title', 'description') or (self.rng.random() < 0.2 and templates[name].field_type != 'bool'))
+                        for order, name in enumerate(field_names)
+                    ])
+                categories.append(category)
+        return categories
+
+    def create_agents(self, projects, per_project):
+        agents = []
+        for project_number, project in enumerate(projects, start=1):
+            for number in range(1, per_project + 1):
+                username = f"{SEED_PREFIX}-agent-{project_number:02d}-{number:03d}"
+                agent = Agent.objects.filter(username=username).first()
+                if agent is None:
+                    agent = Agent(username=username, first_name=self.rng.choice(FIRST_NAMES), last_name=self.rng.choice(LAST_NAMES),
+                                  email=f"{username}@example.com", is_staff=True, agent_role='project_manager' if number == 1 else 'agent')
+                    agent.set_unusable_password(); agent.save() # benchmark_views входит через force_login
+                agent.projects.add(project)
+                if self.rng.random() < 0.2: agent.projects.add(self.rng.choice(projects)) # часть сотрудников работает в двух проектах
+                agents.append(agent)
+        return agents
+
+    def create_blobs(self, count):
+        """Небольшой набор общих файлов-вложений (разного размера и типа)."""
+        storage = attachment_storage(); blobs = []
+        for number in range(count):
+            extension = ('txt', 'log', 'pdf', 'png')[number % 4]
+            content = (f"{SEED_PREFIX} attachment {number}\n" * self.rng.randint(10, 2000)).encode()
+            name = storage.save(f"{seed_name('file', number)}.{extension}", ContentFile(content))
+            # ref_count растет по мере создания вложений (write_batch)
+            blob, _ = AttachmentBlob.objects.get_or_create(sha256=sha256_from_name(name), defaults={'file_name': name, 'size': len(content), 'ref_count': 0})
+            blobs.append((blob, extension))
+        return blobs
+
+    # --- Тикеты ---
+    def _weighted(self, items_with_weights):
+        items, weights = zip(*items_with_weights)
+        return lambda: self.rng.choices(items, weights)[0]
+
+    def build_ticket(self, category, created_at, pick_status, pick_priority, agents_by_project):
+        status = pick_status()
+        form_class_fields = self._category_fields[category.pk]
+        custom_form_data = {}; standard = {}
+        for field_def in form_class_fields:
+            if field_def.name in ('title', 'description'): continue
+            if not field_def.is_required_in_category and self.rng.random() < 0.3: continue
+            value = self._custom_value(field_def)
+            if field_def.name.startswith('reporter_'): standard[field_def.name] = value
+            else: custom_form_data[field_def.name] = value
+        project_agents = agents_by_project.get(category.project_id) or [None]
+        assignee_id = self.rng.choice(project_agents) if status.code != 'new' or self.rng.random() < 0.2 else None
+        resolved_at = created_at + timedelta(hours=self.rng.randint(1, 240)) if status.is_resolved_status else None
+        closed_at = resolved_at + timedelta(hours=self.rng.randint(1, 72)) if status.is_closed_status and resolved_at else (created_at + timedelta(hours=self.rng.randint(1, 300)) if status.is_closed_status else None)
+        ticket = Ticket(
+            title=self.rng.choice(SUBJECTS), description=random_text(self.rng, 10, 80),
+            reporter_name=random_person(self.rng), reporter_email=random_email(self.rng),
+            reporter_department=standard.pop('reporter_department', None) or self.rng.choice(DEPARTMENTS),
+            project_id=category.project_id, category=category, status=status, priority=pick_priority(), assignee_id=assignee_id,
+            custom_form_data=custom_form_data, resolved_at=resolved_at, closed_at=closed_at, **standard,
+        )
+        ticket._seed_created_at = created_at
+        return ticket
+
+    def _custom_value(self, field_def):
+        field_type = field_def.field_type
+        if field_type == 'select':
+            choices = list((field_def.effective_select_choices_json or {}).keys())
+            return self.rng.choice(choices) if choices else ''
+        if field_type == 'int': return self.rng.randint(1, 50)
+        if field_type == 'bool': return self.rng.random() < 0.3
+        if field_type == 'date': return (date.today() - timedelta(days=self.rng.randint(0, 400))).isoformat()
+        if field_type == 'email': return random_email(self.rng)
+        if field_def.name == 'inventory_number': return f"INV-{self.rng.randint(1, 99999):05d}"
+        if field_def.name == 'reporter_phone': return f"+7 9{self.rng.randint(10, 99)} {self.rng.randint(100, 999)}-{self.rng.randint(10, 99)}-{self.rng.randint(10, 99)}"
+        if field_def.name in ('reporter_building', 'reporter_room'): return str(self.rng.randint(1, 500))
+        return random_text(self.rng, 1, 4)[:60]
+
+    def build_comments(self, ticket, count, agents_by_project):
+        comments = []; moment = ticket._seed_created_at
+        project_agents = agents_by_project.get(ticket.project_id) or []
+        for _ in range(count):
+            moment += timedelta(minutes=self.rng.randint(5, 2880))
+            from_agent = project_agents and self.rng.random() < 0.6
+            agent_id = self.rng.choice(project_agents) if from_agent else None
+            comment = Comment(ticket_id=ticket.pk, author_agent_id=agent_id, author_name_display="Сотрудник" if from_agent else ticket.reporter_name,
+                              body=random_text(self.rng, 5, 50), is_internal=bool(from_agent) and self.rng.random() < 0.3)
+            comment._seed_created_at = moment
+            comments.append(comment)
+        return comments
+
+    def create_tickets(self, categories, agents, count, comments_per_ticket=3, attachment_ratio=0.2, blobs=(), days=365):
+        if not categories: return 0
+        self._category_fields = {
+            category.pk: list(category.custom_form_fields.filter(is_active_in_category=True).select_related('field_template'))
+            for category in categories
+        }
+        statuses = reference_data.statuses()
+        status_weights = {code: weight for code, *_, weight in DEFAULT_STATUSES}
+        pick_status = self._weighted([(s, status_weights.get(s.code, CLOSED_STATUS_WEIGHT if s.is_closed_status else 5)) for s in statuses])
+        priority_weights = {code: weight for code, *_, weight in DEFAULT_PRIORITIES}
+        pick_priority = self._weighted([(p, priority_weights.get(p.code, 10)) for p in reference_data.priorities()] or [(None, 1)])
+        agents_by_project = defaultdict(list)
+        for project_id, agent_id in Agent.projects.through.objects.filter(agent__in=agents).values_list('project_id', 'agent_id'): agents_by_project[project_id].append(agent_id)
+        projects_by_id = {project.pk: project for project in Project.objects.filter(pk__in={c.project_id for c in categories})}
+        # Нагрузка неравномерна: первые категории получают больше заявок, как "Принтеры" в живой базе
+        category_weights = [1.0 / (index + 1) ** 0.7 for index in range(len(categories))]
+        now = timezone.now(); created = 0
+        while created < count:
+            size = min(self.batch_size, count - created)
+            tickets = []
+            for _ in range(size):
+                created_at = now - timedelta(minutes=int((self.rng.random() ** 1.5) * days * 1440)) # свежих заявок больше
+                tickets.append(self.build_ticket(self.rng.choices(categories, category_weights)[0], created_at, pick_status, pick_priority, agents_by_project))
+            self.write_batch(tickets, projects_by_id, comments_per_ticket, attachment_ratio, blobs, agents_by_project)
+            created += size
+            if self.progress: self.progress(created, count)
+        return created
+
+    def write_batch(self, tickets, projects_by_id, comments_per_ticket, attachment_ratio, blobs, agents_by_project):
+        with transaction.atomic():
+            groups = defaultdict(list)
+            for ticket in tickets: groups[(ticket.project_id, ticket._seed_created_at.year)].append(ticket)
+            for (project_id, year), group in groups.items():
+                for ticket, ticket_id in zip(group, reserve_ticket_ids(projects_by_id[project_id], len(group), year=year)): ticket.ticket_id_display = ticket_id
+            for ticket in tickets: ticket.created_at = ticket._seed_created_at; ticket.updated_at = ticket.closed_at or ticket._seed_created_at
+            with explicit_timestamps(Ticket): Ticket.objects.bulk_create(tickets)
+            comments = []
+            for ticket in tickets:
+                count = self.rng.randint(0, comments_per_ticket * 2) if comments_per_ticket else 0
+                comments.extend(self.build_comments(ticket, count, agents_by_project))
+            if comments:
+                for comment in comments: comment.created_at = comment._seed_created_at
+                with explicit_timestamps(Comment): Comment.objects.bulk_create(comments)
+            if blobs and attachment_ratio:
+                attachments = []
+                for ticket in tickets:
+                    if self.rng.random() >= attachment_ratio: continue
+                    blob, extension = self.rng.choice(blobs)
+                    attachments.append(Attachment(ticket_id=ticket.pk, file=blob.file_name, blob=blob, original_name=f"{self.rng.choice(['скриншот', 'ошибка', 'отчет', 'фото'])}.{extension}", uploaded_by_name_display=ticket.reporter_name))
+                Attachment.objects.bulk_create(attachments) # в обход Attachment.save(): ссылки на блобы считаются ниже одним запросом на блоб
+                added_by_blob = defaultdict(int)
+                for attachment in attachments: added_by_blob[attachment.blob_id] += 1
+                for blob_id, added in added_by_blob.items():
+                    AttachmentBlob.objects.filter(pk=blob_id).update(ref_count=F('ref_count') + added, updated_at=timezone.now())
+            counters.add_new_tickets([(t.project_id, t.category_id, t.assignee_id, t.status_id) for t in tickets])
+            rollups.add_new_tickets(tickets)
+        if self.update_search_index: index_tickets([t.pk for t in tickets])
+
@@ -0,0 +1,196 @@
+# tickets/signals.py
+# Обработчики сигналов моделей. Подключаются в TicketsConfig.ready().
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from . import counters, rollups
+from .assignment import assignment_board
+from .blobstore import release_blob
+from .custom_filters import custom_field_filters
+from .dynamic_forms import ticket_create_forms
+from .fragment_cache import ticket_row_cache
+from .live import build_ticket_event, ticket_stream_hub
+from .previews import preview_pipeline
+from .models import (
+    Agent, AgentSkill, Attachment, BusinessCalendar, BusinessHours, Comment, CustomFormField, FieldTemplate, Holiday, Project,
+    SLAPolicy, Ticket, TicketCategory, TicketPriority, TicketStatus,
+)
+from .reference_cache import reference_data
+from .scope import invalidate_agent_scopes
+from .search import INDEXED_TICKET_FIELDS, schedule_ticket_reindex
+from .sla import register_first_response, sla_policies
+
+
+# --- Сброс кэша справочников при изменениях из админки ---
+# Сброс откладывается до коммита, чтобы другой поток не успел перечитать старые данные под новой версией.
+@receiver(post_save, sender=TicketStatus)
+@receiver(post_delete, sender=TicketStatus)
+@receiver(post_save, sender=TicketPriority)
+@receiver(post_delete, sender=TicketPriority)
+@receiver(post_save, sender=Project)
+@receiver(post_delete, sender=Project)
+def invalidate_reference_data(sender, **kwargs):
+    transaction.on_commit(reference_data.invalidate)
+
+# --- Сброс кэша политик SLA и рабочих календарей (сроки уже созданных тикетов не меняются - recompute_ticket_sla) ---
+@receiver(post_save, sender=SLAPolicy)
+@receiver(post_delete, sender=SLAPolicy)
+@receiver(post_save, sender=BusinessCalendar)
+@receiver(post_delete, sender=BusinessCalendar)
+@receiver(post_save, sender=BusinessHours)
+@receiver(post_delete, sender=BusinessHours)
+@receiver(post_save, sender=Holiday)
+@receiver(post_delete, sender=Holiday)
+def invalidate_sla_policies(sender, **kwargs):
+    transaction.on_commit(sla_policies.invalidate)
+
+# --- Сброс скомпилированных форм создания тикета при изменении полей или категорий ---
+@receiver(post_save, sender=CustomFormField)
+@receiver(post_delete, sender=CustomFormField)
+@receiver(post_save, sender=FieldTemplate)
+@receiver(post_delete, sender=FieldTemplate)
+@receiver(post_save, sender=TicketCategory)
+@receiver(post_delete, sender=TicketCategory)
+def invalidate_ticket_create_forms(sender, **kwargs):
+    transaction.on_commit(ticket_create_forms.invalidate)
+
+# --- Сброс описаний фильтров по дополнительным полям (индексы создает sync_custom_field_indexes) ---
+@receiver(post_save, sender=CustomFormField)
+@receiver(post_delete, sender=CustomFormField)
+@receiver(post_save, sender=FieldTemplate)
+@receiver(post_delete, sender=FieldTemplate)
+@receiver(post_save, sender=TicketCategory)
+@receiver(post_delete, sender=TicketCategory)
+def invalidate_custom_field_filters(sender, **kwargs):
+    transaction.on_commit(custom_field_filters.invalidate)
+
+# --- Сброс кэша строк списка заявок: категория и имя исполнителя видны в строке, но не меняют updated_at тикета ---
+@receiver(post_save, sender=TicketCategory)
+@receiver(post_delete, sender=TicketCategory)
+def invalidate_ticket_rows_on_category_change(sender, **kwargs):
+    transaction.on_commit(ticket_row_cache.invalidate)
+
+@receiver(post_save, sender=Agent)
+def invalidate_ticket_rows_on_agent_change(sender, instance, created=False, update_fields=None, **kwargs):
+    if created or (update_fields and set(update_fields) <= {'last_login'}): return
+    transaction.on_commit(ticket_row_cache.invalidate)
+
+# --- Сброс составов проектов для автоназначения (сотрудники, их проекты и навыки) ---
+@receiver(post_save, sender=AgentSkill)
+@receiver(post_delete, sender=AgentSkill)
+@receiver(post_save, sender=Project)
+@receiver(post_delete, sender=Project)
+def invalidate_assignment_rosters(sender, **kwargs):
+    transaction.on_commit(assignment_board.invalidate_rosters)
+
+@receiver(post_save, sender=Agent)
+def invalidate_assignment_rosters_on_agent_change(sender, instance, update_fields=None, **kwargs):
+    if update_fields and set(update_fields) <= {'last_login'}: return
+    transaction.on_commit(assignment_board.invalidate_rosters)
+
+@receiver(m2m_changed, sender=Agent.projects.through)
+def invalidate_assignment_rosters_on_projects_change(sender, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'): transaction.on_commit(assignment_board.invalidate_rosters)
+
+# --- Сброс областей доступа сотрудников (AgentScope) ---
+@receiver(post_save, sender=Project)
+@receiver(post_delete, sender=Project)
+def invalidate_scopes_on_project_change(sender, **kwargs):
+    transaction.on_commit(invalidate_agent_scopes)
+
+@receiver(post_save, sender=Agent)
+def invalidate_scopes_on_agent_change(sender, instance, update_fields=None, **kwargs):
+    if update_fields and set(update_fields) <= {'last_login'}: return # вход в систему права не меняет
+    transaction.on_commit(invalidate_agent_scopes)
+
+@receiver(m2m_changed, sender=Agent.projects.through)
+def invalidate_scopes_on_agent_projects_change(sender, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'): transaction.on_commit(invalidate_agent_scopes)
+
+
+# --- Публикация новых тикетов в поток для агентов (после коммита, чтобы тикет уже был виден) ---
+@receiver(post_save, sender=Ticket)
+def publish_new_ticket(sender, instance, created, raw=False, **kwargs):
+    if not created or raw: return
+    transaction.on_commit(lambda: ticket_stream_hub.publish(build_ticket_event(instance)))
+
+
+# --- Обновление поискового индекса при изменении тикета или его комментариев ---
+@receiver(post_save, sender=Ticket)
+def reindex_ticket(sender, instance, raw=False, update_fields=None, **kwargs):
+    if raw or (update_fields and not INDEXED_TICKET_FIELDS.intersection(update_fields)): return # исполнитель, статус, SLA - не в индексе
+    schedule_ticket_reindex(instance.pk)
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def reindex_ticket_comments(sender, instance, raw=False, **kwargs):
+    if raw or not instance.ticket_id: return
+    schedule_ticket_reindex(instance.ticket_id)
+
+
+# --- Прежнее состояние тикета для счетчиков и сводок ---
+# Читается из БД под блокировкой строки в транзакции сохранения/удаления, а не берется из объекта: объект мог
+# быть загружен до того, как параллельный запрос изменил тикет, и одно изменение учлось бы в счетчиках дважды.
+# Блокировка держится до коммита - второй запрос прочитает уже сохраненное первым состояние.
+SAVED_STATE_FIELDS = tuple(dict.fromkeys(counters.STATE_FIELDS + rollups.STATE_FIELDS))
+
+@receiver(pre_save, sender=Ticket)
+@receiver(pre_delete, sender=Ticket)
+def load_ticket_saved_state(sender, instance, raw=False, **kwargs):
+    if raw or instance._state.adding or not instance.pk: return
+    row = Ticket.objects.select_for_update().filter(pk=instance.pk).values(*SAVED_STATE_FIELDS).first()
+    instance._counter_state = counters.state_from_row(row)
+    instance._rollup_state = rollups.state_from_row(row)
+
+
+# --- Счетчики тикетов (TicketCounter) ---
+
+@receiver(post_save, sender=Ticket)
+def update_ticket_counters(sender, instance, created, raw=False, **kwargs):
+    if raw: return
+    old_state = None if created else getattr(instance, '_counter_state', None)
+    new_state = counters.snapshot_state(instance) or counters.load_state(instance.pk)
+    deltas = counters.apply_ticket_change(old_state, new_state)
+    instance._counter_state = new_state
+    if deltas: transaction.on_commit(lambda: assignment_board.apply_counter_deltas(deltas)) # загрузка сотрудников для автоназначения
+
+@receiver(post_delete, sender=Ticket)
+def remove_ticket_from_counters(sender, instance, **kwargs):
+    deltas = counters.apply_ticket_change(getattr(instance, '_counter_state', None), None)
+    if deltas: transaction.on_commit(lambda: assignment_board.apply_counter_deltas(deltas))
+
+
+# --- Ссылки на содержимое вложений (AttachmentBlob) ---
+@receiver(post_delete, sender=Attachment)
+def release_attachment_blob(sender, instance, **kwargs):
+    # Файл не удаляется сразу: на тот же блоб могут ссылаться другие вложения; блобы без ссылок удаляет gc_attachment_blobs
+    release_blob(instance.blob_id)
+
+# --- Превью изображений: генерация в фоне после коммита, запрос загрузки не ждет ---
+@receiver(post_save, sender=Attachment)
+def schedule_attachment_previews(sender, instance, created, raw=False, **kwargs):
+    if not created or raw: return
+    transaction.on_commit(lambda: preview_pipeline.schedule(instance))
+
+
+# --- SLA: первый публичный ответ сотрудника останавливает срок первого ответа ---
+@receiver(post_save, sender=Comment)
+def register_ticket_first_response(sender, instance, created, raw=False, **kwargs):
+    if not created or raw or not instance.ticket_id: return
+    register_first_response(instance)
+
+
+# --- Ежедневные сводки для отчетов (TicketDailyRollup) ---
+@receiver(post_save, sender=Ticket)
+def update_ticket_rollups(sender, instance, created, raw=False, **kwargs):
+    if raw: return
+    old_state = None if created else getattr(instance, '_rollup_state', None)
+    new_state = rollups.snapshot_state(instance) or rollups.load_state(instance.pk)
+    rollups.apply_ticket_change(old_state, new_state)
+    instance._rollup_state = new_state
+
+@receiver(post_delete, sender=Ticket)
+def remove_ticket_from_rollups(sender, instance, **kwargs):
+    # Удаленный тикет перестает быть открытым; созданные, решенные и закрытые за прошлые дни остаются в сводках
+    rollups.apply_ticket_change(getattr(instance, '_rollup_state', None), None)
@@ -0,0 +1,345 @@
+# tickets/sla.py
+# Сроки SLA тикетов: первый ответ и решение по политике SLAPolicy (проект + приоритет) и рабочему календарю.
+# - Сроки считаются один раз, от created_at, и пересчитываются только при смене политики (проект/приоритет)
+#   или командой recompute_ticket_sla --reset. Время считается в рабочих минутах календаря политики.
+# - Первый ответ - первый публичный комментарий сотрудника (tickets/signals.py).
+# - Срок решения выполнен, когда у тикета есть resolved_at или closed_at; возврат в работу снова открывает срок.
+# - Состояние пересчитывает и Ticket.save(), и планировщик run_sla_scheduler (SLAScheduler ниже) - по наступлению
+#   сроков. Эскалации (история и уведомления) отправляет только планировщик; отправленное состояние хранится
+#   в Ticket.sla_escalated_state, поэтому переход, сделанный сохранением раньше планировщика, не теряется.
+# - Политики и календари кэшируются в процессе, как справочники.
+import heapq
+import threading
+from datetime import datetime, timedelta, timezone as dt_timezone
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .cache_versions import VersionStamp
+from .models import BusinessCalendar, SLAPolicy, Ticket, TicketEvent
+
+TARGET_FIRST_RESPONSE = 'first_response'
+TARGET_RESOLUTION = 'resolution'
+TARGET_LABELS = {TARGET_FIRST_RESPONSE: 'первый ответ', TARGET_RESOLUTION: 'решение'}
+
+# Поля, при сохранении которых пересчитывается SLA, и поля, которые пересчет записывает
+SLA_FIELDS = ('sla_policy', 'first_response_due_at', 'resolution_due_at', 'sla_due_at', 'sla_warn_at', 'sla_state', 'sla_escalated_state')
+SLA_UPDATE_FIELDS = frozenset(SLA_FIELDS + ('updated_at',)) # updated_at - ключ кэша строк и опрос планировщика
+SLA_TRIGGER_FIELDS = frozenset(SLA_FIELDS + ('project', 'priority', 'status', 'first_responded_at', 'resolved_at', 'closed_at'))
+MAX_CALENDAR_DAYS = 3 * 366 # дальше срок не ищется (календарь почти без рабочих часов)
+ESCALATION_ACTOR_NAME = 'SLA'
+
+
+# --- Рабочее время ---
+class CalendarSpec:
+    """Рабочие интервалы по дням недели и нерабочие даты в часовом поясе календаря. Без интервалов - круглосуточно."""
+
+    def __init__(self, zone=None, hours=None, holidays=()):
+        self.zone = zone or dt_timezone.utc
+        self.hours = hours or {}
+        self.holidays = frozenset(holidays)
+
+    @classmethod
+    def from_calendar(cls, calendar):
+        try: zone = ZoneInfo(calendar.timezone)
+        except (ZoneInfoNotFoundError, ValueError): zone = dt_timezone.utc
+        hours = {}
+        for interval in calendar.hours.all(): hours.setdefault(interval.weekday, []).append((interval.start_time, interval.end_time))
+        for intervals in hours.values(): intervals.sort()
+        return cls(zone, hours, [holiday.date for holiday in calendar.holidays.all()])
+
+    @property
+    def is_round_the_clock(self):
+        return not self.hours
+
+    def _intervals(self, day):
+        # Рабочие интервалы даты в UTC; окончание 00:00 - до конца суток
+        if day in self.holidays: return
+        for opens, closes in self.hours.get(day.weekday(), ()):
+            begin = datetime.combine(day, opens, tzinfo=self.zone)
+            end = datetime.combine(day + timedelta(days=1) if closes.isoformat() == '00:00:00' else day, closes, tzinfo=self.zone)
+            yield begin.astimezone(dt_timezone.utc), end.astimezone(dt_timezone.utc)
+
+    def add_business_minutes(self, start, minutes):
+        """Момент, когда от start пройдет minutes рабочих минут; None, если столько рабочего времени не нашлось."""
+        if self.is_round_the_clock or minutes <= 0: return start + timedelta(minutes=max(minutes, 0))
+        remaining = timedelta(minutes=minutes)
+        start = start.astimezone(dt_timezone.utc)
+        day = start.astimezone(self.zone).date() - timedelta(days=1) # интервал "до 00:00" предыдущего дня может еще идти
+        for _ in range(MAX_CALENDAR_DAYS):
+            for begin, end in self._intervals(day):
+                if end <= start: continue
+                begin = max(begin, start)
+                if remaining <= end - begin: return begin + remaining
+                remaining -= end - begin
+            day += timedelta(days=1)
+        return None
+
+
+ROUND_THE_CLOCK = CalendarSpec()
+
+
+# --- Кэш политик и календарей ---
+class _SLASnapshot:
+    def __init__(self, policies, calendars):
+        self.policy_by_pk = {p.pk: p for p in policies}
+        self.policy_by_key = {(p.project_id, p.priority_id): p for p in policies if p.is_active}
+        self.calendars = calendars
+
+
+class SLAPolicyRegistry:
+    # Сброс - сигналы post_save/post_delete политик и календарей (tickets/signals.py)
+    def __init__(self):
+        self.stamp = VersionStamp('sla_policies')
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self._snapshot_version = None
+        self.hits = 0
+        self.misses = 0
+        self.loads = 0
+
+    def _load(self):
+        calendars = {c.pk: CalendarSpec.from_calendar(c) for c in BusinessCalendar.objects.prefetch_related('hours', 'holidays')}
+        return _SLASnapshot(list(SLAPolicy.objects.select_related('escalate_to')), calendars)
+
+    def _get_snapshot(self):
+        version = self.stamp.current()
+        snapshot = self._snapshot
+        if snapshot is not None and self._snapshot_version == version:
+            self.hits += 1
+            return snapshot
+        with self._lock:
+            if self._snapshot is None or self._snapshot_version != version:
+                self._snapshot = self._load()
+                self._snapshot_version = version
+                self.loads += 1
+            self.misses += 1
+            return self._snapshot
+
+    def invalidate(self):
+        with self._lock:
+            self._snapshot = None
+        self.stamp.bump()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses, 'loads': self.loads, 'hit_ratio': (self.hits / total) if total else None, 'version': self.stamp.current()}
+
+    def policy_for(self, project_id, priority_id):
+        """Активная политика для тикета: проект+приоритет, проект, приоритет, общая; None - SLA не отслеживается."""
+        by_key = self._get_snapshot().policy_by_key
+        for key in ((project_id, priority_id), (project_id, None), (None, priority_id), (None, None)):
+            if key in by_key: return by_key[key]
+        return None
+
+    def get_policy(self, pk):
+        return self._get_snapshot().policy_by_pk.get(pk) if pk else None
+
+    def calendar_for(self, policy):
+        if policy is None or not policy.calendar_id: return ROUND_THE_CLOCK
+        return self._get_snapshot().calendars.get(policy.calendar_id, ROUND_THE_CLOCK)
+
+
+sla_policies = SLAPolicyRegistry()
+
+
+# --- Сроки и состояние тикета ---
+def _target_minutes(policy, target):
+    return policy.first_response_minutes if target == TARGET_FIRST_RESPONSE else policy.resolution_minutes
+
+def _targets(ticket):
+    # (цель, срок, когда выполнена)
+    return ((TARGET_FIRST_RESPONSE, ticket.first_response_due_at, ticket.first_responded_at),
+            (TARGET_RESOLUTION, ticket.resolution_due_at, ticket.resolved_at or ticket.closed_at))
+
+def active_target(ticket):
+    """Цель, к которой относится ticket.sla_due_at (ближайший невыполненный срок), или None."""
+    if ticket.sla_due_at is None: return None
+    for target, due_at, done_at in _targets(ticket):
+        if due_at == ticket.sla_due_at and done_at is None: return target
+    return None
+
+def breached_target(ticket, now):
+    """(цель, срок) первого нарушенного срока или (None, None)."""
+    for target, due_at, done_at in _targets(ticket):
+        if due_at and (done_at or now) > due_at: return target, due_at
+    return None, None
+
+def _state_tuple(ticket):
+    return (ticket.sla_policy_id, ticket.first_response_due_at, ticket.resolution_due_at, ticket.sla_due_at, ticket.sla_warn_at,
+            ticket.sla_state, ticket.sla_escalated_state)
+
+def update_ticket_sla(ticket, now=None, reset=False):
+    """
+    Пересчитывает поля SLA тикета в памяти (без сохранения). Возвращает True, если что-то изменилось.
+    reset=True - сроки считаются заново даже при той же политике (после изменения политики или календаря).
+    """
+    now = now or timezone.now()
+    before = _state_tuple(ticket)
+    policy = sla_policies.policy_for(ticket.project_id, ticket.priority_id)
+    if reset or (policy.pk if policy else None) != ticket.sla_policy_id:
+        start = ticket.created_at or now
+        calendar = sla_policies.calendar_for(policy)
+        ticket.sla_policy = policy
+        ticket.first_response_due_at = calendar.add_business_minutes(start, policy.first_response_minutes) if policy and policy.first_response_minutes else None
+        ticket.resolution_due_at = calendar.add_business_minutes(start, policy.resolution_minutes) if policy and policy.resolution_minutes else None
+    else:
+        policy = sla_policies.get_policy(ticket.sla_policy_id) # политику могли выключить - сроки тикета остаются
+    targets = _targets(ticket)
+    # Нарушение выводится из данных: срок прошел, а цель не выполнена (или выполнена позже срока)
+    breached = any(due_at and (done_at or now) > due_at for _, due_at, done_at in targets)
+    pending = sorted((due_at, target) for target, due_at, done_at in targets if due_at and done_at is None and due_at > now)
+    ticket.sla_due_at = ticket.sla_warn_at = None
+    if pending:
+        ticket.sla_due_at, target = pending[0]
+        if policy is not None and _target_minutes(policy, target):
+            start = ticket.created_at or now
+            warn_minutes = _target_minutes(policy, target) * policy.at_risk_percent / 100
+            ticket.sla_warn_at = sla_policies.calendar_for(policy).add_business_minutes(start, warn_minutes)
+    if breached: ticket.sla_state = Ticket.SLA_STATE_BREACHED
+    elif ticket.sla_warn_at and ticket.sla_warn_at <= now: ticket.sla_state = Ticket.SLA_STATE_AT_RISK
+    elif any(due_at for _, due_at, _ in targets): ticket.sla_state = Ticket.SLA_STATE_OK
+    else: ticket.sla_state = Ticket.SLA_STATE_NONE
+    # Состояние снизилось (срок выполнен, политика сменилась) - следующий рост снова будет эскалирован
+    if ticket.sla_state < ticket.sla_escalated_state: ticket.sla_escalated_state = ticket.sla_state
+    return _state_tuple(ticket) != before
+
+def register_first_response(comment):
+    """Первый публичный комментарий сотрудника останавливает отсчет срока первого ответа."""
+    if comment.is_internal or not comment.author_agent_id: return False
+    ticket = comment.ticket
+    if ticket.first_responded_at is not None: return False
+    ticket.first_responded_at = comment.created_at or timezone.now()
+    ticket.save(update_fields=['first_responded_at', 'updated_at'])
+    return True
+
+
+# --- Планировщик эскалаций ---
+class SLAScheduler:
+    """
+    Планировщик для run_sla_scheduler. В памяти - куча (heapq) ближайших срабатываний (время, тикет, вид)
+    только на горизонт horizon вперед. Куча дочитывается, а не перестраивается:
+    - новые и измененные тикеты - по updated_at с прошлого опроса (индекс ticket_updated_idx);
+    - следующий участок горизонта - диапазоном по sla_due_at/sla_warn_at (частичные индексы).
+    Запись кучи может устареть (тикет решен, срок пересчитан): при срабатывании строка перечитывается
+    под блокировкой и сроки сверяются, поэтому устаревшие записи из кучи не удаляются, а пропускаются.
+    Тикеты, которые Ticket.save() уже перевел в "под угрозой"/"нарушен" (sla_state > sla_escalated_state),
+    ставятся в кучу на немедленное срабатывание (частичный индекс ticket_sla_unescalated_idx).
+    """
+    KIND_WARN = 'warn'
+    KIND_DUE = 'due'
+    KIND_STATE = 'state'
+
+    def __init__(self, horizon=timedelta(hours=1), poll_overlap=timedelta(minutes=1), batch_size=200):
+        self.horizon = horizon
+        self.poll_overlap = poll_overlap # запас на транзакции, закоммиченные позже своего updated_at
+        self.batch_size = batch_size
+        self.heap = []
+        self.scheduled = {} # (тикет, вид) -> время последней поставленной записи
+        self.loaded_until = None
+        self.changed_since = None
+        self.rows_loaded = 0
+        self.at_risk_fired = 0
+        self.breaches_fired = 0
+
+    # --- Загрузка ---
+    def _deadline_q(self, after, until):
+        due = Q(sla_due_at__lte=until)
+        warn = Q(sla_warn_at__lte=until, sla_state=Ticket.SLA_STATE_OK)
+        if after is not None: due &= Q(sla_due_at__gt=after); warn &= Q(sla_warn_at__gt=after)
+        return due | warn
+
+    def _unescalated_q(self):
+        return Q(sla_state__gt=F('sla_escalated_state'))
+
+    def _load(self, condition, now):
+        rows = Ticket.objects.filter(condition).values_list('pk', 'sla_due_at', 'sla_warn_at', 'sla_state', 'sla_escalated_state')
+        for pk, due_at, warn_at, state, escalated_state in rows.iterator(chunk_size=2000):
+            self.rows_loaded += 1
+            if state > escalated_state: self._push(now, pk, self.KIND_STATE)
+            if warn_at is not None and state == Ticket.SLA_STATE_OK and warn_at <= self.loaded_until: self._push(warn_at, pk, self.KIND_WARN)
+            if due_at is not None and due_at <= self.loaded_until: self._push(due_at, pk, self.KIND_DUE)
+
+    def _push(self, fire_at, ticket_id, kind):
+        key = (ticket_id, kind)
+        if self.scheduled.get(key) == fire_at: return
+        self.scheduled[key] = fire_at
+        heapq.heappush(self.heap, (fire_at, ticket_id, kind))
+
+    def start(self, now):
+        # Уже наступившие сроки тоже попадают в кучу: они сработают на первом проходе
+        self.loaded_until = now + self.horizon; self.changed_since = now
+        self._load(self._deadline_q(None, self.loaded_until) | self._unescalated_q(), now)
+
+    def refresh(self, now):
+        since = self.changed_since - self.poll_overlap; self.changed_since = now
+        self._load(Q(updated_at__gt=since) & (self._deadline_q(None, self.loaded_until) | self._unescalated_q()), now)
+        if now + self.horizon / 2 >= self.loaded_until:
+            after = self.loaded_until; self.loaded_until = now + self.horizon
+            self._load(self._deadline_q(after, self.loaded_until), now)
+
+    def next_fire_at(self):
+        return self.heap[0][0] if self.heap else None
+
+    # --- Срабатывание ---
+    def fire_due(self, now):
+        """Обрабатывает все наступившие записи кучи. Возвращает число эскалаций."""
+        ticket_ids = set()
+        while self.heap and self.heap[0][0] <= now:
+            fire_at, ticket_id, kind = heapq.heappop(self.heap)
+            if self.scheduled.get((ticket_id, kind)) != fire_at: continue # запись заменена более новой
+            del self.scheduled[(ticket_id, kind)]
+            ticket_ids.add(ticket_id)
+        ticket_ids = sorted(ticket_ids); fired = 0
+        for i in range(0, len(ticket_ids), self.batch_size):
+            fired += self._escalate(ticket_ids[i:i + self.batch_size], now)
+        return fired
+
+    def _escalate(self, ticket_ids, now):
+        from .notifications import EVENT_SLA_AT_RISK, EVENT_SLA_BREACHED, enqueue_notification
+        fired = 0
+        with transaction.atomic():
+            for ticket in Ticket.objects.select_for_update().filter(pk__in=ticket_ids).order_by('pk'):
+                old_state = ticket.sla_state; old_due_at = ticket.sla_due_at; target = active_target(ticket)
+                escalated_state = ticket.sla_escalated_state
+                changed = update_ticket_sla(ticket, now)
+                # Срок, который планировщик застал наступившим (каждая цель), или переход, уже сделанный Ticket.save()
+                if changed and target and old_due_at and old_due_at <= now:
+                    event, due_at = EVENT_SLA_BREACHED, old_due_at
+                    note = f"Нарушен срок: {TARGET_LABELS[target]} (до {timezone.localtime(due_at):%d.%m.%Y %H:%M})."
+                elif ticket.sla_state == Ticket.SLA_STATE_BREACHED and escalated_state < Ticket.SLA_STATE_BREACHED:
+                    (target, due_at), event = breached_target(ticket, now), EVENT_SLA_BREACHED
+                    note = f"Нарушен срок: {TARGET_LABELS[target]} (до {timezone.localtime(due_at):%d.%m.%Y %H:%M})."
+                elif ticket.sla_state == Ticket.SLA_STATE_AT_RISK and escalated_state < Ticket.SLA_STATE_AT_RISK:
+                    target = active_target(ticket); event, due_at = EVENT_SLA_AT_RISK, ticket.sla_due_at
+                    note = f"Под угрозой срок: {TARGET_LABELS.get(target, '')} (до {timezone.localtime(due_at):%d.%m.%Y %H:%M})."
+                else:
+                    if changed: ticket.save(update_fields=SLA_UPDATE_FIELDS)
+                    continue # срок уже пересчитан или выполнен - запись кучи устарела
+                if event == EVENT_SLA_BREACHED: self.breaches_fired += 1
+                else: self.at_risk_fired += 1
+                ticket.sla_escalated_state = ticket.sla_state
+                ticket.save(update_fields=SLA_UPDATE_FIELDS)
+                # Если состояние уже сменил Ticket.save(), в истории - переход от последнего эскалированного
+                if old_state == ticket.sla_state: old_state = max(escalated_state, Ticket.SLA_STATE_OK)
+                state_labels = dict(Ticket.SLA_STATE_CHOICES)
+                TicketEvent.objects.create(
+                    ticket=ticket, kind=TicketEvent.KIND_SLA, old_value_id=old_state, old_value_display=state_labels[old_state],
+                    new_value_id=ticket.sla_state, new_value_display=state_labels[ticket.sla_state], actor_name=ESCALATION_ACTOR_NAME, note=note,
+                )
+                policy = sla_policies.get_policy(ticket.sla_policy_id)
+                escalate_to = policy.escalate_to if policy and policy.escalate_to and policy.escalate_to.is_active else None
+                enqueue_notification(
+                    event, ticket, sla_target=TARGET_LABELS.get(target, ''), sla_due_at=f"{timezone.localtime(due_at):%d.%m.%Y %H:%M}",
+                    sla_policy=policy.name if policy else '', escalate_to_email=escalate_to.email if escalate_to else '',
+                )
+                fired += 1
+        return fired
+
+    def stats(self):
+        return {
+            'heap_size': len(self.heap), 'loaded_until': self.loaded_until, 'rows_loaded': self.rows_loaded,
+            'at_risk_fired': self.at_risk_fired, 'breaches_fired': self.breaches_fired,
+        }
@@ -0,0 +1,61 @@
+# tickets/template_cache.py
+# LRU-кэш скомпилированных шаблонов уведомлений (NotificationTemplate).
+# Django Template разбирает исходник при создании объекта, поэтому без кэша каждое письмо
+# заново лексит и парсит тему и тело. Ключ - (pk, updated_at): сохранение шаблона в админке
+# меняет updated_at, и следующая отправка компилирует новую версию, а старая вытесняется по LRU.
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.template import Template as DjangoTemplate
+
+DEFAULT_MAX_SIZE = 128
+
+
+class CompiledTemplate:
+    __slots__ = ('subject', 'body_html')
+
+    def __init__(self, subject_source, body_source):
+        self.subject = DjangoTemplate(subject_source)
+        self.body_html = DjangoTemplate(body_source)
+
+
+class CompiledTemplateCache:
+    def __init__(self, max_size=None):
+        self._max_size = max_size
+        self._lock = threading.Lock()
+        self._items = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def max_size(self):
+        if self._max_size is not None: return self._max_size
+        return getattr(settings, 'NOTIFICATION_TEMPLATE_CACHE_SIZE', DEFAULT_MAX_SIZE)
+
+    def get(self, notification_template):
+        if notification_template.pk is None: # несохраненный шаблон (например, предпросмотр) не кэшируем
+            return CompiledTemplate(notification_template.subject_template, notification_template.body_template_html)
+        key = (notification_template.pk, notification_template.updated_at)
+        with self._lock:
+            compiled = self._items.get(key)
+            if compiled is not None:
+                self._items.move_to_end(key); self.hits += 1
+                return compiled
+        # Компилируем вне блокировки: в худшем случае два потока скомпилируют один шаблон дважды
+        compiled = CompiledTemplate(notification_template.subject_template, notification_template.body_template_html)
+        with self._lock:
+            self.misses += 1
+            self._items[key] = compiled
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_size: self._items.popitem(last=False)
+        return compiled
+
+    def clear(self):
+        with self._lock: self._items.clear()
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self._items), 'max_size': self.max_size}
+
+
+compiled_notification_templates = CompiledTemplateCache()
@@ -16,4 +16,25 @@ def filename_filter(value):
     # Это может быть полезно, если путь к файлу хранится как строка
     elif isinstance(value, str):
         return os.path.basename(value)
-    return str(value) # Возвращаем как есть, если не можем обработать
\ No newline at end of file
+    return str(value) # Возвращаем как есть, если не можем обработать
+@register.filter(name='has_preview')
+def has_preview_filter(attachment):
+    """
+    True, если миниатюра изображения готова. Если ее еще нет (только что загружено или вытеснено из кэша),
+    генерация ставится в фоновую очередь, а страница пока показывает только имя файла.
+    """
+    from tickets.previews import preview_pipeline
+    if preview_pipeline.ready(attachment): return True
+    preview_pipeline.schedule(attachment)
+    return False
+
+@register.filter(name='duration')
+def duration_filter(seconds):
+    """Длительность в секундах коротко: '45 мин', '3 ч 20 мин', '2 д 4 ч'; '-' для None."""
+    if seconds is None: return '-'
+    minutes = int(round(seconds / 60))
+    if minutes < 60: return f"{minutes} мин"
+    hours, minutes = divmod(minutes, 60)
+    if hours < 24: return f"{hours} ч {minutes} мин" if minutes else f"{hours} ч"
+    days, hours = divmod(hours, 24)
+    return f"{days} д {hours} ч" if hours else f"{days} д"
@@ -1,3 +1,561 @@
-from django.test import TestCase
+# tickets/tests.py
+import importlib
+import os
+import tempfile
+import threading
+from collections import defaultdict
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import Resolver404, resolve, reverse
+from django.utils import timezone
+
+from . import counters, rollups
+from .blobstore import BLOB_DIR, attachment_storage, collect_garbage
+from .cache_versions import VersionStamp
+from .custom_filters import custom_field_filters, expected_indexes, index_name
+from .models import Agent, Attachment, AttachmentBlob, CacheVersion, CustomFormField, EmailSettings, FieldTemplate, NotificationOutbox, Project, SLAPolicy, Ticket, TicketCategory, TicketCounter, TicketDailyRollup, TicketRollupSketch, TicketStatus
+from .downloads import parse_range, reporter_attachment_token, ticket_pk_from_token
+from .duplicates import duplicate_index, index_fingerprints, ticket_signature
+from .fragment_cache import ticket_row_cache
+from .importer import TicketImporter
+from .instrumentation import query_budget, request_log
+from .notifications import CLAIM_SECONDS, EVENT_NEW_TICKET, EVENT_SLA_BREACHED, NotificationDispatcher
+from .numbering import allocate_ticket_id, format_ticket_id, get_project_code, reserve_ticket_ids
+from .reference_cache import reference_data
+from .scope import get_agent_scope, scope_version
+from .sla import SLAScheduler, sla_policies
+
+
+def run_in_threads(thread_count, target):
+    """Запускает target(номер потока) одновременно в thread_count потоках; возвращает ошибки потоков."""
+    errors = []; lock = threading.Lock(); start_barrier = threading.Barrier(thread_count)
+
+    def worker(thread_num):
+        try:
+            start_barrier.wait()
+            target(thread_num)
+        except Exception as e:
+            with lock: errors.append(f"Поток {thread_num}: {e!r}")
+        finally:
+            connection.close() # у каждого потока свое соединение
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(thread_count)]
+    for thread in threads: thread.start()
+    for thread in threads: thread.join()
+    return errors
+
+
+# ------------------- Выдача номеров тикетов (tickets/numbering.py) -------------------
+class TicketNumberConcurrencyTests(TransactionTestCase):
+    THREADS = 8
+    PER_THREAD = 25
+
+    def setUp(self):
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            self.skipTest("Нужна файловая SQLite или PostgreSQL: потоки не делят SQLite в памяти с блокировками.")
+        self.project = Project.objects.create(name="Нагрузка номеров")
+        self.prefix = f"{get_project_code(self.project)}-2030-"
+
+    def assert_contiguous(self, ticket_ids, expected_count):
+        self.assertEqual(len(ticket_ids), expected_count)
+        self.assertEqual(len(set(ticket_ids)), expected_count, "Выданы одинаковые номера.")
+        self.assertTrue(all(ticket_id.startswith(self.prefix) for ticket_id in ticket_ids))
+        numbers = sorted(int(ticket_id.rsplit('-', 1)[-1]) for ticket_id in ticket_ids)
+        self.assertEqual(numbers, list(range(1, expected_count + 1)), "В номерах есть пропуски.")
+
+    def test_parallel_single_allocations_have_no_gaps_or_duplicates(self):
+        ticket_ids = []; lock = threading.Lock()
+
+        def allocate(thread_num):
+            for _ in range(self.PER_THREAD):
+                with transaction.atomic(): ticket_id = allocate_ticket_id(self.project, year=2030)
+                with lock: ticket_ids.append(ticket_id)
+
+        errors = run_in_threads(self.THREADS, allocate)
+        self.assertEqual(errors, [])
+        self.assert_contiguous(ticket_ids, self.THREADS * self.PER_THREAD)
+
+    def test_parallel_blocks_and_single_allocations_do_not_overlap(self):
+        ticket_ids = []; lock = threading.Lock()
+
+        def allocate(thread_num):
+            for i in range(self.PER_THREAD):
+                with transaction.atomic():
+                    # Четные потоки - как импорт (блок номеров), нечетные - как форма (по одному)
+                    allocated = list(reserve_ticket_ids(self.project, 3, year=2030)) if thread_num % 2 == 0 else [allocate_ticket_id(self.project, year=2030)]
+                with lock: ticket_ids.extend(allocated)
+
+        errors = run_in_threads(self.THREADS, allocate)
+        self.assertEqual(errors, [])
+        self.assert_contiguous(ticket_ids, (self.THREADS // 2) * self.PER_THREAD * 3 + (self.THREADS // 2) * self.PER_THREAD)
+
+
+# ------------------- Версии внутрипроцессных кэшей (tickets/cache_versions.py) -------------------
+class VersionStampTests(TestCase):
+    @override_settings(CACHE_VERSION_CHECK_INTERVAL=0)
+    def test_bump_from_another_process_is_seen(self):
+        stamp = VersionStamp('test_stamp')
+        initial = stamp.current()
+        # Другой процесс (админка в соседнем воркере, команда) меняет версию только в БД
+        CacheVersion.objects.update_or_create(name='test_stamp', defaults={'version': initial + 5})
+        self.assertEqual(stamp.current(), initial + 5)
+
+    def test_own_bump_is_seen_immediately(self):
+        stamp = VersionStamp('test_stamp_local')
+        initial = stamp.current()
+        self.assertEqual(stamp.bump(), initial + 1)
+        self.assertEqual(stamp.current(), initial + 1)
+        self.assertEqual(CacheVersion.objects.get(name='test_stamp_local').version, initial + 1)
+
+
+def default_status():
+    status, created = TicketStatus.objects.get_or_create(code='new', defaults={'name': "Новый", 'is_default_status': True})
+    if created: reference_data.invalidate() # в TestCase on_commit не выполняется
+    return status
+
+def create_ticket(project=None, **kwargs):
+    project = project or Project.objects.get_or_create(name="Тестовый проект")[0]
+    status = default_status()
+    fields = {'title': "Не работает принтер", 'description': "Принтер в кабинете не печатает.", 'reporter_name': "Иванов И.И.", 'reporter_email': 'ivanov@example.com'}
+    fields.update(kwargs)
+    return Ticket.objects.create(project=project, status=status, **fields)
+
+
+# ------------------- Очередь уведомлений (tickets/notifications.py) -------------------
+class NotificationOutboxTests(TestCase):
+    def setUp(self):
+        self.ticket = create_ticket()
+        NotificationOutbox.objects.all().delete()
+        self.entry = NotificationOutbox.objects.create(event='test_event', ticket=self.ticket)
+
+    def test_disabled_email_leaves_entries_pending(self):
+        EmailSettings.objects.update(is_active=False)
+        out = StringIO()
+        call_command('send_notifications', stdout=out)
+        self.entry.refresh_from_db()
+        self.assertEqual(self.entry.status, NotificationOutbox.STATUS_PENDING)
+        self.assertIn("ждут в очереди", out.getvalue())
+
+    def test_claimed_entries_are_not_claimed_twice_until_lease_expires(self):
+        dispatcher = NotificationDispatcher(EmailSettings(), batch_size=10)
+        now = timezone.now()
+        self.assertEqual([e.pk for e in dispatcher.claim_batch(now)], [self.entry.pk])
+        self.entry.refresh_from_db()
+        self.assertEqual(self.entry.status, NotificationOutbox.STATUS_SENDING)
+        self.assertEqual(dispatcher.claim_batch(now), [])
+        # Воркер упал, не сохранив результат: после срока запись забирает другой воркер
+        self.assertEqual([e.pk for e in dispatcher.claim_batch(now + timedelta(seconds=CLAIM_SECONDS + 1))], [self.entry.pk])
+
+    def test_failed_ticket_creation_leaves_no_outbox_entry(self):
+        category = TicketCategory.objects.create(project=self.ticket.project, name="Оборудование")
+        tickets_before = Ticket.objects.count()
+        # Событие new_ticket уже поставлено, но назначение падает: откатываются и заявка, и событие
+        with mock.patch('tickets.views.auto_assign_ticket', side_effect=RuntimeError("сбой назначения")), self.assertRaises(RuntimeError):
+            self.client.post(reverse('tickets:create_ticket_for_category', args=[category.pk]), {'reporter_name': "Петров П.П.", 'reporter_email': 'petrov@example.com'})
+        self.assertEqual(Ticket.objects.count(), tickets_before)
+        self.assertFalse(NotificationOutbox.objects.filter(event=EVENT_NEW_TICKET).exists())
+
+
+# ------------------- Счетчики тикетов (tickets/counters.py) -------------------
+class TicketCounterTests(TestCase):
+    def test_stale_instances_do_not_count_change_twice(self):
+        with self.captureOnCommitCallbacks(execute=True): # кэш справочников сбрасывается после коммита
+            closed_status = TicketStatus.objects.create(name="Тест: закрыт", code='test-closed', is_closed_status=True)
+        ticket = create_ticket()
+        # Два запроса загрузили тикет до изменений; оба закрывают его
+        first, second = Ticket.objects.get(pk=ticket.pk), Ticket.objects.get(pk=ticket.pk)
+        first.status = closed_status; first.save()
+        second.status = closed_status; second.save()
+        counter = counters.get_counters(TicketCounter.SCOPE_PROJECT, [ticket.project_id])[ticket.project_id]
+        expected = counters.compute_counters()[(TicketCounter.SCOPE_PROJECT, ticket.project_id)]
+        self.assertEqual({field: getattr(counter, field) for field in counters.COUNTER_FIELDS}, expected)
+        self.assertEqual(counter.closed_count, 1)
+
+    def test_reconcile_locks_counters_before_counting(self):
+        ticket = create_ticket()
+        TicketCounter.objects.filter(scope=TicketCounter.SCOPE_PROJECT, object_id=ticket.project_id).update(open_count=100)
+        with CaptureQueriesContext(connection) as queries: call_command('reconcile_ticket_counters', stdout=StringIO())
+        self.assertEqual(counters.get_counters(TicketCounter.SCOPE_PROJECT, [ticket.project_id])[ticket.project_id].open_count, 1)
+        # Подсчет по тикетам идет после чтения (в PostgreSQL - блокировки) строк счетчиков
+        sql = [query['sql'] for query in queries.captured_queries]
+        lock_at = next(i for i, q in enumerate(sql) if q.startswith('SELECT') and 'tickets_ticketcounter' in q)
+        count_at = next(i for i, q in enumerate(sql) if 'COUNT(' in q and 'FROM "tickets_ticket"' in q)
+        self.assertLess(lock_at, count_at)
+
+
+# ------------------- Сводки для отчетов (tickets/rollups.py) -------------------
+class RollupTests(TestCase):
+    def setUp(self):
+        self.project = Project.objects.create(name="Сводки")
+        self.now = timezone.now()
+        self.created_at = timezone.localtime(self.now - timedelta(days=3)).replace(hour=12, minute=0) # факты за несколько часов - в тот же день
+        self.open_status = default_status()
+        with self.captureOnCommitCallbacks(execute=True): # кэш справочников сбрасывается после коммита
+            self.closed_status = TicketStatus.objects.create(name="Тест: закрыт", code='test-closed', is_closed_status=True)
+
+    def state(self, **changes):
+        fields = dict.fromkeys(rollups.STATE_FIELDS); fields.update(project_id=self.project.pk, created_at=self.created_at)
+        fields.update(changes)
+        return rollups.RollupState(**fields)
+
+    def dims(self, state):
+        return (state.project_id, state.category_id or 0, state.priority_id or 0, state.assignee_id or 0)
+
+    def facts_by_row(self, facts):
+        """{(день, разрез): {поле: значение}} без нулевых полей."""
+        return {key: {field: value for field, value in changes.items() if value} for key, changes in facts.rows.items()}
+
+    def test_change_facts_for_new_ticket(self):
+        new = self.state(status_id=self.open_status.pk)
+        facts = rollups.change_facts(None, new, now=self.now)
+        self.assertEqual(self.facts_by_row(facts), {(timezone.localdate(self.created_at), self.dims(new)): {'created_count': 1, 'backlog_delta': 1}})
+
+    def test_change_facts_move_between_dims(self):
+        old = self.state(status_id=self.open_status.pk)
+        new = old._replace(assignee_id=42)
+        today = timezone.localdate(self.now)
+        # Открытый тикет переходит к исполнителю: -1 в старом разрезе, +1 в новом, созданных не прибавляется
+        self.assertEqual(self.facts_by_row(rollups.change_facts(old, new, now=self.now)), {
+            (today, self.dims(old)): {'backlog_delta': -1}, (today, self.dims(new)): {'backlog_delta': 1},
+        })
+        self.assertFalse(rollups.change_facts(old, old, now=self.now)) # без изменений - без фактов
+
+    def test_change_facts_close_and_reopen(self):
+        opened = self.state(status_id=self.open_status.pk)
+        resolved_at = self.created_at + timedelta(hours=5)
+        closed = opened._replace(status_id=self.closed_status.pk, resolved_at=resolved_at, closed_at=resolved_at)
+        facts = rollups.change_facts(opened, closed, now=self.now)
+        dims = self.dims(opened)
+        self.assertEqual(self.facts_by_row(facts), {
+            (timezone.localdate(self.now), dims): {'backlog_delta': -1},
+            (timezone.localdate(resolved_at), dims): {'resolved_count': 1, 'resolution_seconds': 5 * 3600, 'closed_count': 1},
+        })
+        self.assertEqual(dict(facts.sketch), {(timezone.localdate(resolved_at), dims, TicketRollupSketch.METRIC_RESOLUTION, rollups.sketch_bucket(5 * 3600)): 1})
+        # Возврат в работу: снова открыт и +1 к возвращенным; время решения не вычитается
+        reopened = opened._replace(closed_at=None, resolved_at=None)
+        self.assertEqual(self.facts_by_row(rollups.change_facts(closed, reopened, now=self.now)), {
+            (timezone.localdate(self.now), dims): {'backlog_delta': 1, 'reopened_count': 1},
+        })
+        # Удаление открытого тикета убирает его из открытых
+        self.assertEqual(self.facts_by_row(rollups.change_facts(reopened, None, now=self.now)), {(timezone.localdate(self.now), dims): {'backlog_delta': -1}})
+
+    def test_lifetime_facts_of_closed_ticket_leave_no_backlog(self):
+        closed_at = self.created_at + timedelta(days=1)
+        state = self.state(status_id=self.closed_status.pk, first_responded_at=self.created_at + timedelta(minutes=10), resolved_at=closed_at, closed_at=closed_at)
+        facts = rollups.lifetime_facts(state)
+        dims = self.dims(state)
+        self.assertEqual(self.facts_by_row(facts), {
+            (timezone.localdate(self.created_at), dims): {'created_count': 1, 'backlog_delta': 1, 'first_response_count': 1, 'first_response_seconds': 600},
+            (timezone.localdate(closed_at), dims): {'backlog_delta': -1, 'resolved_count': 1, 'resolution_seconds': 24 * 3600, 'closed_count': 1},
+        })
+        self.assertEqual(sum(changes['backlog_delta'] for changes in facts.rows.values()), 0)
+        self.assertFalse(rollups.lifetime_facts(self.state(project_id=None))) # без проекта в сводки не попадает
+
+    def test_sketch_quantiles_are_within_relative_accuracy(self):
+        values = sorted([int(1.5 ** i) + i for i in range(5, 40)] * 3) # от секунд до недель, с повторами
+        counts = defaultdict(int)
+        for seconds in values: counts[rollups.sketch_bucket(seconds)] += 1
+        quantiles = (0.0, 0.5, 0.9, 0.95, 1.0)
+        estimates = rollups.sketch_quantiles(counts, quantiles)
+        for q in quantiles:
+            exact = values[int(q * (len(values) - 1))]
+            self.assertLessEqual(abs(estimates[q] - exact) / exact, rollups.SKETCH_RELATIVE_ACCURACY, q)
+        self.assertEqual(rollups.sketch_quantiles({}, (0.5,)), {0.5: None})
+
+    def test_report_carries_backlog_over_periods(self):
+        day = lambda days_ago: self.now - timedelta(days=days_ago)
+        dims = (self.project.pk, 0, 0, 0)
+        facts = rollups.RollupFacts()
+        facts.add(day(10), dims, created_count=3, backlog_delta=3) # до начала отчета
+        facts.add(day(2), dims, created_count=2, backlog_delta=2)
+        facts.add(day(1), dims, closed_count=1, backlog_delta=-1)
+        rollups.apply_facts(facts)
+        periods, total = rollups.build_report(timezone.localdate(day(2)), timezone.localdate(self.now), granularity='day', project_ids=[self.project.pk])
+        self.assertEqual([(p['period'], p['created_count'], p['backlog']) for p in periods], [
+            (timezone.localdate(day(2)), 2, 5), (timezone.localdate(day(1)), 0, 4),
+        ])
+        self.assertEqual((total['created_count'], total['closed_count'], total['backlog']), (2, 1, 4))
+
+    def test_bulk_upsert_adds_to_existing_rows(self):
+        facts = rollups.RollupFacts()
+        rollups.lifetime_facts(self.state(first_responded_at=self.created_at + timedelta(minutes=30)), facts)
+        rollups.lifetime_facts(self.state(priority_id=None, resolved_at=self.created_at + timedelta(hours=5)), facts)
+        rollups.apply_facts_bulk(facts)
+        rollups.apply_facts_bulk(facts) # второй пакет с теми же ключами - ветка ON CONFLICT DO UPDATE
+        row = TicketDailyRollup.objects.get(day=timezone.localdate(self.created_at), project=self.project)
+        self.assertEqual((row.created_count, row.backlog_delta), (4, 4))
+        sketch = {(r.metric, r.bucket): r.count for r in TicketRollupSketch.objects.filter(project=self.project)}
+        self.assertEqual(sketch, {
+            (TicketRollupSketch.METRIC_FIRST_RESPONSE, rollups.sketch_bucket(30 * 60)): 2,
+            (TicketRollupSketch.METRIC_RESOLUTION, rollups.sketch_bucket(5 * 3600)): 2,
+        })
+        self.assertEqual(sum(r.first_response_seconds for r in TicketDailyRollup.objects.filter(project=self.project)), 2 * 30 * 60)
+
+
+# ------------------- Импорт тикетов (tickets/importer.py) -------------------
+class TicketImportNumberTests(TestCase):
+    def setUp(self):
+        self.project = Project.objects.create(name="Импорт")
+        default_status()
+        self.code = get_project_code(self.project)
+
+    def import_rows(self, ticket_ids):
+        rows = [
+            (line_number, {'title': f"Заявка {line_number}", 'reporter_name': "Петров П.П.", 'reporter_email': 'petrov@example.com', 'project': self.project.pk, 'ticket_id': ticket_id})
+            for line_number, ticket_id in enumerate(ticket_ids, start=1)
+        ]
+        return TicketImporter(source='test-import', batch_size=10).run(rows, restart=True)
+
+    def test_imported_numbers_advance_sequence(self):
+        legacy_id = format_ticket_id(self.code, 2031, 40)
+        checkpoint = self.import_rows([legacy_id, ''])
+        self.assertEqual(checkpoint.tickets_created, 2)
+        self.assertEqual(allocate_ticket_id(self.project, year=2031), format_ticket_id(self.code, 2031, 41))
+
+    def test_taken_and_repeated_numbers_are_row_errors(self):
+        existing = create_ticket(self.project)
+        legacy_id = format_ticket_id(self.code, 2031, 7)
+        checkpoint = self.import_rows([existing.ticket_id_display, legacy_id, legacy_id])
+        self.assertEqual((checkpoint.tickets_created, checkpoint.rows_rejected), (1, 2))
+        self.assertTrue(Ticket.objects.filter(ticket_id_display=legacy_id).exists())
+
+    def test_imported_tickets_get_sla_deadlines(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            SLAPolicy.objects.create(name="Сутки на решение", project=self.project, first_response_minutes=60, resolution_minutes=24 * 60)
+        self.addCleanup(sla_policies.invalidate)
+        created_at = timezone.now() - timedelta(hours=2)
+        rows = [(1, {'title': "Старая заявка", 'reporter_name': "Петров П.П.", 'reporter_email': 'petrov@example.com', 'project': self.project.pk, 'created_at': created_at.isoformat()})]
+        TicketImporter(source='test-import-sla').run(rows, restart=True)
+        ticket = Ticket.objects.get(title="Старая заявка")
+        self.assertEqual(ticket.resolution_due_at, created_at + timedelta(days=1)) # от исходной даты, а не от времени импорта
+        self.assertEqual(ticket.sla_due_at, ticket.resolution_due_at) # срок первого ответа уже прошел
+        self.assertEqual(ticket.sla_state, Ticket.SLA_STATE_BREACHED)
+        self.assertEqual(ticket.sla_escalated_state, Ticket.SLA_STATE_BREACHED) # без эскалации за историю
+
+
+# ------------------- Области доступа сотрудников (tickets/scope.py) -------------------
+class AgentScopeTests(TestCase):
+    def setUp(self):
+        self.project = Project.objects.create(name="Доступ")
+        self.agent = Agent.objects.create_user(username='scope-agent', password=None)
+        with self.captureOnCommitCallbacks(execute=True): self.agent.projects.add(self.project)
+
+    def can_view(self):
+        return get_agent_scope(Agent.objects.get(pk=self.agent.pk)).can_view_project(self.project.pk) # новый запрос - новый объект
+
+    def test_removed_project_is_not_visible_on_next_request(self):
+        self.assertTrue(self.can_view())
+        with self.captureOnCommitCallbacks(execute=True): self.agent.projects.remove(self.project)
+        self.assertFalse(self.can_view())
+
+    @override_settings(CACHE_VERSION_CHECK_INTERVAL=0)
+    def test_scope_is_cached_until_version_changes_in_another_process(self):
+        self.assertTrue(self.can_view())
+        self.agent.projects.through.objects.filter(agent=self.agent).delete() # в обход сигналов: кэш еще отвечает
+        with self.assertNumQueries(2): self.assertTrue(self.can_view()) # сотрудник и версии кэшей, без проектов сотрудника
+        # Другой процесс снял сотрудника с проекта и сменил версию в БД
+        CacheVersion.objects.update_or_create(name='agent_scopes', defaults={'version': scope_version.current() + 1})
+        self.assertFalse(self.can_view())
+
+
+# ------------------- Отдача вложений (tickets/downloads.py) -------------------
+class DownloadTests(TestCase):
+    def test_range_on_empty_file_is_not_satisfiable(self):
+        self.assertIs(parse_range('bytes=-10', 0), False)
+        self.assertIs(parse_range('bytes=0-', 0), False)
+        self.assertEqual(parse_range('bytes=-10', 4), (0, 3))
+
+    def test_reporter_token_opens_only_its_ticket(self):
+        ticket, other = create_ticket(), create_ticket()
+        self.assertEqual(ticket_pk_from_token(reporter_attachment_token(ticket)), ticket.pk)
+        self.assertNotEqual(ticket_pk_from_token(reporter_attachment_token(other)), ticket.pk)
+        self.assertIsNone(ticket_pk_from_token(reporter_attachment_token(ticket) + 'x'))
+
+    @override_settings(DEBUG=True)
+    def test_media_root_is_not_served_directly(self):
+        import helpdesk_project.urls
+        urlconf = importlib.reload(helpdesk_project.urls) # маршрут static() добавлялся при импорте, если DEBUG
+        for path in ('attachment_blobs/ab/abcdef.pdf', 'attachment_previews/1/small.webp', 'ticket_attachments/old.docx'):
+            with self.assertRaises(Resolver404): resolve(settings.MEDIA_URL + path, urlconf=urlconf)
+
+
+# ------------------- Хранилище вложений (tickets/blobstore.py) -------------------
+class AttachmentBlobTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory(); self.addCleanup(media_root.cleanup)
+        media_override = override_settings(MEDIA_ROOT=media_root.name); media_override.enable(); self.addCleanup(media_override.disable)
+        self.ticket = create_ticket()
+
+    def attach(self, content, name):
+        return Attachment.objects.create(ticket=self.ticket, file=SimpleUploadedFile(name, content), uploaded_by_name_display="Тест")
+
+    def blob_files(self):
+        root = attachment_storage().path(BLOB_DIR)
+        return [name for _, _, names in os.walk(root) for name in names if not name.startswith('.upload-')]
+
+    def test_identical_files_share_one_blob_until_collected(self):
+        first = self.attach(b"%PDF-1.4 one report", 'report.pdf')
+        second = self.attach(b"%PDF-1.4 one report", 'report-copy.pdf')
+        self.assertEqual(first.blob_id, second.blob_id)
+        self.assertEqual(first.file.name, second.file.name)
+        self.assertEqual(AttachmentBlob.objects.get().ref_count, 2)
+        self.assertEqual(len(self.blob_files()), 1)
+        self.assertEqual((first.display_name, second.display_name), ('report.pdf', 'report-copy.pdf'))
+
+        first.delete()
+        self.assertEqual(AttachmentBlob.objects.get().ref_count, 1)
+        second.delete()
+        self.assertEqual(AttachmentBlob.objects.get().ref_count, 0)
+        # Без ссылок, но в пределах grace: загрузка могла только что найти этот файл - не удаляем
+        with self.captureOnCommitCallbacks(execute=True): self.assertEqual(collect_garbage(), (0, 0))
+        self.assertEqual(len(self.blob_files()), 1)
+        AttachmentBlob.objects.update(updated_at=timezone.now() - timedelta(hours=25))
+        with self.captureOnCommitCallbacks(execute=True): self.assertEqual(collect_garbage(), (1, len(b"%PDF-1.4 one report")))
+        self.assertFalse(AttachmentBlob.objects.exists())
+        self.assertEqual(self.blob_files(), [])
+
+    def test_referenced_blob_is_not_collected(self):
+        attachment = self.attach(b"plain text", 'note.txt')
+        AttachmentBlob.objects.update(updated_at=timezone.now() - timedelta(days=7))
+        with self.captureOnCommitCallbacks(execute=True): self.assertEqual(collect_garbage(), (0, 0))
+        self.assertTrue(attachment.file.storage.exists(attachment.file.name))
+
+
+# ------------------- Бюджеты SQL-запросов представлений (tickets/instrumentation.py) -------------------
+@override_settings(QUERY_BUDGET_STRICT=True)
+class QueryBudgetTests(TestCase):
+    TICKETS = 30
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.project = Project.objects.create(name="Бюджеты")
+        cls.category = TicketCategory.objects.create(project=cls.project, name="Оборудование")
+        cls.agent = Agent.objects.create_user(username='budget-agent', password=None, is_staff=True, email='budget-agent@example.com')
+        cls.agent.projects.add(cls.project)
+        other = Agent.objects.create_user(username='budget-other', password=None, is_staff=True)
+        other.projects.add(cls.project)
+        # Заявки разных исполнителей: повторные SELECT исполнителя в строках списка сразу видны в числе запросов
+        cls.tickets = [create_ticket(cls.project, category=cls.category, assignee=cls.agent if i % 3 else other) for i in range(cls.TICKETS)]
+
+    def setUp(self):
+        self.client.force_login(self.agent)
+
+    def assert_within_budget(self, view_name, response):
+        self.assertEqual(response.status_code, 200)
+        record = request_log.snapshot()[-1]
+        self.assertEqual(record['view'], view_name)
+        self.assertLessEqual(record['queries'], query_budget(view_name))
+
+    def test_agent_pages(self):
+        ticket = self.tickets[-1]
+        pages = [
+            ('tickets:agent_ticket_list', reverse('tickets:agent_ticket_list'), {}),
+            ('tickets:agent_my_ticket_list', reverse('tickets:agent_my_ticket_list'), {}),
+            ('tickets:agent_my_ticket_list', reverse('tickets:agent_my_ticket_list'), {'sort': 'sla'}),
+            ('tickets:agent_ticket_detail', reverse('tickets:agent_ticket_detail', args=[ticket.pk]), {}),
+            ('tickets:agent_dashboard', reverse('tickets:agent_dashboard'), {}),
+            ('tickets:agent_reports', reverse('tickets:agent_reports'), {}),
+            ('tickets:agent_check_new_tickets_api', reverse('tickets:agent_check_new_tickets_api'), {'since_id': self.tickets[0].pk}),
+        ]
+        for view_name, url, params in pages:
+            ticket_row_cache.cache.clear() # бюджет - для холодного кэша строк списка
+            with self.subTest(view=view_name, params=params):
+                self.assert_within_budget(view_name, self.client.get(url, params))
+
+    def test_check_ticket_status(self):
+        ticket = self.tickets[0]
+        response = self.client.get(reverse('tickets:check_ticket_status'), {'ticket_number': ticket.ticket_id_display, 'reporter_email': ticket.reporter_email})
+        self.assert_within_budget('tickets:check_ticket_status', response)
+
+    async def test_async_requests_are_recorded(self):
+        await self.async_client.aforce_login(self.agent)
+        ticket_row_cache.cache.clear()
+        response = await self.async_client.get(reverse('tickets:agent_my_ticket_list'))
+        self.assertEqual(response.status_code, 200)
+        record = request_log.snapshot()[-1]
+        self.assertEqual(record['view'], 'tickets:agent_my_ticket_list')
+        self.assertGreater(record['queries'], 0)
+        self.assertLessEqual(record['queries'], query_budget('tickets:agent_my_ticket_list'))
+
+
+# ------------------- Эскалации SLA (tickets/sla.py) -------------------
+class SLAEscalationTests(TestCase):
+    def setUp(self):
+        self.project = Project.objects.create(name="SLA")
+        with self.captureOnCommitCallbacks(execute=True): # кэш политик сбрасывается после коммита
+            SLAPolicy.objects.create(name="Час на ответ", project=self.project, first_response_minutes=60)
+        self.addCleanup(sla_policies.invalidate) # политика откатится вместе с тестом, а кэш процесса - нет
+        self.ticket = create_ticket(self.project)
+        self.assertEqual(self.ticket.sla_state, Ticket.SLA_STATE_OK)
+
+    def test_breach_set_by_save_is_escalated_once(self):
+        past = timezone.now() - timedelta(minutes=5)
+        Ticket.objects.filter(pk=self.ticket.pk).update(first_response_due_at=past, sla_due_at=past, sla_warn_at=past - timedelta(minutes=10))
+        # Заявку сохранили после срока, раньше прохода планировщика: save() сам переводит ее в "нарушен"
+        ticket = Ticket.objects.get(pk=self.ticket.pk); ticket.save()
+        self.assertEqual(ticket.sla_state, Ticket.SLA_STATE_BREACHED)
+        self.assertIsNone(ticket.sla_due_at)
+
+        scheduler = SLAScheduler(); now = timezone.now()
+        scheduler.start(now)
+        self.assertEqual(scheduler.fire_due(now), 1)
+        self.assertEqual(scheduler.breaches_fired, 1)
+        self.assertTrue(NotificationOutbox.objects.filter(ticket=ticket, event=EVENT_SLA_BREACHED).exists())
+        self.assertEqual(Ticket.objects.get(pk=ticket.pk).sla_escalated_state, Ticket.SLA_STATE_BREACHED)
+
+        restarted = SLAScheduler(); restarted.start(now)
+        self.assertEqual(restarted.fire_due(now), 0)
+
+
+# ------------------- Поиск дубликатов (tickets/duplicates.py) -------------------
+class DuplicateIndexTests(TestCase):
+    @override_settings(CACHE_VERSION_CHECK_INTERVAL=0)
+    def test_rebuilt_older_fingerprints_are_seen_after_invalidation(self):
+        self.addCleanup(duplicate_index.invalidate)
+        text = {'title': "Не печатает принтер в 305", 'description': "Принтер HP в кабинете 305 не печатает, горит оранжевая лампа."}
+        older, newer = create_ticket(**text), create_ticket(**text)
+        index_fingerprints([newer])
+        signature = ticket_signature(newer)
+        self.assertEqual([ticket_id for _, ticket_id in duplicate_index.find(newer.project_id, signature)], [newer.pk])
+        # rebuild_duplicate_index дописал подпись более ранней заявки (pk меньше уже загруженных) и сбросил версию
+        # в другом процессе: этот процесс перечитывает индекс проекта целиком
+        index_fingerprints([older])
+        CacheVersion.objects.update_or_create(name='duplicate_index', defaults={'version': duplicate_index.stamp.current() + 1})
+        self.assertEqual(sorted(ticket_id for _, ticket_id in duplicate_index.find(newer.project_id, signature)), [older.pk, newer.pk])
+
+    def test_late_fingerprint_of_lower_pk_is_loaded_without_invalidation(self):
+        self.addCleanup(duplicate_index.invalidate)
+        text = {'title': "Не работает сканер в 210", 'description': "Сканер Canon в кабинете 210 не включается после обновления."}
+        older, newer = create_ticket(**text), create_ticket(**text)
+        # Одновременная двойная отправка: запрос заявки с большим pk записал подпись первым, и индекс ее загрузил
+        index_fingerprints([newer])
+        signature = ticket_signature(newer)
+        self.assertEqual([ticket_id for _, ticket_id in duplicate_index.find(newer.project_id, signature)], [newer.pk])
+        index_fingerprints([older]) # подпись меньшего pk - позже и без сброса версии
+        self.assertEqual([ticket_id for _, ticket_id in duplicate_index.find(newer.project_id, signature, exclude_id=newer.pk)], [older.pk])
+
+
+# ------------------- Фильтры по дополнительным полям (tickets/custom_filters.py) -------------------
+class CustomFieldFilterTests(TestCase):
+    def test_ticket_column_names_are_not_filterable(self):
+        self.addCleanup(custom_field_filters.invalidate)
+        template = FieldTemplate(name='reporter_phone', label_default="Телефон", field_type='char', is_filterable=True)
+        with self.assertRaises(ValidationError) as raised: template.full_clean()
+        self.assertIn('is_filterable', raised.exception.message_dict)
+        # Шаблон, сохраненный до проверки, не дает ни фильтра, ни индекса: значение лежит в колонке, а не в JSON
+        template.save()
+        room = FieldTemplate.objects.create(name='room_number', label_default="Кабинет", field_type='char', is_filterable=True)
+        category = TicketCategory.objects.create(project=Project.objects.create(name="Фильтры"), name="Оборудование")
+        for field_template in (template, room): CustomFormField.objects.create(category=category, field_template=field_template)
+        custom_field_filters.invalidate()
+        self.assertEqual([f.name for f in custom_field_filters.all()], ['room_number'])
+        self.assertEqual(set(expected_indexes()), {index_name(room.pk, 'room_number')})
@@ -23,6 +23,9 @@ urlpatterns = [
 
     # Проверка статуса тикета
     path('check_status/', views.check_ticket_status_view, name='check_ticket_status'),
+    # Скачивание вложения заявителем (подписанный токен заявки в параметре token, см. tickets/downloads.py)
+    path('attachment/<int:attachment_pk>/', views.attachment_download_view, name='attachment_download'),
+    path('attachment/<int:attachment_pk>/preview/<str:size>/', views.attachment_preview_view, name='attachment_preview'),
 
     # Форма для жалоб и предложений
     path('feedback/', views.feedback_form_view, name='feedback_form'),
@@ -54,4 +57,15 @@ urlpatterns = [
 
     # API для проверки новых тикетов (для браузерных уведомлений)
     path('agent/api/check_new_tickets/', views.check_new_tickets_api_view, name='agent_check_new_tickets_api'),
+    # Поток новых тикетов (Server-Sent Events, требует ASGI). Опрос API выше остается запасным вариантом.
+    path('agent/api/ticket_stream/', views.agent_ticket_stream_view, name='agent_ticket_stream'),
+    # Потоковая выгрузка тикетов (CSV/JSONL) для BI
+    path('agent/tickets/export/', views.agent_ticket_export_view, name='agent_ticket_export'),
+    # Скачивание вложений с проверкой доступа (Range, ETag, X-Accel-Redirect)
+    path('agent/attachment/<int:attachment_pk>/', views.agent_attachment_download_view, name='agent_attachment_download'),
+    path('agent/attachment/<int:attachment_pk>/preview/<str:size>/', views.agent_attachment_preview_view, name='agent_attachment_preview'),
+    # Нагрузка по представлениям (запросы к БД, время, повторы) и метрики в формате Prometheus
+    path('agent/stats/performance/', views.agent_performance_stats_view, name='agent_performance_stats'),
+    path('agent/metrics/', views.agent_metrics_view, name='agent_metrics'),
+    path('agent/reports/', views.agent_reports_view, name='agent_reports'),
 ]
\ No newline at end of file
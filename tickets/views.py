@@ -1,30 +1,74 @@
 # tickets/views.py
 from django.shortcuts import render, redirect, get_object_or_404
+from django.conf import settings
 from django.contrib import messages
-from django.http import Http404, JsonResponse
+from django.http import Http404, JsonResponse, HttpResponse
 from django.contrib.auth.decorators import login_required
 from django.contrib.admin.views.decorators import staff_member_required
 from django.urls import reverse
 from django.utils.html import format_html
 from django.utils import timezone
-from django import forms
-from django.db.models import Q, Case, When, IntegerField
-from datetime import datetime, timedelta
+from django.db import transaction
+from django.db.models import Q, Case, When, IntegerField, DateTimeField, Value
+from django.db.models.functions import Coalesce
+from django.http import StreamingHttpResponse
+from asgiref.sync import sync_to_async
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+import asyncio
+import hmac
+import os
 
 from .models import (
     Ticket, Comment, Attachment, TicketStatus, TicketCategory,
     TicketPriority, Agent, CustomFormField, Project, FieldTemplate,
-    Feedback # Добавили модель Feedback
+    Feedback, # Добавили модель Feedback
+    TicketEvent, TicketCounter
 )
 from .forms import (
-    TicketCreateForm, AgentCommentForm, TicketUpdateStatusForm,
+    AgentCommentForm, TicketUpdateStatusForm,
     TicketUpdatePriorityForm,
     TicketReassignAgentForm, SelectTicketCategoryForm,
     TicketUpdateProjectForm, TicketFilterForm,
     UserCommentForm, TicketReturnToWorkForm, # Для check_ticket_status
     MyTicketsStatusFilterForm, # Для страницы "Мои заявки"
+    TicketReportFilterForm, # Отчет по сводкам
     FeedbackForm # Добавили форму для Feedback
 )
+from .pagination import KeysetPaginator, InvalidCursor
+from .reference_cache import reference_data
+from .live import ticket_stream_hub, build_ticket_event, format_sse
+from .search import search_tickets
+from .dynamic_forms import get_ticket_create_form_class, ticket_create_forms
+from .history import record_ticket_event
+from .export import TicketExport, STREAM_WRITERS, CONTENT_TYPES
+from .scope import get_agent_scope
+from .downloads import attachment_ticket, reporter_attachment_token, serve_attachment, serve_file, ticket_pk_from_token
+from .previews import PREVIEW_SIZES, preview_name, preview_pipeline
+from .instrumentation import request_log, prometheus_metrics
+from .template_cache import compiled_notification_templates
+from .fragment_cache import ticket_row_cache
+from .sla import sla_policies
+from .assignment import assignment_board, auto_assign_ticket
+from .duplicates import duplicate_candidates_for, duplicate_index, flag_duplicates, merge_ticket_into
+from .rollups import REPORT_QUANTILES, build_report
+from .custom_filters import custom_field_filters
+from .notifications import (
+    enqueue_notification, EVENT_NEW_TICKET, EVENT_NEW_COMMENT, EVENT_STATUS_CHANGED,
+    EVENT_PRIORITY_CHANGED, EVENT_ASSIGNEE_CHANGED, EVENT_PROJECT_CHANGED
+)
+
+# Параметры потока новых тикетов (SSE)
+STREAM_HEARTBEAT_SECONDS = 20 # комментарий-пинг, чтобы прокси не закрывали простаивающее соединение
+STREAM_RETRY_MS = 5000 # через сколько браузер переподключается после обрыва
+STREAM_CATCHUP_LIMIT = 20 # сколько пропущенных тикетов досылаем при переподключении
+
+# Количество тикетов на одной странице списков агента
+TICKET_LIST_PAGE_SIZE = 50
+# GET-параметры навигации по страницам (не относятся к фильтрам)
+PAGINATION_PARAMS = ('after', 'before', 'last')
+
+# Сортировка по SLA: тикеты без срока SLA идут в конце своей группы (keyset-пагинации нужен ключ без NULL)
+SLA_NO_DEADLINE = datetime(9999, 1, 1, tzinfo=dt_timezone.utc)
 
 # Вспомогательная функция для IP
 def get_client_ip(request):
@@ -35,6 +79,26 @@ def get_client_ip(request):
         ip = request.META.get('REMOTE_ADDR')
     return ip
 
+# Данные фильтров из GET без параметров пагинации (чтобы переход по страницам не "связывал" пустую форму)
+def get_filter_data(request):
+    filter_data = request.GET.copy()
+    for param in PAGINATION_PARAMS: filter_data.pop(param, None)
+    return filter_data
+
+# Общая keyset-пагинация для списков тикетов агента
+def paginate_ticket_list(request, queryset, ordering):
+    paginator = KeysetPaginator(queryset, ordering, per_page=TICKET_LIST_PAGE_SIZE)
+    try:
+        page = paginator.page(after=request.GET.get('after'), before=request.GET.get('before'), last=request.GET.get('last') == '1')
+    except InvalidCursor:
+        page = paginator.page()
+    return page, get_filter_data(request).urlencode()
+
+# Нарушенные, под угрозой, в срок, без SLA; внутри группы - по ближайшему сроку (индекс ticket_project_sla_idx)
+def order_tickets_by_sla(queryset):
+    queryset = queryset.annotate(sla_due_order=Coalesce('sla_due_at', Value(SLA_NO_DEADLINE, output_field=DateTimeField())))
+    return queryset, ('-sla_state', 'sla_due_order', '-id')
+
 # -----------------------------------------------------------------------------
 # ПРЕДСТАВЛЕНИЯ ДЛЯ ОБЫЧНЫХ ПОЛЬЗОВАТЕЛЕЙ
 # -----------------------------------------------------------------------------
@@ -51,7 +115,7 @@ def select_ticket_category_view(request):
 
 def create_ticket_view(request, category_id):
     try:
-        selected_category = TicketCategory.objects.select_related('project').prefetch_related('custom_form_fields__field_template').get(pk=category_id)
+        selected_category = TicketCategory.objects.select_related('project').get(pk=category_id)
     except TicketCategory.DoesNotExist:
         messages.error(request, "Выбранная категория не найдена.")
         return redirect('tickets:select_ticket_category')
@@ -69,34 +133,9 @@ def create_ticket_view(request, category_id):
         form_kwargs['data'] = request.POST
         form_kwargs['files'] = request.FILES
     
-    form = TicketCreateForm(**form_kwargs) 
-    
-    custom_fields_definitions = selected_category.custom_form_fields.filter(is_active_in_category=True).select_related('field_template').order_by('order_in_category')
-    
-    for field_def in custom_fields_definitions:
-        field_kwargs_custom = {
-            'label': field_def.effective_label, 
-            'required': field_def.is_required_in_category,
-            'help_text': field_def.effective_help_text
-        }
-        widget_attrs = {}
-        field_name = field_def.name
-        field_type = field_def.field_type
-
-        if field_type == 'char': widget_attrs['class'] = 'form-control'; form.fields[field_name] = forms.CharField(widget=forms.TextInput(attrs=widget_attrs), **field_kwargs_custom)
-        elif field_type == 'text': widget_attrs['class'] = 'form-control'; form.fields[field_name] = forms.CharField(widget=forms.Textarea(attrs=widget_attrs), **field_kwargs_custom)
-        elif field_type == 'email': widget_attrs['class'] = 'form-control'; form.fields[field_name] = forms.EmailField(widget=forms.EmailInput(attrs=widget_attrs), **field_kwargs_custom)
-        elif field_type == 'int': widget_attrs['class'] = 'form-control'; form.fields[field_name] = forms.IntegerField(widget=forms.NumberInput(attrs=widget_attrs), **field_kwargs_custom)
-        elif field_type == 'bool': widget_attrs['class'] = 'form-check-input'; form.fields[field_name] = forms.BooleanField(widget=forms.CheckboxInput(attrs=widget_attrs), **field_kwargs_custom)
-        elif field_type == 'date': widget_attrs.update({'class': 'form-control', 'type': 'date'}); form.fields[field_name] = forms.DateField(widget=forms.DateInput(attrs=widget_attrs, format='%Y-%m-%d'), **field_kwargs_custom)
-        elif field_type == 'file': widget_attrs['class'] = 'form-control-file'; form.fields[field_name] = forms.FileField(widget=forms.ClearableFileInput(attrs=widget_attrs), **field_kwargs_custom)
-        elif field_type == 'select' and field_def.effective_select_choices_json:
-            widget_attrs['class'] = 'form-select'
-            try:
-                choices = list(field_def.effective_select_choices_json.items())
-                if not field_def.is_required_in_category: choices.insert(0, ('', '---------')) 
-                form.fields[field_name] = forms.ChoiceField(choices=choices, widget=forms.Select(attrs=widget_attrs), **field_kwargs_custom)
-            except Exception as e: print(f"Ошибка парсинга JSON для поля {field_name} в категории {selected_category.name}: {e}")
+    # Класс формы с дополнительными полями категории собирается один раз и берется из кэша
+    form_class = get_ticket_create_form_class(selected_category)
+    form = form_class(**form_kwargs)
 
     if request.method == 'POST':
         if form.is_valid(): 
@@ -106,14 +145,14 @@ def create_ticket_view(request, category_id):
             ticket.reporter_ip_address = get_client_ip(request)
 
             try:
-                default_status = TicketStatus.objects.get(is_default_status=True)
+                default_status = reference_data.get_default_status()
                 ticket.status = default_status
             except TicketStatus.DoesNotExist: messages.error(request, "Ошибка: не найден статус по умолчанию."); return redirect('tickets:select_ticket_category')
             except TicketStatus.MultipleObjectsReturned: messages.error(request, "Ошибка: несколько статусов по умолчанию."); return redirect('tickets:select_ticket_category')
 
             standard_model_field_names = [f.name for f in Ticket._meta.get_fields() if not f.is_relation]
             custom_data_for_json_field = {}
-            file_field_names = [f_def.name for f_def in custom_fields_definitions if f_def.field_type == 'file']
+            file_field_names = form_class.file_field_names
 
             for field_name_from_form, value_from_form in form.cleaned_data.items():
                 if field_name_from_form in ['reporter_name', 'reporter_email']:
@@ -125,20 +164,25 @@ def create_ticket_view(request, category_id):
                 if field_name_from_form in standard_model_field_names:
                     setattr(ticket, field_name_from_form, value_from_form)
                 else:
-                    is_defined_custom_non_file_field = any(cfield.name == field_name_from_form for cfield in custom_fields_definitions)
+                    is_defined_custom_non_file_field = field_name_from_form in form_class.custom_field_names
                     if is_defined_custom_non_file_field:
-                        custom_data_for_json_field[field_name_from_form] = value_from_form
+                        # даты - строкой ISO: JSONField не сериализует date
+                        custom_data_for_json_field[field_name_from_form] = value_from_form.isoformat() if isinstance(value_from_form, date) else value_from_form
             
             ticket.custom_form_data = custom_data_for_json_field
-            ticket.save() 
-
-            for field_def in custom_fields_definitions:
-                if field_def.field_type == 'file':
-                    field_name = field_def.name
+            # Заявка, вложения, назначение и события очереди уведомлений фиксируются вместе (см. tickets/notifications.py)
+            with transaction.atomic():
+                ticket.save()
+                for field_name in file_field_names:
                     uploaded_file_object = form.cleaned_data.get(field_name)
                     if uploaded_file_object:
                         Attachment.objects.create(ticket=ticket, file=uploaded_file_object, uploaded_by_name_display=ticket.reporter_name)
-            
+                enqueue_notification(EVENT_NEW_TICKET, ticket)
+                auto_assign_ticket(ticket) # по правилу проекта, если оно включено
+            # После фиксации: подпись должна быть видна параллельным запросам, иначе одновременно
+            # отправленные одинаковые заявки не найдут друг друга (уведомлений flag_duplicates не ставит)
+            flag_duplicates(ticket) # похожие заявки проекта покажутся в карточке
+
             return redirect('tickets:ticket_creation_success', ticket_pk=ticket.pk)
         else: 
             messages.error(request, "Пожалуйста, исправьте ошибки в форме.")
@@ -216,10 +260,12 @@ def check_ticket_status_view(request):
                 client_ip = get_client_ip(request)
                 display_name_for_user_comment = f"Пользователь, IP {client_ip}" if client_ip else "Пользователь"
                 new_comment = Comment(ticket=ticket_instance, author_name_display=display_name_for_user_comment, body=user_comment_form.cleaned_data['body'], is_internal=False, author_ip_address=client_ip)
-                new_comment.save()
-                attachment_file = user_comment_form.cleaned_data.get('attachment_file')
-                if attachment_file:
-                    Attachment.objects.create(comment=new_comment, ticket=ticket_instance, file=attachment_file, uploaded_by_name_display=display_name_for_user_comment)
+                with transaction.atomic():
+                    new_comment.save()
+                    attachment_file = user_comment_form.cleaned_data.get('attachment_file')
+                    if attachment_file:
+                        Attachment.objects.create(comment=new_comment, ticket=ticket_instance, file=attachment_file, uploaded_by_name_display=display_name_for_user_comment)
+                    enqueue_notification(EVENT_NEW_COMMENT, ticket_instance, comment=new_comment, actor_email=ticket_instance.reporter_email)
                 messages.success(request, "Ваш комментарий успешно добавлен.")
                 action_taken = True
             else: messages.error(request, "Пожалуйста, исправьте ошибки в форме комментария.")
@@ -228,13 +274,16 @@ def check_ticket_status_view(request):
             return_to_work_form = TicketReturnToWorkForm(request.POST)
             if return_to_work_form.is_valid():
                 try:
-                    needs_rework_status = TicketStatus.objects.get(code='needs_rework')
-                    old_status_name = ticket_instance.status.name
-                    ticket_instance.status = needs_rework_status
-                    ticket_instance.resolved_at = None; ticket_instance.closed_at = None
-                    ticket_instance.save()
-                    reopen_reason = return_to_work_form.cleaned_data['reopen_comment']
-                    Comment.objects.create(ticket=ticket_instance,author_name_display=ticket_instance.reporter_name, body=f"Заявка возвращена в работу пользователем (статус изменен с '{old_status_name}' на '{needs_rework_status.name}').\nПричина: {reopen_reason}", is_internal=False, author_ip_address=get_client_ip(request))
+                    with transaction.atomic():
+                        needs_rework_status = reference_data.get_status('needs_rework')
+                        old_status = ticket_instance.status; old_status_name = old_status.name
+                        ticket_instance.status = needs_rework_status
+                        ticket_instance.resolved_at = None; ticket_instance.closed_at = None
+                        ticket_instance.save()
+                        reopen_reason = return_to_work_form.cleaned_data['reopen_comment']
+                        record_ticket_event(ticket_instance, TicketEvent.KIND_STATUS, old_status, needs_rework_status, actor_name=ticket_instance.reporter_name, note=reopen_reason)
+                        reopen_comment = Comment.objects.create(ticket=ticket_instance,author_name_display=ticket_instance.reporter_name, body=f"Заявка возвращена в работу пользователем (статус изменен с '{old_status_name}' на '{needs_rework_status.name}').\nПричина: {reopen_reason}", is_internal=False, author_ip_address=get_client_ip(request))
+                        enqueue_notification(EVENT_STATUS_CHANGED, ticket_instance, comment=reopen_comment, actor_email=ticket_instance.reporter_email, old_status=old_status_name, new_status=needs_rework_status.name)
                     messages.success(request, f"Заявка #{ticket_instance.ticket_id_display} возвращена в работу.")
                     action_taken = True
                 except TicketStatus.DoesNotExist: messages.error(request, "Ошибка: не найден статус 'Требуется доработка'. Обратитесь к администратору.")
@@ -249,6 +298,7 @@ def check_ticket_status_view(request):
         'error_message': error_message, 'ticket_number_query': ticket_number_query, 'reporter_email_query': reporter_email_query,
         'custom_fields_display': custom_fields_display, 'user_comment_form': user_comment_form,
         'return_to_work_form': return_to_work_form, 'can_return_to_work': can_return_to_work,
+        'attachment_token': reporter_attachment_token(ticket_instance) if ticket_instance else '',
         'page_title': f"Статус заявки #{ticket_number_query}" if ticket_number_query else "Проверка статуса заявки"
     }
     return render(request, 'tickets/check_ticket_status.html', context)
@@ -273,17 +323,27 @@ def feedback_success_view(request):
 # -----------------------------------------------------------------------------
 @staff_member_required
 def agent_dashboard_view(request):
-    agent = request.user; context = {'agent_name': agent.get_full_name() or agent.username,}; return render(request, 'tickets/agent_dashboard.html', context)
+    agent = request.user; context = {'agent_name': agent.get_full_name() or agent.username,}
+    # Сводка берется из TicketCounter одним запросом: проекты сотрудника + его собственные заявки
+    agent_scope = get_agent_scope(agent)
+    project_filter = Q(scope=TicketCounter.SCOPE_PROJECT)
+    if not agent_scope.is_privileged: project_filter &= Q(object_id__in=agent_scope.project_ids)
+    project_stats = []; my_stats = None
+    for counter in TicketCounter.objects.filter(project_filter | Q(scope=TicketCounter.SCOPE_AGENT, object_id=agent.pk)):
+        if counter.scope == TicketCounter.SCOPE_AGENT: my_stats = counter; continue
+        try: project = reference_data.get_project(counter.object_id)
+        except Project.DoesNotExist: continue
+        if project.is_active: project_stats.append({'project': project, 'counter': counter})
+    project_stats.sort(key=lambda item: item['project'].name)
+    context.update({'project_stats': project_stats, 'my_stats': my_stats})
+    return render(request, 'tickets/agent_dashboard.html', context)
 
 @staff_member_required
 def check_new_tickets_api_view(request):
     current_agent = request.user
-    relevant_tickets_qs = Ticket.objects.select_related('project', 'status', 'category')
-    is_privileged_user = current_agent.is_superuser or getattr(current_agent, 'agent_role', None) == 'system_admin'
-    if not is_privileged_user:
-        agent_projects = current_agent.projects.filter(is_active=True)
-        if agent_projects.exists(): relevant_tickets_qs = relevant_tickets_qs.filter(project__in=agent_projects)
-        else: return JsonResponse({'new_tickets_count': 0, 'tickets': [], 'latest_ticket_id': None, 'current_server_time_iso': timezone.now().isoformat()})
+    agent_scope = get_agent_scope(current_agent)
+    if not agent_scope.has_projects: return JsonResponse({'new_tickets_count': 0, 'tickets': [], 'latest_ticket_id': None, 'current_server_time_iso': timezone.now().isoformat()})
+    relevant_tickets_qs = agent_scope.filter_tickets(Ticket.objects.select_related('project', 'status', 'category'))
     since_id_str = request.GET.get('since_id'); since_timestamp_str = request.GET.get('since_timestamp')
     new_tickets_query = Q()
     if since_id_str and since_id_str.isdigit(): new_tickets_query = Q(pk__gt=int(since_id_str))
@@ -307,21 +367,167 @@ def check_new_tickets_api_view(request):
     }
     return JsonResponse(data)
 
+@staff_member_required
+def agent_ticket_export_view(request):
+    # Потоковая выгрузка тикетов (CSV/JSONL) для BI; агент получает только тикеты своих проектов
+    export_format = request.GET.get('format', 'csv')
+    if export_format not in STREAM_WRITERS: return HttpResponse("Неподдерживаемый формат. Доступны: csv, jsonl.", status=400, content_type='text/plain; charset=utf-8')
+    since = None; since_str = request.GET.get('since')
+    if since_str:
+        try: since = datetime.fromisoformat(since_str.replace("Z", "+00:00"))
+        except ValueError: return HttpResponse("Некорректный параметр since (ожидается ISO 8601).", status=400, content_type='text/plain; charset=utf-8')
+        if timezone.is_naive(since): since = timezone.make_aware(since)
+    queryset = get_agent_scope(request.user).filter_tickets(Ticket.objects.all())
+    project_param = request.GET.get('project')
+    if project_param and project_param.isdigit(): queryset = queryset.filter(project_id=int(project_param))
+    export = TicketExport(queryset, since=since, include_description=request.GET.get('description') == '1')
+    response = StreamingHttpResponse(STREAM_WRITERS[export_format](export), content_type=CONTENT_TYPES[export_format])
+    response['Content-Disposition'] = f'attachment; filename="tickets-{timezone.now():%Y%m%d-%H%M%S}.{export_format}"'
+    return response
+
+# Нагрузка по представлениям (tickets/instrumentation.py): страница для сотрудников и метрики для Prometheus
+@staff_member_required
+def agent_performance_stats_view(request):
+    if request.method == 'POST' and request.user.is_superuser and 'reset' in request.POST:
+        request_log.clear(); messages.success(request, "Статистика сброшена.")
+        return redirect('tickets:agent_performance_stats')
+    records = request_log.snapshot()
+    slowest = sorted(records, key=lambda r: -r['total_ms'])[:20]
+    with_duplicates = sorted((r for r in records if r['duplicates'] or r['similar']), key=lambda r: -(r['duplicates'] + r['similar']))[:20]
+    caches = [
+        ('Справочники', reference_data.stats()), ('Формы категорий', ticket_create_forms.stats()),
+        ('Шаблоны уведомлений', compiled_notification_templates.stats()), ('Превью вложений', preview_pipeline.stats()),
+        ('Строки списка заявок', ticket_row_cache.stats()), ('Политики SLA', sla_policies.stats()),
+        ('Загрузка для автоназначения', assignment_board.stats()), ('Индекс дубликатов', duplicate_index.stats()),
+        ('Фильтры по доп. полям', custom_field_filters.stats()),
+    ]
+    context = {
+        'summary': request_log.summary(), 'slowest': slowest, 'with_duplicates': with_duplicates, 'caches': caches,
+        'buffer_size': len(records), 'since': datetime.fromtimestamp(request_log.started_at, tz=timezone.get_current_timezone()),
+        'page_title': "Нагрузка по представлениям",
+    }
+    return render(request, 'tickets/agent_performance_stats.html', context)
+
+# Отчет по ежедневным сводкам (tickets/rollups.py): месяц и год считаются по сводкам, а не по тикетам
+@staff_member_required
+def agent_reports_view(request):
+    today = timezone.localdate()
+    form = TicketReportFilterForm(request.GET or {'date_from': today.replace(day=1), 'date_to': today, 'granularity': 'month'}, user=request.user)
+    periods = []; totals = None
+    if form.is_valid():
+        data = form.cleaned_data; agent_scope = get_agent_scope(request.user)
+        project_ids = None if agent_scope.is_privileged else agent_scope.project_ids
+        if data['project']: project_ids = [data['project'].pk]
+        periods, totals = build_report(
+            data['date_from'], data['date_to'], data['granularity'], project_ids=project_ids,
+            category_id=data['category'] and data['category'].pk, priority_id=data['priority'] and data['priority'].pk,
+            assignee_id=data['assignee'] and data['assignee'].pk,
+        )
+    context = {
+        'form': form, 'periods': periods, 'totals': totals, 'quantile_labels': [f"p{round(q * 100)}" for q in REPORT_QUANTILES],
+        'page_title': "Отчеты по заявкам",
+    }
+    return render(request, 'tickets/agent_reports.html', context)
+
+def agent_metrics_view(request):
+    # Prometheus не входит в систему: доступ по токену (METRICS_TOKEN) или для сотрудника в сессии
+    token = getattr(settings, 'METRICS_TOKEN', None)
+    authorized = request.user.is_authenticated and request.user.is_staff
+    if token and hmac.compare_digest(request.headers.get('Authorization', '').encode(), f"Bearer {token}".encode()): authorized = True
+    if not authorized: return HttpResponse("Доступ запрещен.", status=403, content_type='text/plain; charset=utf-8')
+    return HttpResponse(prometheus_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+# Вложения для заявителя: доступ по подписанному токену заявки со страницы проверки статуса
+def get_public_attachment(request, attachment_pk):
+    attachment = get_object_or_404(Attachment.objects.select_related('blob', 'ticket', 'comment__ticket'), pk=attachment_pk)
+    ticket = attachment_ticket(attachment)
+    token_ticket_pk = ticket_pk_from_token(request.GET.get('token', ''))
+    if ticket is None or token_ticket_pk != ticket.pk or (attachment.comment_id and attachment.comment.is_internal):
+        raise Http404("Вложение не найдено.") # не раскрываем, существует ли вложение
+    return attachment
+
+def get_agent_attachment(request, attachment_pk):
+    attachment = get_object_or_404(Attachment.objects.select_related('blob', 'ticket', 'comment__ticket'), pk=attachment_pk)
+    ticket = attachment_ticket(attachment)
+    if ticket is None or not get_agent_scope(request.user).can_view_project(ticket.project_id):
+        raise Http404("Вложение не найдено.")
+    return attachment
+
+def serve_attachment_preview(request, attachment, size):
+    if size not in PREVIEW_SIZES: raise Http404("Неизвестный размер превью.")
+    if not preview_pipeline.ready(attachment, size):
+        preview_pipeline.schedule(attachment) # появится к следующему показу страницы
+        raise Http404("Превью еще не готово.")
+    name = preview_name(attachment, size)
+    preview_pipeline.cache.touch(name) # для вытеснения давно не запрошенных превью
+    return serve_file(request, preview_pipeline.cache.path(name), f"{os.path.splitext(attachment.display_name)[0]}_{size}.jpg",
+                      etag=f'"{os.path.basename(name)}"', cache_control='private, max-age=86400', storage_name=name)
+
+def attachment_download_view(request, attachment_pk):
+    return serve_attachment(request, get_public_attachment(request, attachment_pk))
+
+def attachment_preview_view(request, attachment_pk, size):
+    return serve_attachment_preview(request, get_public_attachment(request, attachment_pk), size)
+
+@staff_member_required
+def agent_attachment_download_view(request, attachment_pk):
+    return serve_attachment(request, get_agent_attachment(request, attachment_pk))
+
+@staff_member_required
+def agent_attachment_preview_view(request, attachment_pk, size):
+    return serve_attachment_preview(request, get_agent_attachment(request, attachment_pk), size)
+
+def get_missed_ticket_events(project_ids, since_id):
+    missed_tickets_qs = Ticket.objects.select_related('project', 'status', 'category').filter(pk__gt=since_id)
+    if project_ids is not None: missed_tickets_qs = missed_tickets_qs.filter(project_id__in=project_ids)
+    return [build_ticket_event(t) for t in missed_tickets_qs.order_by('pk')[:STREAM_CATCHUP_LIMIT]]
+
+@staff_member_required
+async def agent_ticket_stream_view(request):
+    # Поток Server-Sent Events с новыми тикетами. Работает только под ASGI-сервером.
+    # БД опрашивается один раз при подключении (и при переподключении - для досылки пропущенного),
+    # дальше события приходят из ticket_stream_hub.
+    if not hasattr(request, 'scope'):
+        # Под WSGI бесконечный поток занял бы рабочий процесс целиком. 204 - сигнал EventSource
+        # не переподключаться; страница переходит на опрос check_new_tickets_api_view.
+        return HttpResponse(status=204)
+    current_agent = await request.auser()
+    # Проекты, тикеты которых агент получает в потоке. None - все проекты (привилегированные пользователи)
+    project_ids = (await sync_to_async(get_agent_scope)(current_agent)).visible_project_ids
+    since_id_str = request.headers.get('Last-Event-ID') or request.GET.get('since_id', '')
+    since_id = int(since_id_str) if since_id_str.isdigit() else None
+
+    async def event_stream():
+        subscription = ticket_stream_hub.subscribe(project_ids)
+        try:
+            yield f"retry: {STREAM_RETRY_MS}\n\n"
+            if since_id is not None:
+                for event in await sync_to_async(get_missed_ticket_events)(project_ids, since_id): yield format_sse(event)
+            while True:
+                try: event = await asyncio.wait_for(subscription.queue.get(), timeout=STREAM_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError: yield ": keep-alive\n\n"; continue
+                yield format_sse(event)
+        finally:
+            ticket_stream_hub.unsubscribe(subscription)
+
+    response = StreamingHttpResponse(event_stream(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no' # nginx не должен буферизовать поток
+    return response
+
 @staff_member_required
 def agent_ticket_list_view(request):
     current_agent = request.user
-    queryset = Ticket.objects.select_related('project', 'status', 'priority', 'assignee', 'category').all()
-    is_privileged_display_user = current_agent.is_superuser or getattr(current_agent, 'agent_role', None) == 'system_admin'
-    if not is_privileged_display_user:
-        agent_projects = current_agent.projects.filter(is_active=True)
-        if agent_projects.exists(): queryset = queryset.filter(project__in=agent_projects)
-        else:
-            queryset = Ticket.objects.none()
-            if not request.GET: messages.info(request, "Вы не привязаны ни к одному активному проекту.")
-    filter_form = TicketFilterForm(request.GET or None, user=current_agent)
+    agent_scope = get_agent_scope(current_agent)
+    queryset = agent_scope.filter_tickets(Ticket.objects.select_related('project', 'status', 'priority', 'assignee', 'category').all())
+    if not agent_scope.has_projects:
+        queryset = Ticket.objects.none()
+        if not request.GET: messages.info(request, "Вы не привязаны ни к одному активному проекту.")
+    filter_form = TicketFilterForm(get_filter_data(request) or None, user=current_agent)
     apply_show_active = filter_form.fields['show_active'].initial
     apply_show_completed = filter_form.fields['show_completed'].initial
     apply_show_only_new = filter_form.fields['show_only_new'].initial
+    search_query = None; sort = ''
     if filter_form.is_bound:
         if filter_form.is_valid():
             apply_show_active = filter_form.cleaned_data.get('show_active')
@@ -330,13 +536,15 @@ def agent_ticket_list_view(request):
             search_query = filter_form.cleaned_data.get('search_query'); project_filter = filter_form.cleaned_data.get('project')
             category_filter = filter_form.cleaned_data.get('category'); status_filter_val = filter_form.cleaned_data.get('status') 
             priority_filter = filter_form.cleaned_data.get('priority'); assignee_filter = filter_form.cleaned_data.get('assignee')
-            if search_query: queryset = queryset.filter(Q(ticket_id_display__icontains=search_query) | Q(title__icontains=search_query) | Q(description__icontains=search_query) | Q(reporter_name__icontains=search_query) | Q(reporter_email__icontains=search_query))
+            sort = filter_form.cleaned_data.get('sort')
+            if search_query: queryset = search_tickets(queryset, search_query) # полнотекстовый индекс, аннотация search_rank
             if project_filter: queryset = queryset.filter(project=project_filter)
             if category_filter: queryset = queryset.filter(category=category_filter)
             if priority_filter: queryset = queryset.filter(priority=priority_filter)
             if assignee_filter: queryset = queryset.filter(assignee=assignee_filter)
+            queryset = filter_form.apply_custom_filters(queryset)
             if apply_show_only_new:
-                try: queryset = queryset.filter(status=TicketStatus.objects.get(code='new'))
+                try: queryset = queryset.filter(status=reference_data.get_status('new'))
                 except TicketStatus.DoesNotExist: messages.warning(request, "Статус 'Новая' (код 'new') не найден.")
             elif status_filter_val: queryset = queryset.filter(status=status_filter_val)
             else: 
@@ -347,61 +555,67 @@ def agent_ticket_list_view(request):
                 if q_status_filter: queryset = queryset.filter(q_status_filter)
     else: 
         if apply_show_only_new:
-             try: queryset = queryset.filter(status=TicketStatus.objects.get(code='new'))
+             try: queryset = queryset.filter(status=reference_data.get_status('new'))
              except TicketStatus.DoesNotExist: messages.warning(request, "Статус 'Новая' (код 'new') не найден.")
         elif apply_show_active and not apply_show_completed: queryset = queryset.filter(status__is_closed_status=False)
         elif not apply_show_active and apply_show_completed: queryset = queryset.filter(status__is_closed_status=True)
         elif not apply_show_active and not apply_show_completed: queryset = queryset.none()
-    try:
-        new_status = TicketStatus.objects.get(code='new')
-        queryset = queryset.annotate(is_new_status_order=Case(When(status=new_status, then=0), default=1, output_field=IntegerField()))
-        ticket_list = queryset.distinct().order_by('is_new_status_order', '-created_at')
-    except TicketStatus.DoesNotExist:
-        messages.warning(request, "Статус 'Новых' заявок (код 'new') не найден. Применена стандартная сортировка.")
-        ticket_list = queryset.distinct().order_by('-created_at')
+    if sort == 'sla': queryset, ordering = order_tickets_by_sla(queryset) # явная сортировка важнее релевантности поиска
+    else:
+        try:
+            new_status = reference_data.get_status('new')
+            queryset = queryset.annotate(is_new_status_order=Case(When(status=new_status, then=0), default=1, output_field=IntegerField()))
+            ordering = ('is_new_status_order', '-created_at', '-id')
+        except TicketStatus.DoesNotExist:
+            messages.warning(request, "Статус 'Новых' заявок (код 'new') не найден. Применена стандартная сортировка.")
+            ordering = ('-created_at', '-id')
+        if search_query: ordering = ('-search_rank',) + ordering # при поиске сначала самые релевантные
+    ticket_list, pagination_query = paginate_ticket_list(request, queryset.distinct(), ordering)
     page_title = 'Список заявок' 
-    if not is_privileged_display_user and hasattr(current_agent, 'projects'):
-        user_project_names = [p.name for p in current_agent.projects.all() if p.is_active]
+    if not agent_scope.is_privileged:
+        user_project_names = [p.name for p in reference_data.projects() if p.pk in agent_scope.project_ids]
         if len(user_project_names) == 1: page_title = f'Заявки по проекту: {user_project_names[0]}'
         elif len(user_project_names) > 1: page_title = f'Заявки по вашим проектам'
-    context = {'ticket_list': ticket_list, 'page_title': page_title, 'filter_form': filter_form}
+    context = {'ticket_list': ticket_list, 'ticket_rows': ticket_row_cache.render_rows(ticket_list), 'pagination_query': pagination_query, 'page_title': page_title, 'filter_form': filter_form}
     return render(request, 'tickets/agent_ticket_list.html', context)
 
 @staff_member_required
 def agent_my_tickets_view(request):
     current_agent = request.user
-    queryset = Ticket.objects.filter(assignee=current_agent).select_related('project', 'status', 'priority', 'category')
-    status_filter_form = MyTicketsStatusFilterForm(request.GET or None)
+    queryset = Ticket.objects.filter(assignee=current_agent).select_related('project', 'status', 'priority', 'category', 'assignee')
+    status_filter_form = MyTicketsStatusFilterForm(get_filter_data(request) or None)
     apply_show_active = status_filter_form.fields['show_active'].initial
-    apply_show_completed = status_filter_form.fields['show_completed'].initial
+    apply_show_completed = status_filter_form.fields['show_completed'].initial; sort = ''
     if status_filter_form.is_bound:
         if status_filter_form.is_valid():
             apply_show_active = status_filter_form.cleaned_data.get('show_active')
             apply_show_completed = status_filter_form.cleaned_data.get('show_completed')
+            sort = status_filter_form.cleaned_data.get('sort')
     q_status_filter = Q()
     if apply_show_active and not apply_show_completed: q_status_filter = Q(status__is_closed_status=False)
     elif not apply_show_active and apply_show_completed: q_status_filter = Q(status__is_closed_status=True)
     elif not apply_show_active and not apply_show_completed: queryset = queryset.none() 
     if q_status_filter: queryset = queryset.filter(q_status_filter)
-    try:
-        new_status = TicketStatus.objects.get(code='new')
-        queryset = queryset.annotate(is_new_status_order=Case(When(status=new_status, then=0), default=1, output_field=IntegerField()))
-        ticket_list = queryset.distinct().order_by('is_new_status_order', '-created_at')
-    except TicketStatus.DoesNotExist: ticket_list = queryset.distinct().order_by('-created_at')
-    context = {'ticket_list': ticket_list, 'page_title': 'Мои назначенные заявки', 'status_filter_form': status_filter_form, 'is_my_tickets_page': True}
+    if sort == 'sla': queryset, ordering = order_tickets_by_sla(queryset)
+    else:
+        try:
+            new_status = reference_data.get_status('new')
+            queryset = queryset.annotate(is_new_status_order=Case(When(status=new_status, then=0), default=1, output_field=IntegerField()))
+            ordering = ('is_new_status_order', '-created_at', '-id')
+        except TicketStatus.DoesNotExist: ordering = ('-created_at', '-id')
+    ticket_list, pagination_query = paginate_ticket_list(request, queryset.distinct(), ordering)
+    context = {'ticket_list': ticket_list, 'ticket_rows': ticket_row_cache.render_rows(ticket_list), 'pagination_query': pagination_query, 'page_title': 'Мои назначенные заявки', 'status_filter_form': status_filter_form, 'is_my_tickets_page': True}
     return render(request, 'tickets/agent_ticket_list.html', context)
 
 @staff_member_required
 def agent_ticket_detail_view(request, ticket_pk):
-    ticket = get_object_or_404(Ticket.objects.select_related('project', 'status', 'priority', 'category', 'assignee').prefetch_related('comments__author_agent', 'comments__attachments', 'attachments', 'category__custom_form_fields__field_template'), pk=ticket_pk)
+    ticket = get_object_or_404(Ticket.objects.select_related('project', 'status', 'priority', 'category', 'assignee', 'sla_policy', 'duplicate_of').prefetch_related('attachments', 'category__custom_form_fields__field_template'), pk=ticket_pk)
     current_agent = request.user
-    is_django_superuser = current_agent.is_superuser
-    is_helpdesk_system_admin = hasattr(current_agent, 'agent_role') and current_agent.agent_role == 'system_admin'
-    is_privileged_user = is_django_superuser or is_helpdesk_system_admin
-    can_view_ticket = is_privileged_user or (ticket.project and ticket.project in current_agent.projects.filter(is_active=True))
-    if not can_view_ticket:
+    agent_scope = get_agent_scope(current_agent)
+    is_privileged_user = agent_scope.is_privileged
+    if not agent_scope.can_view_project(ticket.project_id):
         messages.error(request, "У вас нет доступа к этому тикету или проекту."); return redirect('tickets:agent_ticket_list') 
-    is_agent_in_ticket_project = ticket.project and ticket.project in current_agent.projects.all()
+    is_agent_in_ticket_project = agent_scope.is_member(ticket.project_id)
     is_manager_of_ticket_project = is_agent_in_ticket_project and hasattr(current_agent, 'is_project_manager') and current_agent.is_project_manager
     can_see_status_form = is_privileged_user or is_manager_of_ticket_project
     can_change_priority = is_manager_of_ticket_project or is_privileged_user
@@ -415,6 +629,7 @@ def agent_ticket_detail_view(request, ticket_pk):
         if is_privileged_user or (ticket.assignee == current_agent and is_agent_in_ticket_project) or is_manager_of_ticket_project: can_change_project = True
     can_close_this_ticket = False
     if ticket.status.is_resolved_status and not ticket.status.is_closed_status and (ticket.assignee == current_agent or is_manager_of_ticket_project or is_privileged_user): can_close_this_ticket = True
+    can_merge_ticket = not ticket.status.is_closed_status and not ticket.duplicate_of_id and (is_privileged_user or is_manager_of_ticket_project or ticket.assignee == current_agent)
     comment_form_to_render = AgentCommentForm(); status_form_to_render = TicketUpdateStatusForm(initial={'status': ticket.status}) if can_see_status_form else None
     priority_form_to_render = TicketUpdatePriorityForm(initial={'priority': ticket.priority}) if can_change_priority else None
     reassign_agent_form_to_render = TicketReassignAgentForm(instance=ticket, assignable_agents=assignable_agents_qs) if can_reassign_ticket else None
@@ -428,42 +643,54 @@ def agent_ticket_detail_view(request, ticket_pk):
                 new_comment = comment_form.save(commit=False); new_comment.ticket = ticket; new_comment.author_agent = current_agent
                 new_comment.is_internal = comment_form.cleaned_data.get('is_internal', False)
                 new_comment.author_ip_address = get_client_ip(request) # Сохраняем IP агента
-                new_comment.save()
-                uploaded_file = comment_form.cleaned_data.get('attachment_file_comment')
-                if uploaded_file: Attachment.objects.create(comment=new_comment, ticket=ticket, file=uploaded_file, uploaded_by_agent=current_agent)
+                with transaction.atomic():
+                    new_comment.save()
+                    uploaded_file = comment_form.cleaned_data.get('attachment_file_comment')
+                    if uploaded_file: Attachment.objects.create(comment=new_comment, ticket=ticket, file=uploaded_file, uploaded_by_agent=current_agent)
+                    enqueue_notification(EVENT_NEW_COMMENT, ticket, comment=new_comment, actor_email=current_agent.email)
                 messages.success(request, "Комментарий успешно добавлен.")
             else: messages.error(request, "Ошибка при добавлении комментария."); comment_form_to_render = comment_form
         
         elif 'submit_status' in request.POST and can_see_status_form:
-            action_taken = True; status_form = TicketUpdateStatusForm(request.POST, instance=ticket)
+            action_taken = True; old_status = ticket.status # до привязки формы: is_valid() меняет instance
+            status_form = TicketUpdateStatusForm(request.POST, instance=ticket)
             if status_form.is_valid():
                 new_status_obj = status_form.cleaned_data['status']; comment_for_status_change = request.POST.get('comment_for_status_change', '').strip()
                 if (new_status_obj.is_resolved_status or new_status_obj.is_closed_status) and not comment_for_status_change:
                     messages.error(request, "Для установки этого статуса необходимо оставить комментарий.")
                     status_form_to_render = status_form
                 else:
-                    old_status_name = ticket.status.name; status_form.save(); msg_body = f"Статус изменен с '{old_status_name}' на '{ticket.status.name}'."
-                    if comment_for_status_change: msg_body += f"\nКомментарий: {comment_for_status_change}"
-                    Comment.objects.create(ticket=ticket, author_agent=current_agent, body=msg_body, is_internal=True)
+                    with transaction.atomic():
+                        status_form.save()
+                        record_ticket_event(ticket, TicketEvent.KIND_STATUS, old_status, ticket.status, actor=current_agent, note=comment_for_status_change)
+                        enqueue_notification(EVENT_STATUS_CHANGED, ticket, actor_email=current_agent.email, old_status=old_status.name, new_status=ticket.status.name, status_comment=comment_for_status_change)
                     messages.success(request, f"Статус заявки обновлен на '{ticket.status.name}'.")
             else: messages.error(request, "Ошибка при обновлении статуса."); status_form_to_render = status_form
 
         elif 'submit_priority' in request.POST and can_change_priority:
-            action_taken = True; priority_form = TicketUpdatePriorityForm(request.POST, instance=ticket)
+            action_taken = True; old_priority = ticket.priority
+            priority_form = TicketUpdatePriorityForm(request.POST, instance=ticket)
             if priority_form.is_valid():
-                old_priority_name = ticket.priority.name if ticket.priority else "не был назначен"; priority_form.save()
-                new_priority_name = ticket.priority.name if ticket.priority else "снят"
+                old_priority_name = old_priority.name if old_priority else "не был назначен"
+                with transaction.atomic():
+                    priority_form.save()
+                    new_priority_name = ticket.priority.name if ticket.priority else "снят"
+                    record_ticket_event(ticket, TicketEvent.KIND_PRIORITY, old_priority, ticket.priority, actor=current_agent)
+                    enqueue_notification(EVENT_PRIORITY_CHANGED, ticket, actor_email=current_agent.email, old_priority=old_priority_name, new_priority=new_priority_name)
                 messages.success(request, f"Приоритет изменен с '{old_priority_name}' на '{new_priority_name}'.")
-                Comment.objects.create(ticket=ticket, author_agent=current_agent, body=f"Приоритет изменен на: {new_priority_name} (предыдущий: {old_priority_name})",is_internal=True)
             else: messages.error(request, "Ошибка при обновлении приоритета."); priority_form_to_render = priority_form
 
         elif 'submit_project' in request.POST and can_change_project:
-            action_taken = True; project_form = TicketUpdateProjectForm(request.POST, instance=ticket)
+            action_taken = True; old_project = ticket.project; old_assignee = ticket.assignee
+            project_form = TicketUpdateProjectForm(request.POST, instance=ticket)
             if project_form.is_valid():
-                old_project_name = ticket.project.name; new_project_obj = project_form.cleaned_data['project']
-                ticket.assignee = None; project_form.save()
+                old_project_name = old_project.name; new_project_obj = project_form.cleaned_data['project']
+                with transaction.atomic():
+                    ticket.assignee = None; project_form.save()
+                    record_ticket_event(ticket, TicketEvent.KIND_PROJECT, old_project, new_project_obj, actor=current_agent)
+                    if old_assignee: record_ticket_event(ticket, TicketEvent.KIND_ASSIGNEE, old_assignee, None, actor=current_agent, note="Исполнитель сброшен при смене проекта.")
+                    enqueue_notification(EVENT_PROJECT_CHANGED, ticket, actor_email=current_agent.email, old_project=old_project_name, new_project=new_project_obj.name)
                 messages.success(request, f"Проект заявки изменен с '{old_project_name}' на '{new_project_obj.name}'. Исполнитель сброшен.")
-                Comment.objects.create(ticket=ticket, author_agent=current_agent, body=f"Заявка перенаправлена из проекта '{old_project_name}' в проект '{new_project_obj.name}'. Исполнитель сброшен.", is_internal=True)
             else: messages.error(request, "Ошибка при изменении проекта."); project_form_to_render = project_form
 
         elif 'submit_reassign_agent' in request.POST and can_reassign_ticket:
@@ -475,24 +702,31 @@ def agent_ticket_detail_view(request, ticket_pk):
             if reassign_agent_form.is_valid():
                 old_assignee_obj = Ticket.objects.get(pk=ticket.pk).assignee 
                 old_assignee_name = old_assignee_obj.get_full_name() or old_assignee_obj.username if old_assignee_obj else "не был назначен"
-                reassign_agent_form.save(); new_assignee_obj = ticket.assignee
-                new_assignee_name = new_assignee_obj.get_full_name() or new_assignee_obj.username if new_assignee_obj else "снято назначение"
+                with transaction.atomic():
+                    reassign_agent_form.save(); new_assignee_obj = ticket.assignee
+                    new_assignee_name = new_assignee_obj.get_full_name() or new_assignee_obj.username if new_assignee_obj else "снято назначение"
+                    record_ticket_event(ticket, TicketEvent.KIND_ASSIGNEE, old_assignee_obj, new_assignee_obj, actor=current_agent)
+                    enqueue_notification(EVENT_ASSIGNEE_CHANGED, ticket, actor_email=current_agent.email, old_assignee=old_assignee_name, new_assignee=new_assignee_name)
                 messages.success(request, f"Исполнитель изменен с '{old_assignee_name}' на '{new_assignee_name}'.")
-                Comment.objects.create(ticket=ticket, author_agent=current_agent, body=f"Исполнитель изменен на: {new_assignee_name} (предыдущий: {old_assignee_name}).", is_internal=True)
             else: messages.error(request, "Ошибка при назначении исполнителя."); reassign_agent_form_to_render = reassign_agent_form
         
         elif 'take_ticket' in request.POST and can_take_ticket:
             action_taken = True
             if ticket.assignee is not None: messages.error(request, "Заявка уже кем-то назначена.")
             else:
-                ticket.assignee = current_agent; target_status_code = '80'
-                try:
-                    new_status = TicketStatus.objects.get(code=target_status_code)
-                    old_status_name = ticket.status.name; ticket.status = new_status; ticket.save()
-                    messages.success(request, f"Вы взяли заявку #{ticket.ticket_id_display} в работу. Статус изменен на '{new_status.name}'.")
-                    Comment.objects.create(ticket=ticket, author_agent=current_agent, body=f"Агент взял заявку в работу. Статус изменен с '{old_status_name}' на '{new_status.name}'.", is_internal=True)
-                except TicketStatus.DoesNotExist: ticket.save(); messages.warning(request, f"Вы взяли заявку #{ticket.ticket_id_display} в работу, но статус с кодом '{target_status_code}' не найден."); Comment.objects.create(ticket=ticket, author_agent=current_agent, body=f"Агент взял заявку в работу. (Статус '{target_status_code}' не найден).", is_internal=True)
-                except Exception as e: ticket.save(); messages.error(request, f"Ошибка при смене статуса: {e}."); Comment.objects.create(ticket=ticket, author_agent=current_agent, body=f"Агент взял заявку в работу. (Ошибка при смене статуса).", is_internal=True)
+                ticket.assignee = current_agent; target_status_code = '80'; old_status = ticket.status
+                with transaction.atomic():
+                    record_ticket_event(ticket, TicketEvent.KIND_ASSIGNEE, None, current_agent, actor=current_agent, note="Агент взял заявку в работу.")
+                    try:
+                        # Смена статуса - в точке сохранения: при ошибке заявка остается взятой, но без полусохраненного статуса
+                        with transaction.atomic():
+                            new_status = reference_data.get_status(target_status_code)
+                            old_status_name = old_status.name; ticket.status = new_status; ticket.save()
+                            record_ticket_event(ticket, TicketEvent.KIND_STATUS, old_status, new_status, actor=current_agent)
+                            enqueue_notification(EVENT_STATUS_CHANGED, ticket, actor_email=current_agent.email, old_status=old_status_name, new_status=new_status.name)
+                        messages.success(request, f"Вы взяли заявку #{ticket.ticket_id_display} в работу. Статус изменен на '{new_status.name}'.")
+                    except TicketStatus.DoesNotExist: ticket.save(); messages.warning(request, f"Вы взяли заявку #{ticket.ticket_id_display} в работу, но статус с кодом '{target_status_code}' не найден.")
+                    except Exception as e: ticket.status = old_status; ticket.save(); messages.error(request, f"Ошибка при смене статуса: {e}.")
 
         elif 'action_resolve_ticket' in request.POST:
             action_taken = True
@@ -501,9 +735,12 @@ def agent_ticket_detail_view(request, ticket_pk):
                 if not comment_body: messages.error(request, "Необходимо указать комментарий к решению.")
                 else:
                     try:
-                        new_status = TicketStatus.objects.get(code='resolved')
-                        old_status_name = ticket.status.name; ticket.status = new_status; ticket.save()
-                        Comment.objects.create(ticket=ticket, author_agent=current_agent, body=f"Заявка помечена как 'Решена'. Статус изменен с '{old_status_name}' на '{new_status.name}'.\nРешение: {comment_body}", is_internal=False)
+                        with transaction.atomic():
+                            new_status = reference_data.get_status('resolved')
+                            old_status = ticket.status; old_status_name = old_status.name; ticket.status = new_status; ticket.save()
+                            record_ticket_event(ticket, TicketEvent.KIND_STATUS, old_status, new_status, actor=current_agent, note=comment_body)
+                            resolve_comment = Comment.objects.create(ticket=ticket, author_agent=current_agent, body=f"Заявка помечена как 'Решена'. Статус изменен с '{old_status_name}' на '{new_status.name}'.\nРешение: {comment_body}", is_internal=False)
+                            enqueue_notification(EVENT_STATUS_CHANGED, ticket, comment=resolve_comment, actor_email=current_agent.email, old_status=old_status_name, new_status=new_status.name, status_comment=comment_body)
                         messages.success(request, f"Заявка #{ticket.ticket_id_display} помечена как 'Решена'.")
                     except TicketStatus.DoesNotExist: messages.error(request, "Ошибка: Статус 'resolved' не найден.")
                     except Exception as e: messages.error(request, f"Произошла ошибка: {e}")
@@ -516,9 +753,12 @@ def agent_ticket_detail_view(request, ticket_pk):
                 if not comment_body: messages.error(request, "Для 'Закрыть с замечанием' нужен комментарий.")
                 else:
                     try:
-                        new_status = TicketStatus.objects.get(code='closed_remarks')
-                        old_status_name = ticket.status.name; ticket.status = new_status; ticket.save()
-                        Comment.objects.create(ticket=ticket, author_agent=current_agent, body=f"Заявка закрыта с замечанием. Статус изменен с '{old_status_name}' на '{new_status.name}'.\nЗамечание: {comment_body}", is_internal=False)
+                        with transaction.atomic():
+                            new_status = reference_data.get_status('closed_remarks')
+                            old_status = ticket.status; old_status_name = old_status.name; ticket.status = new_status; ticket.save()
+                            record_ticket_event(ticket, TicketEvent.KIND_STATUS, old_status, new_status, actor=current_agent, note=comment_body)
+                            remarks_comment = Comment.objects.create(ticket=ticket, author_agent=current_agent, body=f"Заявка закрыта с замечанием. Статус изменен с '{old_status_name}' на '{new_status.name}'.\nЗамечание: {comment_body}", is_internal=False)
+                            enqueue_notification(EVENT_STATUS_CHANGED, ticket, comment=remarks_comment, actor_email=current_agent.email, old_status=old_status_name, new_status=new_status.name, status_comment=comment_body)
                         messages.success(request, f"Заявка #{ticket.ticket_id_display} закрыта с замечанием.")
                     except TicketStatus.DoesNotExist: messages.error(request, "Ошибка: Статус 'closed_remarks' не найден.")
                     except Exception as e: messages.error(request, f"Произошла ошибка: {e}")
@@ -529,24 +769,34 @@ def agent_ticket_detail_view(request, ticket_pk):
             if can_close_this_ticket:
                 comment_body = request.POST.get('comment_for_action', '').strip()
                 try:
-                    new_status = TicketStatus.objects.get(code='closed')
-                    old_status_name = ticket.status.name; ticket.status = new_status; ticket.save()
-                    body_for_comment = f"Заявка закрыта. Статус изменен с '{old_status_name}' на '{new_status.name}'."
-                    if comment_body: body_for_comment += f"\nКомментарий при закрытии: {comment_body}"
-                    Comment.objects.create(ticket=ticket, author_agent=current_agent, body=body_for_comment, is_internal=True)
+                    with transaction.atomic():
+                        new_status = reference_data.get_status('closed')
+                        old_status = ticket.status; old_status_name = old_status.name; ticket.status = new_status; ticket.save()
+                        record_ticket_event(ticket, TicketEvent.KIND_STATUS, old_status, new_status, actor=current_agent, note=comment_body)
+                        enqueue_notification(EVENT_STATUS_CHANGED, ticket, actor_email=current_agent.email, old_status=old_status_name, new_status=new_status.name, status_comment=comment_body)
                     messages.success(request, f"Заявка #{ticket.ticket_id_display} закрыта.")
                 except TicketStatus.DoesNotExist: messages.error(request, "Ошибка: Статус 'closed' не найден.")
                 except Exception as e: messages.error(request, f"Произошла ошибка: {e}")
             else: messages.error(request, "Нет прав для закрытия или заявка не решена/уже закрыта.")
         
+        elif 'merge_duplicate' in request.POST:
+            action_taken = True; merge_target = request.POST.get('merge_target', '')
+            target = Ticket.objects.filter(pk=merge_target).first() if merge_target.isdigit() else None
+            if not can_merge_ticket: messages.error(request, "Нет прав для объединения или заявка уже закрыта.")
+            elif target is None or not agent_scope.can_view_project(target.project_id): messages.error(request, "Основная заявка не найдена.")
+            else:
+                try:
+                    merge_ticket_into(ticket, target, current_agent)
+                    messages.success(request, f"Заявка #{ticket.ticket_id_display} объединена с #{target.ticket_id_display} и закрыта.")
+                    return redirect('tickets:agent_ticket_detail', ticket_pk=target.pk)
+                except ValueError as e: messages.error(request, str(e))
+                except TicketStatus.DoesNotExist: messages.error(request, "Ошибка: Статус 'closed' не найден.")
+
         if action_taken: return redirect('tickets:agent_ticket_detail', ticket_pk=ticket.pk)
 
-    all_comments = ticket.comments.select_related('author_agent', 'ticket__project').prefetch_related('attachments').all().order_by('-created_at')
-    user_and_agent_comments = []; ticket_history_log = []
-    system_log_phrases = ["Статус изменен на:", "Агент взял заявку в работу", "Приоритет изменен на:", "Исполнитель изменен на:", "Заявка перенаправлена из проекта", "Заявка помечена как 'Решена'", "Заявка закрыта", "Заявка закрыта с замечанием"]
-    for comment in all_comments:
-        if comment.is_internal and any(phrase in comment.body for phrase in system_log_phrases): ticket_history_log.append(comment)
-        else: user_and_agent_comments.append(comment)
+    # Служебные комментарии, перенесенные в историю (backfill_ticket_events), в ленте не показываем
+    user_and_agent_comments = ticket.comments.filter(ticket_event__isnull=True).select_related('author_agent', 'ticket__project').prefetch_related('attachments').order_by('-created_at')
+    ticket_history_log = list(ticket.events.select_related('actor').order_by('-created_at', '-id'))
     
     ticket_attachments_list = ticket.attachments.filter(comment__isnull=True).order_by('uploaded_at')
     custom_fields_display = []
@@ -566,6 +816,7 @@ def agent_ticket_detail_view(request, ticket_pk):
         'can_reassign_ticket': can_reassign_ticket, 'can_take_ticket': can_take_ticket, 
         'can_change_project': can_change_project, 'can_close_this_ticket': can_close_this_ticket, 
         'custom_fields_display': custom_fields_display,
+        'duplicate_candidates': duplicate_candidates_for(ticket, agent_scope), 'can_merge_ticket': can_merge_ticket,
         'page_title': f"Заявка #{ticket.ticket_id_display} (Проект: {ticket.project.name})",
     }
     return render(request, 'tickets/agent_ticket_detail.html', context)
\ No newline at end of file